@@ -0,0 +1,705 @@
+# -*- coding: utf-8 -*-
+"""
+ClickAI benchmarks — old read/write paths vs new ones, side by side.
+
+What it does (and does NOT do):
+  - It does NOT touch Supabase, Fly.io, Anthropic, or any live data.
+  - DB calls run against FakeRest (the in-memory PostgREST from test_clickai.py),
+    so "bytes" and "round trips" are what the real server would have sent.
+  - Timings are local CPU only; network latency is reported as round trips.
+
+How to run:
+  python3 bench_clickai.py            # all benchmarks
+  python3 bench_clickai.py window     # only benchmarks whose name contains "window"
+
+Adding a benchmark: drop a new `def bench_xxx():` function below that returns a
+list of (label, value) rows. It is auto-discovered.
+"""
+
+import os
+import sys
+import time
+import random
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from test_clickai import _with_fake_rest  # noqa: E402
+
+
+def _sales_history(n, biz="b1", days=3 * 365, seed=7):
+    """n POS sales spread evenly over the last `days` days."""
+    from datetime import datetime, timedelta
+    rnd = random.Random(seed)
+    start = datetime.now() - timedelta(days=days)
+    rows = []
+    for i in range(n):
+        d = start + timedelta(days=days * i / n)
+        rows.append({
+            "id": f"{i:08d}-0000-0000-0000-000000000000",
+            "business_id": biz,
+            "date": d.strftime("%Y-%m-%d"),
+            "created_at": d.strftime("%Y-%m-%dT%H:%M:%S+00:00"),
+            "sale_number": f"POS-{i:06d}",
+            "payment_method": rnd.choice(["cash", "card", "account"]),
+            "subtotal": round(rnd.uniform(10, 5000), 2),
+            "vat": 0.0,
+            "total": round(rnd.uniform(10, 5000), 2),
+            "customer_name": "Walk-in",
+        })
+    return rows
+
+
+def _kb(n):
+    return f"{n / 1024:,.0f} KB"
+
+
+# ---------------------------------------------------------------------------
+# DB.get — server-side filters
+# ---------------------------------------------------------------------------
+
+def bench_date_window_bytes():
+    """'Last 30 days' of sales: full download + Python filter vs server-side window."""
+    import clickai
+    from datetime import datetime, timedelta
+    rows = _sales_history(50000)
+    cutoff = (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d")
+
+    fake, restore = _with_fake_rest({"sales": rows})
+    try:
+        t0 = time.perf_counter()
+        old = [s for s in clickai.db.get("sales", {"business_id": "b1"})
+               if s.get("date", "") >= cutoff]
+        old_t, old_bytes, old_calls = time.perf_counter() - t0, fake.bytes_out, len(fake.calls)
+
+        fake.bytes_out, fake.calls = 0, []
+        t0 = time.perf_counter()
+        new = clickai.db.get("sales", {"business_id": "b1", "date": ("gte", cutoff)})
+        new_t, new_bytes, new_calls = time.perf_counter() - t0, fake.bytes_out, len(fake.calls)
+    finally:
+        restore()
+
+    assert len(old) == len(new), "server window must return the same rows"
+    return [
+        ("rows kept", f"{len(new):,} of {len(rows):,}"),
+        ("old: bytes / round trips", f"{_kb(old_bytes)} / {old_calls}"),
+        ("new: bytes / round trips", f"{_kb(new_bytes)} / {new_calls}"),
+        ("bytes saved", f"{100 * (1 - new_bytes / old_bytes):.1f}%"),
+        ("local time old -> new", f"{old_t * 1000:.0f} ms -> {new_t * 1000:.0f} ms"),
+    ]
+
+
+def bench_keyset_vs_offset_paging():
+    """50k journal rows: OFFSET paging vs keyset (id=gt.<last>) — server rows walked per page."""
+    import clickai
+    rows = [{"id": f"{i:08d}", "business_id": "b1", "account_code": str(1000 + i % 90),
+             "debit": float(i % 700), "credit": 0.0} for i in range(50000)]
+    fake, restore = _with_fake_rest({"journals": rows})
+    try:
+        clickai.DB._unkeyed_tables.add("journals")     # force the legacy OFFSET path
+        old = clickai.db.get("journals", {"business_id": "b1"}, order="id.asc")
+        old_walked, old_calls = fake.rows_walked, len(fake.calls)
+        clickai.DB._unkeyed_tables.discard("journals")
+
+        fake.rows_walked, fake.calls = 0, []
+        new = clickai.db.get("journals", {"business_id": "b1"})
+        new_walked, new_calls = fake.rows_walked, len(fake.calls)
+    finally:
+        clickai.DB._unkeyed_tables.discard("journals")
+        restore()
+
+    assert [r["id"] for r in old] == [r["id"] for r in new]
+    return [
+        ("round trips old / new", f"{old_calls} / {new_calls}"),
+        ("server rows walked (OFFSET)", f"{old_walked:,}"),
+        ("server rows walked (keyset)", f"{new_walked:,}"),
+        ("rows walked per row returned", f"{old_walked / len(old):.1f} -> {new_walked / len(new):.1f}"),
+    ]
+
+
+def bench_parallel_prefetch():
+    """20k journal lines over a 60 ms link (JNB -> Supabase): sequential vs parallel pages."""
+    import clickai
+    rows = [{"id": f"{i:08d}", "business_id": "b1", "account_code": str(1000 + i % 90),
+             "debit": float(i % 700), "credit": 0.0} for i in range(20000)]
+    fake, restore = _with_fake_rest({"journals": rows}, latency=0.060)
+    try:
+        t0 = time.perf_counter()
+        seq = clickai.db.get("journals", {"business_id": "b1"})
+        seq_t, seq_calls = time.perf_counter() - t0, len(fake.calls)
+        fake.calls = []
+        t0 = time.perf_counter()
+        par = clickai.db.get("journals", {"business_id": "b1"}, parallel=True)
+        par_t, par_calls = time.perf_counter() - t0, len(fake.calls)
+    finally:
+        restore()
+    assert [r["id"] for r in seq] == [r["id"] for r in par]
+    return [
+        ("round trips seq / parallel", f"{seq_calls} / {par_calls}"),
+        ("wall time sequential", f"{seq_t * 1000:,.0f} ms"),
+        (f"wall time parallel (x{clickai.DB_PARALLEL_PAGES})", f"{par_t * 1000:,.0f} ms"),
+    ]
+
+
+def bench_single_flight_stock_miss():
+    """8 gthreads miss the stock cache for one business at once: round trips with/without coalescing."""
+    import clickai
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    items = [{"id": f"{i:06d}", "business_id": "b1", "code": f"C{i}", "quantity": i}
+             for i in range(7000)]
+    fake, restore = _with_fake_rest({"stock_items": items, "stock": []}, latency=0.060)
+
+    def burst(fn):
+        clickai._stock_cache.pop("b1", None)
+        fake.calls = []
+        barrier = threading.Barrier(8)
+        def one(_):
+            barrier.wait()
+            return fn()
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(8) as pool:
+            out = list(pool.map(one, range(8)))
+        return time.perf_counter() - t0, len(fake.calls), out
+
+    class _NoFlight:                       # the pre-coalescing behaviour
+        def do(self, key, fn):
+            return fn()
+
+    flights = clickai.db._flights
+    try:
+        clickai.db._flights = _NoFlight()
+        old_t, old_calls, _ = burst(lambda: clickai.db.get_all_stock("b1"))
+        clickai.db._flights = flights
+        new_t, new_calls, out = burst(lambda: clickai.db.get_all_stock("b1"))
+    finally:
+        clickai.db._flights = flights
+        clickai._stock_cache.pop("b1", None)
+        restore()
+    assert all(len(o) == 7000 for o in out)
+    return [
+        ("round trips, no coalescing", f"{old_calls}"),
+        ("round trips, single-flight", f"{new_calls}"),
+        ("burst wall time old -> new", f"{old_t * 1000:,.0f} ms -> {new_t * 1000:,.0f} ms"),
+    ]
+
+
+def bench_iter_rows_peak_memory():
+    """TB-style fold over 20k journal lines: get() a list vs iter_rows() — peak Python heap."""
+    import clickai
+    import tracemalloc
+    rows = [{"id": f"{i:08d}", "business_id": "b1", "account_code": str(1000 + i % 90),
+             "debit": float(i % 700), "credit": 0.0, "date": "2026-03-01",
+             "description": f"POS Sale POS-{i:06d} - Walk-in (Cash)", "reference": f"POS-{i:06d}"}
+            for i in range(20000)]
+    fake, restore = _with_fake_rest({"journals": rows})
+
+    def fold(source):
+        tb = {}
+        for jl in source:
+            tb[jl["account_code"]] = tb.get(jl["account_code"], 0.0) + jl["debit"] - jl["credit"]
+        return tb
+
+    def peak(fn):                     # FakeRest's own scratch lists count too
+        tracemalloc.start()
+        out = fn()
+        _, top = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return out, top
+
+    try:
+        old, old_peak = peak(lambda: fold(clickai.db.get("journals", {"business_id": "b1"})))
+        new, new_peak = peak(lambda: fold(clickai.db.iter_rows("journals", {"business_id": "b1"})))
+        par, par_peak = peak(lambda: fold(clickai.db.iter_rows("journals", {"business_id": "b1"},
+                                                                   parallel=True)))
+    finally:
+        restore()
+    assert old == new == par
+    return [
+        ("peak heap, get() + fold", _kb(old_peak)),
+        ("peak heap, iter_rows() fold", _kb(new_peak)),
+        (f"peak heap, iter_rows(parallel) x{clickai.DB_PARALLEL_PAGES}", _kb(par_peak)),
+        ("reduction", f"{old_peak / max(new_peak, 1):.0f}x"),
+    ]
+
+
+def bench_server_side_tb_totals():
+    """TB per-account totals over 50k journal lines: streamed fold vs one GROUP BY response."""
+    import clickai
+    rows = [{"id": f"{i:08d}", "business_id": "b1", "account_code": str(1000 + i % 90),
+             "debit": float(i % 700), "credit": float(i % 300)} for i in range(50000)]
+    fake, restore = _with_fake_rest({"journals": rows}, latency=0.060)
+    args = dict(sums=["debit", "credit"], group_by=["account_code"], filters={"business_id": "b1"})
+    try:
+        fake.aggregates = False
+        t0 = time.perf_counter()
+        old = clickai.db.aggregate("journals", **args)
+        old_t, old_bytes, old_calls = time.perf_counter() - t0, fake.bytes_out, len(fake.calls)
+        clickai.DB._aggregates_off, fake.aggregates = False, True
+        fake.bytes_out, fake.calls = 0, []
+        t0 = time.perf_counter()
+        new = clickai.db.aggregate("journals", **args)
+        new_t, new_bytes, new_calls = time.perf_counter() - t0, fake.bytes_out, len(fake.calls)
+    finally:
+        clickai.DB._aggregates_off = False
+        restore()
+    assert old == new
+    return [
+        ("accounts", f"{len(new)}"),
+        ("fold: bytes / round trips", f"{_kb(old_bytes)} / {old_calls}"),
+        ("aggregate: bytes / round trips", f"{_kb(new_bytes)} / {new_calls}"),
+        ("wall time (60 ms link)", f"{old_t * 1000:,.0f} ms -> {new_t * 1000:,.0f} ms"),
+    ]
+
+
+def bench_columnar_report_totals():
+    """Balance-sheet style totals over 50k sales, client side only: decode + dict loops vs vectors."""
+    import clickai
+    import json
+    import tracemalloc
+    cols = ["total", "vat", "subtotal", "payment_method"]
+    rows = [{c: r[c] for c in cols} for r in _sales_history(50000)]
+    # The 50 response bodies as they come off the wire; the fake _pages only
+    # decodes them, so the timings below are this worker's CPU, not the server's
+    bodies = [json.dumps(rows[i:i + 1000]).encode() for i in range(0, len(rows), 1000)]
+
+    def old():
+        sales = clickai.db.get("sales", {"business_id": "b1"}, select=",".join(cols), limit=len(rows) + 1)
+        return (sum(float(s.get("total", 0)) for s in sales if s.get("payment_method", "cash") in ("cash", "card")),
+                sum(float(s.get("vat", 0)) for s in sales),
+                sum(float(s.get("subtotal", 0)) for s in sales))
+
+    def new():
+        c = clickai.db.get_columnar("sales", cols, {"business_id": "b1"}, numeric=cols[:3])
+        return (c.total("total", c.isin("payment_method", ("cash", "card"))), c.total("vat"), c.total("subtotal"))
+
+    def best(fn, n=5):
+        out, t = None, float("inf")
+        for _ in range(n):
+            t0 = time.perf_counter()
+            out = fn()
+            t = min(t, time.perf_counter() - t0)
+        return out, t
+
+    loads = clickai._json_loads
+    clickai.db._pages = lambda *a, **k: (clickai._json_loads(b) for b in bodies)
+    try:
+        clickai._json_loads = json.loads
+        _, stdlib_t = best(old)
+        clickai._json_loads = loads
+        o, old_t = best(old)
+        n, new_t = best(new)
+        tracemalloc.start()
+        old()
+        old_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        new()
+        new_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    finally:
+        clickai._json_loads = loads
+        del clickai.db._pages
+    assert all(abs(a - b) < 1e-3 for a, b in zip(o, n))
+    return [
+        ("JSON decoder", "orjson" if clickai._orjson else "stdlib json"),
+        ("vector backend", "numpy" if clickai._np is not None else "array('d')"),
+        ("get() + loops, stdlib json", f"{stdlib_t * 1000:,.0f} ms"),
+        ("get() + loops, fast decode", f"{old_t * 1000:,.0f} ms"),
+        ("get_columnar() + vectors", f"{new_t * 1000:,.0f} ms"),
+        ("peak heap old -> new", f"{_kb(old_peak)} -> {_kb(new_peak)}"),
+    ]
+
+
+def bench_journal_posting_latency():
+    """Journal writes over a 60 ms link: one POST per line (old) vs one bulk POST per entry."""
+    import clickai
+    pos = [("1000", 115.0, 0), ("4000", 0, 100.0), ("2100", 0, 15.0), ("5000", 60.0, 0), ("1300", 0, 60.0)]
+    invoice = [("1200", 1150.0, 0), ("4000", 0, 1000.0), ("2100", 0, 150.0), ("5000", 0, 0)]
+    payslip = [("6000", 30000.0, 0), ("6210", 600.0, 0), ("2200", 0, 4800.0), ("2210", 0, 600.0),
+               ("2220", 0, 300.0), ("2400", 0, 500.0), ("2210", 0, 300.0), ("8400", 0, 24100.0)]
+    cases = [("api_pos_sale (5 legs)", [pos]), ("invoice save (4 legs)", [invoice]),
+             ("payroll post-batch, 10 staff", [payslip] * 10)]
+    fake, restore = _with_fake_rest({"journals": []}, latency=0.060)
+
+    def old_post(journals):                  # the pre-batch loop: one save per line
+        for lines in journals:
+            for code, dr, cr in lines:
+                clickai._DB_SESSION.post(f"{clickai.db.url}/rest/v1/journals?on_conflict=id",
+                                         json={"id": clickai.generate_id(), "account_code": code,
+                                               "debit": dr, "credit": cr})
+
+    def new_post(journals):
+        for lines in journals:
+            clickai.create_journal_entry("b1", "2026-05-01", "bench", "REF", [
+                {"account_code": c, "debit": d, "credit": k} for c, d, k in lines])
+
+    out = []
+    try:
+        for label, journals in cases:
+            t0 = time.perf_counter()
+            old_post(journals)
+            old_t = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            new_post(journals)
+            new_t = time.perf_counter() - t0
+            out.append((label, f"{old_t * 1000:,.0f} ms -> {new_t * 1000:,.0f} ms"))
+    finally:
+        restore()
+    return out
+
+
+def bench_gl_balances_tb_rows_walked():
+    """TB over 50k journal lines / 24 months: server rows walked, journals vs gl_balances."""
+    import clickai
+    import clickai_gl_balances as glb
+    journals = [{"id": f"{i:08d}", "business_id": "b1", "account_code": str(1000 + i % 90),
+                 "date": f"{2025 + (i % 24) // 12}-{1 + i % 12:02d}-15",
+                 "debit": float(i % 700), "credit": float(i % 300)} for i in range(50000)]
+    balances = {}
+    for j in journals:
+        b = balances.setdefault((j["account_code"], j["date"][:7]),
+                                {"business_id": "b1", "account_code": j["account_code"],
+                                 "period": j["date"][:7], "debit": 0.0, "credit": 0.0})
+        b["debit"] += j["debit"]
+        b["credit"] += j["credit"]
+    fake, restore = _with_fake_rest({"journals": journals, "gl_balances": list(balances.values()),
+                                     "gl_balance_state": []})
+    try:
+        glb._READY.clear()
+        old = glb.account_totals(clickai.db, "b1")
+        old_walked = fake.rows_walked
+        fake.tables["gl_balance_state"].append({"business_id": "b1"})
+        glb._READY.clear()
+        fake.rows_walked = 0
+        new = glb.account_totals(clickai.db, "b1")
+        new_walked = fake.rows_walked
+    finally:
+        glb._READY.clear()
+        restore()
+    assert all(abs(old[k]["debit"] - new[k]["debit"]) < 1e-6 for k in old)
+    return [
+        ("accounts", f"{len(new)}"),
+        ("rows walked, journals", f"{old_walked:,}"),
+        ("rows walked, gl_balances", f"{new_walked:,}"),
+    ]
+
+
+def bench_customer_ledger_debtors_list():
+    """Debtors list for 400 customers / 20k documents: full recompute vs the customer
+    ledger, and the cost of syncing one dirty customer after a sale."""
+    import clickai
+    import clickai_customer_ledger as cl
+    cust = [{"id": f"c{i:04d}", "business_id": "b1", "name": f"Customer {i}"} for i in range(400)]
+    invoices = [{"id": f"i{i:06d}", "business_id": "b1", "customer_id": f"c{i % 400:04d}", "status": "posted",
+                 "total": float(i % 900), "invoice_number": f"INV{i}", "date": f"2026-0{1 + i % 9}-15"}
+                for i in range(10000)]
+    receipts = [{"id": f"r{i:06d}", "business_id": "b1", "customer_id": f"c{i % 400:04d}", "customer_name": "",
+                 "amount": float(i % 500), "reference": f"BNK-{i}", "date": f"2026-0{1 + i % 9}-20"}
+                for i in range(8000)]
+    sales = [{"id": f"s{i:06d}", "business_id": "b1", "customer_id": f"c{i % 400:04d}",
+              "payment_method": "account", "total": float(i % 300), "date": "2026-05-01"} for i in range(2000)]
+    fake, restore = _with_fake_rest({"customers": cust, "invoices": invoices, "receipts": receipts, "sales": sales,
+                                     "credit_notes": [], "allocation_log": [], "customer_ledgers": [],
+                                     "customer_ledger_state": [], "customer_ledger_dirty": []})
+    cl._READY.clear()
+    try:
+        t0 = time.perf_counter()
+        old = clickai.calc_all_customer_balances("b1")
+        old_ms, old_bytes = (time.perf_counter() - t0) * 1000, fake.bytes_out
+        cl.rebuild(clickai.db, "b1")
+        fake.bytes_out = 0
+        t0 = time.perf_counter()
+        new = clickai.calc_all_customer_balances("b1")
+        new_ms, new_bytes = (time.perf_counter() - t0) * 1000, fake.bytes_out
+        fake.tables["customer_ledger_dirty"].append({"business_id": "b1", "customer_key": "c0007", "seq": 1})
+        fake.bytes_out = 0
+        t0 = time.perf_counter()
+        clickai.calc_all_customer_balances("b1")
+        sync_ms, sync_bytes = (time.perf_counter() - t0) * 1000, fake.bytes_out
+    finally:
+        cl._READY.clear()
+        restore()
+    assert old == new
+    return [
+        ("recompute", f"{old_ms:.0f}ms, {old_bytes / 1e6:.1f}MB read"),
+        ("ledger", f"{new_ms:.0f}ms, {new_bytes / 1e3:.0f}KB read"),
+        ("ledger + 1 dirty", f"{sync_ms:.0f}ms, {sync_bytes / 1e3:.0f}KB read"),
+    ]
+
+
+def bench_shared_stock_cache_workers():
+    """4 gunicorn workers open the POS for one business: per-worker dicts vs the shared cache."""
+    import clickai
+    from clickai_cache import SharedCache, MemoryBackend, SQLiteBackend
+    import tempfile
+    items = [{"id": f"{i:06d}", "business_id": "b1", "code": f"C{i}", "quantity": i}
+             for i in range(7000)]
+    fake, restore = _with_fake_rest({"stock_items": items, "stock": []})
+    path = os.path.join(tempfile.mkdtemp(prefix="clickai_bench_"), "cache.sqlite3")
+
+    def open_pos(workers):
+        fake.calls = []
+        for cache in workers:                   # each worker's first typeahead
+            clickai._stock_cache = cache
+            assert len(clickai.db.get_all_stock("b1")) == 7000
+        return len(fake.calls)
+
+    saved = clickai._stock_cache
+    try:
+        old_calls = open_pos([SharedCache("stock", 30, MemoryBackend(), register=False) for _ in range(4)])
+        shared = [SharedCache("stock", 30, SQLiteBackend(path), register=False) for _ in range(4)]
+        new_calls = open_pos(shared)
+        t0 = time.perf_counter()
+        for _ in range(200):                    # warm keystrokes: stamp check only
+            shared[1].get("b1")
+        hit_us = (time.perf_counter() - t0) / 200 * 1e6
+        shared[0].pop("b1", None)               # a stock write in worker 0
+        stale = sum(c.get("b1") is not None for c in shared)
+    finally:
+        clickai._stock_cache = saved
+        restore()
+    return [
+        ("Supabase round trips, per-worker", f"{old_calls}"),
+        ("Supabase round trips, shared", f"{new_calls}"),
+        ("warm hit (7k items)", f"{hit_us:,.0f} us"),
+        ("workers stale after a write", f"{stale} of 4"),
+    ]
+
+
+def bench_stock_delta_refresh():
+    """A POS morning: 50 sales against 7,000 items, each followed by a typeahead read: pop + full reload vs in-place patch + updated_at delta."""
+    import clickai
+    stamp = "2026-10-01T08:00:00+00:00"
+    items = [{"id": f"{i:06d}", "business_id": "b1", "code": f"C{i}", "description": f"Item {i}",
+              "quantity": 100, "updated_at": stamp} for i in range(7000)]
+    fake, restore = _with_fake_rest({"stock_items": items, "stock": []})
+    rnd = random.Random(9)
+    sold = [rnd.randrange(7000) for _ in range(50)]
+
+    def morning(refresh):
+        clickai.db.invalidate_stock("b1")
+        clickai.db.stock_catalog("b1")
+        fake.calls, fake.bytes_out = [], 0
+        t0 = time.perf_counter()
+        for n, i in enumerate(sold):
+            row = items[i]
+            row["quantity"] -= 1
+            row["updated_at"] = f"2026-10-01T09:{n // 60:02d}:{n % 60:02d}+00:00"
+            refresh(dict(row))
+            assert clickai.db.stock_catalog("b1").get(row["id"]).qty == row["quantity"]
+        return len(fake.calls), fake.bytes_out, (time.perf_counter() - t0) * 1000
+
+    try:
+        old = morning(lambda row: clickai.db.invalidate_stock("b1"))
+
+        def patch_and_sync(row):
+            clickai.db._stock_row_written("b1", row)   # the till that sold it
+            clickai.db.stock_changed("b1")             # the next 30s sync
+        new = morning(patch_and_sync)
+    finally:
+        clickai.db.invalidate_stock("b1")
+        restore()
+    return [
+        ("round trips, pop + reload", f"{old[0]:,}"),
+        ("round trips, patch + delta", f"{new[0]:,}"),
+        ("bytes, pop + reload", _kb(old[1])),
+        ("bytes, patch + delta", _kb(new[1])),
+        ("wall time old -> new", f"{old[2]:,.0f} ms -> {new[2]:,.0f} ms"),
+    ]
+
+
+def bench_customer_aging_engine():
+    """Month-end aging of 3,000 debtors / ~45k ledger items: per-customer statement loop vs columnar engine."""
+    import random
+    import clickai
+    from clickai_aging import customer_aging
+    rnd = random.Random(3)
+    items, alloc = {}, {}
+    for c in range(3000):
+        rows = []
+        for k in range(rnd.randint(0, 30)):
+            d = f"2026-{rnd.randint(1, 9):02d}-{rnd.randint(1, 28):02d}"
+            if rnd.random() < 0.55:
+                rows.append({"date": d, "debit": round(rnd.uniform(1, 5000), 2), "credit": 0.0,
+                             "invoice_id": f"i{c}-{k}"})
+                if rnd.random() < 0.3:
+                    alloc[f"i{c}-{k}"] = rows[-1]["debit"]
+            else:
+                rows.append({"date": d, "debit": 0.0, "credit": round(rnd.uniform(1, 6000), 2), "kind": "payment"})
+        items[f"c{c}"] = rows
+    t0 = time.perf_counter()
+    old = {}
+    for cid, rows in items.items():
+        a = clickai._statement_aging_from_ledger(rows, "2026-08-31",
+                                                 round(sum(r["debit"] - r["credit"] for r in rows), 2), alloc)
+        a["total"] = round(sum(a.values()), 2)
+        old[cid] = a
+    loop_ms = (time.perf_counter() - t0) * 1000
+    t0 = time.perf_counter()
+    new = customer_aging(items, "2026-08-31", alloc)
+    engine_ms = (time.perf_counter() - t0) * 1000
+    assert old == new
+    return [
+        ("statement loop", f"{loop_ms:.0f}ms"),
+        ("columnar engine", f"{engine_ms:.0f}ms"),
+    ]
+
+
+def bench_stock_typeahead_index():
+    """Typeahead over 50,000 stock items: per-keystroke scan vs db.stock_index() end to end (budget 1ms)."""
+    import re
+    import clickai
+    rnd = random.Random(5)
+    words = ("bolt nut washer hex cap screw flat round m6 m8 m10 m12 galv zinc stainless "
+             "304 316 plate angle channel pipe tube sheet").split()
+    items = [{"id": f"{i:06d}", "business_id": "b1",
+              "code": f"{rnd.choice(['BLT', 'NUT', 'WSH', 'PL', 'ANG', 'M'])}{rnd.randint(1, 9999)}",
+              "description": " ".join(rnd.sample(words, 4)) + f" {rnd.randint(5, 200)} x {rnd.randint(5, 200)}",
+              "category": rnd.choice(["Bolts", "Steel", "Nuts"]), "quantity": rnd.randint(0, 500),
+              "cost_price": round(rnd.uniform(1, 900), 2), "selling_price": round(rnd.uniform(1, 1200), 2),
+              "unit": "each", "barcode": f"600{rnd.randint(10 ** 9, 10 ** 10 - 1)}", "supplier_code": "",
+              "reorder_level": 5, "location": rnd.choice(["A1", "B2", "Yard"]), "vat_type": "standard",
+              "created_at": "2025-01-01T08:00:00+00:00", "updated_at": "2026-10-01T08:00:00+00:00"}
+             for i in range(50000)]
+    keystrokes = ["b", "bo", "bol", "bolt", "bolt m", "bolt m1", "bolt m10", "10 x", "10 x 12",
+                  "blt1", "blt12", "stainless 316", "stainless 316 pl", "zzz"]
+
+    def scan(q):
+        terms = re.sub(r"\s*[xX]\s*", "x", q.lower()).split()
+        hits = []
+        for s in items:
+            c = re.sub(r"\s*[xX]\s*", "x", s["code"].lower())
+            d = re.sub(r"\s*[xX]\s*", "x", s["description"].lower())
+            if all(t in c + " " + d for t in terms):
+                hits.append(s)
+                if len(hits) >= 100:
+                    break
+        return hits
+
+    t0 = time.perf_counter()
+    for q in keystrokes:
+        scan(q)
+    scan_ms = (time.perf_counter() - t0) * 1000 / len(keystrokes)
+    fake, restore = _with_fake_rest({"stock_items": items, "stock": []})
+    clickai.db.invalidate_stock("b1")
+    try:
+        t0 = time.perf_counter()
+        index = clickai.db.stock_index("b1")
+        load_ms = (time.perf_counter() - t0) * 1000
+        local_copy = clickai._stock_cache._local.get("b1") is not None
+        fake.calls = []
+        worst = 0.0
+        for q in keystrokes:                    # what the typeahead route does per keystroke
+            t0 = time.perf_counter()
+            for _ in range(50):
+                clickai.db.stock_index("b1").lookup(q)
+            worst = max(worst, (time.perf_counter() - t0) * 1000 / 50)
+        assert not fake.calls, "warm keystrokes must not read Supabase"
+    finally:
+        clickai.db.invalidate_stock("b1")
+        restore()
+    assert worst < 1.0, f"{worst:.2f}ms over the 1ms typeahead budget"
+    return [
+        ("scan per keystroke", f"{scan_ms:.1f}ms"),
+        ("cold load + index build (once)", f"{load_ms:.0f}ms"),
+        ("local decoded copy kept", "yes" if local_copy else "no (over the byte cap)"),
+        ("stock_index per keystroke (worst)", f"{worst:.3f}ms"),
+        ("index size", _kb(index.__sizeof__())),
+    ]
+
+
+def bench_pos_sale_commit_p95():
+    """Till click to receipt for 40 carts of 1-12 lines over a 10 ms link: per-line writes vs bulk vs one RPC (p50 / p95)."""
+    import clickai
+    from test_clickai import _stock_ledger_trigger, _pos_commit_sale_rpc
+    items = [{"id": f"s{i}", "business_id": "b1", "code": f"C{i}", "quantity": 10 ** 6, "cost_price": 3.0}
+             for i in range(200)]
+    tables = {"stock_items": items, "stock": [], "sales": [], "journals": [], "stock_movements": [],
+              "customers": []}
+    fake, restore = _with_fake_rest(tables, latency=0.010)
+    fake.triggers["stock_movements"] = _stock_ledger_trigger
+    rnd = random.Random(11)
+    carts = [[(f"s{rnd.randrange(200)}", rnd.randint(1, 5)) for _ in range(rnd.randint(1, 12))]
+             for _ in range(40)]
+
+    def journals(n, cost):
+        return [(f"POS Sale {n}", n, [{"account_code": "1050", "debit": 115.0, "credit": 0},
+                                      {"account_code": "4000", "debit": 0, "credit": 100.0},
+                                      {"account_code": "2100", "debit": 0, "credit": 15.0}]),
+                (f"COS - POS Sale {n}", f"COS-{n}", [{"account_code": "5000", "debit": cost, "credit": 0},
+                                                    {"account_code": "1300", "debit": 0, "credit": cost}])]
+
+    def old_sale(n, cart):                   # the route before: one write per table per line
+        sale = {"id": clickai.generate_id(), "business_id": "b1", "sale_number": n, "date": "2026-10-18"}
+        clickai.db.save_batch("sales", [sale])
+        sale_j, cos_j = journals(n, 3.0 * sum(q for _, q in cart))
+        clickai.create_journal_entry("b1", "2026-10-18", *sale_j)
+        found = clickai.db.get_many_stock([sid for sid, _ in cart])
+        for sid, qty in cart:
+            clickai.db.move_stock("b1", sid, "sale", qty, reference=f"POS Sale {n}",
+                                  on_hand=found[sid]["quantity"])
+        clickai.create_journal_entry("b1", "2026-10-18", *cos_j)
+
+    def new_sale(n, cart):
+        sale = {"id": clickai.generate_id(), "business_id": "b1", "sale_number": n, "date": "2026-10-18"}
+        found = clickai.db.get_many_stock([sid for sid, _ in cart])
+        ok, err, _ = clickai.commit_pos_sale(
+            "b1", sale, journals(n, 3.0 * sum(q for _, q in cart)),
+            [{"stock_id": sid, "quantity": qty, "on_hand": found[sid]["quantity"]} for sid, qty in cart])
+        assert ok, err
+
+    def run(commit, till):
+        times = []
+        for k, cart in enumerate(carts):
+            t0 = time.perf_counter()
+            commit(f"POS{till}{k:05d}", cart)
+            times.append((time.perf_counter() - t0) * 1000)
+        times.sort()
+        return times[len(times) // 2], times[int(0.95 * (len(times) - 1))]
+
+    out = []
+    try:
+        clickai._pos_sale_rpc_off = True
+        for till, (label, commit) in enumerate((("per-line writes", old_sale), ("bulk per table", new_sale))):
+            fake.calls = []
+            p50, p95 = run(commit, till)
+            out.append((f"{label} p50 / p95", f"{p50:,.0f} / {p95:,.0f} ms ({len(fake.calls) / len(carts):.1f} calls)"))
+        clickai._pos_sale_rpc_off = False
+        fake.rpcs["pos_commit_sale"] = _pos_commit_sale_rpc
+        fake.calls = []
+        p50, p95 = run(new_sale, 2)
+        out.append(("one RPC p50 / p95", f"{p50:,.0f} / {p95:,.0f} ms ({len(fake.calls) / len(carts):.1f} calls)"))
+    finally:
+        clickai._pos_sale_rpc_off = False
+        clickai.db.invalidate_stock("b1")
+        restore()
+    return out
+
+
+# ---------------------------------------------------------------------------
+# Runner
+# ---------------------------------------------------------------------------
+
+def run(only=""):
+    benches = sorted(
+        (name, fn) for name, fn in globals().items()
+        if name.startswith("bench_") and callable(fn) and only in name
+    )
+    print("=" * 60)
+    print("ClickAI benchmarks")
+    print("=" * 60)
+    failed = 0
+    for name, fn in benches:
+        print(f"{name}  — {(fn.__doc__ or '').strip()}")
+        try:
+            for label, value in fn():
+                print(f"    {label:<32} {value}")
+        except Exception as e:
+            print(f"    ERROR {type(e).__name__}: {e}")
+            failed += 1
+    print("=" * 60)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(run(sys.argv[1] if len(sys.argv) > 1 else ""))
@@ -55,6 +55,8 @@ import re
 import base64
 import time
 import math
+from array import array
+from operator import itemgetter
 import anthropic
 import imaplib
 import email
@@ -65,7 +67,12 @@ from typing import Optional, Dict, List, Any, Tuple
 from functools import wraps
 import uuid
 import hashlib
+import threading
+import urllib.parse
 from concurrent.futures import ThreadPoolExecutor
+from clickai_cache import SharedCache, BoundedCache, cache_stats  # stdlib only
+from clickai_stock_catalog import StockCatalog, apply_stock_changes  # stdlib only
+from clickai_stock_ledger import signed_qty, replay as replay_stock_movements, reconcile as reconcile_stock  # stdlib only
 import html  # XSS protection
 import smtplib
 from email.mime.text import MIMEText
@@ -155,11 +162,33 @@ try:
 except ImportError:
     CASHUP_LOADED = False
 try:
-    from clickai_allocation_log import register_ledger_routes, log_allocation
+    from clickai_allocation_log import (register_ledger_routes, log_allocation,
+                                        reversal_entries, reversed_sources, reversed_references)
     ALLOCATION_LOG_LOADED = True
 except ImportError:
     log_allocation = None
     ALLOCATION_LOG_LOADED = False
+try:
+    from clickai_aging import customer_aging
+    AGING_LOADED = True
+except ImportError:
+    AGING_LOADED = False
+try:
+    from clickai_gl_balances import register_gl_balance_routes, account_totals
+    GL_BALANCES_LOADED = True
+except ImportError:
+    GL_BALANCES_LOADED = False
+try:
+    from clickai_customer_ledger import (register_customer_ledger_routes, ledger_balances,
+                                         ledger_items, ledger_balance)
+    CUSTOMER_LEDGER_LOADED = True
+except ImportError:
+    CUSTOMER_LEDGER_LOADED = False
+try:
+    from clickai_period_close import register_period_close_routes, subledger_snapshot
+    PERIOD_CLOSE_LOADED = True
+except ImportError:
+    PERIOD_CLOSE_LOADED = False
 try:
     from clickai_whatsapp import register_whatsapp_routes
     WHATSAPP_MODULE_LOADED = True
@@ -1074,6 +1103,29 @@ _db_adapter = _HTTPAdapter(pool_connections=20, pool_maxsize=20, max_retries=0)
 _DB_SESSION.mount("https://", _db_adapter)
 _DB_SESSION.mount("http://", _db_adapter)
 
+# Parallel page prefetch for big reads (DB.get(..., parallel=True)). One read
+# fans out to at most DB_PARALLEL_PAGES pages at a time, and all reads in this
+# worker share DB_PARALLEL_SLOTS in-flight page fetches — so a TB report can
+# never take the whole 20-connection pool away from the other gthreads.
+DB_PARALLEL_PAGES = int(os.environ.get("DB_PARALLEL_PAGES", "4"))
+DB_PARALLEL_SLOTS = int(os.environ.get("DB_PARALLEL_SLOTS", "8"))
+_DB_PARALLEL_SEM = threading.BoundedSemaphore(DB_PARALLEL_SLOTS)
+
+# Page decoding for bulk reads. orjson parses a 1000-row page several times
+# faster than the stdlib and returns the same dicts/lists/floats; without it
+# we use json. numpy (pulled in by pandas) backs DB.get_columnar() vectors;
+# without it they are array('d').
+try:
+    import orjson as _orjson
+    _json_loads = _orjson.loads
+except ImportError:
+    _orjson = None
+    _json_loads = json.loads
+try:
+    import numpy as _np
+except ImportError:
+    _np = None
+
 # Email Config - Sending
 SMTP_HOST = os.environ.get("SMTP_HOST", "smtp.gmail.com")
 SMTP_PORT = int(os.environ.get("SMTP_PORT", "587"))
@@ -2194,56 +2246,120 @@ def money(amount) -> str:
         return "R0.00"
 
 
-def _reversed_customer_payment_refs(biz_id: str) -> set:
+def _id_chunks(values, size: int = 100) -> list:
+    """Distinct non-empty values in URL-sized lists for an ("in", ...) filter."""
+    values = sorted({str(v) for v in values if v})
+    return [values[i:i + size] for i in range(0, len(values), size)]
+
+
+def _reversal_entries(biz_id: str, source_ids=None, strict: bool = False) -> list:
+    """allocation_log invoice_reverse / pos_refund entries (full rows, for the
+    who/when/why shown next to a reversed document)."""
+    if not ALLOCATION_LOG_LOADED:
+        return []
+    try:
+        return reversal_entries(db, biz_id, source_ids, strict=strict)
+    except Exception as _e:
+        if strict:
+            raise
+        logger.warning(f"[CALC BATCH] allocation_log reversal read failed: {_e}")
+        return []
+
+
+def _reversed_sources(biz_id: str, source_ids=None, strict: bool = False) -> tuple:
+    """(reversed invoice ids, refunded sale ids) from allocation_log's
+    invoice_reverse / pos_refund entries. The status stamp on the document
+    can lag, so these are the source of truth.
+    source_ids: only look these documents up instead of every reversal.
+    strict: raise on a failed read instead of treating it as "nothing reversed"."""
+    if not ALLOCATION_LOG_LOADED:
+        return set(), set()
+    try:
+        return reversed_sources(db, biz_id, source_ids, strict=strict)
+    except Exception as _e:
+        if strict:
+            raise
+        logger.warning(f"[CALC BATCH] allocation_log derive failed: {_e}")
+        return set(), set()
+
+
+# receipts.customer_name_key (RECEIPT_LOOKUP_SQL); set once the server says
+# the column is not there, so name matching falls back to a Python scan
+_receipt_name_key_off = False
+
+
+def _unlinked_receipts(biz_id: str, names, select: str = "*", strict: bool = False) -> list:
+    """Receipts with no customer_id whose customer name matches one of `names`
+    (upper-cased and stripped - the banking-recon name match). Reads just
+    those names through the indexed customer_name_key column; until
+    RECEIPT_LOOKUP_SQL has been run, every unlinked receipt is read and
+    matched here instead."""
+    global _receipt_name_key_off
+    keys = sorted({(n or "").upper().strip() for n in names} - {""})
+    if not keys:
+        return []
+    if select != "*":
+        select = ",".join(dict.fromkeys(select.split(",") + ["customer_id", "customer_name"]))
+    wanted = set(keys)
+
+    def _unlinked(rows):
+        return [r for r in rows if not r.get("customer_id")
+                and (r.get("customer_name") or "").upper().strip() in wanted]
+
+    if not _receipt_name_key_off:
+        try:
+            return _unlinked([r for _chunk in _id_chunks(keys)
+                              for r in db.iter_rows("receipts", {"business_id": biz_id,
+                                                                 "customer_name_key": ("in", _chunk)},
+                                                    select=select, strict=True)])
+        except RuntimeError as e:
+            if "HTTP 400" in str(e):
+                _receipt_name_key_off = True
+                logger.warning("[RECEIPTS] No customer_name_key column - run RECEIPT_LOOKUP_SQL. "
+                               "Matching unlinked receipts by name in Python.")
+            elif strict:
+                raise
+    return _unlinked(db.iter_rows("receipts", {"business_id": biz_id}, select=select, strict=strict))
+
+
+def _reversed_customer_payment_refs(biz_id: str, refs=None, strict: bool = False) -> set:
     """References whose ledger allocation was reversed with NO surviving active
     allocation. The /ledger reverse marks the allocation_log row status='reversed'
     but does NOT touch the receipt; the receipt shares its 'BNK-...' reference with
     that allocation, so we exclude it from balances/statements. A reference counts as
     reversed only when every allocation carrying it is reversed — so if a duplicate on
-    the SAME reference is kept active, the surviving payment is preserved."""
-    reversed_refs, active_refs = set(), set()
+    the SAME reference is kept active, the surviving payment is preserved.
+    refs: only look these references up (one filtered read) instead of every reversed one.
+    strict: raise on a failed read instead of treating it as "nothing reversed"."""
+    if not ALLOCATION_LOG_LOADED:
+        return set()
     try:
-        for _a in (db.get("allocation_log", {"business_id": biz_id}, select="reference,status") or []):
-            _r = (_a.get("reference") or "").strip()
-            if not _r:
-                continue
-            if (_a.get("status") or "") == "reversed":
-                reversed_refs.add(_r)
-            else:
-                active_refs.add(_r)
+        return reversed_references(db, biz_id, refs, strict=strict)
     except Exception as _e:
+        if strict:
+            raise
         logger.warning(f"[REVERSED PAYMENTS] derive failed: {_e}")
-    return reversed_refs - active_refs
+        return set()
 
 
-def calc_customer_balance(biz_id: str, customer_id: str) -> float:
+def calc_customer_balance(biz_id: str, customer_id: str, customer: dict = None) -> float:
     """Calculate customer balance from source documents (invoices, credit notes, receipts, account sales).
     Positive = customer owes us.  Negative = customer in credit (overpaid).
     Balance = invoices + account_sales - receipts - credit_notes
+    Read from the maintained customer ledger when the business has one;
+    otherwise only this customer's documents are read.
+    customer: the customer record if the caller has it (saves a lookup).
     """
+    if CUSTOMER_LEDGER_LOADED:
+        _led = ledger_balance(db, biz_id, customer_id)
+        if _led is not None:
+            return _led
     try:
         # Debits: what customer owes
         invoices = db.get("invoices", {"business_id": biz_id, "customer_id": customer_id}) or []
         # Exclude reversed invoices — same rule as calc_all_customer_balances.
         # The status stamp can lag, so also derive reversals from allocation_log.
-        _reversed_inv_ids = set()
-        try:
-            _alog = db.get("allocation_log", {"business_id": biz_id}, select="source_id,source_table,extra") or []
-            for _al in _alog:
-                _x_raw = _al.get("extra", "{}")
-                if isinstance(_x_raw, str):
-                    try:
-                        _x = json.loads(_x_raw) if _x_raw else {}
-                    except Exception:
-                        _x = {}
-                elif isinstance(_x_raw, dict):
-                    _x = _x_raw
-                else:
-                    _x = {}
-                if _x.get("action") == "invoice_reverse" and _al.get("source_table") == "invoices":
-                    _reversed_inv_ids.add(_al.get("source_id", ""))
-        except Exception:
-            pass
+        _reversed_inv_ids = _reversed_sources(biz_id, [i.get("id") for i in invoices])[0]
         inv_total = sum(float(i.get("total", 0)) for i in invoices
                         if i.get("status") not in ("credited", "reversed")
                         and i.get("id") not in _reversed_inv_ids)
@@ -2255,17 +2371,14 @@ def calc_customer_balance(biz_id: str, customer_id: str) -> float:
         # Credits: what customer has paid / been credited
         receipts_by_id = db.get("receipts", {"business_id": biz_id, "customer_id": customer_id}) or []
         # Also pick up unlinked receipts matched by name (from banking recon)
-        all_receipts = db.get("receipts", {"business_id": biz_id}) or []
-        _cust = db.get_one("customers", customer_id)
-        _cust_name_upper = (_cust.get("name") or "").upper().strip() if _cust else ""
+        _cust = customer if customer is not None else db.get_one("customers", customer_id)
         _by_id_set = {r.get("id") for r in receipts_by_id}
-        receipts_by_name = [r for r in all_receipts
-                            if not r.get("customer_id") and _cust_name_upper
-                            and (r.get("customer_name") or "").upper().strip() == _cust_name_upper
-                            and r.get("id") not in _by_id_set]
+        receipts_by_name = [r for r in _unlinked_receipts(biz_id, [(_cust or {}).get("name")])
+                            if r.get("id") not in _by_id_set]
         all_cust_receipts = receipts_by_id + receipts_by_name
         # Exclude payments whose ledger allocation was reversed
-        _rev_pay_refs = _reversed_customer_payment_refs(biz_id)
+        _rev_pay_refs = _reversed_customer_payment_refs(
+            biz_id, refs={(r.get("reference") or "").strip() for r in all_cust_receipts})
         all_cust_receipts = [r for r in all_cust_receipts if (r.get("reference") or "").strip() not in _rev_pay_refs]
         # A receipt settles cash + any settlement discount taken — both reduce
         # what the customer owes (the discount was booked to Discount Allowed)
@@ -2322,7 +2435,8 @@ def calc_supplier_balance(biz_id: str, supplier_id: str) -> float:
         return 0.0
 
 
-def _customer_ledger_items(biz_id: str, customers=None, asat: str = None) -> dict:
+def _customer_ledger_items(biz_id: str, customers=None, asat: str = None,
+                           customer_ids=None, strict: bool = False) -> dict:
     """Per-customer debit/credit items built from source documents.
     Returns {customer_id: [{"date", "debit", "credit", "invoice_id"}, ...]}.
 
@@ -2330,8 +2444,23 @@ def _customer_ledger_items(biz_id: str, customers=None, asat: str = None) -> dic
     balance and the aging analysis both read from it, so they cannot disagree.
     Excludes reversed invoices and refunded sales (derived from allocation_log).
     asat: optional 'YYYY-MM-DD' cut-off. Documents with no date always count.
+    customer_ids: only build these customers, reading just their documents
+    (the customer ledger refreshes the customers a write touched this way).
+    strict: raise on any failed read instead of returning what was read.
     """
     items = {}
+    _only = None if customer_ids is None else {str(c) for c in customer_ids if c}
+
+    def _read(table, select, by_customer=True, **flt):
+        """All rows of `table` for this business, or just the _only customers'."""
+        base = {"business_id": biz_id, **flt}
+        if _only is None or not by_customer:
+            if strict:
+                return list(db.iter_rows(table, base, select=select, strict=True))
+            return db.get(table, base, select=select) or []
+        return [row for _chunk in _id_chunks(_only)
+                for row in db.iter_rows(table, {**base, "customer_id": ("in", _chunk)},
+                                        select=select, strict=strict)]
 
     def _add(cid, date, debit, credit, invoice_id=None, kind=None, age_date=None):
         if not cid:
@@ -2342,14 +2471,29 @@ def _customer_ledger_items(biz_id: str, customers=None, asat: str = None) -> dic
         })
 
     try:
-        all_invoices = db.get("invoices", {"business_id": biz_id}, select="id,customer_id,status,total,invoice_number,date") or []
+        all_invoices = _read("invoices", "id,customer_id,status,total,invoice_number,date")
         # NOTE: 'sales' has no status column - asking for it makes PostgREST
         # return 400 and this read silently comes back empty, which drops every
         # POS account sale out of the balance. Refunds come from allocation_log.
-        all_sales = db.get("sales", {"business_id": biz_id}, select="id,customer_id,payment_method,total,date") or []
-        all_receipts = db.get("receipts", {"business_id": biz_id}, select="customer_id,customer_name,amount,reference,discount_total,date") or []
-        all_credit_notes = db.get("credit_notes", {"business_id": biz_id}, select="customer_id,total,invoice_number,date") or []
-        all_customers = customers if customers is not None else (db.get("customers", {"business_id": biz_id}) or [])
+        all_sales = _read("sales", "id,customer_id,payment_method,total,date")
+        _rec_cols = "customer_id,customer_name,amount,reference,discount_total,date"
+        all_credit_notes = _read("credit_notes", "customer_id,total,invoice_number,date")
+        if customers is not None:
+            all_customers = customers
+        elif _only is not None:
+            all_customers = _read("customers", "id,name", by_customer=False)
+        else:
+            all_customers = db.get("customers", {"business_id": biz_id}) or []
+        if _only is None:
+            all_receipts = sorted(_read("receipts", "id," + _rec_cols), key=lambda r: str(r.get("id")))
+        else:
+            # Unlinked receipts (banking recon) are matched to a customer by
+            # name; both reads are put in id order so their items line up
+            all_receipts = sorted(_read("receipts", "id," + _rec_cols) +
+                                  _unlinked_receipts(biz_id, [c.get("name") for c in all_customers
+                                                              if str(c.get("id")) in _only],
+                                                     "id," + _rec_cols, strict=strict),
+                                  key=lambda r: str(r.get("id")))
 
         # ── Statement cut-off ──
         _cut = (asat or "")[:10]
@@ -2361,31 +2505,9 @@ def _customer_ledger_items(biz_id: str, customers=None, asat: str = None) -> dic
             return (not _d) or _d <= _cut
 
         # ── Derive reversed invoice IDs and refunded sale IDs from allocation_log ──
-        _reversed_invoice_ids = set()
-        _refunded_sale_ids = set()
-        try:
-            _alloc_log = db.get("allocation_log", {"business_id": biz_id}, select="source_id,source_table,extra") or []
-            for _al in _alloc_log:
-                _src_id = _al.get("source_id", "")
-                if not _src_id:
-                    continue
-                _extra_raw = _al.get("extra", "{}")
-                if isinstance(_extra_raw, str):
-                    try:
-                        _extra = json.loads(_extra_raw) if _extra_raw else {}
-                    except Exception:
-                        _extra = {}
-                elif isinstance(_extra_raw, dict):
-                    _extra = _extra_raw
-                else:
-                    _extra = {}
-                _action = _extra.get("action", "")
-                if _action == "invoice_reverse" and _al.get("source_table") == "invoices":
-                    _reversed_invoice_ids.add(_src_id)
-                elif _action == "pos_refund" and _al.get("source_table") == "sales":
-                    _refunded_sale_ids.add(_src_id)
-        except Exception as _al_err:
-            logger.warning(f"[CALC BATCH] allocation_log derive failed: {_al_err}")
+        _reversed_invoice_ids, _refunded_sale_ids = _reversed_sources(
+            biz_id, None if _only is None else [d.get("id") for d in all_invoices] + [d.get("id") for d in all_sales],
+            strict=strict)
 
         # Build name→id map for unlinked receipt matching
         _name_to_id = {}
@@ -2417,7 +2539,9 @@ def _customer_ledger_items(biz_id: str, customers=None, asat: str = None) -> dic
 
         # Credits: receipts (skip payments whose ledger allocation was reversed).
         # A receipt settles cash + any settlement discount taken.
-        _rev_pay_refs = _reversed_customer_payment_refs(biz_id)
+        _rev_pay_refs = _reversed_customer_payment_refs(
+            biz_id, refs=None if _only is None else {(r.get("reference") or "").strip() for r in all_receipts},
+            strict=strict)
         for r in all_receipts:
             if not _in_period(r):
                 continue
@@ -2428,7 +2552,7 @@ def _customer_ledger_items(biz_id: str, customers=None, asat: str = None) -> dic
                 # Try name match
                 _rname = (r.get("customer_name") or "").upper().strip()
                 cid = _name_to_id.get(_rname, "")
-            if cid:
+            if cid and (_only is None or cid in _only):
                 _add(cid, r.get("date"), 0.0, float(r.get("amount", 0)), kind="payment")
                 _r_disc = float(r.get("discount_total", 0) or 0)
                 if _r_disc > 0.005:
@@ -2442,6 +2566,13 @@ def _customer_ledger_items(biz_id: str, customers=None, asat: str = None) -> dic
             _num = (inv.get("invoice_number") or "").strip()
             if _num:
                 _inv_date_by_num[_num] = inv.get("date")
+        if _only is not None:
+            # A credit note can name an invoice of another customer
+            _missing = {(cn.get("invoice_number") or "").strip() for cn in all_credit_notes} - set(_inv_date_by_num)
+            for _chunk in _id_chunks(_missing):
+                for inv in db.iter_rows("invoices", {"business_id": biz_id, "invoice_number": ("in", _chunk)},
+                                        select="id,invoice_number,date", strict=strict):
+                    _inv_date_by_num[(inv.get("invoice_number") or "").strip()] = inv.get("date")
         for cn in all_credit_notes:
             if not _in_period(cn):
                 continue
@@ -2453,6 +2584,8 @@ def _customer_ledger_items(biz_id: str, customers=None, asat: str = None) -> dic
 
         return items
     except Exception as e:
+        if strict:
+            raise
         logger.error(f"[CALC BATCH] Customer ledger items error: {e}")
         return {}
 
@@ -2461,7 +2594,17 @@ def calc_all_customer_balances(biz_id: str, customers=None, asat: str = None) ->
     """Calculate balances for ALL customers in one batch. Returns {customer_id: balance}.
     Much more efficient than calling calc_customer_balance() per customer.
     asat: optional 'YYYY-MM-DD' cut-off — the balance as it stood on that day.
+    A closed month-end is read from its period-close snapshot; anything else
+    from the maintained customer ledger when the business has one.
     """
+    if asat and customers is None and PERIOD_CLOSE_LOADED:
+        _snap = subledger_snapshot(db, biz_id, "customer", asat)
+        if _snap is not None:
+            return _snap
+    if CUSTOMER_LEDGER_LOADED:
+        _led = ledger_balances(db, biz_id, asat=asat)
+        if _led is not None:
+            return _led
     try:
         balances = {}
         for cid, rows in _customer_ledger_items(biz_id, customers=customers, asat=asat).items():
@@ -2484,8 +2627,14 @@ def calc_all_customer_aging(biz_id: str, asat: str = None, customers=None) -> di
         if not asat:
             asat = _statement_asat("", default_current=True)[1]
         _alloc = _customer_real_allocations(biz_id, asat)
+        _items = ledger_items(db, biz_id, asat=asat) if CUSTOMER_LEDGER_LOADED else None
+        if _items is None:
+            _items = _customer_ledger_items(biz_id, customers=customers, asat=asat)
+        if AGING_LOADED:
+            # Whole book in one columnar pass (clickai_aging) - same buckets
+            return customer_aging(_items, asat, _alloc)
         out = {}
-        for cid, rows in _customer_ledger_items(biz_id, customers=customers, asat=asat).items():
+        for cid, rows in _items.items():
             _bal = 0.0
             for _r in rows:
                 _bal += _r["debit"] - _r["credit"]
@@ -2499,13 +2648,26 @@ def calc_all_customer_aging(biz_id: str, asat: str = None, customers=None) -> di
         return {}
 
 
-def calc_all_supplier_balances(biz_id: str) -> dict:
+def calc_all_supplier_balances(biz_id: str, asat: str = None) -> dict:
     """Calculate balances for ALL suppliers in one batch. Returns {supplier_id: balance}.
     Much more efficient than calling calc_supplier_balance() per supplier.
+    asat: optional 'YYYY-MM-DD' cut-off. Documents with no date always count.
     """
+    if asat and PERIOD_CLOSE_LOADED:
+        _snap = subledger_snapshot(db, biz_id, "supplier", asat)
+        if _snap is not None:
+            return _snap
+    _cut = (asat or "")[:10]
+
+    def _in_period(rec):
+        _d = (rec.get("date") or "")[:10]
+        return not _cut or not _d or _d <= _cut
+
     try:
-        all_s_invoices = db.get("supplier_invoices", {"business_id": biz_id}) or []
-        all_s_payments = db.get("supplier_payments", {"business_id": biz_id}) or []
+        # Invoices/payments/credit notes are folded page by page (iter_rows),
+        # so a long supplier history never sits in memory as one list
+        all_s_invoices = db.iter_rows("supplier_invoices", {"business_id": biz_id})
+        all_s_payments = db.iter_rows("supplier_payments", {"business_id": biz_id})
         all_suppliers = db.get("suppliers", {"business_id": biz_id}) or []
 
         # Build name→id map for unlinked payment matching
@@ -2520,11 +2682,13 @@ def calc_all_supplier_balances(biz_id: str) -> dict:
         # Debits: supplier invoices (what we owe)
         for si in all_s_invoices:
             sid = si.get("supplier_id", "")
-            if sid and si.get("status") != "cancelled":
+            if sid and si.get("status") != "cancelled" and _in_period(si):
                 balances[sid] = balances.get(sid, 0) + float(si.get("total", 0))
 
         # Credits: supplier payments (cash + any settlement discount taken)
         for p in all_s_payments:
+            if not _in_period(p):
+                continue
             sid = p.get("supplier_id", "")
             if not sid:
                 _pname = (p.get("supplier_name") or "").upper().strip()
@@ -2534,9 +2698,9 @@ def calc_all_supplier_balances(biz_id: str) -> dict:
 
         # Credits: active supplier credit notes also reduce what we owe
         try:
-            all_s_cns = db.get("supplier_credit_notes", {"business_id": biz_id}) or []
+            all_s_cns = db.iter_rows("supplier_credit_notes", {"business_id": biz_id})
             for cn in all_s_cns:
-                if (cn.get("status") or "active") != "active":
+                if (cn.get("status") or "active") != "active" or not _in_period(cn):
                     continue
                 sid = cn.get("supplier_id", "")
                 if sid:
@@ -3044,7 +3208,7 @@ class Email:
             return False
         
         name = customer.get("name", "Customer")
-        balance = calc_customer_balance(business.get("id", ""), customer.get("id", ""))
+        balance = calc_customer_balance(business.get("id", ""), customer.get("id", ""), customer)
         biz_name = business.get("name", "Business") if business else "Business"
         
         subject = f"Payment Reminder - {biz_name}"
@@ -3116,7 +3280,7 @@ Thank you for your business!
             return False
         
         name = safe(customer.get("name", "Customer"))
-        balance = calc_customer_balance(business.get("id", ""), customer.get("id", ""))
+        balance = calc_customer_balance(business.get("id", ""), customer.get("id", ""), customer)
         biz_name = safe(business.get("name", "Business")) if business else "Business"
         biz_address = safe(business.get("address", "")).replace("\n", "<br>") if business else ""
         biz_phone = business.get("phone", "") if business else ""
@@ -3134,19 +3298,15 @@ Thank you for your business!
         biz_id = business.get("id", "") if business else ""
         cust_id = customer.get("id", "")
         
-        # Pull all source documents
+        # Pull this customer's source documents
         try:
-            receipts = db.get("receipts", {"business_id": biz_id}) if biz_id else []
+            cust_receipts = db.get("receipts", {"business_id": biz_id, "customer_id": cust_id}) if biz_id else []
         except Exception:
-            receipts = []
-        cust_receipts = [r for r in receipts if r.get("customer_id") == cust_id]
+            cust_receipts = []
         # Also catch receipts that were saved without customer_id but match by name
-        _cust_name_upper = (customer.get("name") or "").upper().strip()
         _by_id_set = {r.get("id") for r in cust_receipts}
-        cust_receipts += [r for r in receipts
-                          if not r.get("customer_id") and _cust_name_upper
-                          and (r.get("customer_name") or "").upper().strip() == _cust_name_upper
-                          and r.get("id") not in _by_id_set]
+        cust_receipts += [r for r in (_unlinked_receipts(biz_id, [customer.get("name")]) if biz_id else [])
+                          if r.get("id") not in _by_id_set]
         
         try:
             credit_notes = db.get("credit_notes", {"business_id": biz_id, "customer_id": cust_id}) if biz_id else []
@@ -3158,31 +3318,8 @@ Thank you for your business!
             sales = []
         
         # Detect refunds/reversals from allocation_log
-        _refunded_sale_ids = set()
-        _reversed_invoice_ids = set()
-        try:
-            _alloc_log = db.get("allocation_log", {"business_id": biz_id}) if biz_id else []
-            for _al in _alloc_log or []:
-                _src_id = _al.get("source_id", "")
-                if not _src_id:
-                    continue
-                _extra_raw = _al.get("extra", "{}")
-                if isinstance(_extra_raw, str):
-                    try:
-                        _extra = json.loads(_extra_raw) if _extra_raw else {}
-                    except Exception:
-                        _extra = {}
-                elif isinstance(_extra_raw, dict):
-                    _extra = _extra_raw
-                else:
-                    _extra = {}
-                _action = _extra.get("action", "")
-                if _action == "pos_refund" and _al.get("source_table") == "sales":
-                    _refunded_sale_ids.add(_src_id)
-                elif _action == "invoice_reverse" and _al.get("source_table") == "invoices":
-                    _reversed_invoice_ids.add(_src_id)
-        except Exception:
-            pass
+        _reversed_invoice_ids, _refunded_sale_ids = _reversed_sources(
+            biz_id, [d.get("id") for d in list(invoices or []) + list(sales or [])]) if biz_id else (set(), set())
         
         # Build transaction list
         transactions = []
@@ -3197,7 +3334,8 @@ Thank you for your business!
                 "credit": 0,
                 "invoice_id": inv.get("id"),
             })
-        _rev_pay_refs = _reversed_customer_payment_refs(biz_id)
+        _rev_pay_refs = _reversed_customer_payment_refs(
+            biz_id, refs={(r.get("reference") or "").strip() for r in cust_receipts})
         for r in cust_receipts:
             if (r.get("reference") or "").strip() in _rev_pay_refs:
                 continue  # payment whose ledger allocation was reversed
@@ -3592,12 +3730,29 @@ Thank you for your business!
 # 
 
 # === STOCK CACHE — avoids 2x Supabase calls per typeahead keystroke ===
-_stock_cache = {}   # {biz_id: (timestamp, data)}
-_STOCK_CACHE_TTL = 30  # seconds — short enough to stay fresh
-
-# === STOCK CACHE — avoids 2x Supabase calls per typeahead keystroke ===
-_stock_cache = {}   # {biz_id: (timestamp, data)}
-_STOCK_CACHE_TTL = 30  # seconds — short enough to stay fresh
+# Shared by every gunicorn worker (clickai_cache.py): one cold load per machine.
+# Every 30s a read fetches just the rows whose updated_at moved (STOCK_SYNC_SQL);
+# the full two-table load is the fallback (first read, hourly, after deletes).
+_STOCK_CACHE_TTL = 30  # seconds between delta syncs — short enough to stay fresh
+_STOCK_FULL_RELOAD = 3600  # seconds — a full load now and then catches anything a delta missed
+_STOCK_SYNC_OVERLAP = 5  # seconds re-read behind the cursor (writes commit out of order)
+_stock_cache = SharedCache("stock", ttl=_STOCK_FULL_RELOAD,
+                           # {biz_id: (synced_at, rows, stock_items count, {loaded_at, cursor, hidden})}
+                           max_entries=50, max_bytes=48 * 1024 * 1024)
+# This worker's StockCatalog per business, rebuilt when the shared rows change
+_stock_catalogs = BoundedCache("stock_catalog", ttl=None, max_entries=50,
+                               max_bytes=128 * 1024 * 1024)
+# Businesses whose stock was written here outside update_stock: delta-sync on the next read
+_stock_due = set()
+# stock_items / stock have no updated_at (STOCK_SYNC_SQL not run): full reloads only
+_stock_sync_off = False
+# stock_movements has no qty_delta (STOCK_LEDGER_SQL not run): move_stock PATCHes quantities
+_stock_ledger_off = False
+# No pos_commit_sale function (POS_SALE_SQL not run): commit_pos_sale uses bulk REST calls
+_pos_sale_rpc_off = False
+# Tables the activity feed found without a `date` column (a 400 on the date
+# filter): their window is created_at alone from then on
+_activity_undated = set()
 
 
 # ════════════════════════════════════════════════════════════════════
@@ -4306,6 +4461,367 @@ def render_statement_pdf(customer: dict, business: dict, transactions: list,
     return pdf_bytes
 
 
+def _copy_rows(result):
+    """Private copy of a read result — list and row dicts — so callers that
+    sort or annotate what they got cannot reach into each other's data."""
+    if isinstance(result, list):
+        return [dict(r) if isinstance(r, dict) else r for r in result]
+    if isinstance(result, dict):
+        return dict(result)
+    return result
+
+
+class _SingleFlight:
+    """Collapses identical concurrent reads into one round trip.
+
+    When the dashboard, the stock typeahead and POS all miss the stock cache
+    for the same business at once, the first thread (the leader) runs the
+    fetch and the others wait on it and get their own copy of its result.
+    Only calls that overlap in time are merged — nothing is cached here.
+    """
+
+    class _Flight:
+        __slots__ = ("done", "result", "error", "waiters", "copies")
+
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+            self.waiters = 0
+            self.copies = []
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.stats = {"calls": 0, "fetches": 0, "coalesced": 0}
+
+    def do(self, key, fn):
+        with self._lock:
+            self.stats["calls"] += 1
+            flight = self._inflight.get(key)
+            if flight is not None:
+                flight.waiters += 1
+                self.stats["coalesced"] += 1
+                leader = False
+            else:
+                flight = self._inflight[key] = self._Flight()
+                leader = True
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.copies.pop()
+        try:
+            flight.result = fn()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                # Unregister first: a caller arriving from here on starts a new flight
+                self._inflight.pop(key, None)
+                self.stats["fetches"] += 1
+                waiters = flight.waiters
+            if flight.error is None:
+                flight.copies = [_copy_rows(flight.result) for _ in range(waiters)]
+            flight.done.set()
+        return flight.result
+
+
+# table → fn(business_ids) run after every write to that table (derived caches
+# such as the GL role map). business_ids is None when the call does not say.
+_DB_WRITE_LISTENERS = {}
+
+
+def _written_business_ids(args, kwargs):
+    """The business_id(s) a DB write call names, or None if it cannot tell."""
+    if kwargs.get("business_id"):
+        return {kwargs["business_id"]}
+    ids = set()
+    for arg in args:
+        for row in (arg if isinstance(arg, list) else [arg]):
+            if isinstance(row, dict):
+                ids.add(row.get("business_id"))
+    return ids if ids and not ids & {None, ""} else None
+
+
+def _db_write(fn):
+    """Mark a DB method that writes to its `table` argument: once the write
+    returns, reads of that table stop joining flights started before it
+    and the table's write listener runs."""
+    @wraps(fn)
+    def wrapper(self, table, *args, **kwargs):
+        try:
+            return fn(self, table, *args, **kwargs)
+        finally:
+            self._touched(table)
+            listener = _DB_WRITE_LISTENERS.get(table)
+            if listener:
+                try:
+                    listener(_written_business_ids(args, kwargs))
+                except Exception as e:
+                    logger.warning(f"[DB] {table} write listener failed: {e}")
+    return wrapper
+
+
+def _to_float(value) -> float:
+    """A numeric cell as float: NULL, '' and unparseable text count as 0."""
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class ColumnBatch(dict):
+    """Result of DB.get_columnar(): {column: values} plus the row count `n`.
+    Numeric columns are numpy float64 arrays (array('d') without numpy)."""
+
+    def __init__(self, columns: dict, n: int):
+        if _np is not None:
+            columns = {c: _np.frombuffer(v, dtype=_np.float64) if isinstance(v, array) else v
+                       for c, v in columns.items()}
+        super().__init__(columns)
+        self.n = n
+
+    def isin(self, column: str, values) -> list:
+        """Row mask: True where `column` is one of `values`."""
+        wanted = set(values)
+        return [v in wanted for v in self[column]]
+
+    def total(self, column: str, mask=None) -> float:
+        """Sum of a numeric column, optionally only the rows where `mask` is True."""
+        vec = self[column]
+        if _np is not None:
+            vec = _np.asarray(vec, dtype=_np.float64)
+            if mask is not None:
+                vec = vec[_np.asarray(mask, dtype=bool)]
+            return float(vec.sum())
+        if mask is not None:
+            return math.fsum(v for v, keep in zip(vec, mask) if keep)
+        return math.fsum(vec)
+
+
+# ==============================================================================
+# SQL: server-side aggregates for DB.aggregate() (run once in Supabase)
+# PostgREST only accepts sum()/count() in select= once aggregates are switched
+# on. Until then DB.aggregate() folds the rows in Python (same answer, more
+# bytes). The indexes let GROUP BY account_code stay an index scan.
+# ==============================================================================
+
+DB_AGGREGATES_SQL = """
+ALTER ROLE authenticator SET pgrst.db_aggregates_enabled = 'true';
+NOTIFY pgrst, 'reload config';
+
+CREATE INDEX IF NOT EXISTS idx_journals_biz_account ON journals(business_id, account_code);
+CREATE INDEX IF NOT EXISTS idx_invoices_biz_status ON invoices(business_id, status);
+CREATE INDEX IF NOT EXISTS idx_sales_biz_date ON sales(business_id, date);
+"""
+
+
+# ==============================================================================
+# SQL: one-customer lookups (run once in Supabase)
+# A single customer's balance reads its own documents by customer_id, the
+# unlinked receipts carrying its name (customer_name_key, upper/trimmed like
+# the Python name match) and only the allocation_log rows for its documents
+# and references. Without these a customer view walks the business's tables.
+# ==============================================================================
+
+RECEIPT_LOOKUP_SQL = """
+ALTER TABLE receipts ADD COLUMN IF NOT EXISTS customer_name_key TEXT
+    GENERATED ALWAYS AS (UPPER(BTRIM(COALESCE(customer_name, ''), E' \\t\\r\\n'))) STORED;
+CREATE INDEX IF NOT EXISTS idx_receipts_biz_name_key ON receipts(business_id, customer_name_key);
+CREATE INDEX IF NOT EXISTS idx_receipts_biz_customer ON receipts(business_id, customer_id);
+CREATE INDEX IF NOT EXISTS idx_invoices_biz_customer ON invoices(business_id, customer_id);
+CREATE INDEX IF NOT EXISTS idx_sales_biz_customer ON sales(business_id, customer_id);
+CREATE INDEX IF NOT EXISTS idx_credit_notes_biz_customer ON credit_notes(business_id, customer_id);
+CREATE INDEX IF NOT EXISTS idx_allocation_log_biz_source ON allocation_log(business_id, source_id);
+CREATE INDEX IF NOT EXISTS idx_allocation_log_biz_reference ON allocation_log(business_id, reference);
+NOTIFY pgrst, 'reload schema';
+"""
+
+
+
+# ==============================================================================
+# SQL: stock delta sync (run once in Supabase)
+# Every stock row carries the time it last changed, so the stock cache can
+# fetch just the rows that moved since its last sync instead of reloading
+# both tables. Until this has been run the cache reloads everything.
+# ==============================================================================
+
+STOCK_SYNC_SQL = """
+ALTER TABLE stock_items ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+ALTER TABLE stock ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+
+CREATE OR REPLACE FUNCTION stock_touch_updated_at() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.updated_at := now();
+    RETURN NEW;
+END $$;
+
+DROP TRIGGER IF EXISTS stock_items_updated_at_trg ON stock_items;
+CREATE TRIGGER stock_items_updated_at_trg BEFORE UPDATE ON stock_items
+    FOR EACH ROW EXECUTE FUNCTION stock_touch_updated_at();
+DROP TRIGGER IF EXISTS stock_updated_at_trg ON stock;
+CREATE TRIGGER stock_updated_at_trg BEFORE UPDATE ON stock
+    FOR EACH ROW EXECUTE FUNCTION stock_touch_updated_at();
+
+CREATE INDEX IF NOT EXISTS idx_stock_items_biz_updated ON stock_items(business_id, updated_at);
+CREATE INDEX IF NOT EXISTS idx_stock_biz_updated ON stock(business_id, updated_at);
+NOTIFY pgrst, 'reload schema';
+"""
+
+
+# ==============================================================================
+# SQL: stock movement ledger (run once in Supabase, after STOCK_SYNC_SQL)
+# A stock_movements row with a qty_delta moves the item's quantity in the same
+# statement, so DB.move_stock() is one INSERT and concurrent sales never
+# overwrite each other (clickai_stock_ledger.py). Existing movements get their
+# delta from type/quantity and each item gets an 'opening' row for whatever
+# the history does not explain, so sum(qty_delta) = on-hand from the start.
+# Rows inserted without a qty_delta (old code paths that PATCH the quantity
+# themselves) get one filled in and move nothing. Until this has been run
+# move_stock() reads the quantity and PATCHes it as before.
+# ==============================================================================
+
+STOCK_LEDGER_SQL = """
+BEGIN;
+LOCK TABLE stock_items, stock, stock_movements IN SHARE ROW EXCLUSIVE MODE;
+
+ALTER TABLE stock_movements ADD COLUMN IF NOT EXISTS kind TEXT;
+ALTER TABLE stock_movements ADD COLUMN IF NOT EXISTS qty_delta NUMERIC;
+ALTER TABLE stock_movements ADD COLUMN IF NOT EXISTS balance_after NUMERIC;
+
+CREATE OR REPLACE FUNCTION stock_movement_delta(mtype TEXT, qty DOUBLE PRECISION) RETURNS NUMERIC
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT (CASE WHEN lower(mtype) = 'in' THEN abs(COALESCE(qty, 0))
+                 WHEN lower(mtype) = 'out' THEN -abs(COALESCE(qty, 0))
+                 WHEN lower(mtype) IN ('adjustment_in', 'adjustment_out', 'stocktake') THEN COALESCE(qty, 0)
+                 ELSE 0 END)::numeric
+$$;
+
+UPDATE stock_movements SET qty_delta = stock_movement_delta(type, quantity)
+ WHERE qty_delta IS NULL;
+
+INSERT INTO stock_movements (id, business_id, stock_id, date, type, quantity, reference,
+                             kind, qty_delta, created_at)
+SELECT gen_random_uuid(), s.business_id, s.id, current_date,
+       CASE WHEN s.q - COALESCE(m.total, 0) > 0 THEN 'in' ELSE 'out' END,
+       abs(s.q - COALESCE(m.total, 0)), 'Ledger opening balance',
+       'opening', s.q - COALESCE(m.total, 0), now()
+  FROM (SELECT business_id, id, COALESCE(quantity, 0) AS q FROM stock_items
+        UNION ALL
+        SELECT business_id, id, COALESCE(qty, quantity, 0) FROM stock) s
+  LEFT JOIN (SELECT stock_id::text AS stock_id, sum(qty_delta) AS total
+               FROM stock_movements GROUP BY stock_id::text) m ON m.stock_id = s.id::text
+ WHERE s.q - COALESCE(m.total, 0) <> 0;
+
+CREATE OR REPLACE FUNCTION stock_movement_apply() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+DECLARE
+    bal NUMERIC;
+BEGIN
+    IF NEW.qty_delta IS NULL THEN
+        NEW.qty_delta := stock_movement_delta(NEW.type, NEW.quantity);
+        RETURN NEW;
+    END IF;
+    IF NEW.kind IS NULL OR NEW.kind = 'opening' THEN
+        RETURN NEW;
+    END IF;
+    UPDATE stock_items SET quantity = COALESCE(quantity, 0) + NEW.qty_delta
+     WHERE id::text = NEW.stock_id::text AND business_id::text = NEW.business_id::text
+    RETURNING quantity INTO bal;
+    IF NOT FOUND THEN
+        UPDATE stock SET qty = COALESCE(qty, quantity, 0) + NEW.qty_delta,
+                         quantity = COALESCE(qty, quantity, 0) + NEW.qty_delta
+         WHERE id::text = NEW.stock_id::text AND business_id::text = NEW.business_id::text
+        RETURNING qty INTO bal;
+        IF NOT FOUND THEN
+            RETURN NULL;            -- no such item: the movement is not stored
+        END IF;
+    END IF;
+    NEW.balance_after := bal;
+    RETURN NEW;
+END $$;
+
+DROP TRIGGER IF EXISTS stock_movements_apply_trg ON stock_movements;
+CREATE TRIGGER stock_movements_apply_trg BEFORE INSERT ON stock_movements
+    FOR EACH ROW EXECUTE FUNCTION stock_movement_apply();
+
+CREATE INDEX IF NOT EXISTS idx_stock_items_id_text ON stock_items((id::text));
+CREATE INDEX IF NOT EXISTS idx_stock_id_text ON stock((id::text));
+CREATE INDEX IF NOT EXISTS idx_stock_movements_biz_stock ON stock_movements(business_id, stock_id);
+COMMIT;
+NOTIFY pgrst, 'reload schema';
+"""
+
+# ==============================================================================
+# SQL: one-transaction POS sale (run once in Supabase, after STOCK_LEDGER_SQL)
+# commit_pos_sale() sends the sale, its journal lines and its stock movements
+# to pos_commit_sale in ONE call; the function inserts them (the ledger and
+# gl_balances triggers fire as for any insert) and moves an account
+# customer's balance, all in one transaction. Each insert writes only the
+# keys its table has, as DB.save() strips unknown columns; the tables are
+# fixed in the function, so it cannot be pointed at any other table. A retry
+# after a lost response is refused by the sale id (409) instead of posting
+# twice. The DROP removes the generic insert helper an earlier version had.
+# Until this has been run the sale goes up as one bulk request per table.
+# ==============================================================================
+
+POS_SALE_SQL = """
+DROP FUNCTION IF EXISTS pos_insert_rows(TEXT, JSONB);
+
+CREATE OR REPLACE FUNCTION pos_commit_sale(p_sale JSONB, p_journals JSONB, p_movements JSONB,
+                                           p_customer_id TEXT DEFAULT NULL,
+                                           p_balance NUMERIC DEFAULT 0) RETURNS JSONB
+LANGUAGE plpgsql AS $$
+DECLARE
+    cols TEXT;
+    moved JSONB := '[]'::jsonb;
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns
+                    WHERE table_schema = 'public' AND table_name = 'stock_movements'
+                      AND column_name = 'qty_delta') THEN
+        RAISE EXCEPTION 'stock_movements has no qty_delta - run STOCK_LEDGER_SQL first'
+            USING ERRCODE = '42703';
+    END IF;
+    -- Each insert names its table; only the column list follows the payload
+    SELECT string_agg(quote_ident(column_name), ', ' ORDER BY ordinal_position) INTO cols
+      FROM information_schema.columns
+     WHERE table_schema = 'public' AND table_name = 'sales' AND p_sale ? column_name;
+    EXECUTE format('INSERT INTO sales (%s) SELECT %s FROM jsonb_populate_record(NULL::sales, $1)',
+                   cols, cols) USING p_sale;
+    IF jsonb_array_length(COALESCE(p_journals, '[]'::jsonb)) > 0 THEN
+        SELECT string_agg(quote_ident(c.column_name), ', ' ORDER BY c.ordinal_position) INTO cols
+          FROM information_schema.columns c
+         WHERE c.table_schema = 'public' AND c.table_name = 'journals'
+           AND EXISTS (SELECT 1 FROM jsonb_array_elements(p_journals) r WHERE r ? c.column_name);
+        EXECUTE format('INSERT INTO journals (%s) SELECT %s '
+                       'FROM jsonb_populate_recordset(NULL::journals, $1)', cols, cols) USING p_journals;
+    END IF;
+    IF jsonb_array_length(COALESCE(p_movements, '[]'::jsonb)) > 0 THEN
+        SELECT string_agg(quote_ident(c.column_name), ', ' ORDER BY c.ordinal_position) INTO cols
+          FROM information_schema.columns c
+         WHERE c.table_schema = 'public' AND c.table_name = 'stock_movements'
+           AND EXISTS (SELECT 1 FROM jsonb_array_elements(p_movements) r WHERE r ? c.column_name);
+        EXECUTE format('WITH ins AS (INSERT INTO stock_movements (%s) SELECT %s '
+                       'FROM jsonb_populate_recordset(NULL::stock_movements, $1) RETURNING *) '
+                       'SELECT COALESCE(jsonb_agg(to_jsonb(ins)), ''[]''::jsonb) FROM ins', cols, cols)
+           INTO moved USING p_movements;
+    END IF;
+    IF COALESCE(p_customer_id, '') <> '' AND COALESCE(p_balance, 0) <> 0 THEN
+        UPDATE customers SET balance = COALESCE(balance, 0) + p_balance
+         WHERE id::text = p_customer_id;
+    END IF;
+    RETURN jsonb_build_object('movements',
+        (SELECT COALESCE(jsonb_agg(jsonb_build_object('stock_id', m->>'stock_id',
+                                                      'balance_after', m->'balance_after')), '[]'::jsonb)
+           FROM jsonb_array_elements(moved) m));
+END $$;
+
+NOTIFY pgrst, 'reload schema';
+"""
+
 class DB:
     """
     Minimal database layer. Just stores and retrieves.
@@ -4320,90 +4836,519 @@ class DB:
             "Content-Type": "application/json",
             "Prefer": "return=representation"
         }
-    
-    def get(self, table: str, filters: dict = None, limit: int = 50000, select: str = "*") -> List[dict]:
+        # Identical concurrent reads share one fetch. A write bumps its
+        # table's generation, so a read issued after the write never joins
+        # a flight that started before it.
+        self._flights = _SingleFlight()
+        self._table_gen = {}
+
+    def _touched(self, *tables):
+        """Record a write to `tables` (see _flights)."""
+        for t in tables:
+            self._table_gen[t] = self._table_gen.get(t, 0) + 1
+
+    def coalesce_stats(self) -> dict:
+        """Counters for /api/health: calls made, real fetches, calls that
+        waited on another thread's identical fetch instead."""
+        st = dict(self._flights.stats)
+        st["saved_round_trips_pct"] = round(100.0 * st["coalesced"] / st["calls"], 1) if st["calls"] else 0.0
+        return st
+
+    # PostgREST operators accepted as (op, value) filter values. A bare value
+    # keeps the historic eq. behaviour so every existing call is unchanged.
+    FILTER_OPS = {"eq", "neq", "gt", "gte", "lt", "lte", "in", "is",
+                  "like", "ilike", "not.in", "not.is"}
+
+    @staticmethod
+    def _filter_value(value) -> str:
+        """One filter operand, URL-safe. None/True/False map to PostgREST's
+        null/true/false; '+' in a timestamp offset must not become a space."""
+        if value is None:
+            return "null"
+        if isinstance(value, bool):
+            return "true" if value else "false"
+        return urllib.parse.quote(str(value), safe="-_.:*")
+
+    @classmethod
+    def _filter_query(cls, filters: dict = None) -> str:
+        """Render a filters dict as PostgREST query-string conditions.
+
+          {"business_id": biz}                    → &business_id=eq.biz
+          {"date": ("gte", "2026-01-01")}         → &date=gte.2026-01-01
+          {"date": [("gte", a), ("lt", b)]}       → &date=gte.a&date=lt.b
+          {"status": ("in", ["paid", "part"])}    → &status=in.(paid,part)
+          {"deleted_at": ("is", None)}            → &deleted_at=is.null
+          {"or": "(date.gte.X,created_at.gte.X)"} → &or=(date.gte.X,created_at.gte.X)
+
+        Pushing the date window / IN list into the URL means a "last 30 days"
+        screen moves hundreds of rows instead of the business's whole history.
+        """
+        if not filters:
+            return ""
+        parts = []
+        for k, v in filters.items():
+            if k in ("or", "and"):
+                # Raw PostgREST logic tree — caller owns the syntax
+                parts.append(f"&{k}={v}")
+                continue
+            conds = v if isinstance(v, list) else [v]
+            for cond in conds:
+                if not isinstance(cond, tuple):
+                    parts.append(f"&{k}=eq.{cond}")
+                    continue
+                op, val = cond
+                if op not in cls.FILTER_OPS:
+                    raise ValueError(f"Unsupported filter operator '{op}' on {k}")
+                if op in ("in", "not.in"):
+                    items = []
+                    for item in val:
+                        s = str(item)
+                        if any(c in s for c in ',()"'):
+                            s = '"' + s.replace('"', '\\"') + '"'
+                        items.append(urllib.parse.quote(s, safe='-_.:*"'))
+                    parts.append(f"&{k}={op}.({','.join(items)})")
+                else:
+                    parts.append(f"&{k}={op}.{cls._filter_value(val)}")
+        return "".join(parts)
+
+    # Column every keyset page is anchored on. It is the primary key on every
+    # table we own, so "id > last" is an index seek whatever the table size.
+    KEYSET_KEY = "id"
+    _unkeyed_tables = set()   # tables that reject order=id → legacy offset paging
+
+    @staticmethod
+    def _tree_value(value) -> str:
+        """An operand inside an or=/and= tree: quoted if it holds PostgREST
+        delimiters, then URL-encoded."""
+        if isinstance(value, bool):
+            s = "true" if value else "false"
+        else:
+            s = str(value)
+        if any(c in s for c in ',()"'):
+            s = '"' + s.replace("\\", "\\\\").replace('"', '\\"') + '"'
+        return urllib.parse.quote(s, safe="-_.:*")
+
+    @staticmethod
+    def _order_keys(order: str) -> list:
+        """'date.desc.nullslast,id' → [("date", True, True), ("id", False, True)]
+        as (column, descending, nulls_last) — Postgres puts NULLs last for asc
+        and first for desc unless told otherwise."""
+        keys = []
+        for clause in (order or "").split(","):
+            parts = clause.strip().split(".")
+            if parts[0]:
+                desc = "desc" in parts[1:]
+                nulls_last = "nullslast" in parts[1:] or (not desc and "nullsfirst" not in parts[1:])
+                keys.append((parts[0], desc, nulls_last))
+        return keys
+
+    def _keyset_after(self, keys: list, last: dict) -> Optional[str]:
+        """Condition selecting the rows strictly after `last` in `keys` order:
+        (a, b) > (x, y)  ≡  a > x OR (a = x AND b > y), flipped for desc keys.
+        NULLs still waiting at the end of a nulls-last column are kept in.
+        None when a sort value is NULL — the caller drops to OFFSET for the rest."""
+        vals = [last.get(k[0]) for k in keys]
+        if any(v is None for v in vals):
+            return None
+        if len(keys) == 1:
+            col, desc, _ = keys[0]
+            return f"&{col}={'lt' if desc else 'gt'}.{self._filter_value(vals[0])}"
+        branches = []
+        for i, (col, desc, nulls_last) in enumerate(keys):
+            conds = [f"{keys[j][0]}.eq.{self._tree_value(vals[j])}" for j in range(i)]
+            step = f"{col}.{'lt' if desc else 'gt'}.{self._tree_value(vals[i])}"
+            if nulls_last and col != self.KEYSET_KEY:
+                step = f"or({step},{col}.is.null)"
+            conds.append(step)
+            branches.append(conds[0] if len(conds) == 1 else f"and({','.join(conds)})")
+        # Under and=(...) so a caller's own or= filter is left untouched
+        return f"&and=(or({','.join(branches)}))"
+
+    def _fetch_pages_parallel(self, table: str, base: str, order_clause: str,
+                              start: int, end: int, page_size: int) -> Optional[List[dict]]:
+        """Fetch rows [start, end) as OFFSET pages on a bounded pool. Pages are
+        independent, so they cannot chain on a keyset cursor — the fixed, total
+        order (always ends in id) keeps OFFSET pages consistent. Returns None if
+        any page fails so the caller can fall back to sequential keyset reads."""
+        offsets = list(range(start, end, page_size))
+
+        def _page(off):
+            want = min(page_size, end - off)
+            with _DB_PARALLEL_SEM:
+                resp = _DB_SESSION.get(f"{base}{order_clause}&limit={want}&offset={off}",
+                                       headers=self.headers, timeout=15)
+            if resp.status_code != 200:
+                raise RuntimeError(f"HTTP {resp.status_code} at offset {off}: {resp.text[:200]}")
+            page = _json_loads(resp.content)
+            if not isinstance(page, list):
+                raise RuntimeError(f"non-list page at offset {off}")
+            return page
+
+        try:
+            workers = max(1, min(DB_PARALLEL_PAGES, len(offsets)))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                pages = list(pool.map(_page, offsets))
+        except Exception as e:
+            print(f"[DB] Parallel read of {table} failed ({e}) - continuing sequentially", flush=True)
+            return None
+        return [r for page in pages for r in page]
+
+    def get(self, table: str, filters: dict = None, limit: int = 50000, select: str = "*",
+            order: str = None, parallel: bool = False) -> List[dict]:
+        """Get records from table (see _get). Identical reads running at the
+        same moment are coalesced into one fetch."""
+        key = (table, json.dumps(filters, sort_keys=True, default=str), select, order,
+               limit, parallel, self._table_gen.get(table, 0))
+        return self._flights.do(key, lambda: self._get(table, filters, limit, select, order, parallel))
+
+    def _get(self, table: str, filters: dict = None, limit: int = 50000, select: str = "*",
+             order: str = None, parallel: bool = False) -> List[dict]:
         """Get records from table.
         Supabase caps every REST response at 1000 rows regardless of the limit
         we ask for, so anything larger is fetched page by page until the table
-        is exhausted or `limit` is reached."""
+        is exhausted or `limit` is reached.
+        `filters` accepts operator tuples (see _filter_query) so date windows
+        and IN lists run on the server; `order` is a PostgREST order clause
+        such as "date.desc". Without one, rows come back in id order.
+
+        Pages are keyset (cursor) reads: every page after the first asks for
+        rows *after* the last one seen (`id=gt.<last>`, or the compound form
+        for an explicit order) instead of OFFSET, so page 50 costs the server
+        the same as page 1 and no page is fetched twice. `id` is appended as a
+        tie-breaker so the order is total. Tables without an id column, and
+        explicit orders that reach NULL sort values, page by OFFSET as before.
+
+        parallel=True is for the big whole-ledger reads (TB, health checks):
+        the first page also asks for the exact row count, and if more pages
+        are waiting they are fetched concurrently (see _fetch_pages_parallel)
+        instead of one round trip after another."""
         try:
-            base = f"{self.url}/rest/v1/{table}?select={select}"
-            if filters:
-                for k, v in filters.items():
-                    base += f"&{k}=eq.{v}"
-            
             rows = []
-            page_size = 1000
-            _order = ""
-            _no_order_col = False
-            while len(rows) < limit:
-                want = min(page_size, limit - len(rows))
-                endpoint = f"{base}{_order}&limit={want}&offset={len(rows)}"
-                response = _DB_SESSION.get(endpoint, headers=self.headers, timeout=15)
-                if table == "users" and filters:
-                    print(f"[DB DEBUG] GET {table} filters={filters} → status={response.status_code}, rows={len(response.json()) if response.status_code == 200 else 'N/A'}, body={response.text[:200]}", flush=True)
-                if response.status_code != 200:
-                    if _order and not _no_order_col:
-                        # No 'id' column on this table - page without a sort order
-                        print(f"[DB] {table} cannot sort by id, paging unordered", flush=True)
-                        _no_order_col = True
-                        _order = ""
-                        rows = []
-                        continue
-                    print(f"[DB] Get failed on {table} at offset {len(rows)}: status={response.status_code} body={response.text[:200]}", flush=True)
-                    return []
-                page = response.json()
-                if not isinstance(page, list):
-                    return []
-                if len(page) < want:
-                    rows.extend(page)
-                    break
-                if not _order and not _no_order_col and want == page_size:
-                    # A full page means more rows are waiting. Postgres does NOT
-                    # guarantee the same row order across separate LIMIT/OFFSET
-                    # requests without an ORDER BY, so pages can repeat or skip
-                    # rows and the identical query returns a different answer on
-                    # every reload. Restart the read with an explicit sort.
-                    _order = "&order=id.asc"
-                    rows = []
-                    continue
+            for page in self._pages(table, filters, limit, select, order, parallel):
                 rows.extend(page)
-            if len(rows) >= limit > page_size:
+            if len(rows) >= limit > 1000:
                 print(f"[DB] WARNING: {table} hit the {limit}-row read cap - result may be truncated", flush=True)
             return rows
         except Exception as e:
             logger.error(f"[DB] Get error on {table}: {e}")
             return []
-    
+
+    def iter_rows(self, table: str, filters: dict = None, select: str = "*",
+                  page_size: int = 1000, order: str = None, limit: int = None,
+                  parallel: bool = False, strict: bool = False):
+        """Yield rows one page at a time instead of building the whole list.
+
+        For folds over big tables (balances, TB, health checks, forecasts):
+        only one page (<= page_size rows) is alive at a time, so a 100k-line
+        ledger costs a page of memory, not the ledger. Same filters, order and
+        keyset paging as get(); no row cap unless `limit` is given.
+
+        parallel=True fetches DB_PARALLEL_PAGES pages at a time (as get() does
+        for the whole read), so memory stays bounded at that many pages.
+
+        get() swallows errors and returns []; a half-read ledger would give a
+        wrong total, so this raises RuntimeError if a page fails after rows
+        were already yielded. A failure on the very first page yields nothing,
+        like get() - unless strict=True, for callers that store what they read
+        and must never mistake a failed read for an empty table."""
+        yielded = False
+        page_size = min(page_size, 1000)
+        try:
+            for page in self._pages(table, filters, limit or float("inf"), select, order,
+                                    parallel=parallel, page_size=page_size,
+                                    window=DB_PARALLEL_PAGES * page_size):
+                for row in page:
+                    yielded = True
+                    yield row
+        except RuntimeError:
+            if yielded or strict:
+                raise
+            logger.error(f"[DB] iter_rows on {table}: first page failed")
+
+    @staticmethod
+    def _names_column(response, column: str) -> bool:
+        """A 400 saying `column` does not exist (42703 / PGRST schema error).
+        response: the HTTP response, or the RuntimeError a strict read raised."""
+        if isinstance(response, Exception):
+            body = str(response)
+            status = 400 if "HTTP 400" in body else None
+        else:
+            body, status = response.text or "", response.status_code
+        return (status == 400 and ("42703" in body or "PGRST" in body)
+                and re.search(rf"\b{re.escape(column)}\b", body) is not None)
+
+    def _pages(self, table: str, filters: dict = None, limit=50000, select: str = "*",
+               order: str = None, parallel: bool = False, page_size: int = 1000,
+               window: int = None):
+        """Generator behind get() and iter_rows(): one list per REST page (or
+        per parallel batch of `window` rows). Raises RuntimeError when the
+        server refuses a page."""
+        key = self.KEYSET_KEY
+        keyed = table not in self._unkeyed_tables
+        keys = self._order_keys(order)
+        _order = f"&order={order}" if order else ""
+        if keyed and key not in (k[0] for k in keys):
+            keys.append((key, False, True))
+            _order = f"{_order},{key}.asc" if order else f"&order={key}.asc"
+        _extra = []   # key columns added to a narrow select, stripped again below
+        if keyed and select != "*":
+            cols = [c.strip() for c in select.split(",")]
+            _extra = [k[0] for k in keys if k[0] not in cols]
+        _select = ",".join([select] + _extra) if _extra else select
+
+        base = f"{self.url}/rest/v1/{table}?select={_select}"
+        base += self._filter_query(filters)
+
+        def _strip(page):
+            if _extra:
+                for r in page:
+                    for c in _extra:
+                        r.pop(c, None)
+            return page
+
+        seen = 0
+        after = ""            # keyset condition for the next page
+        use_offset = not keyed
+        _probing = False      # retrying without id after a 400 on page one
+        # With no order of the caller's, a read that fits in one page keeps
+        # the server's (insertion) order; only when page one comes back full
+        # is the read restarted in id order so it can be paged
+        _unordered = keyed and not order
+        while seen < limit:
+            want = int(min(page_size, limit - seen))
+            if _unordered:
+                endpoint = f"{base}&limit={want}"
+            elif use_offset:
+                endpoint = f"{base}{_order}&limit={want}&offset={seen}"
+            else:
+                endpoint = f"{base}{_order}{after}&limit={want}"
+            headers = self.headers
+            if parallel and not seen:
+                headers = {**self.headers, "Prefer": "count=exact"}
+            response = _DB_SESSION.get(endpoint, headers=headers, timeout=15)
+            if table == "users" and filters:
+                print(f"[DB DEBUG] GET {table} filters={str(filters)[:200]} → status={response.status_code}, rows={len(response.json()) if response.status_code == 200 else 'N/A'}, body={response.text[:200]}", flush=True)
+            if response.status_code != 200:
+                if keyed and not seen and self._names_column(response, key):
+                    # No 'id' column on this table - page by OFFSET in the
+                    # caller's order (if any) and remember for next time.
+                    # Any other refusal (5xx, 429, a bad filter) raises below
+                    print(f"[DB] {table} cannot sort by {key}, paging by offset", flush=True)
+                    keyed, use_offset, _extra, _probing = False, True, [], True
+                    base = f"{self.url}/rest/v1/{table}?select={select}" + self._filter_query(filters)
+                    _order = f"&order={order}" if order else ""
+                    continue
+                print(f"[DB] Get failed on {table} after {seen} rows: status={response.status_code} body={response.text[:200]}", flush=True)
+                raise RuntimeError(f"{table}: HTTP {response.status_code} after {seen} rows: "
+                                   f"{response.text[:200]}")
+            if _probing:
+                self._unkeyed_tables.add(table)
+                _probing = False
+            page = _json_loads(response.content)
+            if not isinstance(page, list):
+                raise RuntimeError(f"{table}: unexpected response body")
+            if _unordered:
+                _unordered = False
+                if len(page) == want and want < limit:
+                    continue      # more than one page: start over in id order
+            seen += len(page)
+            if len(page) < want:
+                yield _strip(page)
+                return
+            if not use_offset:
+                # Cursor from the raw row, before _strip drops the key columns
+                after = self._keyset_after(keys, page[-1])
+                if after is None:
+                    use_offset = True
+            if parallel and seen == len(page):
+                # Content-Range: 0-999/48213 — the total tells us every page up front
+                _total = str(response.headers.get("content-range", "")).rpartition("/")[2]
+                if _total.isdigit() and int(_total) > seen:
+                    end = min(int(_total), limit)
+                    yield _strip(page)
+                    # `window` rows at a time (iter_rows), or everything at once (get)
+                    while seen < end:
+                        stop = min(seen + (window or end), end)
+                        _rest = self._fetch_pages_parallel(table, base, _order, seen, stop, page_size)
+                        if not _rest:
+                            break     # carry on one page at a time from here
+                        seen += len(_rest)
+                        if not use_offset:
+                            after = self._keyset_after(keys, _rest[-1])
+                            if after is None:
+                                use_offset = True
+                        yield _strip(_rest)
+                        if seen < stop:
+                            return
+                    if seen >= end:
+                        return
+                    continue
+            yield _strip(page)
+
     def get_all_stock(self, business_id: str) -> List[dict]:
         """Get stock from BOTH tables (stock + stock_items) merged.
         stock_items is the newer table used by imports.
         stock is the legacy table used by older features.
-        Returns combined list with normalized field names.
+        Returns the raw rows of stock_catalog() - use the catalog itself for
+        typed fields and id/code lookups.
         CACHED for 30s to avoid 2x Supabase calls per typeahead keystroke."""
-        items = []
         if not business_id:
-            return items
+            return []
+        return self.stock_catalog(business_id).rows
+
+    def stock_catalog(self, business_id: str) -> StockCatalog:
+        """The business's StockCatalog (clickai_stock_catalog.py): merged rows,
+        typed items, id/code lookups. The rows sit in the shared stock cache;
+        each worker builds the catalog once per cached load of them (keyed on
+        the entry's stamp, so a list too big for the cache's local copy is not
+        re-read and decoded per keystroke) and patches it in place after
+        update_stock().
+        Older than 30s: only rows with a newer updated_at are fetched
+        (_sync_stock). The full two-table load runs on a cold cache, once an
+        hour, after a delete, or when the tables have no updated_at."""
+        if not business_id:
+            return StockCatalog([])
         # Check cache first
         now = time.time()
-        cached = _stock_cache.get(business_id)
-        if cached and (now - cached[0]) < _STOCK_CACHE_TTL:
-            return cached[1]
-        # Newer table first
-        stock_items = self.get("stock_items", {"business_id": business_id})
-        if stock_items:
-            items.extend(stock_items)
-        # Legacy table  
-        legacy = self.get("stock", {"business_id": business_id})
-        if legacy:
-            # Avoid duplicates by code
-            existing_codes = {str(s.get("code", "")).lower() for s in items if s.get("code")}
-            for s in legacy:
-                code = str(s.get("code", "")).lower()
-                if not code or code not in existing_codes:
-                    items.append(s)
-        _stock_cache[business_id] = (now, items)
-        return items
+        catalog = _stock_catalogs.get(business_id)
+        stamp, cached = _stock_cache.get_stamped(business_id, catalog and catalog.cache_stamp)
+        if stamp is not None and cached is None:
+            cached = catalog.cache_entry     # unchanged since this worker built the catalog
+        if cached and len(cached) == 4:
+            if (now - cached[0]) < _STOCK_CACHE_TTL and business_id not in _stock_due:
+                return self._catalog_for(business_id, cached, stamp)
+            if (not _stock_sync_off and cached[3].get("cursor")
+                    and (now - cached[3].get("loaded_at", 0)) < _STOCK_FULL_RELOAD):
+                key = ("sync_stock", business_id, cached[0],
+                       self._table_gen.get("stock_items", 0), self._table_gen.get("stock", 0))
+                catalog = self._flights.do(key, lambda: self._sync_stock(business_id, cached, now))
+                if catalog is not None:
+                    return catalog
+        # Cache miss: threads missing together share one two-table load
+        key = ("get_all_stock", business_id,
+               self._table_gen.get("stock_items", 0), self._table_gen.get("stock", 0))
+        return self._flights.do(key, lambda: self._load_all_stock(business_id, now))
+
+    def _catalog_for(self, business_id: str, cached, stamp) -> StockCatalog:
+        """This worker's catalog for a cached entry (stored under `stamp`): kept
+        while the entry's rows are the ones it mirrors, updated in place when
+        only row values moved."""
+        catalog = _stock_catalogs.get(business_id)
+        if catalog is not None and catalog.source is cached[1]:
+            catalog.cache_stamp, catalog.cache_entry = stamp, cached
+            return catalog
+        if catalog is None or not catalog.absorb(cached[1], cached[2]):
+            catalog = StockCatalog(cached[1], cached[2])
+        catalog.cache_stamp, catalog.cache_entry = stamp, cached
+        _stock_catalogs.set(business_id, catalog)
+        return catalog
+
+    def stock_index(self, business_id: str):
+        """StockIndex (clickai_stock_search.py) over the current catalog, or
+        None if the index module won't import. Built once per catalog."""
+        catalog = self.stock_catalog(business_id)
+        if not catalog.index_built and catalog.index is not None and business_id:
+            _stock_catalogs.set(business_id, catalog)   # re-measure it with the index
+        return catalog.index
+
+    def invalidate_stock(self, business_id: str = None):
+        """Drop the cached stock (every worker) - the next read does a full
+        load. For bulk deletes and wipes; after an ordinary stock write use
+        stock_changed()."""
+        if business_id:
+            _stock_cache.pop(business_id, None)
+            _stock_catalogs.pop(business_id, None)
+        else:
+            _stock_cache.clear()
+            _stock_catalogs.clear()
+
+    def stock_changed(self, business_id: str):
+        """Stock rows were written here outside update_stock(): the next read
+        fetches what changed instead of waiting for the 30s sync."""
+        if business_id:
+            _stock_due.add(business_id)
+
+    def _stock_row_written(self, business_id: str, row: dict):
+        """update_stock() wrote `row` (as the database returned it): patch this
+        worker's catalog in place. Other workers pick it up on their next sync."""
+        catalog = _stock_catalogs.get(business_id)
+        if catalog is None or not catalog.patch_row(row):
+            self.stock_changed(business_id)
+
+    def _load_all_stock(self, business_id: str, now: float) -> StockCatalog:
+        global _stock_sync_off
+        gen = (self._table_gen.get("stock_items", 0), self._table_gen.get("stock", 0))
+        ver = _stock_cache.version(business_id)
+        # Newer table first, then legacy rows whose code isn't there yet.
+        # Paged without get()'s row cap; a failed read is returned, never cached.
+        flt = {"business_id": business_id}
+        try:
+            stock_items = list(self.iter_rows("stock_items", flt, parallel=True, strict=True))
+            legacy = list(self.iter_rows("stock", flt, parallel=True, strict=True))
+        except RuntimeError as e:
+            logger.error(f"[STOCK] Stock load failed for biz {business_id[:8]}: {e}")
+            return StockCatalog([])
+        hidden = []
+        catalog = StockCatalog.from_tables(stock_items, legacy, hidden)
+        stamps = [r.get("updated_at") for r in stock_items + legacy if r.get("updated_at")]
+        if (stock_items or legacy) and not stamps and not _stock_sync_off:
+            _stock_sync_off = True
+            logger.warning("[STOCK] No updated_at on stock_items/stock - run STOCK_SYNC_SQL. "
+                           "Reloading the whole stock list every 30s.")
+        state = {"loaded_at": now, "cursor": max(stamps) if stamps else None, "hidden": hidden}
+        _stock_due.discard(business_id)
+        # A stock write that landed mid-load (here or in another worker) would
+        # make this snapshot stale
+        if gen == (self._table_gen.get("stock_items", 0), self._table_gen.get("stock", 0)):
+            entry = (now, catalog.rows, catalog.new_count, state)
+            stamp = _stock_cache.set(business_id, entry, version=ver)
+            if stamp:
+                catalog.cache_stamp, catalog.cache_entry = stamp, entry
+                _stock_catalogs.set(business_id, catalog)
+        return catalog
+
+    def _sync_stock(self, business_id: str, cached, now: float):
+        """Delta refresh: the rows of both tables whose updated_at moved since
+        the cursor, merged into the cached list, plus a HEAD count of each
+        table so a delete (which a delta cannot see) forces a full load.
+        Returns the catalog, or None when a full load is needed."""
+        global _stock_sync_off
+        gen = (self._table_gen.get("stock_items", 0), self._table_gen.get("stock", 0))
+        ver = _stock_cache.version(business_id)
+        _synced, rows, new_count, state = cached
+        try:
+            since = (datetime.fromisoformat(state["cursor"])
+                     - timedelta(seconds=_STOCK_SYNC_OVERLAP)).isoformat()
+        except (TypeError, ValueError):
+            return None
+        flt = {"business_id": business_id, "updated_at": ("gte", since)}
+        try:
+            changed_new = list(self.iter_rows("stock_items", flt, strict=True))
+            changed_legacy = list(self.iter_rows("stock", flt, strict=True))
+        except RuntimeError as e:
+            if "HTTP 400" in str(e):
+                _stock_sync_off = True
+                logger.warning("[STOCK] No updated_at on stock_items/stock - run STOCK_SYNC_SQL. "
+                               "Reloading the whole stock list every 30s.")
+            else:
+                logger.warning(f"[STOCK] Delta sync failed, full reload: {e}")
+            return None
+        rows, new_count, hidden, _changed = apply_stock_changes(
+            rows, new_count, state.get("hidden"), changed_new, changed_legacy)
+        # Deleted rows never show up in a delta - the row counts give them away
+        if (self.count("stock_items", {"business_id": business_id}) != new_count
+                or self.count("stock", {"business_id": business_id}) != len(rows) - new_count + len(hidden)):
+            logger.info(f"[STOCK] Row count moved for biz {business_id[:8]} - full reload")
+            return None
+        stamps = [r.get("updated_at") for r in changed_new + changed_legacy if r.get("updated_at")]
+        state = {**state, "cursor": max(stamps + [state["cursor"]]), "hidden": hidden}
+        entry = (now, rows, new_count, state)
+        _stock_due.discard(business_id)
+        if gen == (self._table_gen.get("stock_items", 0), self._table_gen.get("stock", 0)):
+            stamp = _stock_cache.set(business_id, entry, version=ver)
+            if stamp:
+                return self._catalog_for(business_id, entry, stamp)
+        return StockCatalog(rows, new_count)
     
     def get_one_stock(self, stock_id: str):
         """Get a single stock item - tries stock_items first, then stock"""
@@ -4411,6 +5356,16 @@ class DB:
         if not item:
             item = self.get_one("stock", stock_id)
         return item
+
+    def get_many_stock(self, stock_ids, select: str = "*") -> Dict[str, dict]:
+        """get_one_stock for a whole list: stock_items first, then only the
+        ids still missing from legacy stock. Two requests at most (per
+        URL-sized chunk) instead of up to two per line. Returns {str(id): item}."""
+        found = self.get_many("stock_items", stock_ids, select)
+        missing = [i for i in stock_ids or [] if i and str(i) not in found]
+        if missing:
+            found.update(self.get_many("stock", missing, select))
+        return found
     
     def get_business_users(self, business_id: str) -> list:
         """Get all users linked to a business via team_members + owner.
@@ -4470,11 +5425,19 @@ class DB:
             except:
                 members = []
             
+            # One request for every member's user record, not one each
+            try:
+                users_by_id = self.get_many("users", [tm.get("user_id") for tm in members
+                                                      if tm.get("user_id") not in seen_ids])
+            except Exception as e:
+                logger.warning(f"[DB] get_business_users user lookup failed: {e}")
+                users_by_id = {}
+            
             for tm in members:
                 try:
                     uid = tm.get("user_id")
                     if uid and uid not in seen_ids:
-                        user = self.get_one("users", uid)
+                        user = users_by_id.get(str(uid))
                         if user:
                             if not user.get("name"):
                                 if user.get("raw_user_meta_data"):
@@ -4516,11 +5479,22 @@ class DB:
             42703 (column does not exist) → ALL ATTEMPTS FAILED.
           - Now: build a tailored payload per table BEFORE sending.
           - Plus: 22P02 (int type) retry on TRY 1 still kept.
-        """
-        # Invalidate stock cache on any stock update
-        if biz_id:
-            _stock_cache.pop(biz_id, None)
         
+        Returns True when a row was updated; the cached stock catalog is
+        patched with the row the database sent back.
+        """
+        row = None
+        try:
+            row = self._update_stock(stock_id, updates, biz_id)
+            return bool(row)
+        finally:
+            self._touched("stock_items", "stock")
+            # The cached catalog takes the row as written - no reload of the stock list
+            if biz_id and isinstance(row, dict):
+                self._stock_row_written(biz_id, row)
+
+    def _update_stock(self, stock_id: str, updates: dict, biz_id: str = None):
+        """The PATCH attempts of update_stock(). Returns the updated row, or False."""
         logger.info(f"[STOCK UPDATE] === START === stock_id={stock_id}, updates={updates}, biz_id={biz_id}")
         
         # Determine if this update includes a quantity change
@@ -4591,7 +5565,7 @@ class DB:
                     result = resp.json()
                     if result and len(result) > 0:
                         logger.info(f"[STOCK UPDATE] ✅ SUCCESS! quantity now = {result[0].get('quantity')}")
-                        return True
+                        return result[0]
                     else:
                         logger.warning(f"[STOCK UPDATE] TRY 1: 200 but empty — ID not in stock_items or biz_id mismatch")
                 elif resp.status_code == 400 and "22P02" in resp.text:
@@ -4604,7 +5578,7 @@ class DB:
                         result = resp2.json()
                         if result and len(result) > 0:
                             logger.info(f"[STOCK UPDATE] ✅ SUCCESS after int() force!")
-                            return True
+                            return result[0]
         except Exception as e:
             logger.error(f"[STOCK UPDATE] TRY 1 exception: {e}")
         
@@ -4630,7 +5604,7 @@ class DB:
                         result = resp.json()
                         if result and len(result) > 0:
                             logger.info(f"[STOCK UPDATE] ✅ TRY 2 SUCCESS (no biz_id filter)")
-                            return True
+                            return result[0]
             except Exception as e:
                 logger.error(f"[STOCK UPDATE] TRY 2 exception: {e}")
         
@@ -4664,7 +5638,7 @@ class DB:
                     result = resp.json()
                     if result and len(result) > 0:
                         logger.info(f"[STOCK UPDATE] ✅ TRY 3 SUCCESS (legacy stock table)")
-                        return True
+                        return result[0]
         except Exception as e:
             logger.error(f"[STOCK UPDATE] TRY 3 exception: {e}")
         
@@ -4673,56 +5647,353 @@ class DB:
     
     def save_stock(self, record: dict):
         """Save stock item to stock_items (preferred table)"""
-        # Invalidate stock cache
+        # The next stock read picks the new row up with its delta sync
         _biz = record.get("business_id")
-        if _biz:
-            _stock_cache.pop(_biz, None)
-        return self.save("stock_items", record)
-    
+        try:
+            return self.save("stock_items", record)
+        finally:
+            self.stock_changed(_biz)
+
+    def move_stock(self, business_id: str, stock_id: str, kind: str, quantity,
+                   reference: str = "", updates: dict = None, on_hand=None) -> Optional[float]:
+        """Move stock by appending one movement to the ledger
+        (clickai_stock_ledger.py). kind: sale / job_issue take `quantity`,
+        grv / return add it, adjustment adds it with its sign. `updates` are
+        other columns to write with it (cost, selling price).
+
+        With STOCK_LEDGER_SQL run this is a single INSERT; the trigger adds
+        the delta to the quantity under the row lock, so two tills selling
+        the same item both count. Until then the quantity is read (or taken
+        from `on_hand`), PATCHed with update_stock() and the movement logged
+        after it, as the flows did before.
+
+        Returns the new on-hand, or None when the stock did not move (item
+        not found, write failed)."""
+        delta = signed_qty(kind, quantity)
+        updates = {k: v for k, v in (updates or {}).items() if k not in ("qty", "quantity")}
+        if not delta:
+            if updates:
+                self.update_stock(stock_id, updates, business_id)
+            return on_hand
+        movement = RecordFactory.stock_movement(
+            business_id=business_id, stock_id=stock_id,
+            movement_type="in" if delta > 0 else "out", quantity=abs(delta),
+            reference=reference, kind=kind, qty_delta=delta)
+        if not _stock_ledger_off:
+            try:
+                rows = self.record_stock_movements(business_id, [movement])
+            except RuntimeError as e:
+                logger.error(f"[STOCK] {kind} of {stock_id} not recorded: {e}")
+                return None
+            if rows is not None:
+                if updates:
+                    self.update_stock(stock_id, updates, business_id)
+                balance = rows[0].get("balance_after") if rows else None
+                if balance is None:
+                    logger.warning(f"[STOCK] {kind} {reference}: no stock row {stock_id} to move")
+                    return None
+                return float(balance)
+        # No ledger yet: read-modify-write
+        if on_hand is None:
+            item = self.get_one_stock(stock_id)
+            if not item:
+                logger.error(f"[STOCK] {kind} {reference}: stock {stock_id} not found")
+                return None
+            on_hand = item.get("qty") or item.get("quantity") or 0
+        new_qty = float(on_hand) + delta
+        if not self.update_stock(stock_id, {**updates, "qty": new_qty, "quantity": new_qty}, business_id):
+            logger.error(f"[STOCK] Failed to update stock {stock_id} - qty was {on_hand}, tried to set {new_qty}")
+            return None
+        movement.pop("kind", None)
+        movement.pop("qty_delta", None)
+        try:
+            ok, err = self.save("stock_movements", movement)
+            if not ok:
+                logger.error(f"[STOCK MOVEMENT] Save failed: {err}")
+        except Exception as e:
+            logger.error(f"[STOCK MOVEMENT] Save failed: {e}")
+        return new_qty
+
+    def stock_on_hand(self, business_id: str, stock_ids) -> dict:
+        """{stock_id: quantity} as the database has it now, for both stock
+        tables - not the cached catalog, which can be 30s (or an hour) behind.
+        For flows that turn a counted quantity into a delta. Raises
+        RuntimeError when a read fails, so a failed read never counts as 0."""
+        on_hand = {}
+        for table in ("stock", "stock_items"):      # stock_items wins, as in the catalog
+            for chunk in _id_chunks(stock_ids):
+                for row in self.iter_rows(table, {"business_id": business_id, "id": ("in", chunk)},
+                                          strict=True):
+                    on_hand[row["id"]] = float(row.get("qty") or row.get("quantity") or 0)
+        return on_hand
+
+    def record_stock_movements(self, business_id: str, movements: List[dict]) -> Optional[List[dict]]:
+        """INSERT ledger movements (RecordFactory.stock_movement(..., kind=...))
+        in ONE request. A plain insert, not an upsert: the array lands whole or
+        not at all, and a re-sent batch (same ids) is refused with 409 instead
+        of moving the stock twice.
+
+        Returns the rows as stored, each with the balance_after the trigger
+        wrote (this worker's catalog takes it); None when stock_movements has
+        no ledger columns yet (STOCK_LEDGER_SQL). Raises RuntimeError when the
+        insert fails."""
+        global _stock_ledger_off
+        if not movements:
+            return []
+        try:
+            response = _DB_SESSION.post(
+                f"{self.url}/rest/v1/stock_movements",
+                headers={**self.headers, "Prefer": "return=representation"},
+                json=movements,
+                timeout=30
+            )
+        except Exception as e:
+            raise RuntimeError(f"stock_movements: {e}") from e
+        finally:
+            self._touched("stock_movements", "stock_items", "stock")
+        if response.status_code in (200, 201):
+            rows = _json_loads(response.content) or []
+            for row in rows:
+                self._stock_qty_written(business_id, row.get("stock_id"), row.get("balance_after"))
+            return rows
+        if response.status_code == 409:
+            logger.warning(f"[STOCK] {len(movements)} movement(s) already recorded - not moved again")
+            self.stock_changed(business_id)
+            return [dict(m) for m in movements]
+        if response.status_code == 400 and ("PGRST204" in response.text or "42703" in response.text):
+            _stock_ledger_off = True
+            logger.warning("[STOCK] stock_movements has no qty_delta - run STOCK_LEDGER_SQL. "
+                           "Stock moves read and PATCH the quantity until then.")
+            return None
+        raise RuntimeError(f"stock_movements: HTTP {response.status_code}: {response.text[:300]}")
+
+    def _stock_qty_written(self, business_id: str, stock_id, qty):
+        """A ledger insert left `stock_id` at `qty`: patch this worker's catalog."""
+        catalog = _stock_catalogs.get(business_id)
+        if catalog is None or qty is None or not catalog.patch_qty(stock_id, float(qty)):
+            self.stock_changed(business_id)
+
+    def stock_ledger_check(self, business_id: str) -> dict:
+        """Replay the business's stock movements and compare every item's
+        quantity with the sum of its deltas. With the ledger in place the
+        mismatch list is empty; anything on it was changed outside
+        move_stock()."""
+        flt = {"business_id": business_id}
+        try:
+            movements = list(self.iter_rows("stock_movements", flt, strict=True,
+                                            select="stock_id,type,quantity,qty_delta"))
+        except RuntimeError as e:
+            if "HTTP 400" not in str(e):
+                raise
+            # No qty_delta column yet: the deltas come from type / quantity
+            movements = list(self.iter_rows("stock_movements", flt, strict=True,
+                                            select="stock_id,type,quantity"))
+        on_hand = replay_stock_movements(movements)
+        self.stock_changed(business_id)
+        catalog = self.stock_catalog(business_id)
+        mismatched = reconcile_stock(catalog, on_hand)
+        return {
+            "ok": not mismatched,
+            "ledger": not _stock_ledger_off,
+            "items": len(catalog),
+            "movements": len(movements),
+            "mismatches": [{"id": item.id, "code": item.code, "description": item.description,
+                            "qty": item.qty, "ledger_qty": round(ledger_qty, 4)}
+                           for item, ledger_qty in mismatched[:200]],
+            "mismatch_count": len(mismatched),
+        }
+
     def count(self, table: str, filters: dict = None) -> int:
-        """Fast count - doesn't load all data"""
+        """Fast count - doesn't load all data. The total comes back in the
+        Content-Range header of a HEAD request; no rows cross the wire."""
         try:
-            endpoint = f"{self.url}/rest/v1/{table}?select=count"
-            if filters:
-                for k, v in filters.items():
-                    endpoint += f"&{k}=eq.{v}"
+            endpoint = f"{self.url}/rest/v1/{table}?select=*&limit=1"
+            endpoint += self._filter_query(filters)
             
             headers = {**self.headers, "Prefer": "count=exact"}
-            response = requests.head(endpoint, headers=headers, timeout=30)
-            
-            # Count is in the content-range header
-            content_range = response.headers.get("content-range", "")
-            if "/" in content_range:
-                return int(content_range.split("/")[1])
-            return 0
+            response = _DB_SESSION.head(endpoint, headers=headers, timeout=30)
+            
+            # Count is in the content-range header: 0-0/48213
+            total = str(response.headers.get("content-range", "")).rpartition("/")[2]
+            if response.status_code in (200, 206) and total.isdigit():
+                return int(total)
+            # No exact count from this server - count on the server instead
+            rows = self.aggregate(table, filters=filters, count=True)
+            return int(rows[0]["count"]) if rows else 0
         except Exception as e:
             logger.error(f"[DB] Count error: {e}")
             return 0
     
     def sum_column(self, table: str, column: str, filters: dict = None) -> float:
-        """Get sum of a column - only loads that column, not all data.
-        Reads via get() so it pages past Supabase's 1000-row response cap."""
+        """Get sum of a column. One aggregate request when the server has
+        aggregates enabled, otherwise a streamed fold (see aggregate())."""
         try:
-            rows = self.get(table, filters, select=column)
-            return sum(float(r.get(column, 0) or 0) for r in rows)
+            rows = self.aggregate(table, sums=[column], filters=filters)
+            return rows[0][column] if rows else 0
         except Exception as e:
             logger.error(f"[DB] Sum error: {e}")
             return 0
-    
-    def get_columns(self, table: str, columns: list, filters: dict = None, limit: int = 50000) -> List[dict]:
+
+    # Flipped on the first "aggregates are disabled" answer so this worker
+    # stops asking (see DB_AGGREGATES_SQL).
+    _aggregates_off = False
+
+    def aggregate(self, table: str, sums=(), group_by=(), filters: dict = None,
+                  count: bool = False) -> List[dict]:
+        """SUM / COUNT ... GROUP BY, computed by Postgres.
+
+          db.aggregate("journals", sums=["debit", "credit"], group_by=["account_code"],
+                       filters={"business_id": biz})
+          → [{"account_code": "1000", "debit": 1520.0, "credit": 300.0}, ...]
+
+        One row per group (a single row without group_by), each sum as a
+        float (0.0 for an empty group) and "count" when count=True. Groups
+        come back ordered by the group_by columns.
+
+        A TB over 50k journal lines is ~90 account rows this way instead of
+        50 pages of lines. If the server refuses aggregate selects, the same
+        rows are folded here from a narrow streamed read, so callers never
+        need to know which path ran. Raises RuntimeError if the read fails
+        part-way."""
+        sums, group_by = list(sums or ()), list(group_by or ())
+        if not self._aggregates_off:
+            rows = self._aggregate_on_server(table, sums, group_by, filters, count)
+            if rows is not None:
+                return rows
+        totals = {}
+        cols = list(dict.fromkeys(group_by + sums)) or [self.KEYSET_KEY]
+        for r in self.iter_rows(table, filters, select=",".join(cols)):
+            key = tuple(r.get(c) for c in group_by)
+            acc = totals.get(key)
+            if acc is None:
+                acc = totals[key] = {**dict(zip(group_by, key)), **{c: 0.0 for c in sums}}
+                if count:
+                    acc["count"] = 0
+            for c in sums:
+                acc[c] += float(r.get(c) or 0)
+            if count:
+                acc["count"] += 1
+        if not group_by:
+            return list(totals.values()) or [{**{c: 0.0 for c in sums}, **({"count": 0} if count else {})}]
+        # NULL groups last, as Postgres orders them
+        return [totals[k] for k in sorted(totals, key=lambda k: tuple((v is None, v if v is not None else 0) for v in k))]
+
+    def _aggregate_on_server(self, table, sums, group_by, filters, count) -> Optional[List[dict]]:
+        """PostgREST aggregate select, e.g.
+        select=account_code,debit:debit.sum(),credit:credit.sum(). Groups are
+        paged 1000 at a time. None when the server has aggregates disabled."""
+        fns = [f"{c}:{c}.sum()" for c in sums] + (["count()"] if count else [])
+        base = f"{self.url}/rest/v1/{table}?select={','.join(group_by + fns)}"
+        base += self._filter_query(filters)
+        if group_by:
+            base += f"&order={','.join(group_by)}"
+        out, offset = [], 0
+        while True:
+            response = _DB_SESSION.get(f"{base}&limit=1000&offset={offset}",
+                                       headers=self.headers, timeout=30)
+            if response.status_code != 200:
+                if response.status_code == 400 and not offset and "aggregate" in response.text.lower():
+                    DB._aggregates_off = True
+                    print(f"[DB] Aggregates disabled on the server - folding {table} in Python "
+                          f"(run DB_AGGREGATES_SQL to enable)", flush=True)
+                    return None
+                raise RuntimeError(f"{table}: aggregate HTTP {response.status_code}: {response.text[:200]}")
+            page = _json_loads(response.content)
+            if not isinstance(page, list):
+                raise RuntimeError(f"{table}: unexpected aggregate body")
+            for r in page:
+                for c in sums:
+                    r[c] = float(r.get(c) or 0)
+                if count:
+                    r["count"] = int(r.get("count") or 0)
+            out.extend(page)
+            if not group_by or len(page) < 1000:
+                return out
+            offset += len(page)
+
+    def get_columns(self, table: str, columns: list, filters: dict = None, limit: int = 50000,
+                    order: str = None) -> List[dict]:
         """Get only specific columns - much faster than select=*.
         Reads via get() so it pages past Supabase's 1000-row response cap."""
         try:
-            return self.get(table, filters, limit=limit, select=",".join(columns))
+            return self.get(table, filters, limit=limit, select=",".join(columns), order=order)
         except Exception as e:
             logger.error(f"[DB] Get columns error: {e}")
             return []
     
+    def get_columnar(self, table: str, columns: list, filters: dict = None, numeric=(),
+                     order: str = None, limit: int = None, parallel: bool = False) -> "ColumnBatch":
+        """Read `columns` column by column instead of row by row.
+
+          cols = db.get_columnar("sales", ["total", "vat", "payment_method"],
+                                 {"business_id": biz}, numeric=["total", "vat"])
+          cols.total("vat")                                                   # float
+          cols.total("total", cols.isin("payment_method", ("cash", "card")))  # masked
+
+        `numeric` columns come back as float64 vectors (NULL and junk → 0.0),
+        built a page at a time so no per-row dicts outlive their page; the
+        others are plain lists. Report totals then sum a vector instead of
+        calling float(r.get(...) or 0) on every dict. Like get(), a failed
+        read logs and returns an empty batch, never a partial one."""
+        numeric = set(numeric or ())
+        vecs = {c: array("d") for c in columns if c in numeric}
+        lists = {c: [] for c in columns if c not in numeric}
+        n = 0
+        try:
+            for page in self._pages(table, filters, limit or float("inf"), ",".join(columns),
+                                    order, parallel=parallel, window=DB_PARALLEL_PAGES * 1000):
+                for c, vec in vecs.items():
+                    size = len(vec)
+                    try:
+                        vec.extend(map(itemgetter(c), page))   # C loop; numbers only
+                    except (TypeError, KeyError):              # a NULL or text cell on this page
+                        del vec[size:]
+                        vec.extend([_to_float(r.get(c)) for r in page])
+                for c, vals in lists.items():
+                    vals.extend([r.get(c) for r in page])
+                n += len(page)
+        except Exception as e:
+            logger.error(f"[DB] Get columnar error on {table}: {e}")
+            return ColumnBatch({c: (array("d") if c in numeric else []) for c in columns}, 0)
+        return ColumnBatch({**lists, **vecs}, n)
+
     def get_one(self, table: str, id: str) -> Optional[dict]:
         """Get single record by ID"""
         results = self.get(table, {"id": id}, limit=1)
         return results[0] if results else None
-    
+
+    # Characters of id list per id=in.(...) request. Gateways cap the whole
+    # URL at ~8KB, so this leaves room for the path, select and other filters
+    # (~160 UUIDs a request).
+    GET_MANY_URL_BUDGET = 6000
+
+    def get_many(self, table: str, ids, select: str = "*") -> Dict[str, dict]:
+        """Get many records by ID in as few requests as the URL limit allows.
+        Returns {str(id): record}; ids that don't exist are simply absent.
+        'id' is always included in the result even with a narrow select.
+
+        Replaces a get_one() per line / per team member (N round trips)."""
+        wanted = list(dict.fromkeys(str(i) for i in (ids or []) if i))
+        if not wanted:
+            return {}
+        if select != "*" and self.KEYSET_KEY not in [c.strip() for c in select.split(",")]:
+            select = f"{self.KEYSET_KEY},{select}"
+        chunks, chunk, size = [], [], 0
+        for i in wanted:
+            n = len(urllib.parse.quote(i, safe="-_.:*")) + 3   # comma + possible quotes
+            if chunk and size + n > self.GET_MANY_URL_BUDGET:
+                chunks.append(chunk)
+                chunk, size = [], 0
+            chunk.append(i)
+            size += n
+        chunks.append(chunk)
+        found = {}
+        for chunk in chunks:
+            for row in self.get(table, {"id": ("in", chunk)}, limit=len(chunk), select=select) or []:
+                found[str(row.get("id"))] = row
+        return found
+    
+    @_db_write
     def save(self, table: str, data: dict) -> Tuple[bool, Any]:
         """Insert or update record - auto-handles unknown column errors (PGRST204)"""
         try:
@@ -4809,6 +6080,37 @@ class DB:
             logger.error(f"[DB] Save exception for {table}: {e}")
             return False, str(e)
     
+    @_db_write
+    def save_batch(self, table: str, records: List[dict]) -> Tuple[bool, Any]:
+        """Upsert `records` in ONE request (a JSON array, on_conflict=id).
+
+        PostgREST writes the array in a single statement, so either every row
+        lands or none does - a journal is never left half-posted. Rows keep
+        the ids they are given, so re-sending after a lost response updates
+        the same rows instead of adding them twice. All records must carry the
+        same keys. Returns (ok, error); error starts "HTTP <status>" when the
+        server answered."""
+        if not records:
+            return True, None
+        for r in records:
+            if not r.get("id"):
+                r["id"] = generate_id()
+            if not r.get("created_at"):
+                r["created_at"] = now()
+        try:
+            response = _DB_SESSION.post(
+                f"{self.url}/rest/v1/{table}?on_conflict=id",
+                headers={**self.headers, "Prefer": "return=minimal,resolution=merge-duplicates"},
+                json=records,
+                timeout=30
+            )
+        except Exception as e:
+            return False, str(e)[:300]
+        if response.status_code in (200, 201, 204):
+            return True, None
+        return False, f"HTTP {response.status_code}: {response.text[:300]}"
+
+    @_db_write
     def save_many(self, table: str, records: List[dict]) -> Tuple[int, int]:
         """Batch save records using bulk insert - 100 at a time"""
         success = 0
@@ -4850,6 +6152,7 @@ class DB:
         
         return success, errors
     
+    @_db_write
     def save_many_fast(self, table: str, records: List[dict],
                        business_id: str = None,
                        merge_key: str = None,
@@ -4952,6 +6255,7 @@ class DB:
         
         return success, errors
     
+    @_db_write
     def delete(self, table: str, id: str, business_id: str = None) -> bool:
         """Delete record - with verification"""
         try:
@@ -4985,6 +6289,7 @@ class DB:
             logger.error(f"[DB DELETE] Error: {e}")
             return False
     
+    @_db_write
     def delete_many(self, table: str, ids: list, business_id: str = None) -> Tuple[int, int]:
         """Batch delete multiple records in one API call
         
@@ -5033,7 +6338,26 @@ class DB:
         
         logger.info(f"[DB DELETE_MANY] Total: {success} deleted, {failed} failed")
         return (success, failed)
-    
+
+    @_db_write
+    def delete_where(self, table: str, filters: dict) -> Tuple[bool, Any]:
+        """Delete every row matching `filters` (same forms as get()) in ONE
+        request. business_id is required so a bad filter can never empty a
+        table across tenants. Returns (ok, error)."""
+        if not (filters or {}).get("business_id"):
+            raise ValueError(f"delete_where on {table} needs a business_id filter")
+        try:
+            response = _DB_SESSION.delete(
+                f"{self.url}/rest/v1/{table}?{self._filter_query(filters).lstrip('&')}",
+                headers={**self.headers, "Prefer": "return=minimal"},
+                timeout=30
+            )
+        except Exception as e:
+            return False, str(e)[:300]
+        if response.status_code in (200, 204):
+            return True, None
+        return False, f"HTTP {response.status_code}: {response.text[:300]}"
+
     def storage_upload(self, bucket, path, data_bytes, content_type="application/octet-stream"):
         """Upload raw bytes to a private Supabase Storage bucket. Returns (ok, path_or_error)."""
         try:
@@ -5072,6 +6396,7 @@ class DB:
             logger.error(f"[STORAGE] Download error {bucket}/{path}: {e}")
             return None
 
+    @_db_write
     def update(self, table: str, id: str, data: dict, business_id: str = None) -> bool:
         """Update record - with verification. Auto-handles unknown column errors (PGRST204)."""
         try:
@@ -5137,6 +6462,7 @@ class DB:
             logger.info(f"[DB UPDATE BUSINESS] Data: {data}")
             
             response = requests.patch(url, headers=headers, json=data, timeout=30)
+            self._touched("businesses")
             
             logger.info(f"[DB UPDATE BUSINESS] Response status: {response.status_code}")
             logger.info(f"[DB UPDATE BUSINESS] Response body: {response.text[:500]}")
@@ -5163,6 +6489,7 @@ class DB:
             logger.error(f"[DB UPDATE BUSINESS] Exception: {e}")
             return False, str(e)
     
+    @_db_write
     def update_many(self, table: str, updates: list, business_id: str = None) -> Tuple[int, int]:
         """Batch update multiple records - chunks to avoid URL length limits
         
@@ -5286,11 +6613,6 @@ class DB:
         except Exception as e:
             logger.error(f"[DB] Add column error: {e}")
             return False, str(e)
-    
-    def count(self, table: str, filters: dict = None) -> int:
-        """Count records"""
-        records = self.get(table, filters)
-        return len(records)
 
 
 db = DB()
@@ -5560,8 +6882,9 @@ class RecordFactory:
     
     @staticmethod
     def stock_movement(business_id: str, stock_id: str, movement_type: str, quantity: float, **kwargs) -> dict:
-        """Create a stock movement record"""
-        return {
+        """Create a stock movement record. With kind= (clickai_stock_ledger.py)
+        it is a ledger row: qty_delta moves the item's quantity on insert."""
+        record = {
             "id": kwargs.get("id") or generate_id(),
             "business_id": business_id,
             "stock_id": stock_id,
@@ -5571,6 +6894,10 @@ class RecordFactory:
             "reference": kwargs.get("reference", ""),
             "created_at": kwargs.get("created_at") or now()
         }
+        if kwargs.get("kind"):
+            record["kind"] = kwargs["kind"]
+            record["qty_delta"] = float(kwargs.get("qty_delta", 0))
+        return record
     
     @staticmethod
     def invoice(business_id: str, customer_id: str, customer_name: str, items: list, **kwargs) -> dict:
@@ -8216,19 +9543,18 @@ class ZaneToolHandler:
         low_only = params.get("low_stock_only", False)
         oos_only = params.get("out_of_stock_only", False)
         
-        all_stock = self.db.get_all_stock(self.biz_id)
         results = []
         
-        for s in all_stock:
-            qty = float(s.get("qty") or s.get("quantity") or 0)
+        for s in self.db.stock_catalog(self.biz_id):
+            qty = s.qty
             if oos_only and qty > 0:
                 continue
             if low_only and qty >= 5:
                 continue
             
-            code = str(s.get("code", "")).lower()
-            desc = str(s.get("description", "")).lower()
-            cat = str(s.get("category", "")).lower()
+            code = s.code.lower()
+            desc = s.description.lower()
+            cat = s.category.lower()
             
             if category_filter and category_filter not in cat:
                 continue
@@ -8245,14 +9571,14 @@ class ZaneToolHandler:
                     continue
             
             results.append({
-                "id": s.get("id"),
-                "code": s.get("code", ""),
-                "description": s.get("description", ""),
+                "id": s.id,
+                "code": s.code,
+                "description": s.description,
                 "qty": qty,
-                "cost_price": float(s.get("cost") or s.get("cost_price") or 0),
-                "selling_price": float(s.get("price") or s.get("selling_price") or 0),
-                "category": s.get("category", ""),
-                "unit": s.get("unit", "")
+                "cost_price": s.cost,
+                "selling_price": s.price,
+                "category": s.category,
+                "unit": s.unit
             })
         
         if query:
@@ -9027,7 +10353,6 @@ class ZaneToolHandler:
     def _tool_get_stock_valuation(self, params: dict) -> dict:
         """Stock valuation with PRE-CALCULATED insights"""
         category_filter = params.get("category", "").lower()
-        all_stock = self.db.get_all_stock(self.biz_id)
         
         total_cost = 0
         total_retail = 0
@@ -9039,16 +10364,14 @@ class ZaneToolHandler:
         negative_margin = []
         dead_stock = []  # High value, no movement
         
-        for s in all_stock:
-            cat = s.get("category", "Uncategorised")
+        for s in self.db.stock_catalog(self.biz_id):
+            cat = s.category or "Uncategorised"
             if category_filter and category_filter not in cat.lower():
                 continue
             
-            qty = float(s.get("qty") or s.get("quantity") or 0)
-            cost = float(s.get("cost") or s.get("cost_price") or 0)
-            price = float(s.get("price") or s.get("selling_price") or 0)
-            code = s.get("code", "")
-            desc = s.get("description", "")[:30]
+            qty, cost, price = s.qty, s.cost, s.price
+            code = s.code
+            desc = s.description[:30]
             
             cv = qty * cost
             rv = qty * price
@@ -10475,27 +11798,48 @@ class ZaneToolHandler:
             cutoff_date = (datetime.now() - timedelta(days=days_back)).strftime("%Y-%m-%d")
             biz_id = self.biz_id
             
+            # Only rows inside the window leave the server. _add() below still
+            # applies the exact "date, else created_at" rule per record.
+            since = {"business_id": biz_id,
+                     "or": f"(date.gte.{cutoff_date},created_at.gte.{cutoff_date})"}
+            created_since = {"business_id": biz_id, "created_at": ("gte", cutoff_date)}
+            
+            def _since(table):
+                """`table`'s rows in the window, filtered on the date columns it
+                has: date or created_at, created_at alone for a table without
+                a date (its rows fall back to created_at in _add too)."""
+                if table not in _activity_undated:
+                    try:
+                        return list(db.iter_rows(table, since, strict=True))
+                    except RuntimeError as e:
+                        # Only "no such column date" makes a table undated; any
+                        # other refusal is not a schema fact to remember
+                        if not DB._names_column(e, "date"):
+                            raise
+                        _activity_undated.add(table)
+                return db.get(table, created_since)
+            
             # Parallel load all tables
             pool = ThreadPoolExecutor(max_workers=18)
             try:
                 fut = {
-                    "invoices": pool.submit(db.get, "invoices", {"business_id": biz_id}),
-                    "receipts": pool.submit(db.get, "receipts", {"business_id": biz_id}),
-                    "sales": pool.submit(db.get, "sales", {"business_id": biz_id}),
-                    "supplier_invoices": pool.submit(db.get, "supplier_invoices", {"business_id": biz_id}),
-                    "supplier_payments": pool.submit(db.get, "supplier_payments", {"business_id": biz_id}),
-                    "credit_notes": pool.submit(db.get, "credit_notes", {"business_id": biz_id}),
-                    "delivery_notes": pool.submit(db.get, "delivery_notes", {"business_id": biz_id}),
-                    "purchase_orders": pool.submit(db.get, "purchase_orders", {"business_id": biz_id}),
-                    "grvs": pool.submit(db.get, "goods_received", {"business_id": biz_id}),
-                    "expenses": pool.submit(db.get, "expenses", {"business_id": biz_id}),
-                    "bank_transactions": pool.submit(db.get, "bank_transactions", {"business_id": biz_id}),
-                    "journals": pool.submit(db.get, "journal_entries", {"business_id": biz_id}),
-                    "stock_movements": pool.submit(db.get, "stock_movements", {"business_id": biz_id}),
-                    "quotes": pool.submit(db.get, "quotes", {"business_id": biz_id}),
-                    "jobs": pool.submit(db.get, "jobs", {"business_id": biz_id}),
-                    "cashups": pool.submit(db.get, "cash_ups", {"business_id": biz_id}),
-                    "timesheets": pool.submit(db.get, "timesheet_entries", {"business_id": biz_id}),
+                    "invoices": pool.submit(_since, "invoices"),
+                    "receipts": pool.submit(_since, "receipts"),
+                    "sales": pool.submit(_since, "sales"),
+                    "supplier_invoices": pool.submit(_since, "supplier_invoices"),
+                    "supplier_payments": pool.submit(_since, "supplier_payments"),
+                    "credit_notes": pool.submit(_since, "credit_notes"),
+                    "delivery_notes": pool.submit(_since, "delivery_notes"),
+                    "purchase_orders": pool.submit(_since, "purchase_orders"),
+                    "grvs": pool.submit(_since, "goods_received"),
+                    "expenses": pool.submit(_since, "expenses"),
+                    "bank_transactions": pool.submit(_since, "bank_transactions"),
+                    "journals": pool.submit(_since, "journal_entries"),
+                    "stock_movements": pool.submit(_since, "stock_movements"),
+                    "quotes": pool.submit(_since, "quotes"),
+                    "jobs": pool.submit(_since, "jobs"),
+                    "cashups": pool.submit(_since, "cash_ups"),
+                    "timesheets": pool.submit(_since, "timesheet_entries"),
                     "users": pool.submit(db.get_business_users, biz_id),
                 }
                 
@@ -13764,8 +15108,8 @@ class Actions:
                     stock_id = stock_item.get("id")
                     current_qty = float(stock_item.get("qty") or stock_item.get("quantity") or 0)
                     sold_qty = float(item.get("qty") or item.get("quantity") or 1)
-                    new_qty = current_qty - sold_qty
-                    db.update_stock(stock_id, {"qty": new_qty, "quantity": new_qty}, biz_id)
+                    new_qty = db.move_stock(biz_id, stock_id, "sale", sold_qty,
+                                            reference=f"Invoice {inv_number}", on_hand=current_qty)
                     logger.info(f"[INVOICE AI] Stock {code}: {current_qty} - {sold_qty} = {new_qty}")
             
             # Customer balance is now calculated dynamically — no manual update needed
@@ -14018,12 +15362,10 @@ class Actions:
             return {"success": False, "message": f"Couldn't find stock item: {item_search}"}
         
         # Update quantity and cost (recalc selling price to maintain markup %)
-        new_qty = float(item.get("quantity", 0)) + quantity
+        old_qty = float(item.get("quantity", 0))
         new_cost = float(cost) if cost > 0 else item.get("cost_price", 0)
         
         stock_save = {
-            "id": item["id"],
-            "quantity": new_qty,
             "cost_price": new_cost
         }
         
@@ -14041,17 +15383,12 @@ class Actions:
             stock_save["selling_price"] = new_sell
             logger.info(f"[ZANE] Price recalc {item.get('code','')}: cost {old_cost}->{new_cost}, sell {old_sell}->{new_sell}")
         
-        db.save_stock(stock_save)
-        
-        # Log the movement
-        movement = RecordFactory.stock_movement(
-            business_id=biz_id,
-            stock_id=item["id"],
-            movement_type="in",
-            quantity=quantity,
-            reference=f"Booked in at cost {money(cost)}" if cost > 0 else "Booked in"
-        )
-        db.save("stock_movements", movement)
+        # One ledger movement for the units, the new cost/price with it
+        new_qty = db.move_stock(biz_id, item["id"], "grv", quantity,
+                                reference=f"Booked in at cost {money(cost)}" if cost > 0 else "Booked in",
+                                updates=stock_save, on_hand=old_qty)
+        if new_qty is None:
+            return {"success": False, "message": f"Couldn't book in {item.get('description')} - stock not updated"}
         
         return {
             "success": True,
@@ -14157,10 +15494,11 @@ class Actions:
         except Exception:
             pass
         
+        _new_balance = calc_customer_balance(biz_id, customer['id'], customer)
         return {
             "success": True,
-            "message": f"Received {money(amount)} from {customer['name']} - Balance now {money(calc_customer_balance(biz_id, customer['id']))}",
-            "data": {"customer": customer["name"], "new_balance": calc_customer_balance(biz_id, customer['id'])}
+            "message": f"Received {money(amount)} from {customer['name']} - Balance now {money(_new_balance)}",
+            "data": {"customer": customer["name"], "new_balance": _new_balance}
         }
     
     @staticmethod
@@ -14300,20 +15638,11 @@ class Actions:
         success, _ = db.save("sales", sale)
         
         if success:
-            # Update stock
-            new_qty = current_qty - quantity
-            db.update_stock(item["id"], {"qty": new_qty, "quantity": new_qty}, biz_id)
+            # Update stock (one ledger movement)
+            new_qty = db.move_stock(biz_id, item["id"], "sale", quantity,
+                                    reference=f"Zane Sale {sale_id[:8]}", on_hand=current_qty)
             logger.info(f"[ZANE SALE] Stock {item.get('code')}: {current_qty} - {quantity} = {new_qty}")
             
-            # Log stock movement
-            try:
-                db.save("stock_movements", RecordFactory.stock_movement(
-                    business_id=biz_id, stock_id=item["id"], movement_type="out",
-                    quantity=quantity, reference=f"Zane Sale {sale_id[:8]}"
-                ))
-            except Exception as sm_err:
-                logger.error(f"[ZANE SALE] Stock movement save failed: {sm_err}")
-            
             # Customer balance is now calculated dynamically — no manual update needed
             
             # Create journal entries for GL
@@ -14539,8 +15868,8 @@ class Actions:
                     if stock_item:
                         current_qty = float(stock_item.get("qty") or stock_item.get("quantity") or 0)
                         sold_qty = float(item.get("qty") or item.get("quantity") or 1)
-                        new_qty = current_qty - sold_qty
-                        db.update_stock(stock_item.get("id"), {"qty": new_qty, "quantity": new_qty}, biz_id)
+                        new_qty = db.move_stock(biz_id, stock_item.get("id"), "sale", sold_qty,
+                                                reference=f"Invoice {inv_num}", on_hand=current_qty)
                         logger.info(f"[QUOTE->INV] Stock {code or stock_id}: {current_qty} - {sold_qty} = {new_qty}")
             except Exception as e:
                 logger.error(f"[QUOTE->INV] Stock deduction error: {e}")
@@ -15199,7 +16528,7 @@ class Actions:
                                 merged_qty = keeper_qty + dup_qty
                                 keeper["quantity"] = merged_qty
                                 keeper["qty"] = merged_qty
-                                keeper["_qty_merged"] = True
+                                keeper["_qty_merged"] = keeper.get("_qty_merged", 0) + dup_qty
                         to_delete.append(r)
                     else:
                         seen_keys[key] = r  # Keep this one (the oldest)
@@ -15209,10 +16538,8 @@ class Actions:
                 for key, keeper in seen_keys.items():
                     if keeper.get("_qty_merged"):
                         try:
-                            db.update_stock(keeper["id"], {
-                                "qty": keeper["qty"], 
-                                "quantity": keeper["quantity"]
-                            }, biz_id)
+                            db.move_stock(biz_id, keeper["id"], "adjustment", keeper["_qty_merged"],
+                                          reference="Merged duplicate stock")
                             logger.info(f"[BULK DELETE] Merged qty into {keeper.get('code')}: now {keeper['qty']}")
                         except:
                             pass
@@ -15243,7 +16570,7 @@ class Actions:
                             keeper_qty = float(keeper.get("quantity") or keeper.get("qty") or 0)
                             keeper["quantity"] = keeper_qty + dup_qty
                             keeper["qty"] = keeper_qty + dup_qty
-                            keeper["_cross_merged"] = True
+                            keeper["_cross_merged"] = keeper.get("_cross_merged", 0) + dup_qty
                         
                         # Mark for deletion from correct table
                         if s in stock_items_records:
@@ -15257,10 +16584,8 @@ class Actions:
                 for desc, keeper in seen_descs.items():
                     if keeper.get("_cross_merged"):
                         try:
-                            db.update_stock(keeper["id"], {
-                                "qty": keeper["qty"],
-                                "quantity": keeper["quantity"]
-                            }, biz_id)
+                            db.move_stock(biz_id, keeper["id"], "adjustment", keeper["_cross_merged"],
+                                          reference="Merged duplicate stock")
                         except:
                             pass
                 
@@ -15741,9 +17066,8 @@ class Actions:
                                 if matched:
                                     # Update existing stock
                                     old_qty = float(matched.get("qty") or matched.get("quantity") or 0)
-                                    new_qty = old_qty + li_qty
                                     
-                                    stock_updates = {"qty": new_qty, "quantity": new_qty}
+                                    stock_updates = {}
                                     # Update cost and recalc selling price (maintain markup %)
                                     if li_cost > 0:
                                         old_cost = float(matched.get("cost") or matched.get("cost_price") or 0)
@@ -15759,17 +17083,10 @@ class Actions:
                                         stock_updates["price"] = new_sell
                                         logger.info(f"[SCAN] Price recalc: cost {old_cost}->{li_cost}, sell {old_sell}->{new_sell}")
                                     
-                                    db.update_stock(matched["id"], stock_updates, biz_id)
-                                    
-                                    # Stock movement
-                                    movement = RecordFactory.stock_movement(
-                                        business_id=biz_id,
-                                        stock_id=matched["id"],
-                                        movement_type="in",
-                                        quantity=li_qty,
-                                        reference=inv.get("invoice_number", "")
-                                    )
-                                    db.save("stock_movements", movement)
+                                    # Quantity through the ledger, cost/price with it
+                                    db.move_stock(biz_id, matched["id"], "grv", li_qty,
+                                                  reference=inv.get("invoice_number", ""),
+                                                  updates=stock_updates, on_hand=old_qty)
                                     stock_matched += 1
                                 else:
                                     # CREATE new stock item
@@ -16034,7 +17351,7 @@ class Context:
         import time as _time
         _cache_key = f"dash_stats_{biz_id}"
         if not hasattr(app, '_dash_cache'):
-            app._dash_cache = {}
+            app._dash_cache = SharedCache("dashboard", ttl=60, max_entries=500)
         _cached_entry = app._dash_cache.get(_cache_key)
         if _cached_entry and (_time.time() - _cached_entry.get("ts", 0)) < 60:
             logger.info("[DASHBOARD] Using cached stats (< 60s old)")
@@ -16051,12 +17368,16 @@ class Context:
                 logger.error(f"[DASHBOARD] {key} failed: {e}")
                 results[key] = None
         
-        with ThreadPoolExecutor(max_workers=7) as pool:
-            # 5 column loads + the 2 balance calcs, all in parallel (the balance calcs
-            # only need biz_id, so they no longer have to wait for the loads to finish).
+        today_str = today()
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            # Column loads, server-side totals and the 2 balance calcs, all in parallel
+            # (the balance calcs only need biz_id, so they don't wait for the loads).
+            # Sales and supplier figures are totals/counts only — Postgres adds them
+            # up, so a few years of POS history is one small row, not every sale.
             pool.submit(_fetch, "customers", lambda: db.get_columns("customers", ["name", "phone", "balance"], {"business_id": biz_id}))
-            pool.submit(_fetch, "suppliers", lambda: db.get_columns("suppliers", ["balance"], {"business_id": biz_id}))
-            pool.submit(_fetch, "sales", lambda: db.get_columns("sales", ["date", "total"], {"business_id": biz_id}))
+            pool.submit(_fetch, "supplier_count", lambda: db.count("suppliers", {"business_id": biz_id}))
+            pool.submit(_fetch, "total_sales", lambda: db.sum_column("sales", "total", {"business_id": biz_id}))
+            pool.submit(_fetch, "today_sales", lambda: db.sum_column("sales", "total", {"business_id": biz_id, "date": today_str}))
             pool.submit(_fetch, "stock", lambda: db.get_all_stock(biz_id))
             pool.submit(_fetch, "invoices", lambda: db.get_columns("invoices", ["invoice_number", "customer_name", "total", "status", "date"], {"business_id": biz_id}, limit=200))
             pool.submit(_fetch, "cust_bals", lambda: calc_all_customer_balances(biz_id))
@@ -16066,14 +17387,12 @@ class Context:
         
         # Process results — all from single loads
         customers = results.get("customers") or []
-        suppliers = results.get("suppliers") or []
-        sales_data = results.get("sales") or []
         stock_data = results.get("stock") or []
         invoices = results.get("invoices") or []
         
         # Counts
         customer_count = len(customers)
-        supplier_count = len(suppliers)
+        supplier_count = results.get("supplier_count") or 0
         stock_count = len(stock_data)
         
         # Debtors (calculated from source documents — fetched in parallel above)
@@ -16086,10 +17405,9 @@ class Context:
         total_creditors = sum(v for v in _all_sup_bals.values() if v > 0)
         _t("dash_sup")
         
-        # Sales
-        today_str = today()
-        today_sales = sum(float(s.get("total", 0) or 0) for s in sales_data if s.get("date") == today_str)
-        total_sales = sum(float(s.get("total", 0) or 0) for s in sales_data)
+        # Sales (summed on the server above)
+        today_sales = results.get("today_sales") or 0
+        total_sales = results.get("total_sales") or 0
         
         # Stock value (from same stock load)
         stock_value = sum(float(s.get("qty") or s.get("quantity") or 0) * float(s.get("cost") or s.get("cost_price") or 0) for s in stock_data)
@@ -16516,14 +17834,23 @@ class DailyBriefing:
     def _gather_range_data(cls, business_id: str, start_date, end_date) -> dict:
         """Gather all data for a date range."""
         
+        # Only the window is fetched — the server applies the date range, the
+        # in_range() pass below keeps the exact day-level comparison.
+        lo = start_date.strftime("%Y-%m-%d")
+        hi = (end_date + timedelta(days=1)).strftime("%Y-%m-%d")
+        by_date = {"business_id": business_id, "date": [("gte", lo), ("lt", hi)]}
+        by_created = {"business_id": business_id, "created_at": [("gte", lo), ("lt", hi)]}
+        by_either = {"business_id": business_id,
+                     "or": f"(and(date.gte.{lo},date.lt.{hi}),and(created_at.gte.{lo},created_at.lt.{hi}))"}
+        
         # Get all data IN PARALLEL (no 'with' — same reason as api_pulse_data)
         pool = ThreadPoolExecutor(max_workers=8)
         try:
-            f_sales = pool.submit(db.get, "sales", {"business_id": business_id})
-            f_invoices = pool.submit(db.get, "invoices", {"business_id": business_id})
-            f_quotes = pool.submit(db.get, "quotes", {"business_id": business_id})
-            f_payments = pool.submit(db.get, "payments", {"business_id": business_id})
-            f_pos = pool.submit(db.get, "purchase_orders", {"business_id": business_id})
+            f_sales = pool.submit(db.get, "sales", by_date)
+            f_invoices = pool.submit(db.get, "invoices", by_date)
+            f_quotes = pool.submit(db.get, "quotes", by_created)
+            f_payments = pool.submit(db.get, "payments", by_date)
+            f_pos = pool.submit(db.get, "purchase_orders", by_either)
             f_customers = pool.submit(db.get, "customers", {"business_id": business_id})
             f_stock = pool.submit(db.get_all_stock, business_id)
             f_users = pool.submit(db.get_business_users, business_id)
@@ -18234,13 +19561,14 @@ class StockForecasting:
         """Calculate stock forecasts (run nightly)"""
         try:
             stock = db.get_all_stock(business_id)
-            sales = db.get("sales", {"business_id": business_id}) or []
             
-            # Get last 90 days of sales
+            # Get last 90 days of sales (window applied by the server)
             ninety_days_ago = (datetime.now() - timedelta(days=90)).strftime("%Y-%m-%d")
-            recent_sales = [s for s in sales if s.get("date", "") >= ninety_days_ago]
+            recent_sales = db.iter_rows("sales", {"business_id": business_id,
+                                                  "date": ("gte", ninety_days_ago)},
+                                        select="date,items")
             
-            # Count items sold
+            # Count items sold (folded page by page — the sales list is never held)
             item_sales = {}
             for sale in recent_sales:
                 items = sale.get("items", [])
@@ -19544,8 +20872,11 @@ class Auth:
     (Flask cookie sessions overflow at 4KB → cache silently fails → every request hits DB)
     """
     
-    _mem = {}  # {"user:{id}": {"d": dict, "t": float}, "biz:{id}": ...}
     _TTL = 300
+    # Shared across workers — a clear_cache() in one worker clears them all.
+    # Longest-lived entry is the TB insights fallback (600s).
+    _mem = SharedCache("auth", ttl=600,  # {"user:{id}": {"d": dict, "t": float}, "biz:{id}": ...}
+                       max_entries=5000, max_bytes=8 * 1024 * 1024)
     
     @staticmethod
     def get_current_user() -> Optional[dict]:
@@ -19962,6 +21293,30 @@ try:
 except Exception as e:
     logger.error(f"[CASHUP] Failed to register routes: {e}")
 
+# Register GL balance rebuild/verify routes (separate module — needs get_user_role)
+try:
+    if GL_BALANCES_LOADED:
+        register_gl_balance_routes(app, db, login_required, Auth, get_user_role)
+        logger.info("[GL BALANCES] Routes registered ✓")
+except Exception as e:
+    logger.error(f"[GL BALANCES] Failed to register routes: {e}")
+
+# Register customer ledger rebuild/reconcile routes (separate module — needs get_user_role)
+try:
+    if CUSTOMER_LEDGER_LOADED:
+        register_customer_ledger_routes(app, db, login_required, Auth, get_user_role)
+        logger.info("[CUSTOMER LEDGER] Routes registered ✓")
+except Exception as e:
+    logger.error(f"[CUSTOMER LEDGER] Failed to register routes: {e}")
+
+# Register period close / reopen routes (separate module — needs get_user_role)
+try:
+    if PERIOD_CLOSE_LOADED:
+        register_period_close_routes(app, db, login_required, Auth, get_user_role)
+        logger.info("[PERIOD CLOSE] Routes registered ✓")
+except Exception as e:
+    logger.error(f"[PERIOD CLOSE] Failed to register routes: {e}")
+
 # Register allocation ledger routes (separate module)
 try:
     if ALLOCATION_LOG_LOADED:
@@ -20078,11 +21433,11 @@ const ClickDB = {
     // Pull from server and cache locally
     async pullAndCache(table, onProgress) {
         let all = [];
-        let offset = 0;
+        let after = '';
         const limit = 500;
         
         while (true) {
-            const resp = await fetch(`/api/sync/pull?table=${table}&offset=${offset}&limit=${limit}`);
+            const resp = await fetch(`/api/sync/pull?table=${table}&after=${encodeURIComponent(after)}&limit=${limit}`);
             const data = await resp.json();
             
             if (!data.success) break;
@@ -20090,8 +21445,8 @@ const ClickDB = {
             all = all.concat(data.records || []);
             if (onProgress) onProgress(all.length, data.total || all.length);
             
-            if (!data.has_more) break;
-            offset += limit;
+            if (!data.has_more || !data.cursor) break;
+            after = data.cursor;
         }
         
         // Save to IndexedDB
@@ -25610,6 +26965,28 @@ def api_health():
         "detail": "TABLES config loaded"
     }
     
+    # 8. Read coalescing - identical concurrent reads sharing one fetch (this worker)
+    _co = db.coalesce_stats()
+    results["db_coalescing"] = {
+        "ok": True,
+        **_co,
+        "detail": f"{_co['calls']} reads, {_co['fetches']} fetched, {_co['coalesced']} coalesced"
+    }
+    
+    # 9. Caches - bounded, so worker memory stays flat (full table: /api/health/caches)
+    try:
+        _cs = cache_stats()
+        results["caches"] = {
+            "ok": True,
+            "backend": _cs["backend"],
+            "entries": _cs["entries"],
+            "bytes": _cs["bytes"],
+            "evictions": _cs["evictions"],
+            "detail": f"{len(_cs['caches'])} caches, {_cs['entries']} entries, ~{_cs['bytes'] // 1024} KB in this worker"
+        }
+    except Exception as e:
+        results["caches"] = {"ok": False, "detail": str(e)}
+    
     status = "ALL SYSTEMS GO ✅" if all_ok else "ISSUES FOUND ⚠️"
     
     return jsonify({
@@ -25839,6 +27216,20 @@ def pwa_icon(size):
 # /api/health-check → tests all pages, DB, API, modules
 # ═══════════════════════════════════════════════════════════════
 
+@app.route("/api/health/caches")
+@login_required
+def api_health_caches():
+    """Per-cache stats for THIS worker: size vs limits, hits, misses, evictions.
+    Each gunicorn worker has its own numbers — refresh to sample another."""
+    stats = cache_stats()
+    try:
+        import resource
+        stats["worker_max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except Exception:
+        pass
+    return jsonify(stats)
+
+
 @app.route("/api/health-check")
 @login_required
 def api_health_check():
@@ -27640,8 +29031,9 @@ def suspense_explainer():
     return render_page(title="Suspense Explainer", content=content, active="dashboard")
 
 
-_unposted_cache = {}      # {biz_id: (timestamp, [sales])}
 _UNPOSTED_CACHE_TTL = 300  # seconds — the dashboard is the busiest page
+_unposted_cache = SharedCache("unposted_sales", ttl=_UNPOSTED_CACHE_TTL,  # {biz_id: (timestamp, [sales])}
+                              max_entries=500, max_bytes=8 * 1024 * 1024)
 
 @app.route("/")
 @login_required
@@ -27738,19 +29130,7 @@ def dashboard():
                                                  limit=100000, select="reference") or [])}
                     # Refunded status lives ONLY in allocation_log — the sales
                     # table has no status column (same rule as clickai_pos.py).
-                    _u_refunded = set()
-                    for _al in (db.get("allocation_log", {"business_id": biz_id},
-                                       select="source_id,source_table,extra") or []):
-                        if _al.get("source_table") != "sales" or not _al.get("source_id"):
-                            continue
-                        _ex = _al.get("extra", {})
-                        if isinstance(_ex, str):
-                            try:
-                                _ex = json.loads(_ex) if _ex else {}
-                            except Exception:
-                                _ex = {}
-                        if isinstance(_ex, dict) and _ex.get("action") == "pos_refund":
-                            _u_refunded.add(_al.get("source_id"))
+                    _u_refunded = _reversed_sources(biz_id)[1]
                     _unposted = []
                     for _s in _u_sales:
                         if (_s.get("date") or "") < _cutoff:
@@ -28536,10 +29916,8 @@ def customer_view(customer_id):
         fut_receipts = executor.submit(_fetch, "receipts")
         fut_sales = executor.submit(_fetch, "sales")
         # Also fetch receipts with empty customer_id to match by name (banking allocations)
-        fut_receipts_all = executor.submit(lambda: db.get("receipts", {"business_id": biz_id}) if biz_id else [])
-        # Allocation log entries — used to derive refunded/reversed status without
-        # needing schema columns on sales/invoices (works on any Supabase install)
-        fut_alloc_log = executor.submit(lambda: db.get("allocation_log", {"business_id": biz_id}) if biz_id else [])
+        fut_receipts_unlinked = executor.submit(
+            lambda: _unlinked_receipts(biz_id, [customer.get("name")]) if biz_id else [])
     
     invoices = sorted(fut_invoices.result(), key=lambda x: x.get("date", ""), reverse=True)
     quotes = sorted(fut_quotes.result(), key=lambda x: x.get("date", ""), reverse=True)
@@ -28550,14 +29928,11 @@ def customer_view(customer_id):
     # Combine: receipts matched by customer_id + unlinked receipts matched by customer_name
     _receipts_by_id = fut_receipts.result()
     _receipts_by_id_set = {r.get("id") for r in _receipts_by_id}
-    _cust_name_upper = (customer.get("name") or "").upper().strip()
-    _receipts_by_name = [r for r in fut_receipts_all.result()
-                         if not r.get("customer_id") and _cust_name_upper
-                         and (r.get("customer_name") or "").upper().strip() == _cust_name_upper
-                         and r.get("id") not in _receipts_by_id_set]
+    _receipts_by_name = [r for r in fut_receipts_unlinked.result() if r.get("id") not in _receipts_by_id_set]
     receipts = sorted(_receipts_by_id + _receipts_by_name, key=lambda x: x.get("date", ""), reverse=True)
     # Exclude payments whose ledger allocation was reversed
-    _rev_pay_refs = _reversed_customer_payment_refs(biz_id)
+    _rev_pay_refs = _reversed_customer_payment_refs(
+        biz_id, refs={(r.get("reference") or "").strip() for r in receipts})
     receipts = [r for r in receipts if (r.get("reference") or "").strip() not in _rev_pay_refs]
     sales = sorted(fut_sales.result(), key=lambda x: x.get("date", ""), reverse=True)
     _t("cv_db_done")
@@ -28569,7 +29944,10 @@ def customer_view(customer_id):
     _refund_metadata = {}   # sale_id -> {date, who, reason, ref, amount}
     _reversal_metadata = {} # invoice_id -> {date, who, reason, ref, amount}
     try:
-        for _al in fut_alloc_log.result() or []:
+        # Allocation log entries — used to derive refunded/reversed status without
+        # needing schema columns on sales/invoices (works on any Supabase install)
+        _alloc_log = _reversal_entries(biz_id, [d.get("id") for d in invoices + sales]) if biz_id else []
+        for _al in _alloc_log or []:
             _src_id = _al.get("source_id", "")
             if not _src_id:
                 continue
@@ -30062,7 +31440,8 @@ def customer_opening_balance(customer_id):
     return render_page("Add Opening Balance", content, user, "customers")
 
 
-_audit_health_cache = {}
+_audit_health_cache = SharedCache("audit_badge", ttl=300,  # {biz_id: (timestamp, review_count)}
+                                  max_entries=5000, max_bytes=1024 * 1024)
 
 
 def compute_audit_health(biz_id: str) -> dict:
@@ -33283,7 +34662,7 @@ def api_stock_delete_all():
         
         # Invalidate stock cache so the UI shows zero
         try:
-            _stock_cache.pop(biz_id, None)
+            db.invalidate_stock(biz_id)
         except Exception:
             pass
         
@@ -33481,7 +34860,7 @@ def api_business_wipe_transactions():
         
         # Invalidate stock cache (defensive — stock_movements just got wiped)
         try:
-            _stock_cache.pop(biz_id, None)
+            db.invalidate_stock(biz_id)
         except Exception:
             pass
         
@@ -33988,8 +35367,7 @@ def grv_new():
                 
                 # ── STEP 3: Update qty + cost + selling price ──
                 current_qty = float(matched.get("qty") or matched.get("quantity") or 0)
-                new_qty = current_qty + qty_in
-                stock_updates = {"qty": new_qty, "quantity": new_qty}
+                stock_updates = {}
                 
                 if cost_price > 0:
                     old_cost = float(matched.get("cost") or matched.get("cost_price") or 0)
@@ -34007,17 +35385,11 @@ def grv_new():
                     stock_updates["price"] = new_sell
                     logger.info(f"[GRV] Price recalc {matched.get('code','')}: cost {old_cost}->{cost_price}, sell {old_sell}->{new_sell}")
                 
-                db.update_stock(matched["id"], stock_updates, biz_id)
+                moved = db.move_stock(biz_id, matched["id"], "grv", qty_in, reference=f"GRV {grv_num}",
+                                      updates=stock_updates, on_hand=current_qty)
+                new_qty = moved if moved is not None else current_qty + qty_in
                 logger.info(f"[GRV] Stock updated {matched.get('code','')}: {current_qty} + {qty_in} = {new_qty}")
                 
-                try:
-                    db.save("stock_movements", RecordFactory.stock_movement(
-                        business_id=biz_id, stock_id=matched["id"], movement_type="in",
-                        quantity=qty_in, reference=f"GRV {grv_num}"
-                    ))
-                except Exception:
-                    pass
-                
                 # ── Enrich the item record so the Stock Booking Report can show it ──
                 item["stock_id"] = matched["id"]
                 item["stock_code"] = matched.get("code", "")
@@ -35238,18 +36610,13 @@ def customer_statement(customer_id):
     _stmt_month, _asat = _statement_asat(request.args.get("month"), default_current=True)
     
     # Get all transactions
-    invoices = db.get("invoices", {"business_id": biz_id}) if biz_id else []
-    cust_invoices = [inv for inv in invoices if inv.get("customer_id") == customer_id]
+    cust_invoices = db.get("invoices", {"business_id": biz_id, "customer_id": customer_id}) if biz_id else []
     
-    receipts = db.get("receipts", {"business_id": biz_id}) if biz_id else []
-    cust_receipts = [r for r in receipts if r.get("customer_id") == customer_id]
+    cust_receipts = db.get("receipts", {"business_id": biz_id, "customer_id": customer_id}) if biz_id else []
     # Also pick up unlinked receipts matched by name (from banking recon)
-    _cust_name_upper = (customer.get("name") or "").upper().strip()
     _by_id_set = {r.get("id") for r in cust_receipts}
-    cust_receipts += [r for r in receipts
-                      if not r.get("customer_id") and _cust_name_upper
-                      and (r.get("customer_name") or "").upper().strip() == _cust_name_upper
-                      and r.get("id") not in _by_id_set]
+    cust_receipts += [r for r in (_unlinked_receipts(biz_id, [customer.get("name")]) if biz_id else [])
+                      if r.get("id") not in _by_id_set]
     
     credit_notes = db.get("credit_notes", {"business_id": biz_id, "customer_id": customer_id}) if biz_id else []
     sales = db.get("sales", {"business_id": biz_id, "customer_id": customer_id}) if biz_id else []
@@ -35263,7 +36630,7 @@ def customer_statement(customer_id):
     _refund_metadata = {}
     _reversal_metadata = {}
     try:
-        _alloc_log = db.get("allocation_log", {"business_id": biz_id}) if biz_id else []
+        _alloc_log = _reversal_entries(biz_id, [d.get("id") for d in cust_invoices + sales]) if biz_id else []
         for _al in _alloc_log or []:
             _src_id = _al.get("source_id", "")
             if not _src_id:
@@ -35357,7 +36724,8 @@ def customer_statement(customer_id):
             "link": f"/sale/{s.get('id', '')}"
         })
     
-    _rev_pay_refs = _reversed_customer_payment_refs(biz_id)
+    _rev_pay_refs = _reversed_customer_payment_refs(
+        biz_id, refs={(r.get("reference") or "").strip() for r in cust_receipts})
     for r in cust_receipts:
         if (r.get("reference") or "").strip() in _rev_pay_refs:
             continue  # payment whose ledger allocation was reversed
@@ -35833,17 +37201,12 @@ def customer_statement_print(customer_id):
     _stmt_month, _asat = _statement_asat(request.args.get("month"), default_current=True)
     
     # ── Build transactions (same logic as customer_statement view) ─────────
-    invoices = db.get("invoices", {"business_id": biz_id}) if biz_id else []
-    cust_invoices = [inv for inv in invoices if inv.get("customer_id") == customer_id]
+    cust_invoices = db.get("invoices", {"business_id": biz_id, "customer_id": customer_id}) if biz_id else []
     
-    receipts = db.get("receipts", {"business_id": biz_id}) if biz_id else []
-    cust_receipts = [r for r in receipts if r.get("customer_id") == customer_id]
-    _cust_name_upper = (customer.get("name") or "").upper().strip()
+    cust_receipts = db.get("receipts", {"business_id": biz_id, "customer_id": customer_id}) if biz_id else []
     _by_id_set = {r.get("id") for r in cust_receipts}
-    cust_receipts += [r for r in receipts
-                      if not r.get("customer_id") and _cust_name_upper
-                      and (r.get("customer_name") or "").upper().strip() == _cust_name_upper
-                      and r.get("id") not in _by_id_set]
+    cust_receipts += [r for r in (_unlinked_receipts(biz_id, [customer.get("name")]) if biz_id else [])
+                      if r.get("id") not in _by_id_set]
     
     credit_notes = db.get("credit_notes", {"business_id": biz_id, "customer_id": customer_id}) if biz_id else []
     sales = db.get("sales", {"business_id": biz_id, "customer_id": customer_id}) if biz_id else []
@@ -35854,7 +37217,7 @@ def customer_statement_print(customer_id):
     _refund_metadata = {}
     _reversal_metadata = {}
     try:
-        _alloc_log = db.get("allocation_log", {"business_id": biz_id}) if biz_id else []
+        _alloc_log = _reversal_entries(biz_id, [d.get("id") for d in cust_invoices + sales]) if biz_id else []
         for _al in _alloc_log or []:
             _src_id = _al.get("source_id", "")
             if not _src_id:
@@ -35917,7 +37280,8 @@ def customer_statement_print(customer_id):
             "invoice_id": inv.get("id"),
         })
     
-    _rev_pay_refs = _reversed_customer_payment_refs(biz_id)
+    _rev_pay_refs = _reversed_customer_payment_refs(
+        biz_id, refs={(r.get("reference") or "").strip() for r in cust_receipts})
     for r in cust_receipts:
         if (r.get("reference") or "").strip() in _rev_pay_refs:
             continue  # payment whose ledger allocation was reversed
@@ -36380,17 +37744,12 @@ def _build_statement_body_for_print(customer, business, biz_id, _asat):
     customer_id = customer.get("id")
 
     # ── Build transactions (same logic as customer_statement_print) ─────────
-    invoices = db.get("invoices", {"business_id": biz_id}) if biz_id else []
-    cust_invoices = [inv for inv in invoices if inv.get("customer_id") == customer_id]
+    cust_invoices = db.get("invoices", {"business_id": biz_id, "customer_id": customer_id}) if biz_id else []
 
-    receipts = db.get("receipts", {"business_id": biz_id}) if biz_id else []
-    cust_receipts = [r for r in receipts if r.get("customer_id") == customer_id]
-    _cust_name_upper = (customer.get("name") or "").upper().strip()
+    cust_receipts = db.get("receipts", {"business_id": biz_id, "customer_id": customer_id}) if biz_id else []
     _by_id_set = {r.get("id") for r in cust_receipts}
-    cust_receipts += [r for r in receipts
-                      if not r.get("customer_id") and _cust_name_upper
-                      and (r.get("customer_name") or "").upper().strip() == _cust_name_upper
-                      and r.get("id") not in _by_id_set]
+    cust_receipts += [r for r in (_unlinked_receipts(biz_id, [customer.get("name")]) if biz_id else [])
+                      if r.get("id") not in _by_id_set]
 
     credit_notes = db.get("credit_notes", {"business_id": biz_id, "customer_id": customer_id}) if biz_id else []
     sales = db.get("sales", {"business_id": biz_id, "customer_id": customer_id}) if biz_id else []
@@ -36401,7 +37760,7 @@ def _build_statement_body_for_print(customer, business, biz_id, _asat):
     _refund_metadata = {}
     _reversal_metadata = {}
     try:
-        _alloc_log = db.get("allocation_log", {"business_id": biz_id}) if biz_id else []
+        _alloc_log = _reversal_entries(biz_id, [d.get("id") for d in cust_invoices + sales]) if biz_id else []
         for _al in _alloc_log or []:
             _src_id = _al.get("source_id", "")
             if not _src_id:
@@ -36464,7 +37823,8 @@ def _build_statement_body_for_print(customer, business, biz_id, _asat):
             "invoice_id": inv.get("id"),
         })
 
-    _rev_pay_refs = _reversed_customer_payment_refs(biz_id)
+    _rev_pay_refs = _reversed_customer_payment_refs(
+        biz_id, refs={(r.get("reference") or "").strip() for r in cust_receipts})
     for r in cust_receipts:
         if (r.get("reference") or "").strip() in _rev_pay_refs:
             continue  # payment whose ledger allocation was reversed
@@ -37049,8 +38409,12 @@ DEFAULT_ACCOUNTS = [
 # and ClickAI default accounts (e.g. 1300)
 # ═══════════════════════════════════════════════════════════════
 
-# Cache to avoid repeated DB lookups within same request
-_gl_map_cache = {}  # biz_id → {role: code} — cleared per request cycle
+# Compiled role resolver per business, shared by every worker:
+#   biz_id → {"rules": _GL_RULES_STAMP, "coa_version": n, "roles": {role: code}, "codes": [...]}
+# Any write to chart_of_accounts invalidates the business (see _coa_written), so
+# the map is rebuilt only when the COA changes; the TTL is just a safety net.
+_gl_map_cache = SharedCache("gl_map", ttl=86400, max_entries=500,
+                            max_bytes=4 * 1024 * 1024)
 
 # ClickAI standard chart of accounts — the defaults when no COA imported
 CLICKAI_DEFAULTS = {
@@ -37140,6 +38504,50 @@ SAGE_SYSTEM_ACCOUNT_CODES = {
 }
 
 
+def _compile_coa_rules(keyword_map):
+    """COA_KEYWORD_MAP as [(role, compiled keyword pattern, categories or None)]
+    in map order, plus one pattern matching any keyword (accounts that match
+    none are skipped without trying each role)."""
+    rules = [(entry[1], re.compile("|".join(re.escape(kw) for kw in entry[0])),
+              tuple(entry[2]) if len(entry) > 2 and entry[2] is not None else None)
+             for entry in keyword_map]
+    any_kw = re.compile("|".join(re.escape(kw) for entry in keyword_map for kw in entry[0]))
+    return rules, any_kw
+
+
+_COA_RULES, _COA_ANY_KEYWORD = _compile_coa_rules(COA_KEYWORD_MAP)
+# A cached map built from another version of COA_KEYWORD_MAP is rebuilt
+_GL_RULES_STAMP = hashlib.sha1(repr(COA_KEYWORD_MAP).encode()).hexdigest()[:12]
+
+
+def _coa_code(acc) -> str:
+    return str(acc.get("account_code", "") or acc.get("code", "")).strip()
+
+
+def _match_gl_roles(coa: list) -> dict:
+    """role→code for these chart_of_accounts rows: the first account (in COA
+    order) whose name has one of the role's keywords, within the role's
+    categories when it has any."""
+    gl_map = {}
+    for acc in coa:
+        code = _coa_code(acc)
+        name = str(acc.get("account_name", "") or acc.get("name", "")).lower()
+        if not code or not name or not _COA_ANY_KEYWORD.search(name):
+            continue
+        category = str(acc.get("category", "") or "").lower().strip()
+        source = str(acc.get("source", "") or "").strip().lower()
+        for role, pattern, required_cats in _COA_RULES:
+            if role in gl_map:
+                continue  # Already matched this role, skip
+            # For System Accounts, use their category (e.g. "Trade Payables" → "Current Liabilities");
+            # also check if source type matches (e.g. "Bank Account Balance")
+            if required_cats is not None and not any(rc in category or rc in source for rc in required_cats):
+                continue
+            if pattern.search(name):
+                gl_map[role] = code
+    return gl_map
+
+
 def build_gl_map(biz_id: str) -> dict:
     """
     Build a role→code mapping for a business from its chart_of_accounts.
@@ -37150,47 +38558,41 @@ def build_gl_map(biz_id: str) -> dict:
     not "Bank Charges" which is an Expense.
     """
     coa = db.get("chart_of_accounts", {"business_id": biz_id}) or []
-    if not coa:
-        return {}
-    
-    gl_map = {}
-    
-    # Scan ALL COA records, match by keyword + category
-    for acc in coa:
-        code = str(acc.get("account_code", "") or acc.get("code", "")).strip()
-        name = str(acc.get("account_name", "") or acc.get("name", "")).lower()
-        category = str(acc.get("category", "") or "").lower().strip()
-        source = str(acc.get("source", "") or "").strip()
-        if not code or not name:
-            continue
-        
-        for entry in COA_KEYWORD_MAP:
-            kw_list, role = entry[0], entry[1]
-            required_cats = entry[2] if len(entry) > 2 else None
-            
-            if role in gl_map:
-                continue  # Already matched this role, skip
-            
-            # Check category constraint if specified
-            if required_cats is not None:
-                # For System Accounts, use their category (e.g. "Trade Payables" → "Current Liabilities")
-                # For Account Balance items, use their category column
-                if not any(rc in category for rc in required_cats):
-                    # Also check if source type matches (e.g. "Bank Account Balance")
-                    if not any(rc in source.lower() for rc in required_cats):
-                        continue  # Category doesn't match, skip
-            
-            for kw in kw_list:
-                if kw in name:
-                    gl_map[role] = code
-                    break
-    
+    gl_map = _match_gl_roles(coa)
     if gl_map:
         logger.info(f"[GL MAP] Built for biz {biz_id[:8]}: {gl_map}")
-    
     return gl_map
 
 
+def _gl_resolver(biz_id: str) -> dict:
+    """This business's cached role map and COA codes, built on first use and
+    after every chart_of_accounts change."""
+    entry = _gl_map_cache.get(biz_id)
+    if entry and entry.get("rules") == _GL_RULES_STAMP:
+        return entry
+    ver = _gl_map_cache.version(biz_id)
+    coa = db.get("chart_of_accounts", {"business_id": biz_id}) or []
+    entry = {"rules": _GL_RULES_STAMP, "coa_version": ver,
+             "roles": _match_gl_roles(coa), "codes": sorted({_coa_code(a) for a in coa} - {""})}
+    if entry["roles"]:
+        logger.info(f"[GL MAP] Built for biz {biz_id[:8]}: {entry['roles']}")
+    # Refused if the COA changed while we were reading it - the next call rebuilds
+    _gl_map_cache.set(biz_id, entry, version=ver)
+    return entry
+
+
+def _coa_written(business_ids):
+    """DB write listener: chart_of_accounts changed, drop the role maps."""
+    if business_ids is None:
+        _gl_map_cache.clear()
+        return
+    for biz_id in business_ids:
+        _gl_map_cache.invalidate(biz_id)
+
+
+_DB_WRITE_LISTENERS["chart_of_accounts"] = _coa_written
+
+
 def gl(biz_id: str, role: str) -> str:
     """
     Get the GL account code for a role. Short name for use in GL entries.
@@ -37199,13 +38601,7 @@ def gl(biz_id: str, role: str) -> str:
     
     Checks: business gl_map (from COA import) → CLICKAI_DEFAULTS fallback
     """
-    global _gl_map_cache
-    
-    # Get or build the map for this business
-    if biz_id not in _gl_map_cache:
-        _gl_map_cache[biz_id] = build_gl_map(biz_id)
-    
-    gl_map = _gl_map_cache[biz_id]
+    gl_map = _gl_resolver(biz_id)["roles"]
     
     # Return mapped code, or ClickAI default
     if role in gl_map:
@@ -37231,11 +38627,8 @@ def ensure_gl_account(biz_id: str, role: str, default_name: str, default_type: s
     if not biz_id or not code:
         return code
     try:
-        coa = db.get("chart_of_accounts", {"business_id": biz_id}) or []
-        for acc in coa:
-            existing = str(acc.get("account_code", "") or acc.get("code", "")).strip()
-            if existing == str(code).strip():
-                return code  # account already exists
+        if str(code).strip() in _gl_resolver(biz_id)["codes"]:
+            return code  # account already exists
         # Not found — create it so journals, reports and the GL trail resolve it
         db.save("chart_of_accounts", {
             "business_id": biz_id,
@@ -37247,11 +38640,6 @@ def ensure_gl_account(biz_id: str, role: str, default_name: str, default_type: s
             "source": "auto_created",
         })
         logger.info(f"[GL] Auto-created account {code} ({default_name}) for biz {biz_id[:8]}")
-        # Invalidate the cached GL map so the new account is picked up
-        try:
-            _gl_map_cache.pop(biz_id, None)
-        except Exception:
-            pass
     except Exception as e:
         logger.error(f"[GL] ensure_gl_account failed for {role}/{code}: {e}")
     return code
@@ -37302,7 +38690,12 @@ def create_journal_entry(biz_id: str, date: str, description: str, reference: st
     
     if not biz_id:
         return
-    
+    save_journal_rows(build_journal_rows(biz_id, date, description, reference, entries), reference)
+
+
+def build_journal_rows(biz_id: str, date: str, description: str, reference: str, entries: list) -> list:
+    """The journals rows of one entry, checked but not saved (raises
+    ValueError when it does not balance)."""
     # Validate balance: total debits must equal total credits.
     # Cent-level differences (cash-rounding legs etc.) are auto-balanced to
     # Cash Short/Over so the GL always balances to the cent. Anything larger
@@ -37322,41 +38715,177 @@ def create_journal_entry(biz_id: str, date: str, description: str, reference: st
             print(f"[GL] BLOCKED unbalanced journal! ref={reference} debits={total_debits:.2f} credits={total_credits:.2f} diff={_imbalance:+.2f} desc={str(description)[:80]}", flush=True)
             logger.error(f"[GL] UNBALANCED journal entry BLOCKED! ref={reference} debits={total_debits:.2f} credits={total_credits:.2f}")
             raise ValueError(f"Unbalanced journal blocked: {reference} (DR {total_debits:.2f} vs CR {total_credits:.2f})")
+
+    # A back-dated entry into a closed month is posted like any other - the
+    # source document is usually saved already. PERIOD_CLOSE_SQL's trigger
+    # marks that month's snapshots stale so as-at reports stop trusting them.
     
-    for entry in entries:
-        account_code = entry.get("account_code")
-        debit = float(entry.get("debit", 0))
-        credit = float(entry.get("credit", 0))
-        
-        row = {
-            "id": generate_id(),
-            "business_id": biz_id,
-            "date": date,
-            "description": description,
-            "reference": reference,
-            "account_code": account_code,
-            "debit": debit,
-            "credit": credit,
-            "created_at": now()
-        }
-        
-        # A dropped keep-alive connection to Supabase fails the save outright
-        # (the shared DB session is built with max_retries=0), which silently
-        # loses the journal while the source document is already saved. Retry
-        # twice before giving up. The row keeps the SAME id on every attempt,
-        # so if the first save actually reached Supabase and only the response
-        # was lost, the retry is rejected as a duplicate key instead of
-        # double-posting. Anything still failing is reported by CHK-011.
-        success, err = db.save("journals", row)
-        attempt = 1
-        while not success and attempt < 3:
-            time.sleep(0.5 * attempt)
-            attempt += 1
+    _created = now()
+    rows = [{
+        "id": generate_id(),
+        "business_id": biz_id,
+        "date": date,
+        "description": description,
+        "reference": reference,
+        "account_code": entry.get("account_code"),
+        "debit": float(entry.get("debit", 0)),
+        "credit": float(entry.get("credit", 0)),
+        "created_at": _created
+    } for entry in entries]
+    return rows
+
+
+def save_journal_rows(rows: list, reference: str = ""):
+    """Post journal rows (one or more entries from build_journal_rows)."""
+    if not rows:
+        return
+    # All lines go up in ONE request (db.save_batch), so a 5-leg POS sale is
+    # one round trip instead of five and the entry lands whole or not at all.
+    # A dropped keep-alive connection to Supabase fails the save outright
+    # (the shared DB session is built with max_retries=0), which silently
+    # loses the journal while the source document is already saved. Retry
+    # twice before giving up. Every line keeps the SAME id on every attempt,
+    # so if the first save actually reached Supabase and only the response
+    # was lost, the retry overwrites those rows instead of double-posting.
+    # Anything still failing is reported by CHK-011.
+    success, err = db.save_batch("journals", rows)
+    attempt = 1
+    while not success and attempt < 3 and not str(err).startswith("HTTP 4"):
+        time.sleep(0.5 * attempt)
+        attempt += 1
+        success, err = db.save_batch("journals", rows)
+    if success:
+        return
+    
+    if str(err).startswith("HTTP 4"):
+        # The batch itself was refused (e.g. a column this database lacks) -
+        # post line by line through save(), which strips unknown columns
+        print(f"[GL] Journal batch refused ({err[:120]}) - ref={reference}, posting line by line", flush=True)
+        for row in rows:
             success, err = db.save("journals", row)
-        
-        if not success:
-            print(f"[GL] Journal line save FAILED after {attempt} attempts - ref={reference} account={account_code} err={err}", flush=True)
-            logger.error(f"[GL] Failed to save journal entry: {err}")
+            attempt = 1
+            while not success and attempt < 3:
+                time.sleep(0.5 * attempt)
+                attempt += 1
+                success, err = db.save("journals", row)
+            if not success:
+                print(f"[GL] Journal line save FAILED after {attempt} attempts - ref={reference} account={row['account_code']} err={err}", flush=True)
+                logger.error(f"[GL] Failed to save journal entry: {err}")
+        return
+    
+    print(f"[GL] Journal save FAILED after {attempt} attempts - ref={reference} lines={len(rows)} err={err}", flush=True)
+    logger.error(f"[GL] Failed to save journal entry: {err}")
+
+
+def commit_pos_sale(biz_id: str, sale: dict, journals: list, stock_lines: list,
+                    customer_id: str = None, balance_delta: float = 0.0) -> Tuple[bool, str, Dict[str, float]]:
+    """Write a POS sale: the sales row, its journal entries, one ledger
+    movement per stock line and the account customer's balance.
+
+    journals    - [(description, reference, entries)], dated like the sale
+    stock_lines - [{"stock_id", "quantity" sold, "on_hand" as read (or None)}]
+
+    With POS_SALE_SQL run this is ONE call to pos_commit_sale, which writes
+    it all in one transaction. Until then each table gets one bulk request
+    (the sale, every journal line, every movement), and stock moves line by
+    line through move_stock() if the stock ledger is not there either.
+    The journals are checked before anything is written, so an unbalanced
+    entry raises ValueError with no sale saved.
+
+    Returns (ok, error, {stock_id: on-hand after the sale}); not ok only
+    when the sale itself was not saved."""
+    global _pos_sale_rpc_off
+    sale_num = sale.get("sale_number", "")
+    rows = []
+    for description, reference, entries in journals:
+        rows += build_journal_rows(biz_id, sale.get("date") or today(), description, reference, entries)
+    lines = [line for line in stock_lines if line.get("stock_id") and float(line.get("quantity") or 0) > 0]
+    movements = [RecordFactory.stock_movement(
+                     biz_id, line["stock_id"], "out", abs(float(line["quantity"])),
+                     reference=f"POS Sale {sale_num}", kind="sale",
+                     qty_delta=signed_qty("sale", line["quantity"]))
+                 for line in lines]
+    balance_delta = float(balance_delta or 0) if customer_id else 0.0
+
+    if not _pos_sale_rpc_off and not _stock_ledger_off:
+        params = {"p_sale": sale, "p_journals": rows, "p_movements": movements,
+                  "p_customer_id": str(customer_id or ""), "p_balance": balance_delta}
+        response, err = None, ""
+        # Same payload on every attempt: if a lost response hid a commit, the
+        # retry is refused by the sale id (409) rather than posting again
+        for attempt in range(3):
+            if attempt:
+                time.sleep(0.5 * attempt)
+            try:
+                response = _DB_SESSION.post(f"{db.url}/rest/v1/rpc/pos_commit_sale",
+                                            headers=db.headers, json=params, timeout=30)
+            except Exception as e:
+                response, err = None, str(e)[:300]
+                continue
+            if response.status_code < 500:
+                break
+            err = f"HTTP {response.status_code}: {response.text[:300]}"
+        db._touched("sales", "journals", "stock_movements", "stock_items", "stock", "customers")
+        status = response.status_code if response is not None else None
+        if status == 200:
+            moved = (_json_loads(response.content) or {}).get("movements") or []
+            on_hand = {}
+            for m in moved:
+                db._stock_qty_written(biz_id, m.get("stock_id"), m.get("balance_after"))
+                if m.get("balance_after") is not None:
+                    on_hand[str(m.get("stock_id"))] = float(m["balance_after"])
+            return True, "", on_hand
+        body = response.text if response is not None else ""
+        if status == 409:
+            # Only a retry of a commit whose answer was lost is a success - any
+            # other clash (sale_number, a journal id) rolled everything back
+            if db.get_one("sales", sale["id"]):
+                logger.warning(f"[POS] Sale {sale_num} already committed - not posted again")
+                db.stock_changed(biz_id)
+                return True, "", {}
+            logger.error(f"[POS] Sale {sale_num} refused, nothing written: {body[:300]}")
+            return False, f"HTTP 409: {body[:300]}", {}
+        if status == 404 or "PGRST202" in body or "42703" in body:
+            _pos_sale_rpc_off = True
+            logger.warning("[POS] No pos_commit_sale function - run POS_SALE_SQL (after STOCK_LEDGER_SQL). "
+                           "Committing sales with one bulk request per table until then.")
+        else:
+            return False, err or f"HTTP {status}: {body[:300]}", {}
+
+    ok, err = db.save_batch("sales", [sale])
+    if not ok:
+        # save() strips columns this database lacks and retries
+        ok, err = db.save("sales", sale)
+    if not ok:
+        return False, str(err), {}
+    save_journal_rows(rows, sale_num)
+
+    on_hand, moved = {}, None
+    if movements and not _stock_ledger_off:
+        try:
+            moved = db.record_stock_movements(biz_id, movements)
+        except RuntimeError as e:
+            logger.error(f"[POS] Sale {sale_num}: stock not moved: {e}")
+            moved = []
+    if moved is not None:
+        for m in moved:
+            if m.get("balance_after") is not None:
+                on_hand[str(m.get("stock_id"))] = float(m["balance_after"])
+    else:
+        for line in lines:
+            sid = str(line["stock_id"])
+            new_qty = db.move_stock(biz_id, sid, "sale", line["quantity"], reference=f"POS Sale {sale_num}",
+                                    on_hand=on_hand.get(sid, line.get("on_hand")))
+            if new_qty is None:
+                logger.error(f"[POS] Failed to move stock {sid} - sold {line['quantity']}")
+            else:
+                on_hand[sid] = new_qty
+
+    if balance_delta:
+        customer = db.get_one("customers", customer_id)
+        if customer:
+            db.update("customers", customer_id, {"balance": float(customer.get("balance") or 0) + balance_delta})
+    return True, "", on_hand
 
 # 
 # JOURNALS - Manual entries
@@ -40890,8 +42419,9 @@ def api_sage_drop_import():
 # ═══════════════════════════════════════════════════════════════════════════════
 
 
-# Temporary storage for analysis results
-_smart_import_cache = {}
+# Temporary storage for analysis results (an hour to confirm, then dropped)
+_smart_import_cache = BoundedCache("smart_import", ttl=3600, max_entries=50,
+                                   max_bytes=32 * 1024 * 1024)
 
 @app.route("/smart-import")
 @login_required
@@ -43151,9 +44681,16 @@ def api_smart_import_batch():
                                     updates[k] = v
                             if name: updates["description"] = name
                             if code: updates["code"] = code
+                            # An imported quantity is a count: the difference goes on the stock ledger
+                            counted = updates.pop("quantity", None)
                             success = db.update("stock_items", exist_id, updates)
+                            if counted is not None:
+                                _cur = float(exist_rec.get("quantity") or exist_rec.get("qty") or 0)
+                                moved = db.move_stock(biz_id, exist_id, "adjustment", counted - _cur,
+                                                      reference="Stock import", on_hand=_cur)
+                                success = success and moved is not None
                             try:
-                                _stock_cache.pop(biz_id, None)
+                                db.stock_changed(biz_id)
                             except Exception:
                                 pass
                             status = "updated" if success else "error"
@@ -43837,7 +45374,7 @@ def api_smart_import_execute():
                         logger.error(f"[SMART-IMPORT] Transaction error: {e}")
                 imported["Transactions"] = count
         
-        del _smart_import_cache[analysis_id]
+        _smart_import_cache.pop(analysis_id, None)
         
         try:
             db.save("audit_log", {
@@ -49157,6 +50694,20 @@ def api_import_execute():
             
             print(f"[STOCK-UPDATE] Found {len(code_to_item)} existing items to match against", flush=True)
             
+            # Counts become ledger deltas: take the current quantity from the
+            # database, not the stock cache, for the items being counted
+            counted_ids = []
+            for rec in records:
+                item = code_to_item.get(str(rec.get("code", "")).strip().upper())
+                if item and {"quantity", "qty"} & set(rec.get("updates", {})):
+                    counted_ids.append(item.get("id"))
+            try:
+                on_hand = db.stock_on_hand(biz_id, counted_ids)
+            except RuntimeError as e:
+                logger.error(f"[STOCK-UPDATE] Could not read current quantities: {e}")
+                return jsonify({"success": False,
+                                "error": "Could not read current stock quantities - nothing was imported. Try again."})
+            
             updated = 0
             not_found = 0
             
@@ -49169,8 +50720,16 @@ def api_import_execute():
                     stock_id = existing.get("id")
                     
                     if stock_id and updates:
-                        # Update the item
-                        result = db.update_stock(stock_id, updates, biz_id)
+                        # Update the item - an imported quantity is a stocktake adjustment
+                        if "quantity" in updates or "qty" in updates:
+                            current_qty = on_hand.get(stock_id)
+                            counted = float(updates.get("quantity", updates.get("qty")) or 0)
+                            result = current_qty is not None and db.move_stock(
+                                biz_id, stock_id, "adjustment", counted - current_qty,
+                                reference="Stock import", updates=updates,
+                                on_hand=current_qty) is not None
+                        else:
+                            result = db.update_stock(stock_id, updates, biz_id)
                         if result:
                             updated += 1
                             if updated <= 3:
@@ -51025,12 +52584,11 @@ def api_job_card_issue_material(job_id):
             # Try to find matching stock item by description or code
             stock_id = bom_item.get("stock_id")
             if stock_id:
-                stock_item = db.get_one_stock(stock_id)
-                if stock_item:
-                    current_qty = float(stock_item.get("qty") or stock_item.get("quantity") or 0)
-                    new_qty = current_qty - qty
-                    db.update_stock(stock_id, {"qty": new_qty, "quantity": new_qty}, job.get("business_id"))
-                    logger.info(f"[JOB CARD] Stock issued {stock_id}: {current_qty} - {qty} = {new_qty}")
+                # One ledger movement; the quantity is only read without the ledger
+                new_qty = db.move_stock(job.get("business_id"), stock_id, "job_issue", qty,
+                                        reference=f"Job {job.get('job_number') or job_id}")
+                if new_qty is not None:
+                    logger.info(f"[JOB CARD] Stock issued {stock_id}: -{qty} = {new_qty}")
             
             AuditLog.log("UPDATE", "jobs", job_id, details=f"Material issued: {bom_item.get('description')} x {qty}")
             return jsonify({"success": True})
@@ -52702,7 +54260,7 @@ def customer_demand_letter(customer_id):
         return redirect("/customers")
     
     biz_id = business.get("id", "") if business else ""
-    balance = calc_customer_balance(biz_id, customer_id)
+    balance = calc_customer_balance(biz_id, customer_id, customer)
     biz_name = business.get("name", "Business") if business else "Business"
     biz_address = business.get("address", "") if business else ""
     biz_phone = business.get("phone", "") if business else ""
@@ -56268,8 +57826,10 @@ def api_refund_pos_sale(sale_id):
                         stock_rec = db.get_one("stock", stock_id)
                         if stock_rec:
                             current_qty = float(stock_rec.get("qty") or stock_rec.get("quantity") or 0)
-                            new_qty = current_qty + qty
-                            db.update_stock(stock_id, {"qty": new_qty, "quantity": new_qty}, biz_id)
+                            new_qty = db.move_stock(biz_id, stock_id, "return", qty,
+                                                    reference=f"Refund {sale_number}", on_hand=current_qty)
+                            if new_qty is None:
+                                raise RuntimeError("stock not moved")
                             stock_reversal_summary.append({
                                 "stock_id": stock_id,
                                 "code": stock_rec.get("code", ""),
@@ -62898,6 +64458,7 @@ def api_scan_save_supplier_invoice():
         stock_items_matched = 0
         expenses_booked = 0
         stock_snapshots = []  # Captures old_qty/cost/sell + delta per affected stock item — enables reliable reversal on edit/credit/delete
+        ledger_moved_ids = set()  # Matched items already moved through the ledger - the GRV log below skips them
         
         # ════════════════════════════════════════════════════════════════
         # GRV OPT-IN: only book into stock when the user explicitly ticks
@@ -63138,7 +64699,6 @@ def api_scan_save_supplier_invoice():
                     old_qty = float(matched.get("quantity", matched.get("qty", 0)) or 0)
                     old_cost = float(matched.get("cost_price", matched.get("cost", 0)) or 0)
                     old_sell = float(matched.get("selling_price", matched.get("price", 0)) or 0)
-                    new_qty = old_qty + actual_units
                     table = "stock" if matched in all_stock else "stock_items"
                     
                     # SNAPSHOT: record old values so this invoice can be reversed later
@@ -63160,8 +64720,6 @@ def api_scan_save_supplier_invoice():
                     # legacy stock (qty/cost/price). Passing both names is safe;
                     # update_stock + auto-fix retry strips whichever doesn't exist.
                     stock_updates = {
-                        "quantity": new_qty,
-                        "qty": new_qty,
                         "cost_price": cost_per_unit,
                         "cost": cost_per_unit,
                         "last_purchase_date": today()
@@ -63175,8 +64733,12 @@ def api_scan_save_supplier_invoice():
                         stock_updates["price"] = new_sell
                         logger.info(f"[SCAN] Markup maintained for {matched.get('code')}: ratio={markup_ratio:.3f}, new sell=R{new_sell}")
                     
-                    _upd_ok = db.update_stock(matched["id"], stock_updates, biz_id)
+                    # The units arrive as one ledger movement; cost/price ride along
+                    _upd_ok = db.move_stock(biz_id, matched["id"], "grv", actual_units,
+                                            reference=f"{data.get('invoice_number', '')} | {supplier_name}",
+                                            updates=stock_updates, on_hand=old_qty) is not None
                     if _upd_ok:
+                        ledger_moved_ids.add(str(matched["id"]))
                         if pack_size > 1 or discount_pct > 0:
                             logger.info(f"[SCAN] Updated stock: {matched.get('code')} +{actual_units} units ({qty}×{pack_size}/pack, {discount_pct}% off, cost/unit R{cost_per_unit:.2f})")
                         else:
@@ -63615,7 +65177,7 @@ def api_scan_save_supplier_invoice():
                                 if (_s.get("code") or "").upper() == (_ri.get("code") or "").upper():
                                     _sid = _s.get("id")
                                     break
-                        if _sid:
+                        if _sid and str(_sid) not in ledger_moved_ids:
                             db.save("stock_movements", RecordFactory.stock_movement(
                                 business_id=biz_id, stock_id=_sid, movement_type="in",
                                 quantity=_ri["qty_received"],
@@ -64979,6 +66541,7 @@ def api_sync_pull():
     
     table = request.args.get("table", "")
     since = request.args.get("since")  # ISO timestamp for incremental sync
+    after = request.args.get("after", "")  # keyset cursor: last id of the previous page
     offset = int(request.args.get("offset", 0))
     limit = int(request.args.get("limit", 500))
     
@@ -64988,15 +66551,13 @@ def api_sync_pull():
         return jsonify({"success": False, "error": f"Invalid table: {table}"})
     
     try:
-        # Get records with filters
-        records = db.get(table, {"business_id": biz_id}, limit=limit)
-        
-        # Filter by since if provided (incremental sync)
+        # Keyset page: the next `limit` rows after the cursor, in id order
+        filters = {"business_id": biz_id}
         if since:
-            records = [r for r in records if r.get("updated_at", "") >= since]
-        
-        # Apply offset (pagination)
-        records = records[offset:offset + limit]
+            filters["updated_at"] = ("gte", since)  # incremental sync
+        if after:
+            filters["id"] = ("gt", after)
+        records = db.get(table, filters, limit=limit)
         
         # Get total count
         total = db.count(table, {"business_id": biz_id})
@@ -65008,7 +66569,8 @@ def api_sync_pull():
             "count": len(records),
             "total": total,
             "offset": offset,
-            "has_more": (offset + limit) < total
+            "cursor": records[-1].get("id", "") if records else after,
+            "has_more": len(records) == limit
         })
         
     except Exception as e:
@@ -65214,7 +66776,7 @@ try:
             next_document_number, get_user_role, get_zane_chat,
             RecordFactory, CSS, now, today, extract_time,
             create_journal_entry, log_allocation, gl,
-            AuditLog, Email
+            AuditLog, Email, commit_pos_sale
         )
         logger.info("[POS] Routes registered ✓")
 except Exception as e:
@@ -66225,7 +67787,7 @@ def api_whatsapp_reminder(customer_id):
             return jsonify({"success": False, "error": "Customer not found"})
         
         biz_id = business.get("id", "") if business else ""
-        balance = calc_customer_balance(biz_id, customer_id)
+        balance = calc_customer_balance(biz_id, customer_id, customer)
         if balance <= 0:
             return jsonify({"success": False, "error": "Customer has no outstanding balance"})
         
@@ -66370,7 +67932,7 @@ class Collections:
     def _build_reminder_email(cls, customer: dict, business: dict) -> str:
         """Build HTML email for payment reminder"""
         name = customer.get("name", "Customer")
-        balance = calc_customer_balance(business.get("id", "") if business else "", customer.get("id", ""))
+        balance = calc_customer_balance(business.get("id", "") if business else "", customer.get("id", ""), customer)
         days = customer.get("days_overdue", 0)
         biz_name = business.get("name", "Business") if business else "Business"
         
@@ -67334,7 +68896,7 @@ def portal_statement(customer_id):
     biz_name = safe(business.get("name", "Business")) if business else "Business"
     cust_name = safe(customer.get("name", "Customer"))
     biz_id = customer.get("business_id", "")
-    balance = calc_customer_balance(biz_id, customer_id)
+    balance = calc_customer_balance(biz_id, customer_id, customer)
     
     # Build invoice rows
     rows = ""
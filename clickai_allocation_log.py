@@ -19,6 +19,12 @@ The /ledger page shows accordion bundles that open to reveal:
 Grouping: Per Transaction (default), Per Day, Per Customer, Per Cashier
 Search: Any field - customer, supplier, amount, reference, cashier, date
 
+Reversal index: invoice reversals and POS refunds are recorded only here
+(extra.action). reversal_entries / reversed_sources / reversed_references
+read just those rows through the promoted action column and partial indexes
+(ALLOCATION_REVERSAL_SQL); until a business is backfilled they fall back to
+parsing every entry's extra.
+
 Import in clickai.py with try/except:
     try:
         from clickai_allocation_log import register_ledger_routes, log_allocation
@@ -34,6 +40,8 @@ from datetime import datetime
 from collections import defaultdict
 from flask import request, redirect, flash
 
+from clickai_cache import BoundedCache
+
 logger = logging.getLogger(__name__)
 
 # Module-level reference to db — set during register
@@ -147,6 +155,9 @@ def log_allocation(
             "status": "active",
             "created_at": _now()
         }
+        # No "action" here: ALLOCATION_REVERSAL_SQL's trigger promotes it from
+        # extra on insert, and before that migration the column is not there
+        # (sending it would cost every log a 400 and a retry)
         
         success, err = _db.save("allocation_log", record)
         
@@ -171,6 +182,152 @@ def log_allocation(
         return False
 
 
+# ═══════════════════════════════════════════════════════════════════════════════
+# REVERSAL INDEX - "what was reversed / refunded" as one filtered read
+# ═══════════════════════════════════════════════════════════════════════════════
+
+# extra.action of the entries that reverse a document, and the table that
+# document lives in
+REVERSAL_ACTIONS = {"invoice_reverse": "invoices", "pos_refund": "sales"}
+
+# Businesses whose allocation_log has the action column and no row still
+# waiting for the backfill. A stale False only means a slower, still-correct read.
+_INDEX_READY = BoundedCache("allocation_reversal_ready", ttl=300, max_entries=5000,
+                            max_bytes=1024 * 1024)
+
+
+def allocation_extra(row) -> dict:
+    """allocation_log.extra as a dict (it is stored as JSON text or jsonb)."""
+    x = row.get("extra", "{}")
+    if isinstance(x, str):
+        try:
+            return json.loads(x) if x else {}
+        except Exception:
+            return {}
+    return x if isinstance(x, dict) else {}
+
+
+def _chunks(values, size: int = 100) -> list:
+    values = sorted({str(v) for v in values if v})
+    return [values[i:i + size] for i in range(0, len(values), size)]
+
+
+def reversal_index_ready(db, business_id) -> bool:
+    """True once ALLOCATION_REVERSAL_SQL has run and backfilled this business."""
+    ready = _INDEX_READY.get(business_id)
+    if ready is None:
+        try:
+            ready = not list(db.iter_rows("allocation_log", {"business_id": business_id,
+                                                             "action": ("is", None)},
+                                          select="id", limit=1, strict=True))
+        except RuntimeError:
+            ready = False   # no action column yet (HTTP 400) or the probe failed
+        _INDEX_READY.set(business_id, ready)
+    return ready
+
+
+def reversal_entries(db, business_id, source_ids=None, select: str = "*",
+                     strict: bool = False) -> list:
+    """allocation_log rows that reverse an invoice (invoice_reverse) or refund
+    a POS sale (pos_refund). Once the reversal index is ready this reads just
+    those rows; until then every entry's extra is parsed here.
+    source_ids: only these documents (chunked source_id IN reads).
+    strict: raise on a failed read instead of returning what was read."""
+    if select != "*":
+        select = ",".join(dict.fromkeys(select.split(",") + ["source_table", "source_id", "extra"]))
+    flt = {"business_id": business_id}
+    if reversal_index_ready(db, business_id):
+        flt["action"] = ("in", sorted(REVERSAL_ACTIONS))
+    if source_ids is None:
+        reads = [flt]
+    else:
+        reads = [dict(flt, source_id=("in", chunk)) for chunk in _chunks(source_ids)]
+    out = []
+    for f in reads:
+        for al in db.iter_rows("allocation_log", f, select=select, strict=strict):
+            action = allocation_extra(al).get("action", "")
+            if al.get("source_id") and REVERSAL_ACTIONS.get(action) == al.get("source_table"):
+                out.append(al)
+    return out
+
+
+def reversed_sources(db, business_id, source_ids=None, strict: bool = False) -> tuple:
+    """(reversed invoice ids, refunded sale ids) from the reversal entries."""
+    reversed_invoices, refunded_sales = set(), set()
+    for al in reversal_entries(db, business_id, source_ids,
+                               select="source_id,source_table,extra", strict=strict):
+        if al["source_table"] == "invoices":
+            reversed_invoices.add(al["source_id"])
+        else:
+            refunded_sales.add(al["source_id"])
+    return reversed_invoices, refunded_sales
+
+
+def reversed_references(db, business_id, refs=None, strict: bool = False) -> set:
+    """References whose every allocation is status='reversed'. Without refs,
+    the reversed rows are read first (partial index on status) and then only
+    those references are checked for a surviving active allocation."""
+    if refs is None:
+        refs = {(a.get("reference") or "").strip()
+                for a in db.iter_rows("allocation_log", {"business_id": business_id, "status": "reversed"},
+                                      select="reference", strict=strict)}
+    reversed_refs, active_refs = set(), set()
+    for chunk in _chunks(refs):
+        for a in db.iter_rows("allocation_log", {"business_id": business_id, "reference": ("in", chunk)},
+                              select="reference,status", strict=strict):
+            ref = (a.get("reference") or "").strip()
+            if ref:
+                (reversed_refs if (a.get("status") or "") == "reversed" else active_refs).add(ref)
+    return reversed_refs - active_refs
+
+
+# ==============================================================================
+# SQL: Reversal index (run once in Supabase)
+# Promotes extra->>'action' to a column, backfills it, and indexes the
+# reversal / refund entries and the reversed references.
+# ==============================================================================
+
+ALLOCATION_REVERSAL_SQL = """
+ALTER TABLE allocation_log ADD COLUMN IF NOT EXISTS action TEXT;
+
+-- extra is JSON text on older rows; a row whose extra will not parse has no action
+CREATE OR REPLACE FUNCTION allocation_log_action(extra_text TEXT) RETURNS TEXT
+LANGUAGE plpgsql IMMUTABLE AS $$
+BEGIN
+    RETURN COALESCE((extra_text::jsonb) ->> 'action', '');
+EXCEPTION WHEN others THEN
+    RETURN '';
+END $$;
+
+CREATE OR REPLACE FUNCTION allocation_log_set_action() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.action := allocation_log_action(NEW.extra::text);
+    RETURN NEW;
+END $$;
+
+DROP TRIGGER IF EXISTS allocation_log_action_trg ON allocation_log;
+CREATE TRIGGER allocation_log_action_trg
+    BEFORE INSERT OR UPDATE OF extra ON allocation_log
+    FOR EACH ROW EXECUTE FUNCTION allocation_log_set_action();
+
+-- Backfill ('' = no action; NULL = not backfilled yet, so readers keep scanning)
+UPDATE allocation_log SET action = allocation_log_action(extra::text) WHERE action IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_allocation_log_reversals
+    ON allocation_log (business_id, action, source_table, source_id)
+    WHERE action IN ('invoice_reverse', 'pos_refund');
+CREATE INDEX IF NOT EXISTS idx_allocation_log_reversed_refs
+    ON allocation_log (business_id, reference)
+    WHERE status = 'reversed';
+-- Stays empty once backfilled: the readiness probe is an index lookup
+CREATE INDEX IF NOT EXISTS idx_allocation_log_action_pending
+    ON allocation_log (business_id) WHERE action IS NULL;
+
+NOTIFY pgrst, 'reload schema';
+"""
+
+
 def _try_auto_link(business_id: str, new_id: str, match_key: str, new_type: str, new_amount: float):
     """
     Try to find and link a partner allocation entry.
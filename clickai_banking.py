@@ -194,35 +194,14 @@ def register_banking_routes(app, db, login_required, Auth, render_page,
     """Register all Banking routes with the Flask app."""
 
     def _fetch_all_bank_txns(biz_id):
-        """Fetch ALL bank transactions for a business, NEWEST FIRST, paging past any
-        Supabase/PostgREST max-rows cap (often 1000). Plain db.get sends no ORDER BY,
-        so a capped response returns the OLDEST rows in physical order — which silently
-        drops the most recent month once the table grows past the cap. This pages
-        explicitly with order=date.desc so the latest transactions are always included.
-        Falls back to db.get on any error so the page never breaks."""
+        """Fetch ALL bank transactions for a business, NEWEST FIRST. db.get pages
+        past Supabase's 1000-row cap with keyset reads on (date, id), so if the
+        50k read ceiling is ever reached it is the OLDEST rows that drop off,
+        never the most recent month."""
         if not biz_id:
             return []
-        try:
-            rows = []
-            page_size = 1000
-            offset = 0
-            for _ in range(50):  # hard safety ceiling: up to 50k rows
-                url = (f"{db.url}/rest/v1/bank_transactions"
-                       f"?select=*&business_id=eq.{biz_id}"
-                       f"&order=date.desc.nullslast&limit={page_size}&offset={offset}")
-                resp = requests.get(url, headers=db.headers, timeout=20)
-                if resp.status_code != 200:
-                    logger.warning(f"[BANKING] paged fetch HTTP {resp.status_code}; falling back to db.get")
-                    return db.get("bank_transactions", {"business_id": biz_id}) or []
-                batch = resp.json() or []
-                rows.extend(batch)
-                if len(batch) < page_size:
-                    break
-                offset += page_size
-            return rows
-        except Exception as _e:
-            logger.warning(f"[BANKING] paged fetch failed ({_e}); falling back to db.get")
-            return db.get("bank_transactions", {"business_id": biz_id}) or []
+        return db.get("bank_transactions", {"business_id": biz_id},
+                      order="date.desc.nullslast") or []
 
     @app.route("/banking")
     @login_required
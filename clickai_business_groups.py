@@ -18,7 +18,6 @@ Then register routes:
 
 import logging
 import uuid
-import requests
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
@@ -252,7 +251,9 @@ class BusinessGroupManager:
 
     @staticmethod
     def _get_business_stats(db, business_id):
-        """Get summary stats for one business using raw REST queries."""
+        """Get summary stats for one business. Totals are summed by Postgres
+        (db.sum_column), so each figure is one small response however many
+        invoices the business has."""
         stats = {
             'revenue_this_month': 0,
             'total_debtors': 0,
@@ -265,71 +266,33 @@ class BusinessGroupManager:
             first_of_month = datetime.now().replace(day=1).strftime('%Y-%m-%d')
 
             # Revenue this month
-            try:
-                url = (f"{db.url}/rest/v1/invoices?select=total_amount"
-                       f"&business_id=eq.{business_id}"
-                       f"&status=eq.posted"
-                       f"&invoice_date=gte.{first_of_month}"
-                       f"&limit=10000")
-                resp = requests.get(url, headers=db.headers, timeout=15)
-                if resp.status_code == 200:
-                    for inv in resp.json():
-                        stats['revenue_this_month'] += float(inv.get('total_amount', 0) or 0)
-            except Exception:
-                pass
+            stats['revenue_this_month'] = db.sum_column('invoices', 'total_amount', {
+                'business_id': business_id, 'status': 'posted',
+                'invoice_date': ('gte', first_of_month)})
 
             # Debtors
-            try:
-                url = (f"{db.url}/rest/v1/invoices?select=balance_due"
-                       f"&business_id=eq.{business_id}"
-                       f"&balance_due=gt.0"
-                       f"&limit=10000")
-                resp = requests.get(url, headers=db.headers, timeout=15)
-                if resp.status_code == 200:
-                    for inv in resp.json():
-                        stats['total_debtors'] += float(inv.get('balance_due', 0) or 0)
-            except Exception:
-                pass
+            stats['total_debtors'] = db.sum_column('invoices', 'balance_due', {
+                'business_id': business_id, 'balance_due': ('gt', 0)})
 
             # Creditors
-            try:
-                url = (f"{db.url}/rest/v1/supplier_invoices?select=balance_due"
-                       f"&business_id=eq.{business_id}"
-                       f"&balance_due=gt.0"
-                       f"&limit=10000")
-                resp = requests.get(url, headers=db.headers, timeout=15)
-                if resp.status_code == 200:
-                    for inv in resp.json():
-                        stats['total_creditors'] += float(inv.get('balance_due', 0) or 0)
-            except Exception:
-                pass
+            stats['total_creditors'] = db.sum_column('supplier_invoices', 'balance_due', {
+                'business_id': business_id, 'balance_due': ('gt', 0)})
 
-            # Stock Value
+            # Stock Value - qty x cost per item, so folded here from a streamed
+            # two-column read rather than summed on the server
             try:
-                url = (f"{db.url}/rest/v1/stock_items?select=qty_on_hand,cost_price"
-                       f"&business_id=eq.{business_id}"
-                       f"&qty_on_hand=gt.0"
-                       f"&limit=10000")
-                resp = requests.get(url, headers=db.headers, timeout=15)
-                if resp.status_code == 200:
-                    for s in resp.json():
-                        qty = float(s.get('qty_on_hand', 0) or 0)
-                        cost = float(s.get('cost_price', 0) or 0)
-                        stats['total_stock_value'] += qty * cost
+                for s in db.iter_rows('stock_items', {'business_id': business_id,
+                                                      'qty_on_hand': ('gt', 0)},
+                                      select='qty_on_hand,cost_price'):
+                    qty = float(s.get('qty_on_hand', 0) or 0)
+                    cost = float(s.get('cost_price', 0) or 0)
+                    stats['total_stock_value'] += qty * cost
             except Exception:
                 pass
 
             # Bank Balance
-            try:
-                url = (f"{db.url}/rest/v1/bank_accounts?select=current_balance"
-                       f"&business_id=eq.{business_id}"
-                       f"&limit=100")
-                resp = requests.get(url, headers=db.headers, timeout=15)
-                if resp.status_code == 200:
-                    for b in resp.json():
-                        stats['total_bank_balance'] += float(b.get('current_balance', 0) or 0)
-            except Exception:
-                pass
+            stats['total_bank_balance'] = db.sum_column('bank_accounts', 'current_balance',
+                                                        {'business_id': business_id})
 
         except Exception as e:
             logger.error(f"[BIZ-GROUP] Stats error for {business_id}: {e}")
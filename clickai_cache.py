@@ -0,0 +1,534 @@
+"""
+ClickAI Shared Cache
+=====================
+One cache for every gunicorn worker on the machine.
+
+Each worker used to keep its own dicts (_stock_cache, Auth._mem, the dashboard
+and banner caches). So every worker did its own cold load of a 7,000-item
+stock list, and a .pop() in one worker left stale data in all the others.
+
+SharedCache keeps the same dict-ish interface (get / [key] = value / pop) but
+stores entries in a backend every worker can see:
+
+  sqlite  (default) - a WAL-mode SQLite file on local disk. No outside service.
+  memory            - a plain per-process dict (the old behaviour; tests/dev).
+
+Pick with CLICKAI_CACHE_BACKEND, file location with CLICKAI_CACHE_PATH.
+
+Versioned keys:
+  Every key carries a version number. pop()/invalidate() bumps it in the shared
+  store, so every worker misses on its next read. A loader that reads
+  version(key) BEFORE going to Supabase and then calls set(..., version=v)
+  is refused if someone invalidated the key mid-load - the stale snapshot
+  never lands in the cache.
+
+Local copy:
+  Each worker keeps the last value it decoded per key together with a stamp.
+  A read only re-decodes when the stamp in the shared store changed, so a
+  typeahead keystroke against a cached stock list costs one tiny SELECT.
+
+Values are stored as JSON (tuples come back as lists). Any backend error is
+logged and treated as a miss - the cache can never take a page down.
+
+Bounded caches:
+  Worker RSS must stay flat on a 1GB machine, so every in-process cache is a
+  BoundedCache: LRU order, a TTL, and a cap on entries AND approximate bytes.
+  Each one registers by name; cache_stats() reports hits, misses, evictions
+  and size for all of them (shown at /api/health/caches). A SharedCache's
+  local copy is a BoundedCache too.
+
+Usage:
+    from clickai_cache import SharedCache, BoundedCache
+    _stock_cache = SharedCache("stock", ttl=30)
+    _gl_map_cache = BoundedCache("gl_map", ttl=300, max_entries=500)
+"""
+
+import os
+import json
+import time
+import uuid
+import sys
+import sqlite3
+import logging
+import tempfile
+import threading
+from itertools import islice
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+CACHE_BACKEND = os.environ.get("CLICKAI_CACHE_BACKEND", "sqlite").strip().lower()
+CACHE_PATH = os.environ.get("CLICKAI_CACHE_PATH") or os.path.join(
+    tempfile.gettempdir(), "clickai_cache.sqlite3")
+
+# Invalidation tombstones are kept this long so their version survives a purge
+_TOMBSTONE_KEEP = 3600
+_PURGE_EVERY = 500   # writes between sweeps of expired rows
+
+
+# ---------------------------------------------------------------------------
+# Bounded in-process caches + registry
+# ---------------------------------------------------------------------------
+
+CACHES = {}   # name -> BoundedCache / SharedCache, for cache_stats()
+_SAMPLE = 32  # containers larger than this are sized from a sample
+_SWEEP_EVERY = 64  # sets between sweeps of expired entries
+
+
+def approx_size(obj, _depth=0) -> int:
+    """Rough deep size in bytes. Big lists/dicts are sized from their first
+    few members, so a 7,000-item stock list costs microseconds, not a walk."""
+    size = sys.getsizeof(obj)
+    if _depth > 4:
+        return size
+    if isinstance(obj, dict):
+        n = len(obj)
+        if not n:
+            return size
+        part = sum(approx_size(k, _depth + 1) + approx_size(v, _depth + 1)
+                   for k, v in islice(obj.items(), _SAMPLE))
+        return size + part * n // min(n, _SAMPLE)
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        n = len(obj)
+        if not n:
+            return size
+        part = sum(approx_size(v, _depth + 1) for v in islice(obj, _SAMPLE))
+        return size + part * n // min(n, _SAMPLE)
+    return size
+
+
+class BoundedCache:
+    """Dict-style LRU cache with a TTL and entry/byte caps. Thread-safe.
+
+    ttl=None never expires by age (LRU and the caps still apply)."""
+
+    def __init__(self, name: str, ttl=None, max_entries: int = 1000,
+                 max_bytes: int = 16 * 1024 * 1024, register: bool = True):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()   # key -> (expires, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+        self._sets = 0
+        if register:
+            CACHES[name] = self
+
+    def _drop(self, key):
+        _exp, size, _v = self._data.pop(key)
+        self._bytes -= size
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry[0] is not None and entry[0] < time.time():
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        size = approx_size(value)
+        expires = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            if size > self.max_bytes:      # would evict everything else - don't keep it
+                self.evictions += 1
+                return value
+            self._data[key] = (expires, size, value)
+            self._bytes += size
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._data)))
+                self.evictions += 1
+            self._sets += 1
+        if self._sets % _SWEEP_EVERY == 0:
+            self.purge_expired()
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            value = self._data[key][2]
+            self._drop(key)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def purge_expired(self) -> int:
+        now = time.time()
+        with self._lock:
+            dead = [k for k, e in self._data.items() if e[0] is not None and e[0] < now]
+            for k in dead:
+                self._drop(k)
+            self.expirations += len(dead)
+        return len(dead)
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        if self.pop(key, _MISSING) is _MISSING:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        looks = self.hits + self.misses
+        return {
+            "name": self.name, "kind": "local",
+            "entries": len(self._data), "max_entries": self.max_entries,
+            "bytes": self._bytes, "max_bytes": self.max_bytes, "ttl": self.ttl,
+            "hits": self.hits, "misses": self.misses,
+            "evictions": self.evictions, "expirations": self.expirations,
+            "hit_rate": round(self.hits / looks, 3) if looks else None,
+        }
+
+
+def cache_stats() -> dict:
+    """Stats for every registered cache in this worker, plus totals."""
+    caches = []
+    for name in sorted(CACHES):
+        try:
+            caches.append(CACHES[name].stats())
+        except Exception as e:
+            caches.append({"name": name, "error": str(e)})
+    return {
+        "pid": os.getpid(),
+        "backend": getattr(get_backend(), "name", "?"),
+        "entries": sum(c.get("entries", 0) for c in caches),
+        "bytes": sum(c.get("bytes", 0) for c in caches),
+        "evictions": sum(c.get("evictions", 0) for c in caches),
+        "caches": caches,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Shared (cross-worker) store
+# ---------------------------------------------------------------------------
+
+class MemoryBackend:
+    """Per-process store with the same semantics as SQLiteBackend."""
+
+    name = "memory"
+
+    def __init__(self):
+        self._rows = {}   # (ns, key) -> [ver, stamp, expires, payload]
+        self._lock = threading.Lock()
+
+    def read(self, ns, key, known_stamp=None):
+        with self._lock:
+            row = self._rows.get((ns, key))
+            if not row or row[1] is None or row[2] < time.time():
+                return None
+            ver, stamp, _exp, payload = row
+        return ver, stamp, (None if stamp == known_stamp else payload)
+
+    def write(self, ns, key, payload, ttl, version=None):
+        stamp = uuid.uuid4().hex
+        with self._lock:
+            row = self._rows.get((ns, key))
+            cur = row[0] if row else 0
+            if version is not None and version != cur:
+                return None
+            self._rows[(ns, key)] = [cur, stamp, time.time() + ttl, payload]
+        return stamp
+
+    def invalidate(self, ns, key):
+        with self._lock:
+            row = self._rows.get((ns, key))
+            self._rows[(ns, key)] = [(row[0] if row else 0) + 1, None,
+                                     time.time() + _TOMBSTONE_KEEP, None]
+
+    def clear(self, ns):
+        with self._lock:
+            for (n, k), row in list(self._rows.items()):
+                if n == ns:
+                    self._rows[(n, k)] = [row[0] + 1, None, time.time() + _TOMBSTONE_KEEP, None]
+
+    def version(self, ns, key):
+        with self._lock:
+            row = self._rows.get((ns, key))
+        return row[0] if row else 0
+
+
+class SQLiteBackend:
+    """Shared store in one SQLite file. One connection per thread per process
+    (gunicorn preloads then forks, so a connection opened in the master is
+    never reused by a worker)."""
+
+    name = "sqlite"
+
+    # A rowid table: in a WITHOUT ROWID one a key lookup reads the whole record,
+    # so a stamp check on a 40MB stock list cost ~25ms instead of ~5us.
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            ns      TEXT NOT NULL,
+            k       TEXT NOT NULL,
+            ver     INTEGER NOT NULL DEFAULT 0,
+            stamp   TEXT,
+            expires REAL NOT NULL,
+            v       TEXT,
+            PRIMARY KEY (ns, k)
+        )
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        # Create the file owner-only before SQLite opens it
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        os.close(fd)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("DROP TABLE IF EXISTS kv")     # the WITHOUT ROWID layout - only a cache
+        conn.execute(self._SCHEMA)
+
+    def _conn(self):
+        pid = os.getpid()
+        if getattr(self._local, "pid", None) != pid:
+            conn = sqlite3.connect(self.path, timeout=2.0, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, pid
+        return self._local.conn
+
+    def read(self, ns, key, known_stamp=None):
+        row = self._conn().execute(
+            "SELECT ver, stamp, expires, CASE WHEN stamp = ? THEN NULL ELSE v END "
+            "FROM entries WHERE ns = ? AND k = ?", (known_stamp, ns, key)).fetchone()
+        if not row or row[1] is None or row[2] < time.time():
+            return None
+        return row[0], row[1], row[3]
+
+    def write(self, ns, key, payload, ttl, version=None):
+        stamp = uuid.uuid4().hex
+        conn = self._conn()
+        if version is None:
+            cur = conn.execute(
+                "INSERT INTO entries (ns, k, ver, stamp, expires, v) VALUES (?, ?, 0, ?, ?, ?) "
+                "ON CONFLICT (ns, k) DO UPDATE SET stamp = excluded.stamp, "
+                "expires = excluded.expires, v = excluded.v",
+                (ns, key, stamp, time.time() + ttl, payload))
+        else:
+            cur = conn.execute(
+                "INSERT INTO entries (ns, k, ver, stamp, expires, v) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (ns, k) DO UPDATE SET stamp = excluded.stamp, "
+                "expires = excluded.expires, v = excluded.v WHERE entries.ver = excluded.ver",
+                (ns, key, version, stamp, time.time() + ttl, payload))
+        self._writes += 1
+        if self._writes % _PURGE_EVERY == 0:
+            conn.execute("DELETE FROM entries WHERE expires < ?", (time.time(),))
+        return stamp if cur.rowcount else None
+
+    def invalidate(self, ns, key):
+        self._conn().execute(
+            "INSERT INTO entries (ns, k, ver, stamp, expires, v) VALUES (?, ?, 1, NULL, ?, NULL) "
+            "ON CONFLICT (ns, k) DO UPDATE SET ver = entries.ver + 1, stamp = NULL, v = NULL, "
+            "expires = excluded.expires",
+            (ns, key, time.time() + _TOMBSTONE_KEEP))
+
+    def clear(self, ns):
+        self._conn().execute(
+            "UPDATE entries SET ver = ver + 1, stamp = NULL, v = NULL, expires = ? WHERE ns = ?",
+            (time.time() + _TOMBSTONE_KEEP, ns))
+
+    def version(self, ns, key):
+        row = self._conn().execute(
+            "SELECT ver FROM entries WHERE ns = ? AND k = ?", (ns, key)).fetchone()
+        return row[0] if row else 0
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """The process-wide backend, created on first use. Falls back to memory
+    (per-worker, the old behaviour) if the SQLite file can't be opened."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if CACHE_BACKEND == "memory":
+                    _backend = MemoryBackend()
+                else:
+                    try:
+                        _backend = SQLiteBackend(CACHE_PATH)
+                    except Exception as e:
+                        logger.warning(f"[CACHE] SQLite cache unavailable ({e}) - per-worker memory cache")
+                        _backend = MemoryBackend()
+    return _backend
+
+
+class SharedCache:
+    """A named, shared cache. Reads return None on miss, expiry or any error."""
+
+    def __init__(self, namespace: str, ttl: float, backend=None,
+                 max_entries: int = 1000, max_bytes: int = 16 * 1024 * 1024,
+                 register: bool = True):
+        self.namespace = namespace
+        self.ttl = ttl
+        self._backend = backend
+        # key -> (stamp, value): the last value this worker decoded
+        self._local = BoundedCache(namespace, ttl=ttl, max_entries=max_entries,
+                                   max_bytes=max_bytes, register=False)
+        self.hits = self.misses = self.decodes = 0
+        if register:
+            CACHES[namespace] = self
+
+    @property
+    def backend(self):
+        return self._backend or get_backend()
+
+    def get(self, key, default=None):
+        key = str(key)
+        known = self._local.get(key)
+        try:
+            hit = self.backend.read(self.namespace, key, known[0] if known else None)
+        except Exception as e:
+            logger.debug(f"[CACHE] {self.namespace} read failed: {e}")
+            self.misses += 1
+            return default
+        if hit is None:
+            if known:
+                self._local.pop(key, None)
+            self.misses += 1
+            return default
+        _ver, stamp, payload = hit
+        if payload is None and known and known[0] == stamp:
+            self.hits += 1
+            return known[1]
+        try:
+            value = json.loads(payload)
+        except Exception:
+            self.misses += 1
+            return default
+        self._local.set(key, (stamp, value))
+        self.hits += 1
+        self.decodes += 1
+        return value
+
+    def get_stamped(self, key, known_stamp=None):
+        """(stamp, value), or (None, None) on a miss. For callers that keep
+        something built from the value: when the stored stamp is still
+        known_stamp the payload is neither fetched nor decoded and value is
+        None - so it stays cheap when the value is too big for the local copy."""
+        key = str(key)
+        known = self._local.get(key)
+        try:
+            hit = self.backend.read(self.namespace, key,
+                                    known_stamp or (known[0] if known else None))
+        except Exception as e:
+            logger.debug(f"[CACHE] {self.namespace} read failed: {e}")
+            self.misses += 1
+            return None, None
+        if hit is None:
+            if known:
+                self._local.pop(key, None)
+            self.misses += 1
+            return None, None
+        _ver, stamp, payload = hit
+        if payload is None:
+            self.hits += 1
+            return stamp, (None if stamp == known_stamp else known[1])
+        try:
+            value = json.loads(payload)
+        except Exception:
+            self.misses += 1
+            return None, None
+        self._local.set(key, (stamp, value))
+        self.hits += 1
+        self.decodes += 1
+        return stamp, value
+
+    def set(self, key, value, version=None):
+        """Store value. With version=, only if the key was not invalidated since
+        that version was read. Returns the new stamp (truthy) if stored, else None."""
+        key = str(key)
+        try:
+            payload = json.dumps(value, default=str, separators=(",", ":"))
+            stamp = self.backend.write(self.namespace, key, payload, self.ttl, version)
+        except Exception as e:
+            logger.debug(f"[CACHE] {self.namespace} write failed: {e}")
+            return None
+        if stamp is None:
+            return None
+        self._local.set(key, (stamp, value))
+        return stamp
+
+    def version(self, key) -> int:
+        try:
+            return self.backend.version(self.namespace, str(key))
+        except Exception:
+            return -1   # never matches, so a guarded set() is skipped
+
+    def invalidate(self, key):
+        """Drop key in every worker."""
+        key = str(key)
+        self._local.pop(key, None)
+        try:
+            self.backend.invalidate(self.namespace, key)
+        except Exception as e:
+            logger.warning(f"[CACHE] {self.namespace} invalidate failed: {e}")
+
+    def clear(self):
+        """Drop every key in this namespace, in every worker."""
+        self._local.clear()
+        try:
+            self.backend.clear(self.namespace)
+        except Exception as e:
+            logger.warning(f"[CACHE] {self.namespace} clear failed: {e}")
+
+    # dict-style access so existing call sites read the same
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def pop(self, key, default=None):
+        self.invalidate(key)
+        return default
+
+    def stats(self) -> dict:
+        local = self._local.stats()
+        looks = self.hits + self.misses
+        return {
+            **local, "name": self.namespace, "kind": "shared",
+            "hits": self.hits, "misses": self.misses, "decodes": self.decodes,
+            "hit_rate": round(self.hits / looks, 3) if looks else None,
+        }
+
+
+_MISSING = object()
@@ -0,0 +1,364 @@
+"""
+ClickAI Customer Ledger Module
+===============================
+A maintained per-customer running ledger, so debtor balances are read, not
+recomputed.
+
+_customer_ledger_items() is the one definition of customer debt: it reads
+every invoice, account sale, receipt and credit note in the business and
+unpacks allocation_log to drop reversals. The debtors list, aging, statements
+and customer view all went through it on every page view. customer_ledgers
+keeps its output per customer - the items and their balance - and only the
+customers a write touched are rebuilt:
+
+  - Triggers on invoices, sales, receipts, credit_notes, allocation_log and
+    customers (CUSTOMER_LEDGER_SQL) mark the touched customer dirty in the
+    same transaction as the write - the invoicing, POS, receipt, credit-note
+    and banking paths all land there, whichever module made the write. An
+    unlinked receipt marks its customer name, an allocation its reference.
+  - The next read (sync) rebuilds just the dirty customers with
+    _customer_ledger_items(customer_ids=...), which reads only their
+    documents, then serves the stored rows.
+  - reconcile() recomputes the whole business the old way and compares;
+    ?repair=1 rewrites any customer that differs.
+
+A business is only read from customer_ledgers once rebuilt; until then (or
+if a sync fails) callers recompute as before, so balances are right either way.
+
+Import in clickai.py with try/except:
+    try:
+        from clickai_customer_ledger import (register_customer_ledger_routes, ledger_balances,
+                                             ledger_items, ledger_balance)
+        CUSTOMER_LEDGER_LOADED = True
+    except ImportError:
+        CUSTOMER_LEDGER_LOADED = False
+"""
+
+import logging
+
+from flask import jsonify, request
+
+from clickai_cache import BoundedCache
+
+logger = logging.getLogger(__name__)
+
+# Businesses whose ledger has been rebuilt. A stale False only means a
+# slower, still-correct recompute for a few minutes.
+_READY = BoundedCache("customer_ledger_ready", ttl=300, max_entries=5000, max_bytes=1024 * 1024)
+
+WRITE_BATCH = 200   # customer_ledgers rows per save_batch request
+
+
+def is_ready(db, biz_id) -> bool:
+    ready = _READY.get(biz_id)
+    if ready is None:
+        ready = _READY.set(biz_id, bool(db.get("customer_ledger_state", {"business_id": biz_id, "ready": True},
+                                               limit=1, select="id")))
+    return ready
+
+
+def _norm(name) -> str:
+    return (name or "").upper().strip()
+
+
+def _balance(rows) -> float:
+    """Summed in item order, exactly as calc_all_customer_balances does."""
+    balance = 0.0
+    for r in rows:
+        balance += r["debit"] - r["credit"]
+    return round(balance, 2)
+
+
+def _record(biz_id, cid, rows):
+    return {"id": f"{biz_id}:{cid}", "business_id": biz_id, "customer_id": cid,
+            "balance": _balance(rows), "item_count": len(rows), "items": rows}
+
+
+def _write(db, records):
+    for i in range(0, len(records), WRITE_BATCH):
+        ok, err = db.save_batch("customer_ledgers", records[i:i + WRITE_BATCH])
+        if not ok:
+            raise RuntimeError(f"customer_ledgers write failed: {err}")
+
+
+def refresh(db, biz_id, customer_ids) -> int:
+    """Rebuild these customers' rows from their own documents."""
+    import clickai as _main
+    ids = sorted({str(c) for c in customer_ids if c})
+    if not ids:
+        return 0
+    items = _main._customer_ledger_items(biz_id, customer_ids=ids, strict=True)
+    _write(db, [_record(biz_id, cid, items.get(cid, [])) for cid in ids])
+    return len(ids)
+
+
+def _resolve(db, biz_id, keys) -> set:
+    """Dirty keys -> customer ids. 'name:X' is an unlinked receipt's customer
+    name, 'ref:R' an allocation reference that may un-reverse a receipt."""
+    ids = {k for k in keys if ":" not in k}
+    names = {k[5:] for k in keys if k.startswith("name:")}
+    refs = sorted({k[4:] for k in keys if k.startswith("ref:")})
+    if not names and not refs:
+        return ids
+    by_name = {}
+    for c in db.iter_rows("customers", {"business_id": biz_id}, select="id,name", strict=True):
+        by_name.setdefault(_norm(c.get("name")), set()).add(str(c.get("id")))
+    for i in range(0, len(refs), 100):
+        for r in db.iter_rows("receipts", {"business_id": biz_id, "reference": ("in", refs[i:i + 100])},
+                              select="customer_id,customer_name", strict=True):
+            if r.get("customer_id"):
+                ids.add(str(r["customer_id"]))
+            else:
+                names.add(_norm(r.get("customer_name")))
+    for n in names:
+        ids |= by_name.get(n, set())
+    return ids
+
+
+def sync(db, biz_id) -> int:
+    """Rebuild every customer marked dirty since the last sync. Returns how many."""
+    dirty = list(db.iter_rows("customer_ledger_dirty", {"business_id": biz_id},
+                              select="customer_key,seq", strict=True))
+    if not dirty:
+        return 0
+    keys = sorted({d["customer_key"] for d in dirty})
+    done = refresh(db, biz_id, _resolve(db, biz_id, keys))
+    # Only clear what this pass saw: a key marked again meanwhile has a newer seq
+    top = max(int(d.get("seq") or 0) for d in dirty)
+    for i in range(0, len(keys), 100):
+        db.delete_where("customer_ledger_dirty", {"business_id": biz_id, "customer_key": ("in", keys[i:i + 100]),
+                                                  "seq": ("lte", top)})
+    return done
+
+
+def _synced(db, biz_id) -> bool:
+    """Ready and caught up with every write; False means recompute."""
+    if not biz_id or not is_ready(db, biz_id):
+        return False
+    try:
+        sync(db, biz_id)
+        return True
+    except Exception as e:
+        logger.error(f"[CUSTOMER LEDGER] Sync failed for {biz_id} - recomputing: {e}")
+        return False
+
+
+def _stored(db, biz_id, select, **flt):
+    """customer_ledgers rows with items, or None if the read failed."""
+    try:
+        return list(db.iter_rows("customer_ledgers", {"business_id": biz_id, "item_count": ("gt", 0), **flt},
+                                 select=select, strict=True))
+    except Exception as e:
+        logger.error(f"[CUSTOMER LEDGER] Read failed for {biz_id} - recomputing: {e}")
+        return None
+
+
+def ledger_items(db, biz_id, asat: str = None):
+    """_customer_ledger_items() output read from the ledger, or None if this
+    business has none (the caller recomputes)."""
+    rows = _stored(db, biz_id, "customer_id,items") if _synced(db, biz_id) else None
+    if rows is None:
+        return None
+    cut = (asat or "")[:10]
+    out = {}
+    for row in rows:
+        kept = [r for r in (row.get("items") or [])
+                if not cut or not (r.get("date") or "")[:10] or (r.get("date") or "")[:10] <= cut]
+        if kept:
+            out[row["customer_id"]] = kept
+    return out
+
+
+def ledger_balances(db, biz_id, asat: str = None):
+    """{customer_id: balance} from the ledger, or None (caller recomputes).
+    Without asat this is one narrow read of the stored balances."""
+    if asat:
+        items = ledger_items(db, biz_id, asat)
+        return None if items is None else {cid: _balance(rows) for cid, rows in items.items()}
+    rows = _stored(db, biz_id, "customer_id,balance") if _synced(db, biz_id) else None
+    if rows is None:
+        return None
+    return {r["customer_id"]: round(float(r.get("balance") or 0), 2) for r in rows}
+
+
+def ledger_balance(db, biz_id, customer_id):
+    """One customer's balance from the ledger, or None (caller recomputes)."""
+    if not customer_id:
+        return None
+    rows = _stored(db, biz_id, "balance", customer_id=customer_id) if _synced(db, biz_id) else None
+    if rows is None:
+        return None
+    return round(float(rows[0].get("balance") or 0), 2) if rows else 0.0
+
+
+def rebuild(db, biz_id) -> int:
+    """Recompute every customer from scratch and switch the business over."""
+    import clickai as _main
+    state = {"id": biz_id, "business_id": biz_id, "ready": False, "customers": 0}
+    ok, err = db.save_batch("customer_ledger_state", [dict(state)])   # start collecting dirty marks
+    if not ok:
+        raise RuntimeError(f"customer_ledger_state write failed: {err}")
+    _READY.set(biz_id, False)
+    db.delete_where("customer_ledger_dirty", {"business_id": biz_id})
+    items = _main._customer_ledger_items(biz_id, strict=True)
+    stale = {str(r.get("customer_id")) for r in db.iter_rows("customer_ledgers", {"business_id": biz_id},
+                                                              select="customer_id", strict=True)}
+    _write(db, [_record(biz_id, cid, rows) for cid, rows in items.items()] +
+               [_record(biz_id, cid, []) for cid in sorted(stale - set(items))])
+    ok, err = db.save_batch("customer_ledger_state", [{**state, "ready": True, "customers": len(items),
+                                                       "rebuilt_at": _main.now()}])
+    if not ok:
+        raise RuntimeError(f"customer_ledger_state write failed: {err}")
+    _READY.set(biz_id, True)
+    logger.info(f"[CUSTOMER LEDGER] Rebuilt {biz_id}: {len(items)} customers")
+    return len(items)
+
+
+def reconcile(db, biz_id, repair: bool = False) -> dict:
+    """Compare the ledger with a full recompute. With repair, rewrite every
+    customer that differs."""
+    import clickai as _main
+    if not is_ready(db, biz_id):
+        return {"ok": False, "ready": False, "mismatches": [], "mismatch_count": 0}
+    sync(db, biz_id)
+    expected = {cid: _balance(rows)
+                for cid, rows in _main._customer_ledger_items(biz_id, strict=True).items()}
+    stored = {r["customer_id"]: round(float(r.get("balance") or 0), 2)
+              for r in db.iter_rows("customer_ledgers", {"business_id": biz_id, "item_count": ("gt", 0)},
+                                    select="customer_id,balance", strict=True)}
+    mismatches = [{"customer_id": cid, "recomputed": expected.get(cid, 0.0), "ledger": stored.get(cid, 0.0)}
+                  for cid in sorted(set(expected) | set(stored))
+                  if abs(expected.get(cid, 0.0) - stored.get(cid, 0.0)) > 0.005
+                  or (cid in expected) != (cid in stored)]
+    repaired = refresh(db, biz_id, [m["customer_id"] for m in mismatches]) if repair and mismatches else 0
+    if mismatches:
+        logger.warning(f"[CUSTOMER LEDGER] {biz_id}: {len(mismatches)} customers differ from recompute"
+                       f"{' - repaired' if repaired else ''}")
+    return {"ok": not mismatches, "ready": True, "customers": len(expected),
+            "mismatches": mismatches[:200], "mismatch_count": len(mismatches), "repaired": repaired}
+
+
+def register_customer_ledger_routes(app, db, login_required, Auth, get_user_role):
+    """Rebuild / reconcile endpoints (owner and admin)."""
+
+    def _biz_or_error():
+        business = Auth.get_current_business()
+        biz_id = business.get("id") if business else None
+        if not biz_id:
+            return None, (jsonify({"success": False, "error": "No business selected"}), 400)
+        if get_user_role() not in ("owner", "admin"):
+            return None, (jsonify({"success": False, "error": "Owner or admin only"}), 403)
+        return biz_id, None
+
+    @app.route("/api/customer-ledger/reconcile", methods=["GET", "POST"])
+    @login_required
+    def api_customer_ledger_reconcile():
+        biz_id, err = _biz_or_error()
+        if err:
+            return err
+        try:
+            return jsonify({"success": True,
+                            **reconcile(db, biz_id, repair=request.args.get("repair") == "1")})
+        except Exception as e:
+            logger.error(f"[CUSTOMER LEDGER] Reconcile failed for {biz_id}: {e}")
+            return jsonify({"success": False, "error": str(e)}), 500
+
+    @app.route("/api/customer-ledger/rebuild", methods=["POST"])
+    @login_required
+    def api_customer_ledger_rebuild():
+        biz_id, err = _biz_or_error()
+        if err:
+            return err
+        try:
+            customers = rebuild(db, biz_id)
+        except Exception as e:
+            logger.error(f"[CUSTOMER LEDGER] Rebuild failed for {biz_id}: {e}")
+            return jsonify({"success": False, "error": str(e),
+                            "hint": "Run CUSTOMER_LEDGER_SQL in Supabase first"}), 500
+        return jsonify({"success": True, "customers": customers, **reconcile(db, biz_id)})
+
+
+# ==============================================================================
+# SQL: Database table creation (run once in Supabase)
+# Then POST /api/customer-ledger/rebuild once per business to switch it over.
+# ==============================================================================
+
+CUSTOMER_LEDGER_SQL = """
+CREATE TABLE IF NOT EXISTS customer_ledgers (
+    id TEXT PRIMARY KEY,                      -- '<business_id>:<customer_id>'
+    business_id TEXT NOT NULL,
+    customer_id TEXT NOT NULL,
+    balance NUMERIC(18,2) DEFAULT 0,
+    item_count INTEGER DEFAULT 0,
+    items JSONB DEFAULT '[]',                 -- _customer_ledger_items() rows
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_customer_ledgers_biz ON customer_ledgers(business_id, customer_id);
+
+CREATE TABLE IF NOT EXISTS customer_ledger_state (
+    id TEXT PRIMARY KEY,                      -- business_id
+    business_id TEXT NOT NULL,
+    ready BOOLEAN DEFAULT FALSE,
+    customers INTEGER DEFAULT 0,
+    rebuilt_at TIMESTAMPTZ,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE SEQUENCE IF NOT EXISTS customer_ledger_dirty_seq;
+CREATE TABLE IF NOT EXISTS customer_ledger_dirty (
+    business_id TEXT NOT NULL,
+    customer_key TEXT NOT NULL,               -- customer id | 'name:<NAME>' | 'ref:<reference>'
+    seq BIGINT NOT NULL,
+    PRIMARY KEY (business_id, customer_key)
+);
+
+CREATE OR REPLACE FUNCTION customer_ledger_mark(p_biz TEXT, p_key TEXT) RETURNS void LANGUAGE sql AS $$
+    INSERT INTO customer_ledger_dirty (business_id, customer_key, seq)
+    SELECT p_biz, p_key, nextval('customer_ledger_dirty_seq')
+     WHERE COALESCE(p_key, '') NOT IN ('', 'name:', 'ref:')
+       AND EXISTS (SELECT 1 FROM customer_ledger_state s WHERE s.business_id = p_biz)
+    ON CONFLICT (business_id, customer_key) DO UPDATE SET seq = EXCLUDED.seq;
+$$;
+
+CREATE OR REPLACE FUNCTION customer_ledger_mark_row(p_table TEXT, j JSONB) RETURNS void
+LANGUAGE plpgsql AS $$
+DECLARE biz TEXT := j->>'business_id';
+BEGIN
+    IF p_table = 'customers' THEN
+        PERFORM customer_ledger_mark(biz, j->>'id');
+        PERFORM customer_ledger_mark(biz, 'name:' || UPPER(TRIM(COALESCE(j->>'name', ''))));
+    ELSIF p_table = 'allocation_log' THEN
+        IF j->>'source_table' = 'invoices' THEN
+            PERFORM customer_ledger_mark(biz, (SELECT customer_id::text FROM invoices WHERE id::text = j->>'source_id'));
+        ELSIF j->>'source_table' = 'sales' THEN
+            PERFORM customer_ledger_mark(biz, (SELECT customer_id::text FROM sales WHERE id::text = j->>'source_id'));
+        END IF;
+        PERFORM customer_ledger_mark(biz, 'ref:' || TRIM(COALESCE(j->>'reference', '')));
+    ELSIF COALESCE(j->>'customer_id', '') <> '' THEN
+        PERFORM customer_ledger_mark(biz, j->>'customer_id');
+    ELSIF p_table = 'receipts' THEN
+        PERFORM customer_ledger_mark(biz, 'name:' || UPPER(TRIM(COALESCE(j->>'customer_name', ''))));
+    END IF;
+END $$;
+
+CREATE OR REPLACE FUNCTION customer_ledger_on_write() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM customer_ledger_mark_row(TG_TABLE_NAME, to_jsonb(OLD));
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM customer_ledger_mark_row(TG_TABLE_NAME, to_jsonb(NEW));
+    END IF;
+    RETURN NULL;
+END $$;
+
+DO $$
+DECLARE t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['invoices', 'sales', 'receipts', 'credit_notes', 'allocation_log', 'customers'] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_customer_ledger ON %I', t);
+        EXECUTE format('CREATE TRIGGER trg_customer_ledger AFTER INSERT OR UPDATE OR DELETE ON %I
+                        FOR EACH ROW EXECUTE FUNCTION customer_ledger_on_write()', t);
+    END LOOP;
+END $$;
+"""
@@ -0,0 +1,287 @@
+"""
+ClickAI GL Balances Module
+===========================
+Per-account, per-month GL totals kept next to the journals table.
+
+The TB and the other account-level reports used to pull every journals row
+and fold it by account_code on each page view. gl_balances holds those totals
+already folded - one row per (business, account_code, period 'YYYY-MM') - so a
+report reads a few hundred rows however long the ledger is.
+
+The table is maintained by a trigger on journals (see GL_BALANCES_SQL): every
+insert, update (date / account moves, the same-id retry in
+create_journal_entry) and delete adjusts the matching row in the same
+transaction, whichever code path wrote the journal. A business is only read
+from gl_balances once it has been rebuilt (gl_balance_state row); until then
+account_totals() sums the journals on the server instead, so reports are
+right either way.
+
+    rebuild(db, biz_id)  - recompute this business's rows from journals
+    verify(db, biz_id)   - compare gl_balances against a full journal fold
+
+Import in clickai.py with try/except:
+    try:
+        from clickai_gl_balances import register_gl_balance_routes, account_totals
+        GL_BALANCES_LOADED = True
+    except ImportError:
+        GL_BALANCES_LOADED = False
+"""
+
+import calendar
+import logging
+from datetime import datetime, timedelta
+
+from flask import jsonify
+
+from clickai_cache import BoundedCache
+
+logger = logging.getLogger(__name__)
+
+# Businesses whose gl_balances have been rebuilt (and so are trigger-maintained).
+# A stale False only means a slower, still-correct read for a few minutes.
+_READY = BoundedCache("gl_balances_ready", ttl=300, max_entries=5000, max_bytes=1024 * 1024)
+
+NO_DATE_PERIOD = "0000-00"   # journals without a date
+
+
+def period_of(date) -> str:
+    """'2026-03-14' -> '2026-03' (the same key the trigger writes)."""
+    return str(date or "")[:7] or NO_DATE_PERIOD
+
+
+def is_ready(db, biz_id) -> bool:
+    ready = _READY.get(biz_id)
+    if ready is None:
+        ready = _READY.set(biz_id, bool(db.get("gl_balance_state", {"business_id": biz_id},
+                                               limit=1, select="business_id")))
+    return ready
+
+
+def _add(totals, code, debit, credit):
+    t = totals.setdefault(code, {"debit": 0.0, "credit": 0.0})
+    t["debit"] += debit
+    t["credit"] += credit
+
+
+def _journal_totals(db, biz_id, date_from=None, date_to=None, totals=None):
+    """Per-account journal sums for [date_from, date_to], added up by Postgres."""
+    totals = {} if totals is None else totals
+    flt = {"business_id": biz_id}
+    window = [c for c in (("gte", date_from) if date_from else None,
+                          ("lte", date_to) if date_to else None) if c]
+    if window:
+        flt["date"] = window
+    for row in db.aggregate("journals", sums=["debit", "credit"], group_by=["account_code"], filters=flt):
+        if row.get("account_code"):
+            _add(totals, row["account_code"], row["debit"], row["credit"])
+    return totals
+
+
+def _whole_months(date_from, date_to):
+    """The run of whole calendar months inside [date_from, date_to] as
+    (first_period, last_period, head_end, tail_start): journals dated
+    before head_end or after tail_start fall in the partial edge months.
+    None when the window holds no whole month."""
+    start = datetime.strptime(date_from, "%Y-%m-%d") if date_from else None
+    end = datetime.strptime(date_to, "%Y-%m-%d") if date_to else None
+    if start and start.day != 1:
+        start = (start.replace(day=1) + timedelta(days=32)).replace(day=1)
+    if end and end.day != calendar.monthrange(end.year, end.month)[1]:
+        end = end.replace(day=1) - timedelta(days=1)
+    if start and end and start > end:
+        return None
+    return (start.strftime("%Y-%m") if start else None,
+            end.strftime("%Y-%m") if end else None,
+            (start - timedelta(days=1)).strftime("%Y-%m-%d") if start else None,
+            (end + timedelta(days=1)).strftime("%Y-%m-%d") if end else None)
+
+
+def account_totals(db, biz_id, date_from: str = None, date_to: str = None) -> dict:
+    """{account_code: {"debit": x, "credit": y}} for journals dated in
+    [date_from, date_to] ('YYYY-MM-DD', either end open).
+
+    Whole months come from gl_balances; the partial months at either end of
+    the window (and any business not yet rebuilt) are summed from journals
+    on the server. Raises if a read fails part-way - a TB with an account
+    missing is worse than an error page."""
+    if not biz_id:
+        return {}
+    if not is_ready(db, biz_id):
+        return _journal_totals(db, biz_id, date_from, date_to)
+    span = _whole_months(date_from, date_to)
+    if span is None:
+        return _journal_totals(db, biz_id, date_from, date_to)
+    first, last, head_end, tail_start = span
+    flt = {"business_id": biz_id}
+    periods = [c for c in (("gte", first) if first else None, ("lte", last) if last else None) if c]
+    if periods:
+        flt["period"] = periods
+    totals = {}
+    for row in db.aggregate("gl_balances", sums=["debit", "credit"], group_by=["account_code"], filters=flt):
+        _add(totals, row["account_code"], row["debit"], row["credit"])
+    if date_from and head_end and date_from <= head_end:
+        _journal_totals(db, biz_id, date_from, head_end, totals)
+    if date_to and tail_start and tail_start <= date_to:
+        _journal_totals(db, biz_id, tail_start, date_to, totals)
+    return totals
+
+
+def rebuild(db, biz_id):
+    """Recompute this business's gl_balances from journals (server side, one
+    call, locked against concurrent postings). Returns (ok, journal_lines or error)."""
+    try:
+        import clickai as _main
+        resp = _main._DB_SESSION.post(f"{db.url}/rest/v1/rpc/gl_balances_rebuild",
+                                      headers=db.headers, json={"p_business_id": biz_id}, timeout=120)
+    except Exception as e:
+        return False, str(e)
+    if resp.status_code != 200:
+        return False, f"HTTP {resp.status_code}: {resp.text[:300]}"
+    _READY.set(biz_id, True)
+    return True, resp.json()
+
+
+def verify(db, biz_id) -> dict:
+    """Fold every journal line by (account_code, period) and compare with
+    gl_balances. Read-only; returns what differs."""
+    expected = {}
+    lines = 0
+    for j in db.iter_rows("journals", {"business_id": biz_id}, select="account_code,date,debit,credit"):
+        lines += 1
+        if not j.get("account_code"):
+            continue
+        key = (j["account_code"], period_of(j.get("date")))
+        e = expected.setdefault(key, [0.0, 0.0])
+        e[0] += float(j.get("debit") or 0)
+        e[1] += float(j.get("credit") or 0)
+    stored = {(r.get("account_code"), r.get("period")): [float(r.get("debit") or 0), float(r.get("credit") or 0)]
+              for r in db.iter_rows("gl_balances", {"business_id": biz_id},
+                                    select="account_code,period,debit,credit")}
+    mismatches = []
+    for key in sorted(set(expected) | set(stored), key=str):
+        want = expected.get(key, [0.0, 0.0])
+        got = stored.get(key, [0.0, 0.0])
+        if abs(want[0] - got[0]) > 0.005 or abs(want[1] - got[1]) > 0.005:
+            mismatches.append({"account_code": key[0], "period": key[1],
+                               "journals": {"debit": round(want[0], 2), "credit": round(want[1], 2)},
+                               "gl_balances": {"debit": round(got[0], 2), "credit": round(got[1], 2)}})
+    return {"ok": not mismatches, "ready": is_ready(db, biz_id), "journal_lines": lines,
+            "balance_rows": len(stored), "mismatches": mismatches[:200],
+            "mismatch_count": len(mismatches)}
+
+
+def register_gl_balance_routes(app, db, login_required, Auth, get_user_role):
+    """Rebuild / verify endpoints (owner and admin)."""
+
+    def _biz_or_error():
+        business = Auth.get_current_business()
+        biz_id = business.get("id") if business else None
+        if not biz_id:
+            return None, (jsonify({"success": False, "error": "No business selected"}), 400)
+        if get_user_role() not in ("owner", "admin"):
+            return None, (jsonify({"success": False, "error": "Owner or admin only"}), 403)
+        return biz_id, None
+
+    @app.route("/api/gl-balances/verify")
+    @login_required
+    def api_gl_balances_verify():
+        biz_id, err = _biz_or_error()
+        if err:
+            return err
+        try:
+            return jsonify({"success": True, **verify(db, biz_id)})
+        except Exception as e:
+            logger.error(f"[GL BALANCES] Verify failed for {biz_id}: {e}")
+            return jsonify({"success": False, "error": str(e)}), 500
+
+    @app.route("/api/gl-balances/rebuild", methods=["POST"])
+    @login_required
+    def api_gl_balances_rebuild():
+        biz_id, err = _biz_or_error()
+        if err:
+            return err
+        ok, result = rebuild(db, biz_id)
+        if not ok:
+            logger.error(f"[GL BALANCES] Rebuild failed for {biz_id}: {result}")
+            return jsonify({"success": False, "error": result,
+                            "hint": "Run GL_BALANCES_SQL in Supabase first"}), 500
+        logger.info(f"[GL BALANCES] Rebuilt {biz_id}: {result} journal lines")
+        return jsonify({"success": True, "journal_lines": result, **verify(db, biz_id)})
+
+
+# ==============================================================================
+# SQL: Database table creation (run once in Supabase)
+# Then POST /api/gl-balances/rebuild once per business to switch it over.
+# ==============================================================================
+
+GL_BALANCES_SQL = """
+CREATE TABLE IF NOT EXISTS gl_balances (
+    business_id TEXT NOT NULL,
+    account_code TEXT NOT NULL,
+    period TEXT NOT NULL,                     -- 'YYYY-MM' of the journal date
+    debit NUMERIC(18,2) NOT NULL DEFAULT 0,
+    credit NUMERIC(18,2) NOT NULL DEFAULT 0,
+    line_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (business_id, account_code, period)
+);
+
+CREATE TABLE IF NOT EXISTS gl_balance_state (
+    business_id TEXT PRIMARY KEY,
+    rebuilt_at TIMESTAMPTZ DEFAULT NOW(),
+    journal_lines INTEGER DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION gl_balances_bump(p_biz TEXT, p_code TEXT, p_date TEXT,
+                                            p_debit NUMERIC, p_credit NUMERIC, p_lines INTEGER)
+RETURNS void LANGUAGE sql AS $$
+    INSERT INTO gl_balances (business_id, account_code, period, debit, credit, line_count, updated_at)
+    VALUES (p_biz, p_code, COALESCE(NULLIF(LEFT(p_date, 7), ''), '0000-00'), p_debit, p_credit, p_lines, NOW())
+    ON CONFLICT (business_id, account_code, period) DO UPDATE
+       SET debit = gl_balances.debit + EXCLUDED.debit,
+           credit = gl_balances.credit + EXCLUDED.credit,
+           line_count = gl_balances.line_count + EXCLUDED.line_count,
+           updated_at = NOW();
+$$;
+
+-- Every journals write moves its totals in the same transaction. A rebuild
+-- takes the exclusive form of the same per-business lock, so it never
+-- interleaves with a posting.
+CREATE OR REPLACE FUNCTION gl_balances_on_journal() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND COALESCE(OLD.account_code, '') <> '' THEN
+        PERFORM pg_advisory_xact_lock_shared(hashtext('gl_balances:' || OLD.business_id::text));
+        PERFORM gl_balances_bump(OLD.business_id::text, OLD.account_code, OLD.date::text,
+                                 -COALESCE(OLD.debit, 0), -COALESCE(OLD.credit, 0), -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND COALESCE(NEW.account_code, '') <> '' THEN
+        PERFORM pg_advisory_xact_lock_shared(hashtext('gl_balances:' || NEW.business_id::text));
+        PERFORM gl_balances_bump(NEW.business_id::text, NEW.account_code, NEW.date::text,
+                                 COALESCE(NEW.debit, 0), COALESCE(NEW.credit, 0), 1);
+    END IF;
+    RETURN NULL;
+END $$;
+
+DROP TRIGGER IF EXISTS trg_gl_balances ON journals;
+CREATE TRIGGER trg_gl_balances AFTER INSERT OR UPDATE OR DELETE ON journals
+    FOR EACH ROW EXECUTE FUNCTION gl_balances_on_journal();
+
+CREATE OR REPLACE FUNCTION gl_balances_rebuild(p_business_id TEXT) RETURNS INTEGER
+LANGUAGE plpgsql AS $$
+DECLARE n INTEGER;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('gl_balances:' || p_business_id));
+    DELETE FROM gl_balances WHERE business_id = p_business_id;
+    INSERT INTO gl_balances (business_id, account_code, period, debit, credit, line_count)
+    SELECT p_business_id, account_code, COALESCE(NULLIF(LEFT(date::text, 7), ''), '0000-00'),
+           SUM(COALESCE(debit, 0)), SUM(COALESCE(credit, 0)), COUNT(*)
+      FROM journals
+     WHERE business_id::text = p_business_id AND COALESCE(account_code, '') <> ''
+     GROUP BY 2, 3;
+    SELECT COUNT(*) INTO n FROM journals WHERE business_id::text = p_business_id;
+    INSERT INTO gl_balance_state (business_id, rebuilt_at, journal_lines)
+    VALUES (p_business_id, NOW(), n)
+    ON CONFLICT (business_id) DO UPDATE SET rebuilt_at = NOW(), journal_lines = EXCLUDED.journal_lines;
+    RETURN n;
+END $$;
+"""
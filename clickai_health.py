@@ -26,12 +26,13 @@
 #   as an "info" finding; the runner always completes.
 # ==============================================================================
 
-import json
 import logging
 from collections import defaultdict
 from datetime import datetime, timedelta
 from urllib.parse import quote
 
+from clickai_allocation_log import reversed_sources
+
 logger = logging.getLogger(__name__)
 
 TOLERANCE = 0.02          # cents tolerance, same as create_journal_entry
@@ -86,7 +87,8 @@ def build_ctx(biz_id):
 
     journals = db.get(
         "journals", {"business_id": biz_id}, limit=100000,
-        select="id,date,description,reference,account_code,debit,credit"
+        select="id,date,description,reference,account_code,debit,credit",
+        parallel=True
     ) or []
 
     by_ref = defaultdict(list)
@@ -130,15 +132,18 @@ def build_ctx(biz_id):
 
     invoices = db.get(
         "invoices", {"business_id": biz_id}, limit=100000,
-        select="id,invoice_number,vat,total,date,customer_name"
+        select="id,invoice_number,vat,total,date,customer_name",
+        parallel=True
     ) or []
     expenses = db.get(
         "expenses", {"business_id": biz_id}, limit=100000,
-        select="id,vat_amount,amount,date,description"
+        select="id,vat_amount,amount,date,description",
+        parallel=True
     ) or []
     bank_txns = db.get(
         "bank_transactions", {"business_id": biz_id}, limit=100000,
-        select="id,date,description,amount,matched"
+        select="id,date,description,amount,matched",
+        parallel=True
     ) or []
 
     sales = db.get(
@@ -148,19 +153,7 @@ def build_ctx(biz_id):
 
     # Refunded status lives ONLY in allocation_log — the sales table has no
     # status column (same rule as clickai_pos.py). Checks read ctx, never the DB.
-    refunded_sale_ids = set()
-    for al in (db.get("allocation_log", {"business_id": biz_id}, limit=100000,
-                      select="source_id,source_table,extra") or []):
-        if al.get("source_table") != "sales" or not al.get("source_id"):
-            continue
-        extra = al.get("extra", {})
-        if isinstance(extra, str):
-            try:
-                extra = json.loads(extra) if extra else {}
-            except Exception:
-                extra = {}
-        if isinstance(extra, dict) and extra.get("action") == "pos_refund":
-            refunded_sale_ids.add(al.get("source_id"))
+    refunded_sale_ids = reversed_sources(db, biz_id)[1]
 
     return {
         "biz_id": biz_id,
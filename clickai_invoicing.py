@@ -287,6 +287,13 @@ def register_invoicing_routes(app, db, login_required, Auth, render_page,
                 return max(0.0, min(90.0, _p))
             
             _item_stock_ids = request.form.getlist("item_stock_id[]")
+            # Every linked line's stock record in one lookup (not one per line)
+            _camp_stock = {}
+            if _camp_active:
+                try:
+                    _camp_stock = db.get_many_stock(_item_stock_ids)
+                except Exception:
+                    _camp_stock = {}
             
             subtotal = Decimal("0")
             for i, desc in enumerate(descriptions):
@@ -301,10 +308,7 @@ def register_invoicing_routes(app, db, login_required, Auth, render_page,
                     original_price = 0.0
                     _sid = _item_stock_ids[i] if i < len(_item_stock_ids) else ""
                     if _sid and _camp_active:
-                        try:
-                            _st = db.get_one_stock(_sid)
-                        except Exception:
-                            _st = None
+                        _st = _camp_stock.get(str(_sid))
                         if _st:
                             _pct = _camp_pct(_st.get("category"))
                             _full = float(_st.get("price") or _st.get("selling_price") or 0)
@@ -380,15 +384,18 @@ def register_invoicing_routes(app, db, login_required, Auth, render_page,
                 # === DEDUCT STOCK ===
                 # Get stock_ids from form if provided
                 stock_ids = request.form.getlist("item_stock_id[]")
+                _stock_by_id = db.get_many_stock(stock_ids)
                 for i, desc in enumerate(descriptions):
                     if desc.strip() and i < len(stock_ids) and stock_ids[i]:
                         stock_id = stock_ids[i]
-                        stock_item = db.get_one_stock(stock_id)
+                        stock_item = _stock_by_id.get(str(stock_id))
                         if stock_item:
                             current_qty = float(stock_item.get("qty") or stock_item.get("quantity") or 0)
                             sold_qty = float(quantities[i] or 0)
-                            new_qty = current_qty - sold_qty
-                            db.update_stock(stock_id, {"qty": new_qty, "quantity": new_qty}, biz_id)
+                            new_qty = db.move_stock(biz_id, stock_id, "sale", sold_qty,
+                                                    reference=f"Invoice {inv_num}", on_hand=current_qty)
+                            if new_qty is not None:
+                                stock_item["qty"] = stock_item["quantity"] = new_qty
                             logger.info(f"[INVOICE] Stock {stock_id}: {current_qty} - {sold_qty} = {new_qty}")
                 
                 # Try to create journal entries (won't crash if tables don't exist)
@@ -2223,13 +2230,9 @@ def register_invoicing_routes(app, db, login_required, Auth, render_page,
                 for _sid, _delta in _stock_delta.items():
                     if abs(_delta) < 0.0001:
                         continue
-                    _st = db.get_one_stock(_sid)
-                    if not _st:
-                        continue
-                    _cur = float(_st.get("qty") or _st.get("quantity") or 0)
-                    _new_qty = _cur + _delta
-                    db.update_stock(_sid, {"qty": _new_qty, "quantity": _new_qty}, biz_id)
-                    logger.info(f"[INVOICE EDIT] Stock {_sid}: {_cur} {_delta:+} = {_new_qty}")
+                    _new_qty = db.move_stock(biz_id, _sid, "adjustment", _delta,
+                                             reference=f"Invoice {inv_num} edited")
+                    logger.info(f"[INVOICE EDIT] Stock {_sid}: {_delta:+} = {_new_qty}")
             except Exception as _stk_err:
                 logger.error(f"[INVOICE EDIT] Stock adjustment failed for {inv_num}: {_stk_err}")
             
@@ -5420,8 +5423,7 @@ def register_invoicing_routes(app, db, login_required, Auth, render_page,
             # === DEDUCT STOCK ===
             try:
                 items_list = json.loads(quote.get("items", "[]"))
-                all_stock = db.get_all_stock(biz_id)
-                stock_by_code = {s.get("code", "").upper(): s for s in all_stock if s.get("code")}
+                catalog = db.stock_catalog(biz_id)
                 
                 for item in items_list:
                     code = (item.get("code") or "").upper()
@@ -5431,14 +5433,14 @@ def register_invoicing_routes(app, db, login_required, Auth, render_page,
                     # Find by stock_id first, then by code
                     if stock_id:
                         stock_item = db.get_one_stock(stock_id)
-                    elif code and code in stock_by_code:
-                        stock_item = stock_by_code[code]
+                    elif code and catalog.by_code(code):
+                        stock_item = catalog.by_code(code).row
                     
                     if stock_item:
                         current_qty = float(stock_item.get("qty") or stock_item.get("quantity") or 0)
                         sold_qty = float(item.get("qty") or item.get("quantity") or 1)
-                        new_qty = current_qty - sold_qty
-                        db.update_stock(stock_item.get("id"), {"qty": new_qty, "quantity": new_qty}, biz_id)
+                        new_qty = db.move_stock(biz_id, stock_item.get("id"), "sale", sold_qty,
+                                                reference=f"Invoice {inv_num}", on_hand=current_qty)
                         logger.info(f"[QUOTE->INV ROUTE] Stock {code or stock_id}: {current_qty} - {sold_qty} = {new_qty}")
             except Exception as e:
                 logger.error(f"[QUOTE->INV ROUTE] Stock deduction error: {e}")
@@ -5613,21 +5615,10 @@ def register_invoicing_routes(app, db, login_required, Auth, render_page,
                     for item in items:
                         stock_id = item.get("stock_id")
                         if stock_id:
-                            stock_item = db.get_one_stock(stock_id)
-                            if stock_item:
-                                current_qty = float(stock_item.get("qty") or stock_item.get("quantity") or 0)
-                                sold_qty = float(item.get("quantity", 0))
-                                new_qty = current_qty - sold_qty
-                                # Allow negative stock - use update with biz_id
-                                db.update_stock(stock_id, {"qty": new_qty, "quantity": new_qty}, biz_id)
-                                logger.info(f"[GRN] Stock {stock_id}: {current_qty} - {sold_qty} = {new_qty}")
-                                # Log stock movement
-                                try:
-                                    db.save("stock_movements", RecordFactory.stock_movement(
-                                        business_id=biz_id, stock_id=stock_id, movement_type="out",
-                                        quantity=sold_qty, reference=f"GRN {dn_num}"
-                                    ))
-                                except Exception as sm_err: logger.error(f"[STOCK MOVEMENT] Save failed: {sm_err}")
+                            # Allow negative stock - one ledger movement per line
+                            sold_qty = float(item.get("quantity", 0))
+                            new_qty = db.move_stock(biz_id, stock_id, "sale", sold_qty, reference=f"GRN {dn_num}")
+                            logger.info(f"[GRN] Stock {stock_id}: -{sold_qty} = {new_qty}")
                 
                 # Clear the unfinished-work draft now that the delivery note is properly saved
                 _dft_id = request.form.get("capture_draft_id", "")
@@ -5659,7 +5650,7 @@ def register_invoicing_routes(app, db, login_required, Auth, render_page,
         
         customers = db.get("customers", {"business_id": biz_id}) if biz_id else []
         invoices = db.get("invoices", {"business_id": biz_id, "status": "outstanding"}) if biz_id else []
-        stock = db.get_all_stock(biz_id)
+        stock = db.stock_catalog(biz_id)
         
         customer_options = '<option value="">-- Select Customer --</option>'
         for c in sorted(customers, key=lambda x: x.get("name", "")):
@@ -5673,7 +5664,7 @@ def register_invoicing_routes(app, db, login_required, Auth, render_page,
         
         stock_options = ""
         for s in stock:
-            stock_options += f'<option value="{s.get("id")}" data-desc="{safe_string(s.get("description",""))}">{safe_string(s.get("description",""))} (Qty: {s.get("quantity",0)})</option>'
+            stock_options += f'<option value="{s.id}" data-desc="{safe_string(s.description)}">{safe_string(s.description)} (Qty: {s.qty:g})</option>'
         
         # Build prefill items HTML
         items_html = ""
@@ -6487,20 +6478,9 @@ def register_invoicing_routes(app, db, login_required, Auth, render_page,
                 stock_id = item.get("stock_id")
                 if stock_id:
                     try:
-                        stock_item = db.get_one_stock(stock_id)
-                        if stock_item:
-                            current_qty = float(stock_item.get("qty") or stock_item.get("quantity") or 0)
-                            sold_qty = float(item.get("quantity", 0))
-                            new_qty = current_qty - sold_qty
-                            db.update_stock(stock_id, {"qty": new_qty, "quantity": new_qty}, biz_id)
-                            logger.info(f"[DN] Stock {stock_id}: {current_qty} - {sold_qty} = {new_qty}")
-                            try:
-                                db.save("stock_movements", RecordFactory.stock_movement(
-                                    business_id=biz_id, stock_id=stock_id, movement_type="out",
-                                    quantity=sold_qty, reference=f"DN {dn_num}"
-                                ))
-                            except Exception as sm_err:
-                                logger.error(f"[STOCK MOVEMENT] Save failed: {sm_err}")
+                        sold_qty = float(item.get("quantity", 0))
+                        new_qty = db.move_stock(biz_id, stock_id, "sale", sold_qty, reference=f"DN {dn_num}")
+                        logger.info(f"[DN] Stock {stock_id}: -{sold_qty} = {new_qty}")
                     except Exception as e:
                         logger.error(f"[DN] Stock reduce error for {stock_id}: {e}")
             
@@ -481,11 +481,11 @@ def register_jobcards_routes(app, db, login_required, Auth, render_page,
         ok, e = db.save("job_card_lines", line)
         if not ok:
             return jsonify({"success": False, "error": e or "Save failed"})
-        # Deduct stock (same pattern as invoicing)
+        # Issue to the job: one stock ledger movement
         try:
             current_qty = float(st.get("qty") or st.get("quantity") or 0)
-            new_qty = current_qty - qty
-            db.update_stock(stock_id, {"qty": new_qty, "quantity": new_qty}, biz_id)
+            db.move_stock(biz_id, stock_id, "job_issue", qty,
+                          reference=f"Job {job.get('job_number', '')}", on_hand=current_qty)
         except Exception as _se:
             logger.error(f"[JOBCARD] Stock deduction failed: {_se}")
         # GL: DR Cost of Sales, CR Stock at cost
@@ -539,11 +539,8 @@ def register_jobcards_routes(app, db, login_required, Auth, render_page,
         # Stock lines: return to stock and reverse the GL entry
         if line.get("line_type") == "stock" and line.get("stock_id"):
             try:
-                st = db.get_one_stock(line.get("stock_id"))
-                if st:
-                    current_qty = float(st.get("qty") or st.get("quantity") or 0)
-                    new_qty = current_qty + float(line.get("qty") or 0)
-                    db.update_stock(line.get("stock_id"), {"qty": new_qty, "quantity": new_qty}, biz_id)
+                db.move_stock(biz_id, line.get("stock_id"), "return", float(line.get("qty") or 0),
+                              reference=f"Job {job.get('job_number', '')} line removed")
             except Exception as _se:
                 logger.error(f"[JOBCARD] Restock failed: {_se}")
             try:
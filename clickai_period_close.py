@@ -0,0 +1,414 @@
+"""
+ClickAI Period Close Module
+============================
+Month-end snapshots, frozen when a period is closed.
+
+Closing a month writes its closing position once - cumulative debit/credit
+of the dated journals per GL account, and the balance of every customer and
+supplier - into period_balances, then marks the month closed
+(period_snapshots). After that:
+
+    gl_snapshot(db, biz, day)                - latest fresh GL snapshot ending <= day
+    subledger_snapshot(db, biz, kind, date)  - a closed month-end balance list, or None
+
+clickai_tb.trial_balance() (the TB, income statement and balance sheet)
+starts from gl_snapshot() and reads only the journals dated after it, so a
+report for any date is one snapshot plus the still-open delta instead of
+the whole history.
+
+A snapshot is only right while nothing moves underneath it. Back-dated
+postings are still accepted - most document routes have already saved the
+invoice or receipt by the time its journal is posted - but PERIOD_CLOSE_SQL
+adds a trigger on journals and on every sub-ledger document table that marks
+the month's snapshot (and every later one) stale. The as-at readers skip a
+stale snapshot and fall back to the previous good one plus the delta, so
+nothing is silently dropped, and closing the month again rebuilds it.
+reopen_period() drops the month's snapshots (and every later one) outright.
+
+Import in clickai.py (and clickai_tb.py) with try/except:
+    try:
+        from clickai_period_close import register_period_close_routes, subledger_snapshot
+        PERIOD_CLOSE_LOADED = True
+    except ImportError:
+        PERIOD_CLOSE_LOADED = False
+"""
+
+import calendar
+import logging
+from datetime import date as _date, datetime, timedelta
+
+from flask import jsonify, request
+
+from clickai_cache import SharedCache
+
+logger = logging.getLogger(__name__)
+
+# biz_id -> sorted list of closed periods. Shared so a close in one worker
+# shows in all of them. Whether a snapshot is still usable is read fresh
+# (usable_periods) - the server trigger marks it stale without telling us.
+_CLOSED = SharedCache("period_close", ttl=300, max_entries=5000, max_bytes=2 * 1024 * 1024)
+
+SNAPSHOT_BATCH = 500   # period_balances rows per save_batch request
+
+_stale_column_off = False   # period_snapshots.stale missing (PERIOD_CLOSE_SQL not re-run)
+
+
+def month_end(period: str) -> str:
+    """'2026-02' -> '2026-02-28'."""
+    y, m = int(period[:4]), int(period[5:7])
+    return f"{period}-{calendar.monthrange(y, m)[1]:02d}"
+
+
+def _next_day(day: str) -> str:
+    return (datetime.strptime(day, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+
+
+def closed_periods(db, biz_id) -> list:
+    """Every closed 'YYYY-MM' for this business, oldest first."""
+    periods = _CLOSED.get(biz_id)
+    if periods is None:
+        rows = db.get("period_snapshots", {"business_id": biz_id}, select="period", order="period") or []
+        periods = [r["period"] for r in rows if r.get("period")]
+        _CLOSED.set(biz_id, periods)
+    return periods
+
+
+def closed_through(db, biz_id) -> str:
+    """The last closed 'YYYY-MM', or '' if nothing is closed."""
+    periods = closed_periods(db, biz_id)
+    return periods[-1] if periods else ""
+
+
+def _snapshot_states(db, biz_id) -> list:
+    """[(period, stale)] for every closed month, read fresh - a back-dated
+    posting marks a snapshot stale on the server at any moment."""
+    global _stale_column_off
+    if not _stale_column_off:
+        try:
+            return [(r["period"], bool(r.get("stale")))
+                    for r in db.iter_rows("period_snapshots", {"business_id": biz_id},
+                                          select="period,stale", order="period", strict=True)
+                    if r.get("period")]
+        except RuntimeError as e:
+            if "HTTP 400" not in str(e):
+                raise
+            _stale_column_off = True
+            logger.warning("[PERIOD CLOSE] period_snapshots.stale missing - run PERIOD_CLOSE_SQL "
+                           "so back-dated postings invalidate closed snapshots")
+    return [(p, False) for p in closed_periods(db, biz_id)]
+
+
+def usable_periods(db, biz_id) -> list:
+    """Closed months whose snapshots still hold, oldest first."""
+    return [p for p, stale in _snapshot_states(db, biz_id) if not stale]
+
+
+def stale_periods(db, biz_id) -> list:
+    """Closed months a back-dated posting has invalidated - close them
+    again (oldest first) to rebuild."""
+    return [p for p, stale in _snapshot_states(db, biz_id) if stale]
+
+
+def _snapshot_for(db, biz_id, day: str, usable: list = None) -> str:
+    """The latest usable closed period whose month-end is on or before `day`."""
+    best = ""
+    for period in usable_periods(db, biz_id) if usable is None else usable:
+        if month_end(period) <= day:
+            best = period
+    return best
+
+
+def _snapshot_rows(db, biz_id, period, kind, select):
+    # strict: a failed first page must never read as an empty snapshot
+    return db.iter_rows("period_balances", {"business_id": biz_id, "period": period, "kind": kind},
+                        select=select, strict=True)
+
+
+def gl_snapshot(db, biz_id, day: str) -> tuple:
+    """(period, {account_code: (debit, credit)}) - the latest fresh GL
+    snapshot whose month-end is on or before `day`: every dated journal to
+    that month-end. ("", {}) when there is none or it cannot be read."""
+    if not biz_id or not day:
+        return "", {}
+    try:
+        base = _snapshot_for(db, biz_id, day)
+        if not base:
+            return "", {}
+        return base, {r["key"]: (float(r.get("debit") or 0), float(r.get("credit") or 0))
+                      for r in _snapshot_rows(db, biz_id, base, "gl", "key,debit,credit")}
+    except Exception as e:
+        logger.warning(f"[PERIOD CLOSE] GL snapshot read failed for {biz_id} {day}: {e}")
+        return "", {}
+
+
+def subledger_snapshot(db, biz_id, kind: str, asat: str):
+    """{party_id: balance} frozen for a closed month-end, or None when `asat`
+    is not one, or its snapshot is stale (the caller then computes it).
+    kind: 'customer' | 'supplier'."""
+    day = str(asat or "")[:10]
+    if not biz_id or len(day) != 10 or day != month_end(day[:7]):
+        return None
+    try:
+        if day[:7] not in usable_periods(db, biz_id):
+            return None
+        return {r["key"]: round(float(r.get("balance") or 0), 2)
+                for r in _snapshot_rows(db, biz_id, day[:7], kind, "key,balance")}
+    except Exception as e:
+        logger.warning(f"[PERIOD CLOSE] {kind} snapshot read failed for {biz_id} {day}: {e}")
+        return None
+
+
+def _write_rows(db, biz_id, period, kind, rows):
+    """rows: [(key, debit, credit, balance)] -> period_balances, deterministic ids."""
+    records = [{"id": f"{biz_id}:{period}:{kind}:{key}", "business_id": biz_id, "period": period,
+                "kind": kind, "key": key, "debit": round(debit, 2), "credit": round(credit, 2),
+                "balance": round(balance, 2)} for key, debit, credit, balance in rows]
+    for i in range(0, len(records), SNAPSHOT_BATCH):
+        ok, err = db.save_batch("period_balances", records[i:i + SNAPSHOT_BATCH])
+        if not ok:
+            raise RuntimeError(f"period_balances write failed: {err}")
+    return len(records)
+
+
+def _write_gl(db, biz_id, period, totals):
+    return _write_rows(db, biz_id, period, "gl",
+                       [(code, t["debit"], t["credit"], t["debit"] - t["credit"])
+                        for code, t in sorted(totals.items())])
+
+
+def _gl_cumulative(db, biz_id, end, base):
+    """Dated-journal GL totals to `end` from the `base` snapshot (or from the start)."""
+    from clickai_tb import dated_totals
+    totals = {}
+    if base:
+        for r in _snapshot_rows(db, biz_id, base, "gl", "key,debit,credit"):
+            totals[r["key"]] = {"debit": float(r.get("debit") or 0), "credit": float(r.get("credit") or 0)}
+    for code, t in dated_totals(db, biz_id, end, month_end(base) if base else None).items():
+        acc = totals.setdefault(code, {"debit": 0.0, "credit": 0.0})
+        acc["debit"] += t["debit"]
+        acc["credit"] += t["credit"]
+    return totals
+
+
+def close_period(db, biz_id, period: str, closed_by: str = "") -> dict:
+    """Snapshot `period` ('YYYY-MM'). Only a finished month can be closed;
+    earlier months left open are still covered by the as-at readers through
+    the journal delta. A closed month whose snapshot went stale is closed
+    again to rebuild it."""
+    import clickai as _main
+    if len(period or "") != 7 or period >= _date.today().strftime("%Y-%m"):
+        raise ValueError(f"Only a finished month can be closed (got {period!r})")
+    states = dict(_snapshot_states(db, biz_id))
+    if period in states and not states[period]:
+        raise ValueError(f"{period} is already closed - reopen it to rebuild its snapshot")
+    if period in states:
+        # Rebuilding a stale month: drop its old rows first, or a customer or
+        # account that has since gone would keep its old balance
+        ok, err = db.delete_where("period_balances", {"business_id": biz_id, "period": period})
+        if not ok:
+            raise RuntimeError(f"period_balances delete failed: {err}")
+    end = month_end(period)
+    base = _snapshot_for(db, biz_id, end, [p for p, stale in states.items() if not stale and p != period])
+    gl = _gl_cumulative(db, biz_id, end, base)
+    accounts = _write_gl(db, biz_id, period, gl)
+    customers = _main.calc_all_customer_balances(biz_id, asat=end)
+    suppliers = _main.calc_all_supplier_balances(biz_id, asat=end)
+    _write_rows(db, biz_id, period, "customer", [(k, 0.0, 0.0, v) for k, v in customers.items()])
+    _write_rows(db, biz_id, period, "supplier", [(k, 0.0, 0.0, v) for k, v in suppliers.items()])
+    snapshot = {"id": f"{biz_id}:{period}", "business_id": biz_id, "period": period,
+                "closed_at": _main.now(), "closed_by": closed_by or "",
+                "gl_accounts": accounts, "customers": len(customers), "suppliers": len(suppliers)}
+    if not _stale_column_off:
+        snapshot["stale"] = False
+    ok, err = db.save_batch("period_snapshots", [snapshot])
+    _CLOSED.invalidate(biz_id)
+    if not ok:
+        raise RuntimeError(f"period_snapshots write failed: {err}")
+    # A journal posted while the snapshot was being taken may have missed it
+    # (and its stale mark was just overwritten) - read the month once more
+    # and rewrite if it moved.
+    again = _gl_cumulative(db, biz_id, end, base)
+    if any(abs(again.get(c, {}).get(f, 0) - gl.get(c, {}).get(f, 0)) > 0.005
+           for c in set(again) | set(gl) for f in ("debit", "credit")):
+        logger.warning(f"[PERIOD CLOSE] {biz_id} {period}: GL moved during close - snapshot rewritten")
+        accounts = _write_gl(db, biz_id, period, again)
+        gone = [f"{biz_id}:{period}:gl:{code}" for code in set(gl) - set(again)]
+        if gone:
+            db.delete_where("period_balances", {"business_id": biz_id, "id": ("in", gone)})
+    logger.info(f"[PERIOD CLOSE] {biz_id} closed {period}: {accounts} accounts, "
+                f"{len(customers)} customers, {len(suppliers)} suppliers")
+    return {"period": period, "month_end": end, "gl_accounts": accounts,
+            "customers": len(customers), "suppliers": len(suppliers)}
+
+
+def reopen_period(db, biz_id, period: str) -> dict:
+    """Unlock `period` and every later closed month, dropping their snapshots.
+    Close them again (oldest first) to rebuild."""
+    dropped = [p for p in closed_periods(db, biz_id) if p >= period]
+    for table in ("period_snapshots", "period_balances"):
+        ok, err = db.delete_where(table, {"business_id": biz_id, "period": ("gte", period)})
+        if not ok:
+            _CLOSED.invalidate(biz_id)
+            raise RuntimeError(f"{table} delete failed: {err}")
+    _CLOSED.invalidate(biz_id)
+    logger.info(f"[PERIOD CLOSE] {biz_id} reopened {', '.join(dropped) or period}")
+    return {"reopened": dropped, "closed_through": closed_through(db, biz_id)}
+
+
+def register_period_close_routes(app, db, login_required, Auth, get_user_role):
+    """Close / reopen / status endpoints (owner and admin)."""
+
+    def _biz_or_error():
+        business = Auth.get_current_business()
+        biz_id = business.get("id") if business else None
+        if not biz_id:
+            return None, (jsonify({"success": False, "error": "No business selected"}), 400)
+        if get_user_role() not in ("owner", "admin"):
+            return None, (jsonify({"success": False, "error": "Owner or admin only"}), 403)
+        return biz_id, None
+
+    def _period_arg():
+        data = request.get_json(silent=True) or {}
+        return str(data.get("period") or request.args.get("period") or "")[:7]
+
+    @app.route("/api/periods")
+    @login_required
+    def api_periods():
+        biz_id, err = _biz_or_error()
+        if err:
+            return err
+        return jsonify({"success": True, "closed": closed_periods(db, biz_id),
+                        "closed_through": closed_through(db, biz_id),
+                        "stale": stale_periods(db, biz_id)})
+
+    @app.route("/api/periods/close", methods=["POST"])
+    @login_required
+    def api_period_close():
+        biz_id, err = _biz_or_error()
+        if err:
+            return err
+        user = Auth.get_current_user() or {}
+        try:
+            result = close_period(db, biz_id, _period_arg(), user.get("name") or user.get("email") or "")
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+        except Exception as e:
+            logger.error(f"[PERIOD CLOSE] Close failed for {biz_id}: {e}")
+            return jsonify({"success": False, "error": str(e),
+                            "hint": "Run PERIOD_CLOSE_SQL in Supabase first"}), 500
+        return jsonify({"success": True, **result})
+
+    @app.route("/api/periods/reopen", methods=["POST"])
+    @login_required
+    def api_period_reopen():
+        biz_id, err = _biz_or_error()
+        if err:
+            return err
+        period = _period_arg()
+        if len(period) != 7:
+            return jsonify({"success": False, "error": "period must be YYYY-MM"}), 400
+        try:
+            return jsonify({"success": True, **reopen_period(db, biz_id, period)})
+        except Exception as e:
+            logger.error(f"[PERIOD CLOSE] Reopen failed for {biz_id}: {e}")
+            return jsonify({"success": False, "error": str(e)}), 500
+
+
+# ==============================================================================
+# SQL: Database table creation (run once in Supabase)
+# ==============================================================================
+
+PERIOD_CLOSE_SQL = """
+CREATE TABLE IF NOT EXISTS period_snapshots (
+    id TEXT PRIMARY KEY,                      -- '<business_id>:<YYYY-MM>'
+    business_id TEXT NOT NULL,
+    period TEXT NOT NULL,
+    closed_at TIMESTAMPTZ DEFAULT NOW(),
+    closed_by TEXT DEFAULT '',
+    gl_accounts INTEGER DEFAULT 0,
+    customers INTEGER DEFAULT 0,
+    suppliers INTEGER DEFAULT 0,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_period_snapshots_biz_period ON period_snapshots(business_id, period);
+
+CREATE TABLE IF NOT EXISTS period_balances (
+    id TEXT PRIMARY KEY,                      -- '<business_id>:<YYYY-MM>:<kind>:<key>'
+    business_id TEXT NOT NULL,
+    period TEXT NOT NULL,
+    kind TEXT NOT NULL,                       -- 'gl' | 'customer' | 'supplier'
+    key TEXT NOT NULL,                        -- account_code / customer_id / supplier_id
+    debit NUMERIC(18,2) DEFAULT 0,            -- gl: cumulative to month-end
+    credit NUMERIC(18,2) DEFAULT 0,
+    balance NUMERIC(18,2) DEFAULT 0,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_period_balances_lookup ON period_balances(business_id, period, kind);
+
+ALTER TABLE period_snapshots ADD COLUMN IF NOT EXISTS stale BOOLEAN DEFAULT false;
+
+-- A posting dated in a closed month (journals, or any document the customer
+-- and supplier balances are built from) marks that month's snapshot and
+-- every later one stale, whichever path writes it. Closing again rebuilds.
+DROP TRIGGER IF EXISTS trg_journals_period_guard ON journals;
+DROP FUNCTION IF EXISTS journals_period_guard();
+
+CREATE OR REPLACE FUNCTION period_snapshots_mark_stale() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    o JSONB := to_jsonb(OLD);
+    n JSONB := to_jsonb(NEW);
+    r JSONB;
+    k TEXT;
+    moved BOOLEAN := TG_OP <> 'UPDATE';
+BEGIN
+    -- An UPDATE counts only when a column the balances are built from
+    -- changed (the trigger's arguments); a status only when it moves into or
+    -- out of one that drops the document. Allocating a payment to an old
+    -- invoice (paid_amount, status 'paid') leaves the snapshots alone.
+    IF NOT moved THEN
+        FOREACH k IN ARRAY TG_ARGV LOOP
+            IF k = 'status' THEN
+                moved := (o->>k) IS DISTINCT FROM (n->>k)
+                         AND (COALESCE(o->>k, '') IN ('active', 'reversed', 'credited', 'cancelled', 'refunded')
+                              OR COALESCE(n->>k, '') IN ('active', 'reversed', 'credited', 'cancelled', 'refunded'));
+            ELSE
+                moved := (o->k) IS DISTINCT FROM (n->k);
+            END IF;
+            EXIT WHEN moved;
+        END LOOP;
+        IF NOT moved THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+    FOREACH r IN ARRAY ARRAY[n, o] LOOP
+        CONTINUE WHEN r IS NULL OR COALESCE(r->>'date', '') = '' OR COALESCE(r->>'business_id', '') = '';
+        UPDATE period_snapshots SET stale = true
+         WHERE business_id = r->>'business_id' AND period >= LEFT(r->>'date', 7) AND stale IS NOT TRUE;
+    END LOOP;
+    RETURN NULL;
+END $$;
+
+-- table, the columns its customer / supplier / GL balance is built from
+DO $$
+DECLARE t RECORD;
+BEGIN
+    FOR t IN SELECT * FROM (VALUES
+        ('journals', 'date,account_code,debit,credit'),
+        ('invoices', 'date,total,customer_id,invoice_number,status'),
+        ('sales', 'date,total,customer_id,payment_method,status'),
+        ('receipts', 'date,amount,discount_total,customer_id,customer_name,reference'),
+        ('credit_notes', 'date,total,customer_id,invoice_number,status'),
+        ('supplier_invoices', 'date,total,supplier_id,status'),
+        ('supplier_payments', 'date,amount,discount_total,supplier_id,supplier_name'),
+        ('supplier_credit_notes', 'date,total,supplier_id,status')
+    ) AS v(tbl, cols) LOOP
+        IF to_regclass(t.tbl) IS NOT NULL THEN
+            EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_period_stale ON %I', t.tbl, t.tbl);
+            EXECUTE format('CREATE TRIGGER trg_%s_period_stale AFTER INSERT OR UPDATE OR DELETE ON %I '
+                           'FOR EACH ROW EXECUTE FUNCTION period_snapshots_mark_stale(%s)',
+                           t.tbl, t.tbl,
+                           (SELECT string_agg(quote_literal(c), ',') FROM unnest(string_to_array(t.cols, ',')) c));
+        END IF;
+    END LOOP;
+END $$;
+"""
\ No newline at end of file
@@ -15,6 +15,8 @@ from decimal import Decimal
 from concurrent.futures import ThreadPoolExecutor
 from flask import request, jsonify, session, redirect, flash
 
+from clickai_allocation_log import reversed_sources
+
 logger = logging.getLogger(__name__)
 
 # SA VAT rate constant (same as in clickai.py)
@@ -26,7 +28,7 @@ def register_pos_routes(app, db, login_required, Auth, render_page,
                         next_document_number, get_user_role, get_zane_chat,
                         RecordFactory, CSS, now, today, extract_time,
                         create_journal_entry, log_allocation, gl,
-                        AuditLog, Email):
+                        AuditLog, Email, commit_pos_sale):
     """Register all POS and Bar routes with the Flask app."""
 
     @app.route("/pos")
@@ -42,12 +44,12 @@ def register_pos_routes(app, db, login_required, Auth, render_page,
         # Get stock, customers, suppliers IN PARALLEL (was sequential — each takes 0.5-2s)
         from concurrent.futures import ThreadPoolExecutor
         with ThreadPoolExecutor(max_workers=4) as pool:
-            f_stock = pool.submit(db.get_all_stock, biz_id)
+            f_stock = pool.submit(db.stock_catalog, biz_id)
             f_customers = pool.submit(db.get, "customers", {"business_id": biz_id}) if biz_id else None
             f_suppliers = pool.submit(db.get, "suppliers", {"business_id": biz_id}) if biz_id else None
             f_cashiers = pool.submit(db.get_business_users, biz_id) if biz_id else None
         
-        stock = f_stock.result(timeout=15) or []
+        stock = f_stock.result(timeout=15).items
         customers = f_customers.result(timeout=15) if f_customers else []
         customers = customers or []
         suppliers = f_suppliers.result(timeout=15) if f_suppliers else []
@@ -107,17 +109,17 @@ def register_pos_routes(app, db, login_required, Auth, render_page,
             pass
         
         # Sort stock by category then code
-        stock = sorted(stock, key=lambda x: (x.get("category") or "ZZZ", x.get("code") or ""))
+        stock = sorted(stock, key=lambda x: (x.category or "ZZZ", x.code))
         
         # Build stock rows for the table (only first 100 visible for fast render)
         stock_rows = ""
         total_stock_count = len(stock)
         for row_idx, item in enumerate(stock):
-            code = safe_string(item.get("code", ""))
-            desc = safe_string(item.get("description", ""))
-            price = float(item.get("price") or item.get("selling_price") or 0)
-            qty = float(item.get("qty") or item.get("quantity") or 0)
-            category = safe_string(item.get("category", ""))
+            code = safe_string(item.code)
+            desc = safe_string(item.description)
+            price = item.price
+            qty = item.qty
+            category = safe_string(item.category)
             
             # Stock status styling
             stock_class = ""
@@ -137,20 +139,20 @@ def register_pos_routes(app, db, login_required, Auth, render_page,
             row_hidden = ' style="display:none"' if row_idx >= 100 else ''
             stock_rows += f'''
             <tr class="stock-row {stock_class}"{row_hidden}
-                data-id="{item.get("id")}"
+                data-id="{item.id}"
                 data-code="{code}"
                 data-desc="{desc}"
                 data-price="{price}"
                 data-qty="{qty}"
                 data-disc="{_camp_pct(category)}"
                 data-search="{code.lower()} {desc.lower()}"
-                onclick="addToCart('{item.get("id")}', '{code}', '{desc}', {price}, {qty})">
+                onclick="addToCart('{item.id}', '{code}', '{desc}', {price}, {qty})">
                 <td class="col-code">{code}</td>
                 <td class="col-desc">{desc}</td>
                 <td class="col-price">R{price:,.2f}</td>
                 <td class="col-stock">{stock_badge}</td>
                 <td class="col-action">
-                    <button class="qty-btn" onclick="addBulkToCart(event, '{item.get("id")}', '{code}', '{desc}', {price}, {qty})" title="Enter quantity">QTY</button>
+                    <button class="qty-btn" onclick="addBulkToCart(event, '{item.id}', '{code}', '{desc}', {price}, {qty})" title="Enter quantity">QTY</button>
                 </td>
             </tr>
             '''
@@ -5793,31 +5795,10 @@ def register_pos_routes(app, db, login_required, Auth, render_page,
         # install) — refunded status lives ONLY in allocation_log (action=pos_refund /
         # invoice_reverse). Derive the excluded IDs here so X-Read, Z-Read and
         # Expected Cash never count a reversed transaction.
-        _reversed_invoice_ids = set()
-        _refunded_sale_ids = set()
         try:
-            _alloc_log = db.get("allocation_log", {"business_id": biz_id}, select="source_id,source_table,extra") or []
-            for _al in _alloc_log:
-                _src_id = _al.get("source_id", "")
-                if not _src_id:
-                    continue
-                _extra_raw = _al.get("extra", "{}")
-                if isinstance(_extra_raw, str):
-                    try:
-                        _extra = json.loads(_extra_raw) if _extra_raw else {}
-                    except Exception:
-                        _extra = {}
-                elif isinstance(_extra_raw, dict):
-                    _extra = _extra_raw
-                else:
-                    _extra = {}
-                _action = _extra.get("action", "")
-                if _action == "invoice_reverse" and _al.get("source_table") == "invoices":
-                    _reversed_invoice_ids.add(_src_id)
-                elif _action == "pos_refund" and _al.get("source_table") == "sales":
-                    _refunded_sale_ids.add(_src_id)
+            _reversed_invoice_ids, _refunded_sale_ids = reversed_sources(db, biz_id)
         except Exception:
-            pass
+            _reversed_invoice_ids, _refunded_sale_ids = set(), set()
         
         def _sale_active(s):
             return (s.get("status") or "").lower() not in ("refunded", "reversed") and s.get("id") not in _refunded_sale_ids
@@ -6929,6 +6910,9 @@ def register_pos_routes(app, db, login_required, Auth, render_page,
             _vcamp_active = bool(_vcamp.get("active"))
             _vcamp_cats = {(k or "").strip().lower(): float(v or 0) for k, v in (_vcamp.get("categories") or {}).items()}
             _vcamp_default = float(_vcamp.get("default_pct") or 0)
+            # Every line's stock row in ONE batched read: the campaign category,
+            # the cost of sales and the on-hand all come from it
+            _stock_by_id = db.get_many_stock([_it.get("stock_id") for _it in items])
             for _it in items:
                 try:
                     _ipct = float(_it.get("discount_pct", 0) or 0)
@@ -6938,7 +6922,7 @@ def register_pos_routes(app, db, login_required, Auth, render_page,
                     continue
                 _allowed = _manual_pct
                 if _vcamp_active and _it.get("stock_id"):
-                    _st = db.get_one_stock(_it.get("stock_id"))
+                    _st = _stock_by_id.get(str(_it.get("stock_id")))
                     if _st:
                         _cpct = float(_vcamp_cats.get((_st.get("category") or "").strip().lower(), _vcamp_default) or 0)
                         if _cpct > 0:
@@ -6965,7 +6949,7 @@ def register_pos_routes(app, db, login_required, Auth, render_page,
             # ═══════════════════════════════════════════════════════════════
             if not customer_id and biz_id:
                 try:
-                    _all_custs = db.get("customers", {"business_id": biz_id}) or []
+                    _all_custs = db.get("customers", {"business_id": biz_id}, select="id,name,created_at") or []
                     _cs_matches = []
                     for _c in _all_custs:
                         _cn = (_c.get("name") or "").strip().lower()
@@ -7032,26 +7016,6 @@ def register_pos_routes(app, db, login_required, Auth, render_page,
                 "created_at": now()
             }
             
-            success, err = db.save("sales", sale)
-            
-            # If payment_total/rounding columns don't exist yet, retry without them
-            if not success and ("payment_total" in str(err) or "rounding" in str(err)):
-                logger.warning(f"[POS] payment_total/rounding columns missing, retrying without them")
-                sale.pop("payment_total", None)
-                sale.pop("rounding", None)
-                success, err = db.save("sales", sale)
-            
-            # If created_by column doesn't exist, retry without it
-            if not success and "created_by" in str(err):
-                logger.warning(f"[POS] created_by column missing, retrying without it")
-                sale.pop("created_by", None)
-                sale["notes"] = f"Cashier: {data.get('cashier_name', '')}"
-                success, err = db.save("sales", sale)
-            
-            if not success:
-                logger.error(f"[POS] Sale save failed: {err}")
-                return jsonify({"success": False, "error": f"Failed to save sale: {str(err)[:200]}"})
-            
             # === GL ENTRIES ===
             
             # Determine debit account based on payment method
@@ -7080,63 +7044,34 @@ def register_pos_routes(app, db, login_required, Auth, render_page,
             elif rounding_adj < 0:
                 # Customer paid LESS (e.g. R10.06 → R10.00) — small expense to cash_short
                 journal_lines.append({"account_code": gl(biz_id, "cash_short"), "debit": float(abs(rounding_adj)), "credit": 0})
+            journals = [(f"POS Sale {sale_num} - {customer_name} ({debit_name})", sale_num, journal_lines)]
             
-            # Create journal entry for the sale
-            create_journal_entry(
-                biz_id,
-                today(),
-                f"POS Sale {sale_num} - {customer_name} ({debit_name})",
-                sale_num,
-                journal_lines
-            )
-            
-            # Update stock quantities and create Cost of Sales entries
+            # Stock to move and Cost of Sales, from the rows read above
             total_cost = Decimal("0")
+            stock_lines = []
             for item in items:
-                stock_id = item.get("stock_id")
-                qty_sold = int(item.get("quantity", 0))
-                
-                if stock_id:
-                    stock_item = db.get_one_stock(stock_id)
-                    if stock_item:
-                        current_qty = float(stock_item.get("qty") or stock_item.get("quantity") or 0)
-                        new_qty = current_qty - qty_sold
-                        
-                        if qty_sold > 0:
-                            success = db.update_stock(stock_id, {"qty": new_qty, "quantity": new_qty}, biz_id)
-                            if not success:
-                                logger.error(f"[POS] Failed to update stock {stock_id} - qty was {current_qty}, tried to set {new_qty}")
-                            else:
-                                try:
-                                    db.save("stock_movements", RecordFactory.stock_movement(
-                                        business_id=biz_id, stock_id=stock_id, movement_type="out",
-                                        quantity=qty_sold, reference=f"POS Sale {sale_num}"
-                                    ))
-                                except Exception as sm_err: logger.error(f"[STOCK MOVEMENT] Save failed: {sm_err}")
-                        
-                        cost_price = Decimal(str(stock_item.get("cost") or stock_item.get("cost_price") or 0))
-                        line_cost = cost_price * qty_sold
-                        total_cost += line_cost
-            
-            # Create Cost of Sales journal entry (if there's cost)
+                stock_item = _stock_by_id.get(str(item.get("stock_id") or ""))
+                if stock_item:
+                    qty_sold = int(item.get("quantity", 0))
+                    stock_lines.append({"stock_id": item.get("stock_id"), "quantity": qty_sold,
+                                        "on_hand": float(stock_item.get("qty") or stock_item.get("quantity") or 0)})
+                    cost_price = Decimal(str(stock_item.get("cost") or stock_item.get("cost_price") or 0))
+                    total_cost += cost_price * qty_sold
             if total_cost > 0:
-                create_journal_entry(
-                    biz_id,
-                    today(),
-                    f"COS - POS Sale {sale_num}",
-                    f"COS-{sale_num}",
-                    [
-                        {"account_code": gl(biz_id, "cogs"), "debit": float(total_cost), "credit": 0},   # Cost of Sales
-                        {"account_code": gl(biz_id, "stock"), "debit": 0, "credit": float(total_cost)},   # Stock
-                    ]
-                )
-            
-            # Update customer balance if account sale
-            if customer_id and payment_method == "account":
-                customer = db.get_one("customers", customer_id)
-                if customer:
-                    new_balance = float(customer.get("balance", 0)) + float(total)
-                    db.update("customers", customer_id, {"balance": new_balance})
+                journals.append((f"COS - POS Sale {sale_num}", f"COS-{sale_num}", [
+                    {"account_code": gl(biz_id, "cogs"), "debit": float(total_cost), "credit": 0},   # Cost of Sales
+                    {"account_code": gl(biz_id, "stock"), "debit": 0, "credit": float(total_cost)},   # Stock
+                ]))
+            
+            # Sale, journals, stock movements and the account customer's
+            # balance in one commit (one RPC once POS_SALE_SQL has been run)
+            success, err, _ = commit_pos_sale(
+                biz_id, sale, journals, stock_lines,
+                customer_id=customer_id if payment_method == "account" else None,
+                balance_delta=float(total))
+            if not success:
+                logger.error(f"[POS] Sale save failed: {err}")
+                return jsonify({"success": False, "error": f"Failed to save sale: {str(err)[:200]}"})
             
             logger.info(f"[POS] Sale {sale_num}: R{total:.2f} ({payment_method}) - GL entries created")
             
@@ -7243,20 +7178,6 @@ def register_pos_routes(app, db, login_required, Auth, render_page,
                         "notes": f"OFFLINE SALE — synced {now()}"
                     }
                     
-                    success, err = db.save("sales", sale)
-                    if not success and ("payment_total" in str(err) or "rounding" in str(err)):
-                        sale.pop("payment_total", None)
-                        sale.pop("rounding", None)
-                        success, err = db.save("sales", sale)
-                    if not success and "created_by" in str(err):
-                        sale.pop("created_by", None)
-                        sale["notes"] = f"OFFLINE SALE — Cashier: {queued_sale.get('cashier_name', '')} — synced {now()}"
-                        success, err = db.save("sales", sale)
-                    
-                    if not success:
-                        errors.append(f"Sale R{total}: {str(err)[:100]}")
-                        continue
-                    
                     # GL entries
                     if payment_method == "cash":
                         debit_account, debit_name = "1050", "Cash"
@@ -7275,33 +7196,17 @@ def register_pos_routes(app, db, login_required, Auth, render_page,
                     elif rounding_adj < 0:
                         journal_lines.append({"account_code": gl(biz_id, "cash_short"), "debit": float(abs(rounding_adj)), "credit": 0})
                     
-                    create_journal_entry(
-                        biz_id, sale_date,
-                        f"OFFLINE POS Sale {sale_num} - {customer_name} ({debit_name})",
-                        sale_num,
-                        journal_lines
-                    )
-                    
-                    # Update stock
-                    for item in items:
-                        stock_id = item.get("stock_id")
-                        qty_sold = int(item.get("quantity", 0))
-                        if stock_id and qty_sold > 0:
-                            stock_item = db.get_one_stock(stock_id)
-                            if stock_item:
-                                current_qty = float(stock_item.get("qty") or stock_item.get("quantity") or 0)
-                                new_qty = current_qty - qty_sold
-                                db.update_stock(stock_id, {"qty": new_qty, "quantity": new_qty}, biz_id)
-                    
-                    # Update customer balance for account sales
-                    if payment_method == "account" and customer_id:
-                        try:
-                            cust = db.get_by_id("customers", customer_id)
-                            if cust:
-                                old_bal = float(cust.get("balance") or 0)
-                                db.update("customers", customer_id, {"balance": old_bal + float(total)})
-                        except Exception:
-                            pass
+                    # Sale, journal, stock and account balance in one commit
+                    success, err, _ = commit_pos_sale(
+                        biz_id, sale,
+                        [(f"OFFLINE POS Sale {sale_num} - {customer_name} ({debit_name})", sale_num, journal_lines)],
+                        [{"stock_id": item.get("stock_id"), "quantity": int(item.get("quantity", 0)), "on_hand": None}
+                         for item in items],
+                        customer_id=customer_id if payment_method == "account" else None,
+                        balance_delta=float(total))
+                    if not success:
+                        errors.append(f"Sale R{total}: {str(err)[:100]}")
+                        continue
                     
                     synced += 1
                     logger.info(f"[POS OFFLINE SYNC] Sale {sale_num}: R{total:.2f} ({payment_method}) — originally {sale_date} {sale_time}")
@@ -7728,24 +7633,20 @@ def register_pos_routes(app, db, login_required, Auth, render_page,
                 return jsonify({"success": False, "error": str(err)})
             
             # Update stock quantities
+            _stock_by_id = db.get_many_stock([item.get("stock_id") for item in items])
             for item in items:
                 stock_id = item.get("stock_id")
                 qty_sold = int(item.get("quantity", 0))
                 
                 if stock_id and qty_sold > 0:
-                    stock_item = db.get_one_stock(stock_id)
+                    stock_item = _stock_by_id.get(str(stock_id))
                     if stock_item:
                         current_qty = float(stock_item.get("qty") or stock_item.get("quantity") or 0)
-                        new_qty = current_qty - qty_sold
-                        db.update_stock(stock_id, {"qty": new_qty, "quantity": new_qty}, biz_id)
-                        logger.info(f"[POS INV] Stock {stock_id}: {current_qty} - {qty_sold} = {new_qty}")
-                        # Log stock movement
-                        try:
-                            db.save("stock_movements", RecordFactory.stock_movement(
-                                business_id=biz_id, stock_id=stock_id, movement_type="out",
-                                quantity=qty_sold, reference=f"Invoice {inv_num}"
-                            ))
-                        except Exception as sm_err: logger.error(f"[STOCK MOVEMENT] Save failed: {sm_err}")
+                        new_qty = db.move_stock(biz_id, stock_id, "sale", qty_sold,
+                                                reference=f"Invoice {inv_num}", on_hand=current_qty)
+                        if new_qty is not None:
+                            stock_item["qty"] = stock_item["quantity"] = new_qty
+                            logger.info(f"[POS INV] Stock {stock_id}: {current_qty} - {qty_sold} = {new_qty}")
             
             # Update customer balance
             customer = db.get_one("customers", customer_id)
@@ -7902,24 +7803,20 @@ def register_pos_routes(app, db, login_required, Auth, render_page,
                 return jsonify({"success": False, "error": str(err)})
             
             # Return stock to inventory
+            _stock_by_id = db.get_many_stock([item.get("stock_id") for item in items])
             for item in items:
                 stock_id = item.get("stock_id")
                 qty_returned = int(item.get("quantity", 0))
                 
                 if stock_id and qty_returned > 0:
-                    stock_item = db.get_one_stock(stock_id)
+                    stock_item = _stock_by_id.get(str(stock_id))
                     if stock_item:
                         current_qty = float(stock_item.get("qty") or stock_item.get("quantity") or 0)
-                        new_qty = current_qty + qty_returned
-                        db.update_stock(stock_id, {"qty": new_qty, "quantity": new_qty}, biz_id)
-                        logger.info(f"[POS CN] Stock {stock_id}: {current_qty} + {qty_returned} = {new_qty}")
-                        # Log stock movement
-                        try:
-                            db.save("stock_movements", RecordFactory.stock_movement(
-                                business_id=biz_id, stock_id=stock_id, movement_type="in",
-                                quantity=qty_returned, reference=f"Credit Note {cn_num}"
-                            ))
-                        except Exception as sm_err: logger.error(f"[STOCK MOVEMENT] Save failed: {sm_err}")
+                        new_qty = db.move_stock(biz_id, stock_id, "return", qty_returned,
+                                                reference=f"Credit Note {cn_num}", on_hand=current_qty)
+                        if new_qty is not None:
+                            stock_item["qty"] = stock_item["quantity"] = new_qty
+                            logger.info(f"[POS CN] Stock {stock_id}: {current_qty} + {qty_returned} = {new_qty}")
             
             # Update customer balance (reduce it)
             customer = db.get_one("customers", customer_id)
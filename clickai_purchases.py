@@ -3465,10 +3465,15 @@ def register_purchases_routes(app, db, login_required, Auth, render_page,
                 code = str(s.get("code", "")).upper().strip()
                 if code:
                     stock_by_code[code] = s
+            ledger_moved_ids = set()   # received through the stock ledger - not logged again below
             
             # Abbreviations for smart code generation
             abbrevs = {"STAINLESS": "SS", "STEEL": "ST", "FLAT": "FL", "BAR": "BR", "ROUND": "RD", "SQUARE": "SQ", "PIPE": "PP", "TUBE": "TB", "SHEET": "SH", "PLATE": "PL", "ANGLE": "AN", "GALV": "GV", "HEX": "HX", "BOLT": "BLT", "NUT": "NT", "WASHER": "WS", "HOSE": "HS", "CLAMP": "CL", "VALVE": "VL", "FLANGE": "FL", "REDUCER": "RD", "COUPLING": "CP", "ELBOW": "EL", "TEE": "TE", "NIPPLE": "NP", "CAP": "CP", "PLUG": "PG", "BUSH": "BS", "FITTING": "FT", "SCREW": "SC"}
             
+            # Linked stock for every received line in one lookup
+            _stock_by_id = db.get_many_stock(
+                [items[int(i)].get("stock_id") for i in quantities if 0 <= int(i) < len(items)]
+            ) if update_stock else {}
             for idx_str, qty_received in quantities.items():
                 idx = int(idx_str)
                 if 0 <= idx < len(items):
@@ -3482,7 +3487,7 @@ def register_purchases_routes(app, db, login_required, Auth, render_page,
                     stock_item = None
                     
                     if stock_id:
-                        stock_item = db.get_one_stock(stock_id)
+                        stock_item = _stock_by_id.get(str(stock_id))
                     
                     if not stock_item and stock_id:
                         # stock_id exists but item not found - try by code
@@ -3536,8 +3541,7 @@ def register_purchases_routes(app, db, login_required, Auth, render_page,
                     # Now update the stock quantity + cost/selling price
                     if stock_item:
                         current_qty = float(stock_item.get("qty") or stock_item.get("quantity") or 0)
-                        new_qty = current_qty + qty_received
-                        stock_updates = {"qty": new_qty, "quantity": new_qty}
+                        stock_updates = {}
                         
                         # Update cost price from PO and recalc selling price (maintain markup %)
                         po_price = float(items[idx].get("price", 0) or 0)
@@ -3555,7 +3559,14 @@ def register_purchases_routes(app, db, login_required, Auth, render_page,
                             stock_updates["price"] = new_sell
                             logger.info(f"[PO RECEIVE] Price recalc {stock_item.get('code','')}: cost {old_cost}->{po_price}, sell {old_sell}->{new_sell}")
                         
-                        db.update_stock(stock_item["id"], stock_updates, biz_id)
+                        moved = db.move_stock(biz_id, stock_item["id"], "grv", qty_received,
+                                              reference=f"{po.get('po_number', '')} | {safe_string(po.get('supplier_name', ''))}",
+                                              updates=stock_updates, on_hand=current_qty)
+                        if moved is not None:
+                            ledger_moved_ids.add(str(stock_item["id"]))
+                        new_qty = moved if moved is not None else current_qty
+                        stock_updates["qty"] = stock_updates["quantity"] = new_qty
+                        stock_item.update(stock_updates)   # a repeat line starts from here
                         logger.info(f"[PO RECEIVE] Updated stock {stock_item.get('code')}: {current_qty} + {qty_received} = {new_qty}")
                         
                         # Store stock info in item for GRV tracking
@@ -3683,7 +3694,7 @@ def register_purchases_routes(app, db, login_required, Auth, render_page,
             # Log stock movements SEPARATELY - don't let GRV failure block this
             movements_logged = 0
             for ri in received_items:
-                if ri.get("stock_id") and ri.get("booked_to_stock"):
+                if ri.get("stock_id") and ri.get("booked_to_stock") and str(ri["stock_id"]) not in ledger_moved_ids:
                     try:
                         db.save("stock_movements", RecordFactory.stock_movement(
                             business_id=biz_id, stock_id=ri["stock_id"], movement_type="in",
@@ -4700,7 +4711,8 @@ def register_purchases_routes(app, db, login_required, Auth, render_page,
         Returns (success, message).
         
         For each snapshot entry:
-          - action='updated': restore old_qty/cost/sell exactly (subtracts delta)
+          - action='updated': take delta_qty back off (an adjustment on the stock
+            ledger, so sales since the invoice stay counted); restore cost/sell
           - action='created': delete the stock_items row
         """
         if not snapshots:
@@ -4728,23 +4740,27 @@ def register_purchases_routes(app, db, login_required, Auth, render_page,
                     except Exception as e:
                         logger.warning(f"[REVERSE] Could not delete created stock {stock_id}: {e}")
                 else:
-                    # Updated: restore old qty/cost/sell exactly
+                    # Updated: take the invoice's units back off, restore cost/sell
                     old_qty = float(snap.get("old_qty", 0) or 0)
                     old_cost = float(snap.get("old_cost", 0) or 0)
                     old_sell = float(snap.get("old_sell", 0) or 0)
                     
                     restore_payload = {
-                        "id": stock_id,
-                        "quantity": old_qty,
-                        "qty": old_qty,
                         "cost_price": old_cost,
                         "cost": old_cost,
                     }
                     if old_sell > 0:
                         restore_payload["selling_price"] = old_sell
                         restore_payload["price"] = old_sell
-                    db.save(table, restore_payload)
-                    logger.info(f"[REVERSE] Restored stock {snap.get('code','?')}: qty={old_qty}, cost={old_cost}, sell={old_sell}")
+                    if snap.get("delta_qty") is not None:
+                        delta = -float(snap.get("delta_qty") or 0)
+                    else:
+                        # Old snapshots without the delta: back to old_qty
+                        cur = db.get_one_stock(stock_id) or {}
+                        delta = old_qty - float(cur.get("quantity", cur.get("qty", 0)) or 0)
+                    new_qty = db.move_stock(biz_id, stock_id, "adjustment", delta,
+                                            reference="Supplier invoice reversed", updates=restore_payload)
+                    logger.info(f"[REVERSE] Restored stock {snap.get('code','?')}: qty {delta:+} = {new_qty}, cost={old_cost}, sell={old_sell}")
             except Exception as e:
                 logger.error(f"[REVERSE] Snapshot entry failed: {e}")
         
@@ -4800,9 +4816,9 @@ def register_purchases_routes(app, db, login_required, Auth, render_page,
                 if sd == desc or (desc and desc in sd) or (sd and sd in desc):
                     current_qty = float(s.get("quantity", s.get("qty", 0)) or 0)
                     new_qty = max(0, current_qty - actual)
-                    table = "stock" if "code" in s and s.get("code") and not s.get("description","").startswith("__") else "stock_items"
                     try:
-                        db.save(table, {"id": s["id"], "quantity": new_qty, "qty": new_qty})
+                        db.move_stock(biz_id, s["id"], "adjustment", new_qty - current_qty,
+                                      reference="Supplier invoice reversed", on_hand=current_qty)
                         reversed_count += 1
                     except Exception as e:
                         logger.warning(f"[REVERSE-LEGACY] Could not reverse stock {s.get('code')}: {e}")
@@ -4902,7 +4918,6 @@ def register_purchases_routes(app, db, login_required, Auth, render_page,
                     old_qty = float(matched.get("quantity", matched.get("qty", 0)) or 0)
                     old_cost = float(matched.get("cost_price", matched.get("cost", 0)) or 0)
                     old_sell = float(matched.get("selling_price", matched.get("price", 0)) or 0)
-                    new_qty = old_qty + qty
                     table = "stock" if matched in all_stock else "stock_items"
                     
                     new_snapshots.append({
@@ -4913,7 +4928,6 @@ def register_purchases_routes(app, db, login_required, Auth, render_page,
                     })
                     
                     update_payload = {
-                        "id": matched["id"], "quantity": new_qty, "qty": new_qty,
                         "cost_price": cost_per_unit, "cost": cost_per_unit, "last_purchase_date": today()
                     }
                     if old_cost > 0 and old_sell > 0 and cost_per_unit > 0:
@@ -4921,7 +4935,8 @@ def register_purchases_routes(app, db, login_required, Auth, render_page,
                         new_sell = round(cost_per_unit * markup_ratio, 2)
                         update_payload["selling_price"] = new_sell
                         update_payload["price"] = new_sell
-                    db.save(table, update_payload)
+                    db.move_stock(biz_id, matched["id"], "grv", qty, reference="Supplier invoice edited",
+                                  updates=update_payload, on_hand=old_qty)
                 else:
                     # Create new stock item
                     final_code = smart_stock_code(desc, set(s.get("code","").upper() for s in all_stock if s.get("code")))
@@ -6964,16 +6979,8 @@ Nothing else."""
                 if not sid:
                     continue
                 try:
-                    stock_item = db.get_one_stock(sid)
-                    if stock_item:
-                        cur_qty = float(stock_item.get("qty") or stock_item.get("quantity") or 0)
-                        new_qty = cur_qty - cl["quantity"]
-                        db.update_stock(sid, {"qty": new_qty, "quantity": new_qty}, biz_id)
-                        db.save("stock_movements", RecordFactory.stock_movement(
-                            business_id=biz_id, stock_id=sid, movement_type="out",
-                            quantity=cl["quantity"],
-                            reference=f"{cn_number} | Supplier Return | {safe_string(supplier_name)}"
-                        ))
+                    db.move_stock(biz_id, sid, "supplier_return", cl["quantity"],
+                                  reference=f"{cn_number} | Supplier Return | {safe_string(supplier_name)}")
                 except Exception as se:
                     logger.error(f"[SUP RETURN] Stock decrement failed for {sid}: {se}")
             
@@ -7200,7 +7207,8 @@ Nothing else."""
                                                 # On 'created', the entire current qty IS the delta.
                                                 reduce_by = cur_qty * ratio
                                                 new_qty = max(0, cur_qty - reduce_by)
-                                                db.save(table, {"id": stock_id, "quantity": new_qty, "qty": new_qty})
+                                                db.move_stock(biz_id, stock_id, "adjustment", new_qty - cur_qty,
+                                                              reference="Supplier credit note", on_hand=cur_qty)
                                                 partial_reversed += 1
                                         except Exception as _e:
                                             logger.warning(f"[CN-PARTIAL] created-stock partial reduce failed: {_e}")
@@ -7220,7 +7228,8 @@ Nothing else."""
                                     snap_delta = delta_added
                                 reduce_by = snap_delta * ratio
                                 new_qty = max(0, cur_qty - reduce_by)
-                                db.save(table, {"id": stock_id, "quantity": new_qty, "qty": new_qty})
+                                db.move_stock(biz_id, stock_id, "adjustment", new_qty - cur_qty,
+                                              reference="Supplier credit note", on_hand=cur_qty)
                                 partial_reversed += 1
                             except Exception as _e:
                                 logger.warning(f"[CN-PARTIAL] snapshot entry partial reverse failed: {_e}")
@@ -8,14 +8,24 @@
 # ==============================================================================
 
 import os
+import re
 import json
 import time
 import logging
 import traceback
+import urllib.parse
 from datetime import datetime, timedelta
 from decimal import Decimal
 from concurrent.futures import ThreadPoolExecutor
-from flask import request, jsonify, session, redirect, flash
+from flask import request, jsonify, session, redirect, flash, Response, stream_with_context
+
+from clickai_tb import trial_balance, PNL_SECTIONS
+
+try:
+    from clickai_aging import supplier_invoice_aging
+    AGING_LOADED = True
+except ImportError:
+    AGING_LOADED = False
 
 logger = logging.getLogger(__name__)
 
@@ -846,47 +856,61 @@ def register_report_routes(app, db, login_required, Auth, render_page,
         # === SOURCE 1: Unpaid supplier invoices — outstanding is calculated
         # from the source documents: invoice total minus payments already
         # allocated (paid_amount). Credited invoices are closed. ===
-        outstanding_sinv = [p for p in supplier_invoices if p.get("status") not in ("paid", "credited")]
-        for p in outstanding_sinv:
-            supp_id = p.get("supplier_id")
-            supp_name = p.get("supplier_name", "Unknown")
-            
-            key = supp_id or supp_name
-            if not key or key == "Unknown":
-                continue
-            
-            if key not in aging_data:
+        # Statement-based aging (Sage): buckets by calendar MONTH.
+        # Current = this month's invoices; 31-60 = last month's, payable
+        # 30 days from statement; 61-90 = two months back, and so on.
+        # Bucketed for all suppliers at once (clickai_aging) when it loads.
+        if AGING_LOADED:
+            _sinv_names = {}
+            for p in supplier_invoices:
+                if p.get("status") not in ("paid", "credited"):
+                    _sinv_names.setdefault(p.get("supplier_id") or p.get("supplier_name", "Unknown"),
+                                           p.get("supplier_name", "Unknown"))
+            for key, _b in supplier_invoice_aging(supplier_invoices, today_date.isoformat()).items():
+                supp_id = key if key in supplier_map else None
                 supp = supplier_map.get(supp_id, {}) if supp_id else {}
                 aging_data[key] = {
-                    "name": supp.get("name") or supp_name,
-                    "current": 0, "d30": 0, "d60": 0, "d90": 0, "d120": 0, "total": 0
+                    "name": supp.get("name") or _sinv_names.get(key, "Unknown"),
+                    "current": _b["current"], "d30": _b["30"], "d60": _b["60"],
+                    "d90": _b["90"], "d120": _b["120"], "total": _b["total"]
                 }
-            
-            try:
-                p_date = datetime.strptime(p.get("date", today()), "%Y-%m-%d").date()
-            except:
-                p_date = today_date
-            
-            # Statement-based aging (Sage): buckets by calendar MONTH.
-            # Current = this month's invoices; 31-60 = last month's, payable
-            # 30 days from statement; 61-90 = two months back, and so on.
-            months_old = (today_date.year - p_date.year) * 12 + (today_date.month - p_date.month)
-            amount = round(float(p.get("total", 0) or 0) - float(p.get("paid_amount", 0) or 0), 2)
-            if amount <= 0:
-                continue  # fully covered by payments — nothing left to age
-            
-            if months_old <= 0:
-                aging_data[key]["current"] += amount
-            elif months_old == 1:
-                aging_data[key]["d30"] += amount
-            elif months_old == 2:
-                aging_data[key]["d60"] += amount
-            elif months_old == 3:
-                aging_data[key]["d90"] += amount
-            else:
-                aging_data[key]["d120"] += amount
-            
-            aging_data[key]["total"] += amount
+        else:
+            for p in supplier_invoices:
+                if p.get("status") in ("paid", "credited"):
+                    continue
+                supp_id = p.get("supplier_id")
+                supp_name = p.get("supplier_name", "Unknown")
+
+                key = supp_id or supp_name
+                if not key or key == "Unknown":
+                    continue
+
+                try:
+                    p_date = datetime.strptime(p.get("date", today()), "%Y-%m-%d").date()
+                except Exception:
+                    p_date = today_date
+
+                months_old = (today_date.year - p_date.year) * 12 + (today_date.month - p_date.month)
+                amount = round(float(p.get("total", 0) or 0) - float(p.get("paid_amount", 0) or 0), 2)
+                if amount <= 0:
+                    continue  # fully covered by payments — nothing left to age
+
+                if key not in aging_data:
+                    supp = supplier_map.get(supp_id, {}) if supp_id else {}
+                    aging_data[key] = {
+                        "name": supp.get("name") or supp_name,
+                        "current": 0, "d30": 0, "d60": 0, "d90": 0, "d120": 0, "total": 0
+                    }
+                if months_old <= 0:
+                    aging_data[key]["current"] += amount
+                elif months_old == 1:
+                    aging_data[key]["d30"] += amount
+                elif months_old == 2:
+                    aging_data[key]["d60"] += amount
+                elif months_old == 3:
+                    aging_data[key]["d90"] += amount
+                else:
+                    aging_data[key]["d120"] += amount
         
         # Reconcile each supplier's invoice aging to their CALCULATED ledger
         # balance (invoices - payments - credits), so on-account payments
@@ -1024,6 +1048,61 @@ def register_report_routes(app, db, login_required, Auth, render_page,
 
     # === GL REPORT, TRIAL BALANCE, PnL, BALANCE SHEET, VAT ===
 
+    GL_LINES_PAGE = 200      # journal lines per "Load more" on the GL page
+    GL_SEARCH_LIMIT = 200    # matches the GL search reads
+    TB_MAX_COMPARE = 3       # comparative periods on the TB / P&L / balance sheet
+
+    def _compare_arg():
+        """?compare=N comparative periods, 0..TB_MAX_COMPARE."""
+        try:
+            return max(0, min(TB_MAX_COMPARE, int(request.args.get("compare", 0))))
+        except (TypeError, ValueError):
+            return 0
+
+    def _years_before(day, years):
+        """'2026-02-28' -> '2025-02-28' (29 Feb falls back to the 28th)."""
+        d = datetime.strptime(day[:10], "%Y-%m-%d")
+        try:
+            return d.replace(year=d.year - years).strftime("%Y-%m-%d")
+        except ValueError:
+            return d.replace(year=d.year - years, day=28).strftime("%Y-%m-%d")
+
+    def _compare_options(selected, unit):
+        """<option>s for the ?compare= select."""
+        out = ""
+        for n in range(TB_MAX_COMPARE + 1):
+            label = f"Compare {n} {unit}{'s' if n > 1 else ''}" if n else "No comparatives"
+            out += f'<option value="{n}" {"selected" if n == selected else ""}>{label}</option>'
+        return out
+
+    def _dr_cr(balance):
+        """A net balance as 'R 1,234.56 Dr' / 'R 1,234.56 Cr'."""
+        if abs(balance) < 0.005:
+            return ""
+        return f"R {abs(balance):,.2f} {'Dr' if balance > 0 else 'Cr'}"
+
+    def _tb_account_names(biz_id):
+        """names / default_names for trial_balance(): the accounts table first,
+        then (after the chart of accounts) the booking categories and the
+        ClickAI control accounts."""
+        all_accounts = db.get("accounts", {"business_id": biz_id}, select="code,name") or []
+        names = {a.get("code"): a.get("name") or f"Account {a.get('code')}" for a in all_accounts if a.get("code")}
+        default_names = {}
+        try:
+            for _grp in IndustryKnowledge.BOOKING_CATEGORIES.values():
+                for _cat_name, _gl_code in _grp.get("items", []):
+                    if _gl_code and _gl_code not in default_names:
+                        default_names[_gl_code] = _cat_name
+        except Exception:
+            pass
+        # Extra defaults not in BOOKING_CATEGORIES
+        for _c, _n in {"1200": "Debtors Control", "1400": "VAT Input", "1300": "Stock",
+                        "2000": "Creditors Control", "2200": "PAYE Payable", "3100": "Retained Earnings",
+                        "6000": "Salaries & Wages", "2210": "UIF Payable", "2220": "SDL Payable",
+                        "2400": "Payroll Deductions Payable", "6210": "Employer Payroll Costs (UIF/SDL)"}.items():
+            default_names.setdefault(_c, _n)
+        return {"names": names, "default_names": default_names}
+
     @app.route("/reports/gl")
     @login_required
     def report_gl():
@@ -1045,8 +1124,135 @@ def register_report_routes(app, db, login_required, Auth, render_page,
             logger.error(f"[GL REPORT] Traceback: {tb}")
             return render_page("General Ledger", f"<div class='card'><h3>Error loading GL</h3><pre style='color:var(--red);font-size:12px;white-space:pre-wrap;'>{safe_string(str(e))}\n\n{safe_string(tb[-500:])}</pre></div>", user, "reports")
     
+    def _gl_account_totals(biz_id):
+        """{account_code: {"debit", "credit", "lines"}} over every journal line -
+        from gl_balances once the business has been rebuilt, otherwise summed by
+        Postgres. Account and grand totals on the GL page come from here, never
+        from the lines shown, so they are right before any line is loaded."""
+        from clickai_gl_balances import is_ready
+        if is_ready(db, biz_id):
+            rows = db.aggregate("gl_balances", sums=["debit", "credit", "line_count"],
+                                group_by=["account_code"], filters={"business_id": biz_id})
+            return {r["account_code"]: {"debit": r["debit"], "credit": r["credit"], "lines": int(r["line_count"])}
+                    for r in rows if r.get("account_code") and (r["debit"] or r["credit"])}
+        rows = db.aggregate("journals", sums=["debit", "credit"], group_by=["account_code"], count=True,
+                            filters={"business_id": biz_id, "or": "(debit.neq.0,credit.neq.0)"})
+        return {r["account_code"]: {"debit": r["debit"], "credit": r["credit"], "lines": r["count"]}
+                for r in rows if r.get("account_code")}
+
+    def _gl_line_row(j):
+        _jdr = money(float(j.get("debit", 0) or 0)) if float(j.get("debit", 0) or 0) else "-"
+        _jcr = money(float(j.get("credit", 0) or 0)) if float(j.get("credit", 0) or 0) else "-"
+        return (f'<tr><td>{j.get("date") or "-"}</td><td>{safe_string(j.get("description") or "-")}</td>'
+                f'<td>{safe_string(j.get("reference") or "-")}</td><td style="text-align:right;color:var(--green);">{_jdr}</td>'
+                f'<td style="text-align:right;color:var(--red);">{_jcr}</td></tr>')
+
+    def _gl_lines_page(biz_id, code, before=None, limit=GL_LINES_PAGE):
+        """One page of an account's journal lines, newest first. before is the
+        (date, id) of the last line already on the page. Returns (lines, the
+        cursor for the next page or None)."""
+        tree = "or(debit.neq.0,credit.neq.0)"
+        if before:
+            _d, _i = (urllib.parse.quote(str(v), safe="-_.:") for v in before)
+            if _d:
+                tree += f",or(date.is.null,date.lt.{_d},and(date.eq.{_d},id.lt.{_i}))"
+            else:
+                tree += f",and(date.is.null,id.lt.{_i})"
+        rows = db.get("journals", {"business_id": biz_id, "account_code": code, "and": f"({tree})"},
+                      limit=limit + 1, select="id,date,description,reference,debit,credit",
+                      order="date.desc.nullslast,id.desc") or []
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, [rows[-1].get("date") or "", rows[-1].get("id")]
+
+    def _gl_lazy_detail(code, header_html):
+        """Detail panel whose journal lines are fetched when the account is opened."""
+        return f'''<div style="padding:0 10px 8px 10px;">
+                        <div style="font-size:11px;color:var(--text-muted);padding:4px 0;">{header_html}</div>
+                        <table class="table" style="font-size:11px;"><thead><tr><th>Date</th><th>Description</th><th>Ref</th><th style="text-align:right;">Debit</th><th style="text-align:right;">Credit</th></tr></thead><tbody></tbody></table>
+                        <button type="button" class="btn btn-secondary gl-more" style="display:none;font-size:11px;padding:3px 10px;" onclick="glLoad(this.closest('details'), true)">Load more</button>
+                    </div>'''
+
+    @app.route("/api/reports/gl/lines")
+    @login_required
+    def api_report_gl_lines():
+        """A page of one account's journal lines for the GL report (rendered rows)."""
+        business = Auth.get_current_business()
+        biz_id = business.get("id") if business else None
+        code = (request.args.get("code") or "").strip()
+        if not biz_id or not code:
+            return jsonify({"error": "No business or account"}), 400
+        before = None
+        if request.args.get("before_id"):
+            before = (request.args.get("before_date", ""), request.args["before_id"])
+        rows, cursor = _gl_lines_page(biz_id, code, before)
+        return jsonify({"html": "".join(_gl_line_row(j) for j in rows), "count": len(rows), "next": cursor})
+
+    @app.route("/api/reports/gl/search")
+    @login_required
+    def api_report_gl_search():
+        """Journal lines whose description or reference (or date) matches q - the
+        GL page search, done by Postgres since lines are only loaded per account."""
+        business = Auth.get_current_business()
+        biz_id = business.get("id") if business else None
+        q = " ".join(re.sub(r'[,()"*\\]', " ", request.args.get("q") or "").split())
+        if not biz_id or len(q) < 2:
+            return jsonify({"html": "", "count": 0})
+        pat = urllib.parse.quote(f'"*{q}*"', safe='"*')
+        tree = f"description.ilike.{pat},reference.ilike.{pat}"
+        if re.fullmatch(r"\d{4}-\d{2}-\d{2}", q):
+            tree += f",date.eq.{q}"
+        rows = db.get("journals", {"business_id": biz_id, "or": f"({tree})"}, limit=GL_SEARCH_LIMIT + 1,
+                      select="account_code,date,description,reference,debit,credit",
+                      order="date.desc.nullslast,id.desc") or []
+        if not rows:
+            return jsonify({"html": f'<span style="color:var(--text-muted);font-size:13px;">No entries found for "{safe_string(q)}"</span>',
+                            "count": 0})
+        _found = f"{GL_SEARCH_LIMIT}+" if len(rows) > GL_SEARCH_LIMIT else str(len(rows))
+        _cell = 'style="padding:3px 4px;"'
+        html = (f'<div style="font-weight:600;margin-bottom:8px;font-size:13px;">🔍 Found {_found} entries matching "{safe_string(q)}"</div>'
+                '<table style="width:100%;font-size:12px;border-collapse:collapse;">'
+                '<tr style="border-bottom:1px solid var(--border);"><th style="text-align:left;padding:4px;">Account</th><th style="text-align:left;padding:4px;">Date</th><th style="text-align:left;padding:4px;">Description</th><th style="text-align:left;padding:4px;">Ref</th><th style="text-align:right;padding:4px;">Debit</th><th style="text-align:right;padding:4px;">Credit</th></tr>')
+        for j in rows[:20]:
+            _dr = float(j.get("debit", 0) or 0)
+            _cr = float(j.get("credit", 0) or 0)
+            html += (f'<tr style="border-bottom:1px solid rgba(255,255,255,0.05);"><td {_cell}>{safe_string(j.get("account_code") or "")}</td>'
+                     f'<td {_cell}>{j.get("date") or "-"}</td><td {_cell}>{safe_string((j.get("description") or "-")[:40])}</td>'
+                     f'<td style="padding:3px 4px;color:var(--primary);">{safe_string(j.get("reference") or "-")}</td>'
+                     f'<td style="text-align:right;padding:3px 4px;">{money(_dr) if _dr else "-"}</td>'
+                     f'<td style="text-align:right;padding:3px 4px;">{money(_cr) if _cr else "-"}</td></tr>')
+        if len(rows) > 20:
+            html += f'<tr><td colspan="6" style="padding:6px;color:var(--text-muted);font-style:italic;">...and {_found if len(rows) > GL_SEARCH_LIMIT else len(rows) - 20} more</td></tr>'
+        html += '</table>'
+        return jsonify({"html": html, "count": min(len(rows), GL_SEARCH_LIMIT)})
+
     def _report_gl_inner(user, biz_id):
-        """GL built from chart_of_accounts (Sage import) OR journal_entries OB OR live ClickAI transactions"""
+        """GL built from chart_of_accounts (Sage import) OR journal_entries OB OR live ClickAI transactions.
+
+        Streamed: the page chrome goes out at once, then the account list as it
+        is built (totals from _gl_account_totals), then the grand totals. Each
+        account's journal lines are fetched page by page when it is opened."""
+        head, tail = render_page("General Ledger", "<!--GL-STREAM-->", user, "reports").split("<!--GL-STREAM-->", 1)
+
+        def generate():
+            yield head
+            state = {"debit": 0.0, "credit": 0.0, "source": "", "empty": True}
+            try:
+                for block in _gl_account_blocks(biz_id, state):
+                    yield block
+            except Exception as e:
+                logger.error(f"[GL REPORT] Crash: {e}\n{traceback.format_exc()}")
+                yield f"<div class='card'><h3>Error loading GL</h3><pre style='color:var(--red);font-size:12px;white-space:pre-wrap;'>{safe_string(str(e))}</pre></div>"
+            yield _gl_page_tail(state)
+            yield tail
+
+        return Response(stream_with_context(generate()), mimetype="text/html")
+
+    def _gl_account_blocks(biz_id, state):
+        """Yield the GL page header and one <details> block per account, adding
+        each account's totals to state["debit"] / state["credit"] and clearing
+        state["empty"] once an account is shown."""
         
         # 1. Get chart of accounts (the real Sage data)
         coa = db.get("chart_of_accounts", {"business_id": biz_id}) or []
@@ -1056,34 +1262,17 @@ def register_report_routes(app, db, login_required, Auth, render_page,
         journal_entries = db.get("journal_entries", {"business_id": biz_id}) or []
         opening_entries = [je for je in journal_entries if je.get("reference") == "OB"]
         
-        # 3. Get live transactions for fallback
-        invoices = db.get("invoices", {"business_id": biz_id}) or []
-        expenses = db.get("expenses", {"business_id": biz_id}) or []
-        sales = db.get("sales", {"business_id": biz_id}) or []
-        supplier_invoices = db.get("supplier_invoices", {"business_id": biz_id}) or []
+        state["source"] = "Chart of Accounts (Sage)" if coa else ("Imported Trial Balance + Live Transactions" if opening_entries else "Built from transactions")
+        yield _gl_page_head(state["source"])
+        
+        # 3. Per-account journal totals (the lines themselves load on demand)
+        journal_totals = _gl_account_totals(biz_id)
+        _no_journals = {"debit": 0.0, "credit": 0.0, "lines": 0}
         
         # 4. Build GL - Priority: chart_of_accounts > journal_entries OB > synthetic
-        accounts_html = ""
-        total_debit_all = 0
-        total_credit_all = 0
         coa_codes_shown = set()  # Track codes shown from COA to avoid duplication with journals
         
         if coa:
-            # Pre-load ALL journals for merging with COA
-            _all_journals_for_merge = db.get("journals", {"business_id": biz_id}) or []
-            _journal_by_code = {}
-            for _jl in _all_journals_for_merge:
-                _ac = _jl.get("account_code", "")
-                if not _ac:
-                    continue
-                _dr = float(_jl.get("debit", 0) or 0)
-                _cr = float(_jl.get("credit", 0) or 0)
-                if _dr == 0 and _cr == 0:
-                    continue
-                if _ac not in _journal_by_code:
-                    _journal_by_code[_ac] = []
-                _journal_by_code[_ac].append(_jl)
-            
             # Use imported chart of accounts with real balances + merged journals
             for acc in coa:
                 if not acc.get("is_active", True):
@@ -1115,9 +1304,8 @@ def register_report_routes(app, db, login_required, Auth, render_page,
                     balance_credit = 0
                 
                 # Merge journal entries for this code
-                code_journals = _journal_by_code.get(code, [])
-                j_dr = sum(float(j.get("debit", 0) or 0) for j in code_journals)
-                j_cr = sum(float(j.get("credit", 0) or 0) for j in code_journals)
+                code_journals = journal_totals.get(code, _no_journals)
+                j_dr, j_cr, j_lines = code_journals["debit"], code_journals["credit"], code_journals["lines"]
                 combined_debit = balance_debit + j_dr
                 combined_credit = balance_credit + j_cr
                 
@@ -1125,34 +1313,26 @@ def register_report_routes(app, db, login_required, Auth, render_page,
                     continue
                 
                 coa_codes_shown.add(code)
-                total_debit_all += combined_debit
-                total_credit_all += combined_credit
+                state["debit"] += combined_debit
+                state["credit"] += combined_credit
+                state["empty"] = False
                 
                 debit_display = money(combined_debit) if combined_debit else "-"
                 credit_display = money(combined_credit) if combined_credit else "-"
                 debit_color = "var(--green)" if combined_debit else "var(--text-muted)"
                 credit_color = "var(--red)" if combined_credit else "var(--text-muted)"
                 
-                # Build journal detail rows if any
+                # Journal detail rows, if any, load when the account is opened
                 detail_html = ""
-                if code_journals:
-                    sorted_j = sorted(code_journals, key=lambda x: x.get("date", ""), reverse=True)
-                    j_rows = ""
-                    for _j in sorted_j:
-                        _jdr = money(float(_j.get("debit", 0) or 0)) if float(_j.get("debit", 0) or 0) else "-"
-                        _jcr = money(float(_j.get("credit", 0) or 0)) if float(_j.get("credit", 0) or 0) else "-"
-                        j_rows += f'<tr><td>{_j.get("date","-")}</td><td>{safe_string(_j.get("description","-"))}</td><td>{safe_string(_j.get("reference","-"))}</td><td style="text-align:right;color:var(--green);">{_jdr}</td><td style="text-align:right;color:var(--red);">{_jcr}</td></tr>'
+                if j_lines:
                     ob_label = f"Sage Opening Balance: DR {money(balance_debit)} / CR {money(balance_credit)}" if (balance_debit or balance_credit) else ""
-                    detail_html = f'''<div style="padding:0 10px 8px 10px;">
-                        <div style="font-size:11px;color:var(--text-muted);padding:4px 0;">{ob_label} | {len(code_journals)} GL journal entries</div>
-                        <table class="table" style="font-size:11px;"><thead><tr><th>Date</th><th>Description</th><th>Ref</th><th style="text-align:right;">Debit</th><th style="text-align:right;">Credit</th></tr></thead><tbody>{j_rows}</tbody></table>
-                    </div>'''
+                    detail_html = _gl_lazy_detail(code, f"{ob_label} | {j_lines} GL journal entries")
                 else:
                     detail_html = f'<div style="padding:8px 12px;font-size:12px;color:var(--text-muted);">Opening Balance: {money(opening)} | Category: {safe_string(category)}</div>'
                 
-                j_count_label = f" + {len(code_journals)} journals" if code_journals else ""
-                accounts_html += f'''
-                <details style="background:var(--card);border-radius:6px;margin-bottom:4px;">
+                j_count_label = f" + {j_lines} journals" if j_lines else ""
+                yield f'''
+                <details style="background:var(--card);border-radius:6px;margin-bottom:4px;"{_gl_lazy_attrs(code, j_lines)}>
                     <summary style="cursor:pointer;padding:8px 12px;list-style:none;">
                         <div style="display:grid;grid-template-columns:2fr 1fr 1fr;align-items:center;font-size:13px;">
                             <span><strong>{safe_string(code)}</strong> - {safe_string(name)} <span style="color:var(--text-muted);font-size:11px;">({safe_string(category)}{j_count_label})</span></span>
@@ -1164,6 +1344,10 @@ def register_report_routes(app, db, login_required, Auth, render_page,
                 </details>
                 '''
         elif opening_entries:
+            invoices = db.get("invoices", {"business_id": biz_id}) or []
+            expenses = db.get("expenses", {"business_id": biz_id}) or []
+            sales = db.get("sales", {"business_id": biz_id}) or []
+            supplier_invoices = db.get("supplier_invoices", {"business_id": biz_id}) or []
             # Use imported TB opening balances from journal_entries
             gl_ob_accounts = {}  # code -> {name, debit, credit}
             for oe in opening_entries:
@@ -1248,29 +1432,14 @@ def register_report_routes(app, db, login_required, Auth, render_page,
             # Merge live GL journals (payroll, banking, etc.) into the OB
             # accounts by code, so the same Sage code never shows twice —
             # once as Balance Brought Forward and once as bare journal lines.
-            _all_journals_for_merge = db.get("journals", {"business_id": biz_id}) or []
-            _journal_by_code = {}
-            for _jl in _all_journals_for_merge:
-                _ac = _jl.get("account_code", "")
-                if not _ac:
-                    continue
-                _dr = float(_jl.get("debit", 0) or 0)
-                _cr = float(_jl.get("credit", 0) or 0)
-                if _dr == 0 and _cr == 0:
-                    continue
-                if _ac not in _journal_by_code:
-                    _journal_by_code[_ac] = []
-                _journal_by_code[_ac].append(_jl)
-
             for code in sorted(gl_ob_accounts.keys()):
                 acc = gl_ob_accounts[code]
                 ob_debit = acc["debit"]
                 ob_credit = acc["credit"]
                 name = acc["name"]
 
-                code_journals = _journal_by_code.get(code, [])
-                j_dr = sum(float(j.get("debit", 0) or 0) for j in code_journals)
-                j_cr = sum(float(j.get("credit", 0) or 0) for j in code_journals)
+                code_journals = journal_totals.get(code, _no_journals)
+                j_dr, j_cr, j_lines = code_journals["debit"], code_journals["credit"], code_journals["lines"]
                 debit = ob_debit + j_dr
                 credit = ob_credit + j_cr
 
@@ -1278,33 +1447,26 @@ def register_report_routes(app, db, login_required, Auth, render_page,
                     continue
 
                 coa_codes_shown.add(code)
-                total_debit_all += debit
-                total_credit_all += credit
+                state["debit"] += debit
+                state["credit"] += credit
+                state["empty"] = False
 
                 debit_display = money(debit) if debit else "-"
                 credit_display = money(credit) if credit else "-"
                 debit_color = "var(--green)" if debit else "var(--text-muted)"
                 credit_color = "var(--red)" if credit else "var(--text-muted)"
 
-                if code_journals:
-                    sorted_j = sorted(code_journals, key=lambda x: x.get("date", ""), reverse=True)
-                    j_rows = ""
-                    for _j in sorted_j:
-                        _jdr = money(float(_j.get("debit", 0) or 0)) if float(_j.get("debit", 0) or 0) else "-"
-                        _jcr = money(float(_j.get("credit", 0) or 0)) if float(_j.get("credit", 0) or 0) else "-"
-                        j_rows += f'<tr><td>{_j.get("date","-")}</td><td>{safe_string(_j.get("description","-"))}</td><td>{safe_string(_j.get("reference","-"))}</td><td style="text-align:right;color:var(--green);">{_jdr}</td><td style="text-align:right;color:var(--red);">{_jcr}</td></tr>'
-                    detail_html = f'''<div style="padding:0 10px 8px 10px;">
-                        <div style="font-size:11px;color:var(--text-muted);padding:4px 0;">Imported Opening Balance: DR {money(ob_debit)} / CR {money(ob_credit)} | {len(code_journals)} GL journal entries</div>
-                        <table class="table" style="font-size:11px;"><thead><tr><th>Date</th><th>Description</th><th>Ref</th><th style="text-align:right;">Debit</th><th style="text-align:right;">Credit</th></tr></thead><tbody>{j_rows}</tbody></table>
-                    </div>'''
+                if j_lines:
+                    detail_html = _gl_lazy_detail(
+                        code, f"Imported Opening Balance: DR {money(ob_debit)} / CR {money(ob_credit)} | {j_lines} GL journal entries")
                 else:
                     detail_html = '''<div style="padding:8px 12px;font-size:12px;color:var(--text-muted);">
                         Source: Imported Opening Balance
                     </div>'''
-                _j_count_label = f' <span style="color:var(--text-muted);font-size:11px;">(+ {len(code_journals)} journals)</span>' if code_journals else ""
+                _j_count_label = f' <span style="color:var(--text-muted);font-size:11px;">(+ {j_lines} journals)</span>' if j_lines else ""
 
-                accounts_html += f'''
-                <details style="background:var(--card);border-radius:6px;margin-bottom:4px;">
+                yield f'''
+                <details style="background:var(--card);border-radius:6px;margin-bottom:4px;"{_gl_lazy_attrs(code, j_lines)}>
                     <summary style="cursor:pointer;padding:8px 12px;list-style:none;">
                         <div style="display:grid;grid-template-columns:2fr 1fr 1fr;align-items:center;font-size:13px;">
                             <span><strong>{safe_string(code)}</strong> - {safe_string(name)}{_j_count_label}</span>
@@ -1316,6 +1478,10 @@ def register_report_routes(app, db, login_required, Auth, render_page,
                 </details>
                 '''
         else:
+            invoices = db.get("invoices", {"business_id": biz_id}) or []
+            expenses = db.get("expenses", {"business_id": biz_id}) or []
+            sales = db.get("sales", {"business_id": biz_id}) or []
+            supplier_invoices = db.get("supplier_invoices", {"business_id": biz_id}) or []
             # Fallback: build synthetic GL from transactions
             gl_accounts = {
                 "1000": {"name": "Bank", "type": "asset", "entries": []},
@@ -1381,12 +1547,13 @@ def register_report_routes(app, db, login_required, Auth, render_page,
                 td = sum(e.get("debit", 0) for e in entries)
                 tc = sum(e.get("credit", 0) for e in entries)
                 if not entries: continue
-                total_debit_all += td
-                total_credit_all += tc
+                state["debit"] += td
+                state["credit"] += tc
+                state["empty"] = False
                 trans_rows = ""
                 for e in entries:
                     trans_rows += f'<tr><td>{e.get("date","-")}</td><td>{safe_string(e.get("description","-"))}</td><td>{e.get("ref","-")}</td><td style="text-align:right;color:var(--green);">{money(e["debit"]) if e.get("debit") else "-"}</td><td style="text-align:right;color:var(--red);">{money(e["credit"]) if e.get("credit") else "-"}</td></tr>'
-                accounts_html += f'''
+                yield f'''
                 <details style="background:var(--card);border-radius:6px;margin-bottom:4px;">
                     <summary style="cursor:pointer;padding:8px 12px;list-style:none;">
                         <div style="display:grid;grid-template-columns:2fr 1fr 1fr;align-items:center;font-size:13px;">
@@ -1406,9 +1573,8 @@ def register_report_routes(app, db, login_required, Auth, render_page,
         # This includes: stock adjustments, GRVs, PO receives, banking,
         # payments, payroll, invoice GL entries, etc.
         # ═══════════════════════════════════════════════════════════════
-        all_journals_gl = db.get("journals", {"business_id": biz_id}) or []
-        if all_journals_gl:
-            logger.info(f"[GL] Merging {len(all_journals_gl)} journal lines into GL report")
+        if journal_totals:
+            logger.info(f"[GL] Merging {sum(t['lines'] for t in journal_totals.values())} journal lines into GL report")
             all_accounts_list = db.get("accounts", {"business_id": biz_id}) or []
             acc_name_map = {a.get("code"): a.get("name", f"Account {a.get('code')}") for a in all_accounts_list}
             
@@ -1471,67 +1637,35 @@ def register_report_routes(app, db, login_required, Auth, render_page,
                 if code not in acc_name_map:
                     acc_name_map[code] = name
             
-            # Group journals by account_code
-            journal_by_acc = {}
-            for jl in all_journals_gl:
-                try:
-                    acc_code = jl.get("account_code", "")
-                    if not acc_code:
-                        continue
-                    debit = float(jl.get("debit", 0) or 0)
-                    credit = float(jl.get("credit", 0) or 0)
-                    if debit == 0 and credit == 0:
-                        continue
-                    if acc_code not in journal_by_acc:
-                        journal_by_acc[acc_code] = []
-                    journal_by_acc[acc_code].append({
-                        "date": jl.get("date", "-"),
-                        "description": jl.get("description", "-"),
-                        "ref": jl.get("reference", "-"),
-                        "debit": debit,
-                        "credit": credit
-                    })
-                except:
-                    pass
-            
-            for code in sorted(journal_by_acc.keys()):
+            for code in sorted(journal_totals.keys()):
                 if code in coa_codes_shown:
                     continue  # Already merged into COA section above
-                entries = sorted(journal_by_acc[code], key=lambda x: x.get("date", ""), reverse=True)
-                td = sum(e.get("debit", 0) for e in entries)
-                tc = sum(e.get("credit", 0) for e in entries)
+                td, tc, n_lines = journal_totals[code]["debit"], journal_totals[code]["credit"], journal_totals[code]["lines"]
                 acc_name = acc_name_map.get(code, f"Account {code}")
-                total_debit_all += td
-                total_credit_all += tc
-                trans_rows = ""
-                for e in entries:
-                    dr_display = money(e["debit"]) if e.get("debit") else "-"
-                    cr_display = money(e["credit"]) if e.get("credit") else "-"
-                    trans_rows += f'<tr><td>{e.get("date","-")}</td><td>{safe_string(e.get("description","-"))}</td><td>{safe_string(e.get("ref","-"))}</td><td style="text-align:right;color:var(--green);">{dr_display}</td><td style="text-align:right;color:var(--red);">{cr_display}</td></tr>'
-                accounts_html += f'''
-                <details style="background:var(--card);border-radius:6px;margin-bottom:4px;">
+                state["debit"] += td
+                state["credit"] += tc
+                state["empty"] = False
+                yield f'''
+                <details style="background:var(--card);border-radius:6px;margin-bottom:4px;"{_gl_lazy_attrs(code, n_lines)}>
                     <summary style="cursor:pointer;padding:8px 12px;list-style:none;">
                         <div style="display:grid;grid-template-columns:2fr 1fr 1fr;align-items:center;font-size:13px;">
-                            <span><strong>{code}</strong> - {safe_string(acc_name)} <span style="color:var(--text-muted);font-size:11px;">(GL Journals: {len(entries)})</span></span>
+                            <span><strong>{safe_string(code)}</strong> - {safe_string(acc_name)} <span style="color:var(--text-muted);font-size:11px;">(GL Journals: {n_lines})</span></span>
                             <span style="text-align:right;color:var(--green);">{money(td)}</span>
                             <span style="text-align:right;color:var(--red);">{money(tc)}</span>
                         </div>
                     </summary>
-                    <div style="padding:0 10px 8px 10px;">
-                        <table class="table" style="font-size:11px;"><thead><tr><th>Date</th><th>Description</th><th>Ref</th><th style="text-align:right;">Debit</th><th style="text-align:right;">Credit</th></tr></thead><tbody>{trans_rows}</tbody></table>
-                    </div>
+                    {_gl_lazy_detail(code, f"{n_lines} GL journal entries")}
                 </details>
                 '''
-        
-        if not accounts_html:
-            accounts_html = '<div class="card" style="text-align:center;padding:40px;"><p>No accounts found. Import your Chart of Accounts or create transactions.</p></div>'
-        
-        diff = abs(total_debit_all - total_credit_all)
-        balance_note = f'<span style="color:var(--green);">✅ Balanced</span>' if diff < 0.02 else f'<span style="color:var(--orange);">Difference: {money(diff)}</span>'
-        
-        source_label = "Chart of Accounts (Sage)" if coa else ("Imported Trial Balance + Live Transactions" if opening_entries else "Built from transactions")
-        
-        content = f'''
+
+    def _gl_lazy_attrs(code, lines):
+        """<details> attributes that load the account's lines when it is opened."""
+        if not lines:
+            return ""
+        return f' data-code="{safe_string(code)}" ontoggle="glLoad(this)"'
+
+    def _gl_page_head(source_label):
+        return f'''
         <style>
         /* General Ledger — compact, professional printout (overrides the oversized global print font for THIS page only) */
         @media print {{
@@ -1574,88 +1708,74 @@ def register_report_routes(app, db, login_required, Auth, render_page,
             </div>
         </div>
         
-        {accounts_html}
+        '''
+
+    def _gl_page_tail(state):
+        if state["empty"]:
+            empty_html = '<div class="card" style="text-align:center;padding:40px;"><p>No accounts found. Import your Chart of Accounts or create transactions.</p></div>'
+        else:
+            empty_html = ""
+        diff = abs(state["debit"] - state["credit"])
+        balance_note = f'<span style="color:var(--green);">✅ Balanced</span>' if diff < 0.02 else f'<span style="color:var(--orange);">Difference: {money(diff)}</span>'
+        return f'''
+        {empty_html}
         
         <div style="padding:10px 12px;background:var(--card);border-radius:6px;margin-top:8px;border:2px solid var(--border);">
             <div style="display:grid;grid-template-columns:2fr 1fr 1fr;align-items:center;font-size:14px;font-weight:bold;">
                 <span>TOTALS {balance_note}</span>
-                <span style="text-align:right;color:var(--green);">{money(total_debit_all)}</span>
-                <span style="text-align:right;color:var(--red);">{money(total_credit_all)}</span>
+                <span style="text-align:right;color:var(--green);">{money(state["debit"])}</span>
+                <span style="text-align:right;color:var(--red);">{money(state["credit"])}</span>
             </div>
         </div>
         
         <script>
+        function glRenderPage(d, data) {{
+            d.querySelector('tbody').insertAdjacentHTML('beforeend', data.html || '');
+            const more = d.querySelector('.gl-more');
+            if (data.next) {{
+                d.dataset.beforeDate = data.next[0] || '';
+                d.dataset.beforeId = data.next[1];
+                if (more) more.style.display = '';
+            }} else {{
+                d.dataset.done = '1';
+                if (more) more.style.display = 'none';
+            }}
+        }}
+
+        function glLoad(d, more) {{
+            if (!d.open || d.dataset.loading || d.dataset.done) return;
+            if (d.dataset.loaded && !more) return;
+            d.dataset.loading = '1';
+            let url = '/api/reports/gl/lines?code=' + encodeURIComponent(d.dataset.code);
+            if (more && d.dataset.beforeId) {{
+                url += '&before_date=' + encodeURIComponent(d.dataset.beforeDate || '') + '&before_id=' + encodeURIComponent(d.dataset.beforeId);
+            }}
+            fetch(url).then(r => r.json()).then(data => {{
+                d.dataset.loaded = '1';
+                glRenderPage(d, data);
+            }}).catch(() => {{}}).finally(() => {{ delete d.dataset.loading; }});
+        }}
+
+        let glSearchTimer = null;
         function filterGL(query) {{
             const results = document.getElementById('glSearchResults');
-            const q = query.toLowerCase().trim();
-            
+            const q = query.trim();
+            clearTimeout(glSearchTimer);
             if (q.length < 2) {{
                 results.style.display = 'none';
-                // Show all accounts
-                document.querySelectorAll('.gl-account-card, details').forEach(el => el.style.display = '');
                 return;
             }}
-            
-            // Search through all table rows in GL
-            let matches = [];
-            document.querySelectorAll('details').forEach(detail => {{
-                const accTitle = detail.querySelector('summary') ? detail.querySelector('summary').textContent.toLowerCase() : '';
-                let found = false;
-                detail.querySelectorAll('tbody tr').forEach(row => {{
-                    const cells = row.querySelectorAll('td');
-                    if (cells.length >= 3) {{
-                        const date = cells[0] ? cells[0].textContent.toLowerCase() : '';
-                        const desc = cells[1] ? cells[1].textContent.toLowerCase() : '';
-                        const ref = cells[2] ? cells[2].textContent.toLowerCase() : '';
-                        const debit = cells[3] ? cells[3].textContent : '';
-                        const credit = cells[4] ? cells[4].textContent : '';
-                        
-                        if (desc.includes(q) || ref.includes(q) || date.includes(q)) {{
-                            found = true;
-                            row.style.display = '';
-                            row.style.background = 'rgba(99,102,241,0.1)';
-                            matches.push({{
-                                account: accTitle.substring(0, 50),
-                                date: cells[0].textContent.trim(),
-                                desc: cells[1].textContent.trim().substring(0, 40),
-                                ref: cells[2].textContent.trim(),
-                                debit: debit.trim(),
-                                credit: credit.trim()
-                            }});
-                        }} else {{
-                            row.style.background = '';
-                        }}
-                    }}
-                }});
-                
-                if (found) {{
-                    detail.style.display = '';
-                    detail.open = true;
-                }} else {{
-                    detail.style.display = 'none';
-                }}
-            }});
-            
-            if (matches.length > 0) {{
-                let html = '<div style="font-weight:600;margin-bottom:8px;font-size:13px;">🔍 Found ' + matches.length + ' entries matching "' + query + '"</div>';
-                html += '<table style="width:100%;font-size:12px;border-collapse:collapse;">';
-                html += '<tr style="border-bottom:1px solid var(--border);"><th style="text-align:left;padding:4px;">Account</th><th style="text-align:left;padding:4px;">Date</th><th style="text-align:left;padding:4px;">Description</th><th style="text-align:left;padding:4px;">Ref</th><th style="text-align:right;padding:4px;">Debit</th><th style="text-align:right;padding:4px;">Credit</th></tr>';
-                matches.slice(0, 20).forEach(m => {{
-                    html += '<tr style="border-bottom:1px solid rgba(255,255,255,0.05);"><td style="padding:3px 4px;">' + m.account + '</td><td style="padding:3px 4px;">' + m.date + '</td><td style="padding:3px 4px;">' + m.desc + '</td><td style="padding:3px 4px;color:var(--primary);">' + m.ref + '</td><td style="text-align:right;padding:3px 4px;">' + m.debit + '</td><td style="text-align:right;padding:3px 4px;">' + m.credit + '</td></tr>';
-                }});
-                if (matches.length > 20) html += '<tr><td colspan="6" style="padding:6px;color:var(--text-muted);font-style:italic;">...and ' + (matches.length - 20) + ' more</td></tr>';
-                html += '</table>';
-                results.innerHTML = html;
-                results.style.display = 'block';
-            }} else {{
-                results.innerHTML = '<span style="color:var(--text-muted);font-size:13px;">No entries found for "' + query + '"</span>';
-                results.style.display = 'block';
-            }}
+            // Lines are loaded per account, so the search runs on the server
+            glSearchTimer = setTimeout(() => {{
+                fetch('/api/reports/gl/search?q=' + encodeURIComponent(q)).then(r => r.json()).then(data => {{
+                    if (document.getElementById('glSearch').value.trim() !== q) return;
+                    results.innerHTML = data.html || '';
+                    results.style.display = data.html ? 'block' : 'none';
+                }}).catch(() => {{}});
+            }}, 250);
         }}
         </script>
         '''
-        
-        return render_page("General Ledger", content, user, "reports")
     
     
     # 
@@ -1676,24 +1796,19 @@ def register_report_routes(app, db, login_required, Auth, render_page,
             return render_page("Trial Balance", "<div class='card'><p>No business selected</p></div>", user, "reports")
         
         # ═══════════════════════════════════════════════════════════════
-        # GET ALL DATA SOURCES
-        # ═══════════════════════════════════════════════════════════════
-        
-        # 1. Imported opening balances (from journal_entries with ref=OB)
-        journal_entries = db.get("journal_entries", {"business_id": biz_id}) or []
-        opening_entries = [je for je in journal_entries if je.get("reference") == "OB"]
-        logger.info(f"[TB] Journal entries: {len(journal_entries)}, Opening balances: {len(opening_entries)}")
-        
-        # 2. Live transaction data
-        customers = db.get("customers", {"business_id": biz_id}) or []
-        suppliers = db.get("suppliers", {"business_id": biz_id}) or []
-        invoices = db.get("invoices", {"business_id": biz_id}) or []
-        expenses = db.get("expenses", {"business_id": biz_id}) or []
-        sales = db.get("sales", {"business_id": biz_id}) or []
-        
-        # ═══════════════════════════════════════════════════════════════
-        # BUILD TRIAL BALANCE
+        # ONE LEDGER READ: imported OB + GL journals, as at the date asked
+        # for and at each comparative year-end before it
         # ═══════════════════════════════════════════════════════════════
+        asat = (request.args.get("asat") or "")[:10] or None
+        if asat:
+            try:
+                datetime.strptime(asat, "%Y-%m-%d")
+            except ValueError:
+                asat = today()   # a malformed ?asat= reads as today, not a 500
+        periods = [(None, asat)] + [(None, _years_before(asat or today(), k))
+                                    for k in range(1, _compare_arg() + 1)]
+        tb = trial_balance(db, biz_id, periods, **_tb_account_names(biz_id))
+        opening_count = tb.ob_entries
         
         tb_accounts = {}  # code -> {name, debit, credit, type}
         
@@ -1703,121 +1818,49 @@ def register_report_routes(app, db, login_required, Auth, render_page,
             tb_accounts[code]["debit"] += debit
             tb_accounts[code]["credit"] += credit
         
-        # Load imported opening balances
-        if opening_entries:
-            logger.info(f"[TB] Loading {len(opening_entries)} imported opening balances")
-            for oe in opening_entries:
-                acc_name = oe.get("account", "Unknown")
-                acc_code = oe.get("account_code", "") or oe.get("code", "")
-                debit = float(oe.get("debit", 0) or 0)
-                credit = float(oe.get("credit", 0) or 0)
-                
-                if not acc_code:
-                    # Sage embeds the GL code inside the account name, e.g.
-                    # "8400/000 : Standard Bank" -> code "8400/000", name "Standard Bank".
-                    # Extract it so the report shows the real Sage code, not a 9xxx placeholder.
-                    _nm = (acc_name or "").strip()
-                    _cp = ""
-                    if " : " in _nm:
-                        _cp = _nm.split(" : ", 1)[0].strip()
-                    elif ": " in _nm:
-                        _cp = _nm.split(": ", 1)[0].strip()
-                    elif " - " in _nm:
-                        _cp = _nm.split(" - ", 1)[0].strip()
-                    if _cp and _cp[0].isdigit():
-                        acc_code = _cp
-                        acc_name = _nm[len(_cp):].lstrip(" :-").strip() or _nm
-                    else:
-                        acc_code = f"9{len(tb_accounts):03d}"
-                
-                add_account(acc_code, acc_name, debit, credit)
-            
-            # DON'T add live data when we have imported TB - it would double count!
-            logger.info(f"[TB] Using imported TB only - not adding live transaction data")
-        
-        else:
-            # NO imported TB - check if we have GL journals
-            all_journals_check = db.get("journals", {"business_id": biz_id}) or []
-            
-            if not all_journals_check:
-                # No imported TB AND no journals - use live data estimates as fallback
-                logger.info(f"[TB] No imported TB, no journals - building from live transaction estimates")
-                
-                # Debtors Control - from customer balances
-                debtors_total = sum(float(c.get("balance", 0)) for c in customers if float(c.get("balance", 0)) > 0)
-                if debtors_total > 0:
-                    add_account("1200", "Debtors Control", debit=debtors_total)
-                
-                # Creditors Control - from supplier balances
-                creditors_total = sum(float(s.get("balance", 0)) for s in suppliers if float(s.get("balance", 0)) > 0)
-                if creditors_total > 0:
-                    add_account("3000", "Creditors Control", credit=creditors_total)
-                
-                # Sales - from invoices (excluding credited)
-                inv_sales = sum(float(inv.get("subtotal", 0)) for inv in invoices if inv.get("status") != "credited")
-                pos_sales = sum(float(s.get("subtotal", 0)) for s in sales)
-                total_sales = inv_sales + pos_sales
-                if total_sales > 0:
-                    add_account("5000", "Sales", credit=total_sales)
-                
-                # VAT Output - from invoices and POS
-                vat_output = sum(float(inv.get("vat", 0)) for inv in invoices if inv.get("status") != "credited")
-                vat_output += sum(float(s.get("vat", 0)) for s in sales)
-                if vat_output > 0:
-                    add_account("2100", "VAT Output", credit=vat_output)
-                
-                # Operating Expenses
-                exp_total = sum(float(e.get("amount", 0)) for e in expenses)
-                if exp_total > 0:
-                    add_account("6000", "Operating Expenses", debit=exp_total)
-            else:
-                logger.info(f"[TB] No imported TB but {len(all_journals_check)} GL journals found - using journals only")
-        
-        # ═══════════════════════════════════════════════════════════════
-        # PROCESS ALL GL JOURNALS (banking, payments, payroll, invoices, etc.)
-        # These are individual debit/credit lines in the "journals" table,
-        # created by create_journal_entry() throughout the system
-        # ═══════════════════════════════════════════════════════════════
-        all_journals = db.get("journals", {"business_id": biz_id}) or []
-        # Get account names from accounts table + chart_of_accounts + defaults
-        all_accounts = db.get("accounts", {"business_id": biz_id}) or []
-        account_names = {a.get("code"): a.get("name", f"Account {a.get('code')}") for a in all_accounts}
-        # Enrich from chart_of_accounts (Sage imported names)
-        for acc in (db.get("chart_of_accounts", {"business_id": biz_id}) or []):
-            c = str(acc.get("account_code", "") or acc.get("code", "")).strip()
-            n = acc.get("account_name", "") or acc.get("name", "")
-            if c and n and c not in account_names:
-                account_names[c] = n
-        # Fallback default names from BOOKING_CATEGORIES for all ClickAI GL codes
-        try:
-            for _grp in IndustryKnowledge.BOOKING_CATEGORIES.values():
-                for _cat_name, _gl_code in _grp.get("items", []):
-                    if _gl_code and _gl_code not in account_names:
-                        account_names[_gl_code] = _cat_name
-        except Exception:
-            pass
-        # Extra defaults not in BOOKING_CATEGORIES
-        for _c, _n in {"1200": "Debtors Control", "1400": "VAT Input", "1300": "Stock",
-                        "2000": "Creditors Control", "2200": "PAYE Payable", "3100": "Retained Earnings",
-                        "6000": "Salaries & Wages", "2210": "UIF Payable", "2220": "SDL Payable",
-                        "2400": "Payroll Deductions Payable", "6210": "Employer Payroll Costs (UIF/SDL)"}.items():
-            if _c not in account_names:
-                account_names[_c] = _n
-        
-        if all_journals:
-            logger.info(f"[TB] Processing {len(all_journals)} GL journal lines into TB")
-            for jl in all_journals:
-                try:
-                    acc_code = jl.get("account_code", "")
-                    if not acc_code:
-                        continue
-                    debit = float(jl.get("debit", 0) or 0)
-                    credit = float(jl.get("credit", 0) or 0)
-                    acc_name = account_names.get(acc_code, f"Account {acc_code}")
-                    if debit > 0 or credit > 0:
-                        add_account(acc_code, acc_name, debit=debit, credit=credit)
-                except Exception as jl_err:
-                    logger.error(f"[TB] Error processing journal line {jl.get('id', '?')}: {jl_err}")
+        shown = set()
+        for i in range(len(periods)):
+            shown.update(tb.codes(i=i))
+        for acc_code in sorted(shown):
+            debit, credit = tb.amounts(acc_code, 0)
+            add_account(acc_code, tb.accounts[acc_code]["name"], debit=debit, credit=credit)
+        
+        if not tb.accounts:
+            # No imported TB AND no journals - use live data estimates as fallback
+            logger.info(f"[TB] No imported TB, no journals - building from live transaction estimates")
+            customers = db.get("customers", {"business_id": biz_id}, select="balance") or []
+            suppliers = db.get("suppliers", {"business_id": biz_id}, select="balance") or []
+            invoices = db.get("invoices", {"business_id": biz_id}, select="status,subtotal,vat") or []
+            expenses = db.get("expenses", {"business_id": biz_id}, select="amount") or []
+            sales = db.get("sales", {"business_id": biz_id}, select="subtotal,vat") or []
+            
+            # Debtors Control - from customer balances
+            debtors_total = sum(float(c.get("balance", 0) or 0) for c in customers if float(c.get("balance", 0) or 0) > 0)
+            if debtors_total > 0:
+                add_account("1200", "Debtors Control", debit=debtors_total)
+            
+            # Creditors Control - from supplier balances
+            creditors_total = sum(float(s.get("balance", 0) or 0) for s in suppliers if float(s.get("balance", 0) or 0) > 0)
+            if creditors_total > 0:
+                add_account("3000", "Creditors Control", credit=creditors_total)
+            
+            # Sales - from invoices (excluding credited)
+            inv_sales = sum(float(inv.get("subtotal", 0) or 0) for inv in invoices if inv.get("status") != "credited")
+            pos_sales = sum(float(s.get("subtotal", 0) or 0) for s in sales)
+            total_sales = inv_sales + pos_sales
+            if total_sales > 0:
+                add_account("5000", "Sales", credit=total_sales)
+            
+            # VAT Output - from invoices and POS
+            vat_output = sum(float(inv.get("vat", 0) or 0) for inv in invoices if inv.get("status") != "credited")
+            vat_output += sum(float(s.get("vat", 0) or 0) for s in sales)
+            if vat_output > 0:
+                add_account("2100", "VAT Output", credit=vat_output)
+            
+            # Operating Expenses
+            exp_total = sum(float(e.get("amount", 0) or 0) for e in expenses)
+            if exp_total > 0:
+                add_account("6000", "Operating Expenses", debit=exp_total)
         
         # Calculate totals
         total_debit = sum(acc.get("debit", 0) for acc in tb_accounts.values())
@@ -1839,25 +1882,35 @@ def register_report_routes(app, db, login_required, Auth, render_page,
             debit_str = f"R {debit:,.2f}" if debit > 0 else ""
             credit_str = f"R {credit:,.2f}" if credit > 0 else ""
             
+            compare_cells = "".join(f'<td style="text-align:right;color:var(--text-muted);">{_dr_cr(tb.balance(code, i)) if code in tb.accounts else ""}</td>'
+                                    for i in range(1, len(periods)))
+            
             rows_html += f'''
             <tr>
                 <td style="font-family:monospace;color:var(--text-muted);">{code}</td>
                 <td>{safe_string(name)}</td>
                 <td style="text-align:right;">{debit_str}</td>
                 <td style="text-align:right;">{credit_str}</td>
+                {compare_cells}
             </tr>
             '''
         
+        compare_heads = "".join(f'<th style="text-align:right;width:150px;">{to}</th>' for _, to in periods[1:])
+        compare_foot = "".join(f'<td style="text-align:right;border-top:2px solid var(--text);">{_dr_cr(tb.totals(i)[0] - tb.totals(i)[1])}</td>'
+                               for i in range(1, len(periods)))
+        
         if not tb_accounts:
-            rows_html = '''
+            rows_html = f'''
             <tr>
-                <td colspan="4" style="text-align:center;padding:40px;color:var(--text-muted);">
+                <td colspan="{4 + len(periods) - 1}" style="text-align:center;padding:40px;color:var(--text-muted);">
                     No trial balance data yet.<br><br>
                     <a href="/import">Import Opening Trial Balance</a> or start creating invoices and expenses.
                 </td>
             </tr>
             '''
         
+        compare_options = _compare_options(len(periods) - 1, "year")
+        
         # Build TB data for AI analysis (JSON)
         tb_data_json = json.dumps([
             {"code": code, "name": acc["name"], "debit": acc["debit"], "credit": acc["credit"]}
@@ -1886,6 +1939,13 @@ def register_report_routes(app, db, login_required, Auth, render_page,
         <div class="no-print" style="display:flex;justify-content:space-between;align-items:center;margin-bottom:15px;">
             <a href="/reports" style="color:var(--text-muted);">← Back to Reports</a>
             <div style="display:flex;gap:10px;flex-wrap:wrap;align-items:center;">
+                <form method="get" action="/reports/tb" style="display:flex;gap:6px;align-items:center;margin:0;">
+                    <input type="date" name="asat" value="{asat or ''}" title="As at" style="padding:7px 10px;border-radius:6px;border:1px solid var(--border);background:var(--card);color:var(--text);font-size:13px;">
+                    <select name="compare" onchange="this.form.submit()" style="padding:8px 12px;border-radius:6px;border:1px solid var(--border);background:var(--card);color:var(--text);font-size:13px;">
+                        {compare_options}
+                    </select>
+                    <button type="submit" class="btn btn-secondary" style="padding:7px 12px;">Go</button>
+                </form>
                 <select id="reportLang" style="padding:8px 12px;border-radius:6px;border:1px solid var(--border);background:var(--card);color:var(--text);font-size:13px;">
                     <option value="en">English</option>
                     <option value="af">Afrikaans</option>
@@ -1902,18 +1962,18 @@ def register_report_routes(app, db, login_required, Auth, render_page,
                     📁 Upload CSV/Excel
                     <input type="file" id="tbFileUpload" accept=".csv,.xlsx,.xls" style="display:none;" onchange="handleTBUpload(this)">
                 </label>
-                {f'<button class="btn btn-warning" onclick="clearOpeningBalances()" style="background:#f59e0b;">Clear OB ({len(opening_entries)})</button>' if opening_entries else ''}
+                {f'<button class="btn btn-warning" onclick="clearOpeningBalances()" style="background:#f59e0b;">Clear OB ({opening_count})</button>' if opening_count else ''}
             </div>
         </div>
         
-        {f'<div class="card" style="background:rgba(239,68,68,0.1);border:1px solid #ef4444;padding:15px;margin-bottom:15px;"><strong>⚠️ Warning:</strong> There are <strong>{len(opening_entries)}</strong> opening balance entries for <strong>{len(tb_accounts)}</strong> accounts. If you imported multiple times, click "Clear OB" and import again.</div>' if opening_entries and len(opening_entries) > len(tb_accounts) + 5 else ''}
+        {f'<div class="card" style="background:rgba(239,68,68,0.1);border:1px solid #ef4444;padding:15px;margin-bottom:15px;"><strong>⚠️ Warning:</strong> There are <strong>{opening_count}</strong> opening balance entries for <strong>{len(tb_accounts)}</strong> accounts. If you imported multiple times, click "Clear OB" and import again.</div>' if opening_count and opening_count > len(tb_accounts) + 5 else ''}
         
         <div class="card" style="padding:30px;">
             <!-- HEADER -->
             <div style="text-align:center;margin-bottom:30px;">
                 <h2 style="margin:0;">{safe_string(biz_name)}</h2>
                 <h3 style="margin:10px 0;color:var(--text-muted);font-weight:normal;">Trial Balance</h3>
-                <p style="color:var(--text-muted);margin:0;">As at {today()}</p>
+                <p style="color:var(--text-muted);margin:0;">As at {asat or today()}</p>
             </div>
             
             <!-- TABLE -->
@@ -1924,6 +1984,7 @@ def register_report_routes(app, db, login_required, Auth, render_page,
                         <th>Account</th>
                         <th style="text-align:right;width:150px;">Debit (Dr)</th>
                         <th style="text-align:right;width:150px;">Credit (Cr)</th>
+                        {compare_heads}
                     </tr>
                 </thead>
                 <tbody>
@@ -1935,6 +1996,7 @@ def register_report_routes(app, db, login_required, Auth, render_page,
                         <td>TOTAL</td>
                         <td style="text-align:right;border-top:2px solid var(--text);">R {total_debit:,.2f}</td>
                         <td style="text-align:right;border-top:2px solid var(--text);">R {total_credit:,.2f}</td>
+                        {compare_foot}
                     </tr>
                 </tfoot>
             </table>
@@ -3961,6 +4023,25 @@ def register_report_routes(app, db, login_required, Auth, render_page,
     # TB INSIGHTS - Async AI analysis (called AFTER report loads)
     # ═══════════════════════════════════════════════════════════════════════
     
+    def _tb_accounts_text(tb, i=0):
+        """The account listing the insights prompt quotes, grouped by TB section."""
+        groups = (("ASSETS", ("current_asset", "fixed_asset")),
+                  ("LIABILITIES", ("current_liability", "long_term_liability")),
+                  ("EQUITY", ("equity",)), ("INCOME", ("income", "other_income")),
+                  ("EXPENSES", ("cos", "expense")), ("UNCLASSIFIED", ("unclassified",)))
+        text = "FULL ACCOUNT LIST (Python-verified):\n" + "=" * 80 + "\n"
+        for title, sections in groups:
+            codes = tb.codes(sections, i=i)
+            if not codes:
+                continue
+            text += f"\n{title}:\n"
+            for code in codes:
+                dr, cr = tb.amounts(code, i)
+                text += f"{code:<10} {tb.accounts[code]['name'][:40]:<40} R{dr:>13,.2f} R{cr:>13,.2f}\n"
+        total_debit, total_credit = tb.totals(i)
+        text += "=" * 80 + f"\nTOTAL: {len(tb.codes(i=i))} accounts | Debits: R{total_debit:,.2f} | Credits: R{total_credit:,.2f}"
+        return text
+
     @app.route("/api/reports/tb/insights", methods=["POST"])
     @login_required
     def api_tb_insights():
@@ -3979,10 +4060,19 @@ def register_report_routes(app, db, login_required, Auth, render_page,
                 # Fallback to cache (legacy)
                 _tb_cache_key = f"tb_insights:{session.get('user_id', 'anon')}"
                 _cached = Auth._mem.get(_tb_cache_key)
-                if not _cached or (time.time() - _cached.get("t", 0)) > 600:
-                    return jsonify({"success": False, "error": "No TB data found. Please re-analyze."})
-                td = _cached["d"]
-                logger.info(f"[TB INSIGHTS] Using data from cache")
+                if _cached and (time.time() - _cached.get("t", 0)) <= 600:
+                    td = _cached["d"]
+                    logger.info(f"[TB INSIGHTS] Using data from cache")
+                else:
+                    # Nothing analysed yet - the business's own ledger, from the TB engine
+                    biz_id = business.get("id") if business else None
+                    tb = trial_balance(db, biz_id, [(None, None)], **_tb_account_names(biz_id)) if biz_id else None
+                    if not tb or not tb.accounts:
+                        return jsonify({"success": False, "error": "No TB data found. Please re-analyze."})
+                    td = {**tb.summary(0), "accounts_text": _tb_accounts_text(tb)[:15000],
+                          "report_company": biz_name, "industry": business.get("industry", "general"),
+                          "is_third_party": False, "lang": posted.get("lang", "en")}
+                    logger.info(f"[TB INSIGHTS] Using the ledger TB ({len(tb.accounts)} accounts)")
             
             lang = td.get('lang', 'en')
             report_company = td.get('report_company', biz_name)
@@ -4936,6 +5026,114 @@ def register_report_routes(app, db, login_required, Auth, render_page,
     # PROFIT & LOSS
     # 
     
+    def _prior_windows(period, today_date, n):
+        """The n whole calendar months / quarters / years before the current
+        one, newest first: [(date_from, date_to, label)]."""
+        out = []
+        step = {"month": 1, "quarter": 3, "year": 12}[period]
+        first = today_date.replace(day=1)
+        if period == "quarter":
+            first = first.replace(month=(first.month - 1) // 3 * 3 + 1)
+        elif period == "year":
+            first = first.replace(month=1)
+        for _ in range(n):
+            end = first - timedelta(days=1)
+            months = end.year * 12 + end.month - step
+            first = end.replace(year=months // 12, month=months % 12 + 1, day=1)
+            if period == "month":
+                label = first.strftime("%B %Y")
+            elif period == "quarter":
+                label = f"Q{(first.month - 1) // 3 + 1} {first.year}"
+            else:
+                label = f"Year {first.year}"
+            out.append((first.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"), label))
+        return out
+
+    def _pnl_from_ledger(tb, windows, period):
+        """Income Statement page from trial_balance() movements, one column per window."""
+        n = len(windows)
+        cell = 'style="text-align:right;"'
+
+        def amounts_row(label, values, style="", indent=40, negate=False, red=False):
+            tds = "".join(f'<td style="text-align:right;{"color:var(--red);" if red else ""}">'
+                          f'{("(" + money(v) + ")") if negate else money(v)}</td>' for v in values)
+            return f'<tr style="{style}"><td style="padding-left:{indent}px;">{label}</td>{tds}</tr>'
+
+        def section_rows(sections, sign):
+            rows = ""
+            for code in tb.codes(sections):
+                values = [sign * tb.balance(code, i, "movement") + 0.0 for i in range(n)]
+                if any(abs(v) >= 0.005 for v in values):
+                    rows += amounts_row(f'{safe_string(tb.accounts[code]["name"])} <span style="color:var(--text-muted);font-size:11px;">{safe_string(code)}</span>', values)
+            return rows
+
+        def total(sections, sign):
+            return [sign * tb.total(sections, i, "movement") + 0.0 for i in range(n)]
+
+        def heading(label, bg):
+            return f'<tr style="background:{bg};"><td colspan="{n + 1}"><strong>{label}</strong></td></tr>'
+
+        revenue = total(("income",), -1)
+        cos = total(("cos",), 1)
+        gross = [r - c for r, c in zip(revenue, cos)]
+        other = total(("other_income",), -1)
+        expenses = total(("expense",), 1)
+        net = [tb.profit(i, "movement") for i in range(n)]
+        margin = lambda v, i: f'{(v / revenue[i] * 100):.1f}%' if revenue[i] > 0 else "-"
+
+        head = "".join(f'<th {cell}>{safe_string(label)}</th>' for _, _, label in windows)
+        body = heading("REVENUE", "rgba(16,185,129,0.1)")
+        body += section_rows(("income",), -1) or f"<tr><td style='padding-left:40px;color:var(--text-muted);' colspan='{n + 1}'>No revenue recorded</td></tr>"
+        body += amounts_row("Total Revenue", revenue, "font-weight:bold;", 20)
+        body += heading("COST OF SALES", "rgba(239,68,68,0.05)")
+        body += section_rows(("cos",), 1)
+        body += amounts_row("Total Cost of Sales", cos, "font-weight:bold;", 20, negate=True, red=True)
+        body += (f'<tr style="font-weight:bold;background:rgba(59,130,246,0.1);border-top:2px solid var(--border);"><td>GROSS PROFIT</td>'
+                 + "".join(f'<td style="text-align:right;color:{"var(--green)" if g >= 0 else "var(--red)"};">{money(g)} '
+                           f'<span style="font-size:12px;color:var(--text-muted);">({margin(g, i)})</span></td>'
+                           for i, g in enumerate(gross)) + '</tr>')
+        if tb.codes(("other_income",)):
+            body += heading("OTHER INCOME", "rgba(16,185,129,0.05)")
+            body += section_rows(("other_income",), -1)
+            body += amounts_row("Total Other Income", other, "font-weight:bold;", 20)
+        body += heading("OPERATING EXPENSES", "rgba(239,68,68,0.1)")
+        body += section_rows(("expense",), 1) or f"<tr><td style='padding-left:40px;color:var(--text-muted);' colspan='{n + 1}'>No expenses recorded</td></tr>"
+        body += amounts_row("Total Operating Expenses", expenses, "font-weight:bold;", 20, negate=True, red=True)
+        body += (f'<tr style="font-weight:bold;font-size:16px;border-top:2px solid var(--border);"><td>NET PROFIT / (LOSS)</td>'
+                 + "".join(f'<td style="text-align:right;color:{"var(--green)" if v >= 0 else "var(--red)"};">{money(v)} '
+                           f'<span style="font-size:12px;color:var(--text-muted);">({margin(v, i)})</span></td>'
+                           for i, v in enumerate(net)) + '</tr>')
+        compare = len(windows) - 1
+        return f'''
+        <div style="display:flex;justify-content:space-between;align-items:center;margin-bottom:20px;">
+            <a href="/reports" style="color:var(--text-muted);">← Back to Reports</a>
+            <div style="display:flex;gap:10px;align-items:center;">
+                <select onchange="window.location='/reports/pnl?compare={compare}&period='+this.value" style="padding:8px;border-radius:6px;background:var(--card);color:var(--text);border:1px solid var(--border);">
+                    <option value="month" {"selected" if period == "month" else ""}>This Month</option>
+                    <option value="quarter" {"selected" if period == "quarter" else ""}>This Quarter</option>
+                    <option value="year" {"selected" if period == "year" else ""}>This Year</option>
+                    <option value="all" {"selected" if period == "all" else ""}>All Time</option>
+                </select>
+                <select onchange="window.location='/reports/pnl?period={period}&compare='+this.value" {"disabled" if period == "all" else ""} style="padding:8px;border-radius:6px;background:var(--card);color:var(--text);border:1px solid var(--border);">
+                    {_compare_options(compare, period if period != "all" else "period")}
+                </select>
+                <button class="btn btn-secondary" onclick="window.print();">🖨️ Print</button>
+            </div>
+        </div>
+        
+        <div class="card">
+            <h2 style="margin-bottom:5px;">[CHART] Income Statement</h2>
+            <p style="color:var(--text-muted);margin-bottom:20px;">For the period: {safe_string(windows[0][2])} — from the general ledger</p>
+            
+            <table class="table" style="font-size:14px;">
+                <thead><tr><th></th>{head}</tr></thead>
+                <tbody>
+                    {body}
+                </tbody>
+            </table>
+        </div>
+        '''
+
     @app.route("/reports/pnl")
     @login_required
     def report_pnl():
@@ -4972,21 +5170,24 @@ def register_report_routes(app, db, login_required, Auth, render_page,
             end_date = today_date.strftime("%Y-%m-%d")
             period_label = today_date.strftime("%B %Y")
         
-        # Get data filtered by date
-        invoices = db.get("invoices", {"business_id": biz_id}) if biz_id else []
-        invoices = [i for i in invoices if start_date <= i.get("date", "") <= end_date]
-        
-        sales = db.get("sales", {"business_id": biz_id}) if biz_id else []
-        sales = [s for s in sales if start_date <= s.get("date", "") <= end_date]
-        
-        expenses = db.get("expenses", {"business_id": biz_id}) if biz_id else []
-        expenses = [e for e in expenses if start_date <= e.get("date", "") <= end_date]
-        
-        payslips = db.get("payslips", {"business_id": biz_id}) if biz_id else []
-        payslips = [p for p in payslips if start_date <= p.get("date", "") <= end_date]
-        
-        supplier_invoices = db.get("supplier_invoices", {"business_id": biz_id}) if biz_id else []
-        supplier_invoices = [si for si in supplier_invoices if start_date <= si.get("date", "") <= end_date]
+        # From the ledger when the business has one: this period and the
+        # comparatives (the N calendar periods before it) in one read
+        if biz_id:
+            windows = [(None if period == "all" else start_date, end_date, period_label)]
+            if period in ("month", "quarter", "year"):
+                windows += _prior_windows(period, today_date, _compare_arg())
+            tb = trial_balance(db, biz_id, [(f, t) for f, t, _ in windows], **_tb_account_names(biz_id))
+            if tb.codes(PNL_SECTIONS):
+                return render_page("Income Statement", _pnl_from_ledger(tb, windows, period), user, "reports")
+        
+        # No ledger yet - estimate from the documents
+        # Get data filtered by date — the window runs on the server
+        period_filter = {"business_id": biz_id, "date": [("gte", start_date), ("lte", end_date)]}
+        invoices = db.get("invoices", period_filter) if biz_id else []
+        sales = db.get("sales", period_filter) if biz_id else []
+        expenses = db.get("expenses", period_filter) if biz_id else []
+        payslips = db.get("payslips", period_filter) if biz_id else []
+        supplier_invoices = db.get("supplier_invoices", period_filter) if biz_id else []
         
         # REVENUE
         invoice_income = sum(float(inv.get("subtotal", 0)) for inv in invoices)
@@ -4998,8 +5199,7 @@ def register_report_routes(app, db, login_required, Auth, render_page,
         
         # If no supplier invoices categorized, estimate from stock movements
         if cost_of_sales == 0:
-            stock_movements = db.get("stock_movements", {"business_id": biz_id}) if biz_id else []
-            stock_out = [sm for sm in stock_movements if sm.get("type") == "out" and start_date <= sm.get("date", "") <= end_date]
+            stock_out = db.get("stock_movements", {**period_filter, "type": "out"}) if biz_id else []
             cost_of_sales = sum(float(sm.get("cost", 0)) * float(sm.get("quantity", 0)) for sm in stock_out)
         
         gross_profit = total_revenue - cost_of_sales
@@ -5126,6 +5326,94 @@ def register_report_routes(app, db, login_required, Auth, render_page,
     # BALANCE SHEET
     # 
     
+    def _balance_sheet_from_ledger(tb, dates):
+        """Balance Sheet page from trial_balance() closing balances, one column per as-at date."""
+        n = len(dates)
+
+        def amounts_row(label, values, style="", indent=40):
+            tds = "".join(f'<td style="text-align:right;">{money(v)}</td>' for v in values)
+            return f'<tr style="{style}"><td style="padding-left:{indent}px;">{label}</td>{tds}</tr>'
+
+        def section_rows(sections, sign):
+            rows = ""
+            for code in tb.codes(sections):
+                values = [sign * tb.balance(code, i) + 0.0 for i in range(n)]
+                if any(abs(v) >= 0.005 for v in values):
+                    rows += amounts_row(f'{safe_string(tb.accounts[code]["name"])} <span style="color:var(--text-muted);font-size:11px;">{safe_string(code)}</span>', values)
+            return rows
+
+        def total(sections, sign):
+            return [sign * tb.total(sections, i) + 0.0 for i in range(n)]
+
+        def heading(label, bg, indent=0):
+            return f'<tr style="background:{bg};"><td colspan="{n + 1}" style="padding-left:{indent}px;"><strong>{label}</strong></td></tr>'
+
+        current_assets, fixed_assets = total(("current_asset",), 1), total(("fixed_asset",), 1)
+        assets = [a + b for a, b in zip(current_assets, fixed_assets)]
+        current_liab, long_liab = total(("current_liability",), -1), total(("long_term_liability",), -1)
+        liabilities = [a + b for a, b in zip(current_liab, long_liab)]
+        profit = [tb.profit(i) for i in range(n)]
+        # Accounts no chart or code range places are shown, not dropped, so
+        # the sheet still adds up to the TB
+        unclassified = total(("unclassified",), -1)
+        equity = [e + p + u for e, p, u in zip(total(("equity",), -1), profit, unclassified)]
+        diff = [a - (l + e) for a, l, e in zip(assets, liabilities, equity)]
+        is_balanced = all(abs(d) < 0.01 for d in diff)
+
+        body = heading("ASSETS", "rgba(59,130,246,0.1)")
+        body += heading("Current Assets", "transparent", 20) + section_rows(("current_asset",), 1)
+        body += amounts_row("Total Current Assets", current_assets, "font-weight:bold;border-top:1px solid var(--border);", 20)
+        if tb.codes(("fixed_asset",)):
+            body += heading("Non-current Assets", "transparent", 20) + section_rows(("fixed_asset",), 1)
+            body += amounts_row("Total Non-current Assets", fixed_assets, "font-weight:bold;border-top:1px solid var(--border);", 20)
+        body += amounts_row("TOTAL ASSETS", assets, "font-weight:bold;background:rgba(59,130,246,0.05);", 8)
+        body += heading("LIABILITIES", "rgba(239,68,68,0.1)")
+        body += heading("Current Liabilities", "transparent", 20) + section_rows(("current_liability",), -1)
+        body += amounts_row("Total Current Liabilities", current_liab, "font-weight:bold;border-top:1px solid var(--border);", 20)
+        if tb.codes(("long_term_liability",)):
+            body += heading("Long-term Liabilities", "transparent", 20) + section_rows(("long_term_liability",), -1)
+            body += amounts_row("Total Long-term Liabilities", long_liab, "font-weight:bold;border-top:1px solid var(--border);", 20)
+        body += amounts_row("TOTAL LIABILITIES", liabilities, "font-weight:bold;background:rgba(239,68,68,0.05);", 8)
+        body += heading("EQUITY", "rgba(139,92,246,0.1)") + section_rows(("equity",), -1)
+        body += amounts_row("Profit/Loss not yet closed to Retained Earnings", profit)
+        if tb.codes(("unclassified",)):
+            body += amounts_row("Unclassified accounts", unclassified)
+        body += amounts_row("TOTAL EQUITY", equity, "font-weight:bold;background:rgba(139,92,246,0.05);", 8)
+        head = "".join(f'<th style="text-align:right;">{d}</th>' for d in dates)
+        check = "".join(f'<div style="color:var(--red);margin-top:10px;">{d_}: Difference {money(v)} - Please review entries</div>'
+                        for d_, v in zip(dates, diff) if abs(v) >= 0.01)
+        return f'''
+        <div style="display:flex;justify-content:space-between;align-items:center;margin-bottom:20px;">
+            <a href="/reports" style="color:var(--text-muted);">← Back to Reports</a>
+            <div style="display:flex;gap:10px;align-items:center;">
+                <select onchange="window.location='/reports/balance-sheet?compare='+this.value" style="padding:8px;border-radius:6px;background:var(--card);color:var(--text);border:1px solid var(--border);">
+                    {_compare_options(n - 1, "year")}
+                </select>
+                <button class="btn btn-secondary" onclick="window.print();">🖨️ Print</button>
+            </div>
+        </div>
+        
+        <div class="card">
+            <h2 style="margin-bottom:5px;">[CHART] Balance Sheet</h2>
+            <p style="color:var(--text-muted);margin-bottom:20px;">As at {dates[0]} — from the general ledger</p>
+            
+            <table class="table" style="font-size:14px;">
+                <thead><tr><th></th>{head}</tr></thead>
+                <tbody>
+                    {body}
+                </tbody>
+            </table>
+            
+            <div style="margin-top:20px;padding:15px;border-radius:8px;background:{'rgba(16,185,129,0.1)' if is_balanced else 'rgba(239,68,68,0.1)'};border:1px solid {'var(--green)' if is_balanced else 'var(--red)'};">
+                <div style="display:flex;justify-content:space-between;align-items:center;">
+                    <span>{'' if is_balanced else '[!]'} Assets = Liabilities + Equity</span>
+                    <span style="font-weight:bold;">{money(assets[0])} = {money(liabilities[0])} + {money(equity[0])}</span>
+                </div>
+                {check}
+            </div>
+        </div>
+        '''
+
     @app.route("/reports/balance-sheet")
     @login_required
     def report_balance_sheet():
@@ -5135,6 +5423,15 @@ def register_report_routes(app, db, login_required, Auth, render_page,
         business = Auth.get_current_business()
         biz_id = business.get("id") if business else None
         
+        # From the ledger when the business has one, as at today and the
+        # comparative year-ends before it, in one read
+        if biz_id:
+            dates = [today()] + [_years_before(today(), k) for k in range(1, _compare_arg() + 1)]
+            tb = trial_balance(db, biz_id, [(None, d) for d in dates], **_tb_account_names(biz_id))
+            if tb.accounts:
+                return render_page("Balance Sheet", _balance_sheet_from_ledger(tb, dates), user, "reports")
+        
+        # No ledger yet - estimate from the documents
         # ASSETS
         # Current Assets
         customers = db.get("customers", {"business_id": biz_id}) if biz_id else []
@@ -5146,27 +5443,37 @@ def register_report_routes(app, db, login_required, Auth, render_page,
             for s in stock
         )
         
+        # Every figure below is a column total, so the source tables are read
+        # column-wise (db.get_columnar) and summed as vectors
+        from clickai import ColumnBatch
+        
+        def _cols(table, numeric, extra=()):
+            if not biz_id:
+                return ColumnBatch({c: [] for c in list(numeric) + list(extra)}, 0)
+            return db.get_columnar(table, list(numeric) + list(extra), {"business_id": biz_id},
+                                   numeric=numeric)
+        
         # Bank balance (from receipts - expenses - supplier payments)
-        receipts = db.get("receipts", {"business_id": biz_id}) if biz_id else []
-        total_receipts = sum(float(r.get("amount", 0)) for r in receipts)
+        receipts = _cols("receipts", ["amount"])
+        total_receipts = receipts.total("amount")
         
-        sales = db.get("sales", {"business_id": biz_id}) if biz_id else []
+        sales = _cols("sales", ["total", "vat", "subtotal"], ["payment_method"])
         # Only cash and card sales affect bank - account sales are in debtors
-        cash_card_sales = sum(float(s.get("total", 0)) for s in sales if s.get("payment_method", "cash") in ("cash", "card"))
+        cash_card_sales = sales.total("total", sales.isin("payment_method", ("cash", "card")))
         
-        expenses = db.get("expenses", {"business_id": biz_id}) if biz_id else []
-        total_expenses_paid = sum(float(e.get("amount", 0)) for e in expenses)
+        expenses = _cols("expenses", ["amount", "vat"])
+        total_expenses_paid = expenses.total("amount")
         
-        supplier_payments = db.get("supplier_payments", {"business_id": biz_id}) if biz_id else []
-        total_supplier_payments = sum(float(p.get("amount", 0)) for p in supplier_payments)
+        supplier_payments = _cols("supplier_payments", ["amount"])
+        total_supplier_payments = supplier_payments.total("amount")
         
-        payslips = db.get("payslips", {"business_id": biz_id}) if biz_id else []
-        total_payroll_paid = sum(float(p.get("net", 0)) for p in payslips)
+        payslips = _cols("payslips", ["net", "gross"])
+        total_payroll_paid = payslips.total("net")
         
         bank_balance = total_receipts + cash_card_sales - total_expenses_paid - total_supplier_payments - total_payroll_paid
         
         # VAT Receivable (input VAT from expenses)
-        vat_receivable = sum(float(e.get("vat", 0)) for e in expenses)
+        vat_receivable = expenses.total("vat")
         
         total_current_assets = total_debtors + stock_value + bank_balance + vat_receivable
         if bank_balance < 0:
@@ -5180,9 +5487,9 @@ def register_report_routes(app, db, login_required, Auth, render_page,
         total_creditors = sum(float(s.get("balance", 0)) for s in suppliers if float(s.get("balance", 0)) > 0)
         
         # VAT Payable (output VAT from sales)
-        invoices = db.get("invoices", {"business_id": biz_id}) if biz_id else []
-        vat_from_invoices = sum(float(i.get("vat", 0)) for i in invoices)
-        vat_from_sales = sum(float(s.get("vat", 0)) for s in sales)
+        invoices = _cols("invoices", ["vat", "subtotal"])
+        vat_from_invoices = invoices.total("vat")
+        vat_from_sales = sales.total("vat")
         vat_payable = vat_from_invoices + vat_from_sales - vat_receivable
         if vat_payable < 0:
             vat_payable = 0  # VAT refund due would be an asset
@@ -5194,16 +5501,16 @@ def register_report_routes(app, db, login_required, Auth, render_page,
         
         # EQUITY
         # Calculate retained earnings from profit
-        invoice_income = sum(float(inv.get("subtotal", 0)) for inv in invoices)
-        sales_income = sum(float(s.get("subtotal", 0)) for s in sales)
+        invoice_income = invoices.total("subtotal")
+        sales_income = sales.total("subtotal")
         total_income = invoice_income + sales_income
         
-        expense_total = sum(float(e.get("amount", 0)) for e in expenses)
-        payroll_total = sum(float(p.get("gross", 0)) for p in payslips)
+        expense_total = expenses.total("amount")
+        payroll_total = payslips.total("gross")
         
         # Cost of sales from supplier invoices
-        supplier_invoices = db.get("supplier_invoices", {"business_id": biz_id}) if biz_id else []
-        cost_of_sales = sum(float(si.get("total", 0)) for si in supplier_invoices)
+        supplier_invoices = _cols("supplier_invoices", ["total"])
+        cost_of_sales = supplier_invoices.total("total")
         
         net_profit = total_income - cost_of_sales - expense_total - payroll_total
         
@@ -5380,18 +5687,12 @@ def register_report_routes(app, db, login_required, Auth, render_page,
         month_names = ["", "Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
         period_label = f"{month_names[period_start_month]}-{month_names[period_end_month]} {year}"
         
-        # Get data filtered by period
-        invoices = db.get("invoices", {"business_id": biz_id}) if biz_id else []
-        invoices = [i for i in invoices if start_date <= i.get("date", "") < end_date]
-        
-        sales = db.get("sales", {"business_id": biz_id}) if biz_id else []
-        sales = [s for s in sales if start_date <= s.get("date", "") < end_date]
-        
-        expenses = db.get("expenses", {"business_id": biz_id}) if biz_id else []
-        expenses = [e for e in expenses if start_date <= e.get("date", "") < end_date]
-        
-        supplier_invoices = db.get("supplier_invoices", {"business_id": biz_id}) if biz_id else []
-        supplier_invoices = [si for si in supplier_invoices if start_date <= si.get("date", "") < end_date]
+        # Get data filtered by period — the window runs on the server
+        period_filter = {"business_id": biz_id, "date": [("gte", start_date), ("lt", end_date)]}
+        invoices = db.get("invoices", period_filter) if biz_id else []
+        sales = db.get("sales", period_filter) if biz_id else []
+        expenses = db.get("expenses", period_filter) if biz_id else []
+        supplier_invoices = db.get("supplier_invoices", period_filter) if biz_id else []
         
         # OUTPUT VAT (what you owe SARS)
         # For imported invoices where vat=0, back-calculate from total (assume VAT inclusive)
@@ -5635,21 +5936,13 @@ def register_report_routes(app, db, login_required, Auth, render_page,
             end_date = today_date.strftime("%Y-%m-%d")
             period_label = today_date.strftime("%B %Y")
         
-        # Get data filtered by period
-        receipts = db.get("receipts", {"business_id": biz_id}) if biz_id else []
-        receipts = [r for r in receipts if start_date <= r.get("date", "") <= end_date]
-        
-        sales = db.get("sales", {"business_id": biz_id}) if biz_id else []
-        sales = [s for s in sales if start_date <= s.get("date", "") <= end_date]
-        
-        expenses = db.get("expenses", {"business_id": biz_id}) if biz_id else []
-        expenses = [e for e in expenses if start_date <= e.get("date", "") <= end_date]
-        
-        payslips = db.get("payslips", {"business_id": biz_id}) if biz_id else []
-        payslips = [p for p in payslips if start_date <= p.get("date", "") <= end_date]
-        
-        supplier_payments = db.get("supplier_payments", {"business_id": biz_id}) if biz_id else []
-        supplier_payments = [sp for sp in supplier_payments if start_date <= sp.get("date", "") <= end_date]
+        # Get data filtered by period — the window runs on the server
+        period_filter = {"business_id": biz_id, "date": [("gte", start_date), ("lte", end_date)]}
+        receipts = db.get("receipts", period_filter) if biz_id else []
+        sales = db.get("sales", period_filter) if biz_id else []
+        expenses = db.get("expenses", period_filter) if biz_id else []
+        payslips = db.get("payslips", period_filter) if biz_id else []
+        supplier_payments = db.get("supplier_payments", period_filter) if biz_id else []
         
         # OPERATING ACTIVITIES
         # Cash IN
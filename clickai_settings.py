@@ -1967,8 +1967,8 @@ def register_settings_routes(app, db, login_required, Auth, render_page,
             return jsonify({"error": "No business selected"})
         
         # Build the GL map from COA
-        global _gl_map_cache
-        _gl_map_cache = {}  # Clear cache
+        import clickai as _main
+        _main._gl_map_cache.pop(biz_id, None)  # Clear cache
         gl_map = build_gl_map(biz_id)
         
         if not gl_map:
@@ -2079,7 +2079,7 @@ def register_settings_routes(app, db, login_required, Auth, render_page,
                 pass
         
         # Clear GL map cache so next request picks up fresh data
-        _gl_map_cache = {}
+        _main._gl_map_cache.pop(biz_id, None)
         
         logger.info(f"[GL MIGRATE] Done: {migrated} journals migrated, {failed} failed, {je_migrated} OB entries migrated")
         
@@ -2102,8 +2102,8 @@ def register_settings_routes(app, db, login_required, Auth, render_page,
         if not biz_id:
             return jsonify({"error": "No business selected"})
         
-        global _gl_map_cache
-        _gl_map_cache = {}
+        import clickai as _main
+        _main._gl_map_cache.pop(biz_id, None)
         gl_map = build_gl_map(biz_id)
         
         coa = db.get("chart_of_accounts", {"business_id": biz_id}) or []
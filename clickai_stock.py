@@ -760,9 +760,7 @@ def register_stock_routes(app, db, login_required, Auth, render_page,
                 saved_cats[(k or "").strip()] = 0.0
         
         # Distinct categories from live stock
-        all_stock = db.get_all_stock(biz_id) if biz_id else []
-        categories = sorted(set((s.get("category") or "").strip() for s in all_stock
-                                if (s.get("category") or "").strip()))
+        categories = db.stock_catalog(biz_id).categories()
         
         cat_rows = ""
         for cat in categories:
@@ -862,13 +860,17 @@ def register_stock_routes(app, db, login_required, Auth, render_page,
         movements.sort(key=lambda m: str(m.get("date") or m.get("created_at") or ""), reverse=True)
         
         # Get all stock items for lookup
-        all_stock = db.get_all_stock(biz_id) if biz_id else []
-        stock_lookup = {s.get("id"): s for s in all_stock}
+        catalog = db.stock_catalog(biz_id)
+        all_stock = catalog.rows
+        
+        def _stock_row(sid):
+            item = catalog.get(sid)
+            return item.row if item else {}
         
         # Build table rows
         rows_html = ""
         for m in movements[:500]:  # Limit to 500
-            stock = stock_lookup.get(m.get("stock_id"), {})
+            stock = _stock_row(m.get("stock_id"))
             stock_desc = stock.get("description") or stock.get("name") or stock.get("code") or ""
             stock_code = stock.get("code", "")
             # If stock item not found in lookup, try to extract name from reference
@@ -1005,8 +1007,8 @@ def register_stock_routes(app, db, login_required, Auth, render_page,
 
         def _resolve_stock(line):
             sid = line.get("stock_id")
-            if sid and sid in stock_lookup:
-                return stock_lookup[sid]
+            if sid and catalog.get(sid):
+                return catalog.get(sid).row
             c = _norm_txt(line.get("code"))
             if c and c in _by_code:
                 return _by_code[c]
@@ -1044,7 +1046,7 @@ def register_stock_routes(app, db, login_required, Auth, render_page,
             d = str(m.get("date") or m.get("created_at") or "")[:10]
             if not d:
                 continue
-            s = stock_lookup.get(m.get("stock_id")) or {}
+            s = _stock_row(m.get("stock_id"))
             cost = float(s.get("cost_price", 0) or 0)
             qin = float(m.get("quantity") or 0)
             g = "Stainless Steel" if _normalise_category(s.get("category", "")) in _stainless else "Hardware"
@@ -2091,8 +2093,8 @@ def register_stock_routes(app, db, login_required, Auth, render_page,
         biz_id = business.get("id") if business else None
         
         # Get categories for dropdown
-        all_stock = db.get_all_stock(biz_id)
-        categories = sorted(set(s.get("category") or "General" for s in all_stock))
+        catalog = db.stock_catalog(biz_id)
+        categories = catalog.categories(default="General")
         
         if request.method == "POST":
             code = request.form.get("code", "").strip()
@@ -2118,16 +2120,15 @@ def register_stock_routes(app, db, login_required, Auth, render_page,
                 dup_warnings = []
                 
                 if code:
-                    existing_by_code = [s for s in all_stock if s.get("code", "").strip().upper() == code.upper()]
-                    if existing_by_code:
-                        e = existing_by_code[0]
-                        dup_warnings.append(f"⚠️ Code <strong>{code}</strong> already exists: {safe_string(e.get('description', ''))} (Qty: {e.get('qty', e.get('quantity', 0))})")
+                    e = catalog.by_code(code)
+                    if e:
+                        dup_warnings.append(f"⚠️ Code <strong>{code}</strong> already exists: {safe_string(e.description)} (Qty: {e.qty:g})")
                 
                 if description:
                     desc_lower = description.lower().strip()
                     desc_words = set(desc_lower.replace("-", " ").split())
                     
-                    for s in all_stock:
+                    for s in catalog.rows:
                         s_desc = (s.get("description") or "").lower().strip()
                         s_code = (s.get("code") or "").lower().strip()
                         s_words = set(s_desc.replace("-", " ").split()) | set(s_code.replace("-", " ").split())
@@ -2972,6 +2973,29 @@ def register_stock_routes(app, db, login_required, Auth, render_page,
         return jsonify({"success": True, "items": items})
     
     
+    @app.route("/api/stock/ledger-check")
+    @login_required
+    def api_stock_ledger_check():
+        """Replay the stock movement ledger and list every item whose
+        quantity is not the sum of its movements (clickai_stock_ledger.py)."""
+        role = get_user_role()
+        if role not in ("owner", "admin"):
+            return jsonify({"success": False, "error": "Owner/Admin only"})
+
+        business = Auth.get_current_business()
+        biz_id = business.get("id") if business else None
+
+        if not biz_id:
+            return jsonify({"success": False, "error": "No business"})
+
+        try:
+            result = db.stock_ledger_check(biz_id)
+        except RuntimeError as e:
+            logger.error(f"[STOCK LEDGER] Replay failed: {e}")
+            return jsonify({"success": False, "error": "Could not read stock movements"})
+        return jsonify({"success": True, **result})
+
+
     @app.route("/api/stock/adjust", methods=["POST"])
     @login_required
     def api_stock_adjust():
@@ -3004,36 +3028,20 @@ def register_stock_routes(app, db, login_required, Auth, render_page,
         
         current_qty = float(item.get("quantity", 0) or 0)
         
-        # Calculate new quantity
+        # Signed change
         if adj_type == "add":
-            new_qty = current_qty + qty
             movement_qty = qty
-            movement_type = "adjustment_in"
         elif adj_type == "remove":
-            new_qty = current_qty - qty
             movement_qty = -qty
-            movement_type = "adjustment_out"
-        else:  # set
-            new_qty = qty
+        else:  # set (stocktake): the difference from what is on hand now
             movement_qty = qty - current_qty
-            movement_type = "stocktake"
         
-        # Update stock
-        result = db.update_stock(stock_id, {"quantity": new_qty}, biz_id)
+        # One adjustment movement on the stock ledger moves the quantity
+        new_qty = db.move_stock(biz_id, stock_id, "adjustment", movement_qty,
+                                reference=note, on_hand=current_qty)
+        result = new_qty is not None
         
         if result:
-            # Record movement
-            movement = RecordFactory.stock_movement(
-                business_id=biz_id,
-                stock_id=stock_id,
-                movement_type=movement_type,
-                quantity=movement_qty,
-                reference=note,
-                note=f"Previous: {current_qty}, New: {new_qty}",
-                created_by=user.get("id", "") if user else ""
-            )
-            db.save("stock_movements", movement)
-            
             # --- GL Journal Entry for stock adjustment ---
             # Use item cost_price to calculate GL value
             cost_price = float(item.get("cost_price", 0) or item.get("cost", 0) or 0)
@@ -3090,8 +3098,7 @@ def register_stock_routes(app, db, login_required, Auth, render_page,
             return redirect("/stock")
         
         # Get categories for dropdown
-        all_stock = db.get_all_stock(biz_id)
-        categories = sorted(set(s.get("category") or "General" for s in all_stock))
+        categories = db.stock_catalog(biz_id).categories(default="General")
         
         if request.method == "POST":
             code = request.form.get("code", "").strip()
@@ -3173,10 +3180,9 @@ def register_stock_routes(app, db, login_required, Auth, render_page,
                         result = resp.json()
                         if result and len(result) > 0:
                             saved = True
-                            # Invalidate stock cache
+                            # Refresh the cached stock catalog on its next read
                             try:
-                                import clickai as _main
-                                _main._stock_cache.pop(biz_id, None)
+                                db.stock_changed(biz_id)
                             except:
                                 pass
                             break
@@ -3415,8 +3421,13 @@ def register_stock_routes(app, db, login_required, Auth, render_page,
         limit = int(request.args.get("limit", 100))
         category = request.args.get("category", "").strip()
         
-        # Get all stock (cached in production, fast from Supabase)
-        all_stock = db.get_all_stock(biz_id)
+        index = db.stock_index(biz_id)
+        if index is not None:
+            # Prebuilt index: filtered and sorted without a scan
+            all_stock = index.search(query, category)
+            query = category = ""
+        else:
+            all_stock = db.get_all_stock(biz_id)
         
         # Filter by search query
         if query:
@@ -3434,7 +3445,8 @@ def register_stock_routes(app, db, login_required, Auth, render_page,
             all_stock = [s for s in all_stock if str(s.get("category", "")).lower() == category.lower()]
         
         # Sort by category then description
-        all_stock = sorted(all_stock, key=lambda x: (x.get("category") or "ZZZ", x.get("description") or ""))
+        if index is None:
+            all_stock = sorted(all_stock, key=lambda x: (x.get("category") or "ZZZ", x.get("description") or ""))
         
         total = len(all_stock)
         items = all_stock[offset:offset + limit]
@@ -3479,31 +3491,12 @@ def register_stock_routes(app, db, login_required, Auth, render_page,
         })
     
     
-    # In-memory stock cache for typeahead lookup. Stock changes infrequently,
-    # so caching the full list per business for 60 seconds turns 2.3-second
-    # cold queries into ~30ms warm queries. The cache is invalidated on any
-    # stock save/update/delete (see _stock_cache_invalidate calls below).
-    _STOCK_CACHE = {}  # biz_id -> {"data": [...], "expires": timestamp}
-    _STOCK_CACHE_TTL = 60  # seconds
-    
-    def _stock_cache_get(biz_id):
-        """Get cached stock list for a business, or fetch and cache it."""
-        import time as _time
-        entry = _STOCK_CACHE.get(biz_id)
-        now_ts = _time.time()
-        if entry and entry.get("expires", 0) > now_ts:
-            return entry.get("data") or []
-        # Cache miss or expired - fetch fresh
-        data = db.get_all_stock(biz_id) or []
-        _STOCK_CACHE[biz_id] = {"data": data, "expires": now_ts + _STOCK_CACHE_TTL}
-        return data
-    
+    # Typeahead and search read the stock catalog (db.stock_catalog): one
+    # merged list per business in the shared 30s stock cache, with its search
+    # index built once per load. update_stock/save_stock drop it.
     def _stock_cache_invalidate(biz_id=None):
-        """Drop the cached stock list (call after any stock mutation)."""
-        if biz_id:
-            _STOCK_CACHE.pop(biz_id, None)
-        else:
-            _STOCK_CACHE.clear()
+        """Drop the cached stock catalog (call after any stock mutation)."""
+        db.invalidate_stock(biz_id)
     
     # Expose invalidator on app for other modules / routes to call
     try:
@@ -3518,9 +3511,10 @@ def register_stock_routes(app, db, login_required, Auth, render_page,
         Uses the SAME filter logic as the Stock page (multi-term, x-fuzzy):
           - "bolt m10" matches items containing BOTH "bolt" AND "m10"
           - "10 x 12" is normalised to "10x12" so it matches "10x12 bolt"
-        Code matches are returned before description-only matches.
-        Limit raised to 100 matches.
-        Stock list is cached in-memory for 60 seconds for performance.
+        Code-prefix matches come first, then code matches, then
+        description-only matches. Limit raised to 100 matches.
+        Answered from the StockIndex (clickai_stock_search.py) of the cached
+        stock catalog.
         """
         import re as _re
         business = Auth.get_current_business()
@@ -3530,44 +3524,42 @@ def register_stock_routes(app, db, login_required, Auth, render_page,
         raw = request.args.get("q", "").strip().lower()
         if len(raw) < 1:
             return jsonify([])
-        # Same normalisation as Stock page filterStock(): collapse "10 x 12" → "10x12"
-        normalised = _re.sub(r'\s*[xX]\s*', 'x', raw)
-        terms = [t for t in normalised.split() if t]
-        if not terms:
-            return jsonify([])
-        all_stock = _stock_cache_get(biz_id)
-        code_hits = []
-        desc_hits = []
-        for s in all_stock:
-            c_raw = str(s.get("code", "")).lower()
-            d_raw = str(s.get("description", "")).lower()
-            # Apply same x-normalisation to the searchable fields
-            c = _re.sub(r'\s*[xX]\s*', 'x', c_raw)
-            d = _re.sub(r'\s*[xX]\s*', 'x', d_raw)
-            haystack = c + " " + d
-            # Multi-term: every term must appear somewhere in code OR description
-            if not all(t in haystack for t in terms):
-                continue
-            price = float(s.get("price") or s.get("selling_price") or 0)
+        index = db.stock_index(biz_id)
+        if index is not None:
+            hits = index.lookup(raw, limit=100)
+        else:
+            # Same normalisation as Stock page filterStock(): collapse "10 x 12" → "10x12"
+            normalised = _re.sub(r'\s*[xX]\s*', 'x', raw)
+            terms = [t for t in normalised.split() if t]
+            if not terms:
+                return jsonify([])
+            code_hits = []
+            desc_hits = []
+            for s in db.get_all_stock(biz_id):
+                c = _re.sub(r'\s*[xX]\s*', 'x', str(s.get("code", "")).lower())
+                d = _re.sub(r'\s*[xX]\s*', 'x', str(s.get("description", "")).lower())
+                # Multi-term: every term must appear somewhere in code OR description
+                if not all(t in c + " " + d for t in terms):
+                    continue
+                # Prioritise: any term matching the code goes to the top
+                (code_hits if any(t in c for t in terms) else desc_hits).append(s)
+                if len(code_hits) + len(desc_hits) >= 100:
+                    break
+            hits = code_hits + desc_hits
+        out = []
+        for s in hits:
             cs = s.get("code", "")
             ds = s.get("description", "")
-            entry = {
+            out.append({
                 "id": s.get("id", ""),
                 "label": (f"{cs} - {ds}" if cs else ds),
                 "desc": ds,
                 "code": cs,
-                "price": price,
+                "price": float(s.get("price") or s.get("selling_price") or 0),
                 "unit": s.get("unit", ""),
                 "qty": float(s.get("qty") or s.get("quantity") or 0),
-            }
-            # Prioritise: any term matching the code goes to the top
-            if any(t in c for t in terms):
-                code_hits.append(entry)
-            else:
-                desc_hits.append(entry)
-            if len(code_hits) + len(desc_hits) >= 100:
-                break
-        return jsonify(code_hits + desc_hits)
+            })
+        return jsonify(out)
     
     
     # Store pending edits temporarily
@@ -3610,9 +3602,11 @@ def register_stock_routes(app, db, login_required, Auth, render_page,
             if qty > current_qty:
                 return jsonify({"success": False, "error": f"Not enough stock. Only {current_qty} available."})
             
-            # Update stock quantity
-            new_qty = current_qty - qty
-            db.update_stock(stock_id, {"qty": new_qty, "quantity": new_qty}, biz_id)
+            # Issue to the job: one movement on the stock ledger
+            new_qty = db.move_stock(biz_id, stock_id, "job_issue", qty,
+                                    reference=f"Job {job.get('job_number') or job_id}", on_hand=current_qty)
+            if new_qty is None:
+                return jsonify({"success": False, "error": "Stock could not be updated"})
             logger.info(f"[ISSUE TO JOB] Stock {code}: {current_qty} - {qty} = {new_qty}")
             
             # Update job card materials_issued
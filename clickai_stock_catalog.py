@@ -0,0 +1,277 @@
+"""
+ClickAI Stock Catalog
+======================
+One in-memory stock read model per business.
+
+Stock lives in two tables: stock_items (the newer one, used by imports) and
+the legacy stock table. DB.get_all_stock used to merge them on every cache
+miss and hand back raw rows, so every consumer re-did the field aliasing
+(qty / quantity, price / selling_price, cost / cost_price) and built its own
+id or code dict. A second 60s cache in clickai_stock.py held the same list
+again for the typeahead.
+
+StockCatalog is built once per load of the shared stock cache:
+
+  rows      - the merged raw rows, exactly what get_all_stock always returned
+              (stock_items first, legacy rows whose code is not already there)
+  items     - StockItem per row: typed, alias-free fields plus the source table
+  get(id)   - StockItem by id
+  by_code() - StockItem by code (case-insensitive; stock_items wins)
+  index     - the StockIndex for typeahead, built on first use
+
+Raw rows keep their table's columns, so a row read here can still be sent
+back to its table.
+
+Keeping it fresh without reloading 7,000 rows (see DB.stock_catalog):
+  patch_row()          - update_stock() hands over the row PostgREST returned
+                         from its PATCH; this worker's copy changes in place
+  patch_qty()          - the same for a ledger movement (DB.move_stock): the
+                         on-hand the insert trigger wrote back
+  apply_stock_changes() - the delta sync merges the rows whose updated_at
+                         moved since the last sync into the cached list
+  absorb()             - a newer cached list with the same items (a delta
+                         another worker ran) is copied in without rebuilding
+                         the catalog or its search index
+Only a change to what the index reads (code, description, category) or to
+which items exist costs a rebuild.
+
+Usage:
+    catalog = db.stock_catalog(biz_id)
+    item = catalog.get(stock_id)
+    if item and item.qty < item.reorder_level: ...
+
+Stdlib only (the search index imports NumPy lazily).
+"""
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def _num(row, *keys) -> float:
+    for k in keys:
+        v = row.get(k)
+        if v not in (None, ""):
+            try:
+                return float(v)
+            except (TypeError, ValueError):
+                continue
+    return 0.0
+
+
+SEARCH_FIELDS = ("code", "description", "name", "category")   # what StockIndex reads
+
+
+def _code_key(row) -> str:
+    return str(row.get("code") or "").lower()
+
+
+def merge_stock_tables(stock_items, legacy, hidden: list = None) -> list:
+    """stock_items rows, then legacy rows whose code is not already there
+    (rows without a code are always kept). The ids of the legacy rows left
+    out go into `hidden` when given."""
+    rows = list(stock_items or [])
+    codes = {_code_key(s) for s in rows if s.get("code")}
+    for s in legacy or []:
+        code = _code_key(s)
+        if not code or code not in codes:
+            rows.append(s)
+        elif hidden is not None:
+            hidden.append(str(s.get("id") or ""))
+    return rows
+
+
+def apply_stock_changes(rows, new_count: int, hidden, changed_new, changed_legacy):
+    """Merge changed rows of stock_items / legacy stock into a merged list.
+    Known ids are replaced where they stand, new stock_items rows join the
+    stock_items part (hiding a legacy row with the same code), new legacy
+    rows follow the merge rule. Returns (rows, new_count, hidden, changed) -
+    a new list when anything changed, the same one otherwise."""
+    pos = {str(r.get("id") or ""): i for i, r in enumerate(rows)}
+    hidden = list(hidden or [])
+    out, changed = None, False
+    for table, batch in (("stock_items", changed_new), ("stock", changed_legacy)):
+        for row in batch or []:
+            sid = str(row.get("id") or "")
+            if not sid or sid in hidden:
+                continue
+            i = pos.get(sid)
+            if i is not None:
+                if rows[i] != row:
+                    out = out if out is not None else list(rows)
+                    out[i] = row
+                    changed = True
+                continue
+            out = out if out is not None else list(rows)
+            code = _code_key(row)
+            if table == "stock_items":
+                if code:
+                    for j in range(new_count, len(out)):
+                        if _code_key(out[j]) == code:
+                            hidden.append(str(out[j].get("id") or ""))
+                            del out[j]
+                            break
+                out.insert(new_count, row)
+                new_count += 1
+            elif code and any(_code_key(r) == code for r in out[:new_count]):
+                hidden.append(sid)
+                continue
+            else:
+                out.append(row)
+            pos = {str(r.get("id") or ""): k for k, r in enumerate(out)}
+            changed = True
+    return (out if out is not None else rows), new_count, hidden, changed
+
+
+class StockItem:
+    """Typed view of one stock row. `row` is the untouched source dict."""
+
+    __slots__ = ("id", "code", "description", "category", "unit", "qty", "cost",
+                 "price", "reorder_level", "table", "row")
+
+    def __init__(self, row: dict, table: str):
+        self.row = row
+        self.table = table
+        self._load()
+
+    def _load(self):
+        row = self.row
+        self.id = str(row.get("id") or "")
+        self.code = str(row.get("code") or "")
+        self.description = str(row.get("description") or row.get("name") or "")
+        self.category = str(row.get("category") or "")
+        self.unit = str(row.get("unit") or "")
+        # Same precedence the call sites used: qty or quantity, cost or cost_price, ...
+        self.qty = _num(row, "qty", "quantity")
+        self.cost = _num(row, "cost", "cost_price")
+        self.price = _num(row, "price", "selling_price")
+        self.reorder_level = _num(row, "reorder_level")
+
+    def __repr__(self):
+        return f"StockItem({self.code or self.id!r}, qty={self.qty:g})"
+
+
+class StockCatalog:
+    """The merged stock of one business. `new_count` = how many of `rows`
+    (from the front) came from stock_items; the rest are legacy stock."""
+
+    def __init__(self, rows, new_count=None):
+        self.rows = rows
+        self.source = rows        # the cached list this catalog mirrors
+        self.cache_stamp = None   # shared-cache stamp of the entry `source` came from
+        self.cache_entry = None   # that entry, so an unchanged stamp needs no re-read
+        self.new_count = len(rows) if new_count is None else new_count
+        self.items = [StockItem(r, "stock_items" if i < self.new_count else "stock")
+                      for i, r in enumerate(rows)]
+        self._by_id = {}
+        self._by_code = {}
+        for item in self.items:
+            if item.id:
+                self._by_id.setdefault(item.id, item)
+            if item.code:
+                self._by_code.setdefault(item.code.lower(), item)
+        self._index = None
+        self._index_lock = threading.Lock()
+
+    @classmethod
+    def from_tables(cls, stock_items, legacy, hidden: list = None):
+        rows = merge_stock_tables(stock_items, legacy, hidden)
+        return cls(rows, len(stock_items or []))
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + 400 * len(self.items) + (self._index.__sizeof__() if self._index else 0)
+
+    def get(self, stock_id):
+        return self._by_id.get(str(stock_id or ""))
+
+    def by_code(self, code):
+        return self._by_code.get(str(code or "").strip().lower())
+
+    def categories(self, default: str = None) -> list:
+        """Distinct categories, sorted. Blank ones count as `default`
+        (left out when default is None)."""
+        cats = {item.category.strip() or default for item in self.items}
+        cats.discard(None)
+        cats.discard("")
+        return sorted(cats)
+
+    def _replace(self, item, row) -> bool:
+        """Copy row into item's dict in place (the index holds the same dict).
+        Returns True when a field the index reads changed."""
+        searched = any(item.row.get(k) != row.get(k) for k in SEARCH_FIELDS)
+        old_code = item.code.lower()
+        if item.row is not row:
+            # Values change in place; readers walking the dict never see it shrink
+            item.row.update(row)
+            for k in [k for k in item.row if k not in row]:
+                item.row.pop(k, None)
+        item._load()
+        if item.code.lower() != old_code:
+            if self._by_code.get(old_code) is item:
+                del self._by_code[old_code]
+            if item.code:
+                self._by_code.setdefault(item.code.lower(), item)
+        if searched:
+            self._index = None
+        return searched
+
+    def patch_row(self, row: dict) -> bool:
+        """A stock row as the database now has it (update_stock's PATCH
+        response). Returns False when the id is not in this catalog."""
+        item = self.get(row.get("id"))
+        if item is None:
+            return False
+        self._replace(item, row)
+        return True
+
+    def patch_qty(self, stock_id, qty) -> bool:
+        """Set one item's on-hand (a ledger movement's balance_after) in the
+        quantity columns its row has. False when the id is not here."""
+        item = self.get(stock_id)
+        if item is None:
+            return False
+        row = dict(item.row)
+        keys = [k for k in ("qty", "quantity") if k in row] or ["quantity"]
+        for k in keys:
+            row[k] = qty
+        self._replace(item, row)
+        return True
+
+    def absorb(self, rows, new_count) -> bool:
+        """Take a newer copy of the same items (same ids, same order) in
+        place. Returns False - build a new catalog - when items were added,
+        removed or moved."""
+        if len(rows) != len(self.items) or new_count != self.new_count:
+            return False
+        if any(str(r.get("id") or "") != item.id for r, item in zip(rows, self.items)):
+            return False
+        for item, row in zip(self.items, rows):
+            if item.row != row:
+                self._replace(item, row)
+        self.source = rows
+        return True
+
+    @property
+    def index_built(self) -> bool:
+        return self._index is not None
+
+    @property
+    def index(self):
+        """StockIndex over rows (clickai_stock_search), or None if it won't import."""
+        if self._index is None:
+            with self._index_lock:
+                if self._index is None:
+                    try:
+                        from clickai_stock_search import StockIndex
+                    except ImportError as e:
+                        logger.warning(f"[STOCK] search index unavailable: {e}")
+                        return None
+                    self._index = StockIndex(self.rows)
+        return self._index
@@ -0,0 +1,97 @@
+"""
+ClickAI Stock Ledger
+=====================
+Stock quantities as an append-only stream of movements.
+
+Every flow that moved stock used to read the item, work out the new quantity
+and PATCH it over the old one (update_stock: up to three attempts across
+stock_items and stock), then log a stock_movements row on the side. Two tills
+selling the same item at once both read 10 and both write 9; the log and the
+quantity drifted apart whenever either write failed.
+
+With STOCK_LEDGER_SQL run, a flow records one stock_movements row instead
+(DB.move_stock). The row carries its signed qty_delta, and a trigger adds it
+to the item's quantity in the same statement (UPDATE ... SET quantity =
+quantity + delta, under the row lock), so concurrent movements all land and
+on-hand is the maintained aggregate of the ledger. The trigger writes the
+resulting on-hand back into the movement as balance_after.
+
+Movement kinds (type stays 'in' / 'out' with a positive quantity, as the
+reports and the movements page read it):
+
+  sale            - POS, invoice and Zane sales            out
+  job_issue       - stock issued to a job card             out
+  supplier_return - goods sent back to a supplier          out
+  grv             - goods received, scanned supplier bills in
+  return          - credit notes, refunds, job lines undone in
+  adjustment      - stocktake, imports, edits, merges      signed
+  opening         - reconciling row written by the SQL when the ledger
+                    starts; it records the quantity already on hand and
+                    moves nothing
+
+Replay (the proof): the on-hand of every item is the sum of its qty_delta.
+replay() folds movements in Python, reconcile() compares a catalog with it.
+
+Stdlib only.
+"""
+
+OUT_KINDS = ("sale", "job_issue", "supplier_return")
+IN_KINDS = ("grv", "return")
+SIGNED_KINDS = ("adjustment", "opening")
+KINDS = OUT_KINDS + IN_KINDS + SIGNED_KINDS
+# Stock page adjustments before the ledger: type says which, quantity is signed
+LEGACY_SIGNED_TYPES = ("adjustment_in", "adjustment_out", "stocktake")
+
+
+def signed_qty(kind: str, quantity) -> float:
+    """The qty_delta of a movement: out kinds take stock, in kinds add it,
+    adjustments keep the sign they are given."""
+    if kind not in KINDS:
+        raise ValueError(f"unknown stock movement kind: {kind!r}")
+    q = float(quantity or 0)
+    if kind in OUT_KINDS:
+        return -abs(q)
+    if kind in IN_KINDS:
+        return abs(q)
+    return q
+
+
+def movement_delta(row: dict) -> float:
+    """qty_delta of a stored movement. Rows logged before the ledger have
+    only type and quantity ('in' adds, 'out' takes, the old adjustment
+    types carry their sign, anything else is 0) - the same rule
+    STOCK_LEDGER_SQL uses to backfill them."""
+    delta = row.get("qty_delta")
+    if delta not in (None, ""):
+        return float(delta)
+    q = float(row.get("quantity") or 0)
+    kind = str(row.get("type") or "").lower()
+    if kind == "in":
+        return abs(q)
+    if kind == "out":
+        return -abs(q)
+    if kind in LEGACY_SIGNED_TYPES:
+        return q
+    return 0.0
+
+
+def replay(movements) -> dict:
+    """{stock_id: on-hand} from a stream of movements (any order)."""
+    on_hand = {}
+    for m in movements:
+        sid = str(m.get("stock_id") or "")
+        if sid:
+            on_hand[sid] = on_hand.get(sid, 0.0) + movement_delta(m)
+    return on_hand
+
+
+def reconcile(items, on_hand: dict, tolerance: float = 1e-6) -> list:
+    """Items whose quantity differs from the ledger replay, as
+    (item, ledger_qty) pairs. `items` are StockItems (a StockCatalog); an
+    item with no movements replays to 0."""
+    out = []
+    for item in items:
+        ledger_qty = on_hand.get(item.id, 0.0)
+        if abs(item.qty - ledger_qty) > tolerance:
+            out.append((item, ledger_qty))
+    return out
@@ -0,0 +1,211 @@
+"""
+ClickAI Stock Search
+=====================
+Prebuilt search index for the stock typeahead and the Stock page search.
+
+/api/stock/lookup used to scan every stock dict on every keystroke, running
+the "10 x 12" -> "10x12" re.sub on each code and description before the
+substring checks. StockIndex does that work once, when the stock list is
+loaded, and answers a keystroke from posting lists:
+
+  - every 1-3 character piece of every word (code and description, after
+    the x-normalisation) maps to the item positions that contain it, so a
+    short term is answered exactly from one posting list
+  - a longer term intersects the posting lists of its trigrams; the few
+    items that share the trigrams but not the term are dropped when the
+    results are read out
+  - multi-term queries AND their posting lists (bool masks over the catalog)
+  - every prefix of a code maps to its items, so code-prefix hits rank first
+
+Items are numbered in code order, so each rank tier reads out sorted by code:
+  1. a term is a prefix of the code
+  2. a term appears in the code
+  3. description-only matches
+
+The index is immutable once built - rebuild it when the stock list changes.
+
+Built on first use by StockCatalog.index (clickai_stock_catalog.py), so it
+lives exactly as long as the cached catalog it indexes:
+    index = db.stock_index(biz_id)   # None if NumPy won't import
+    hits = index.lookup("bolt m10")
+"""
+
+import re
+
+import numpy as np
+
+GRAM = 3           # longest piece kept in the posting lists
+MAX_PREFIX = 24    # longest code prefix indexed
+LOOKUP_LIMIT = 100
+
+_X = re.compile(r"\s*x\s*")
+_EMPTY = np.zeros(0, dtype=np.int32)
+
+
+def normalise(text) -> str:
+    """Lowercase and collapse "10 x 12" to "10x12" (the Stock page filter rule)."""
+    return _X.sub("x", str(text or "").lower())
+
+
+def query_terms(query) -> list:
+    return [t for t in normalise(query).split() if t]
+
+
+def _pieces(text):
+    out = set()
+    for word in text.split():
+        n = len(word)
+        for size in range(1, GRAM + 1):
+            for i in range(n - size + 1):
+                out.add(word[i:i + size])
+    return out
+
+
+def _freeze(postings):
+    return {k: np.asarray(v, dtype=np.int32) for k, v in postings.items()}
+
+
+class StockIndex:
+    """Search index over one business's stock list (as get_all_stock returns it)."""
+
+    def __init__(self, items):
+        self.items = items
+        keyed = [(normalise(s.get("code", "")), normalise(s.get("description", "")), s)
+                 for s in items]
+        keyed.sort(key=lambda k: (k[0] == "", k[0], k[1]))
+        self.n = len(keyed)
+        self.rows = [k[2] for k in keyed]
+        self.code = [k[0] for k in keyed]
+        self.text = [f"{c} {d}" for c, d, _s in keyed]
+
+        text_post, code_post, prefix_post, cat_post = {}, {}, {}, {}
+        for i, (code, desc, s) in enumerate(keyed):
+            code_pieces = _pieces(code)
+            for g in code_pieces | _pieces(desc):
+                text_post.setdefault(g, []).append(i)
+            for g in code_pieces:
+                code_post.setdefault(g, []).append(i)
+            for size in range(1, min(len(code), MAX_PREFIX) + 1):
+                prefix_post.setdefault(code[:size], []).append(i)
+            cat_post.setdefault(str(s.get("category") or "").lower(), []).append(i)
+        self._text = _freeze(text_post)
+        self._code = _freeze(code_post)
+        self._prefix = _freeze(prefix_post)
+        self._cat = _freeze(cat_post)
+
+        # The Stock page lists matches by category, then description
+        page = sorted(range(self.n), key=lambda i: (self.rows[i].get("category") or "ZZZ",
+                                                    self.rows[i].get("description") or ""))
+        self._page_rank = np.empty(self.n, dtype=np.int32)
+        self._page_rank[page] = np.arange(self.n, dtype=np.int32)
+
+    def __len__(self):
+        return self.n
+
+    def __sizeof__(self):
+        arrays = sum(a.nbytes + 96 for p in (self._text, self._code, self._prefix, self._cat)
+                     for a in p.values())
+        return object.__sizeof__(self) + arrays + self._page_rank.nbytes + 120 * self.n
+
+    # -- posting lists ----------------------------------------------------
+
+    def _mask(self, ids):
+        m = np.zeros(self.n, dtype=bool)
+        m[ids] = True
+        return m
+
+    def _match(self, postings, term):
+        """Items whose text holds term: exact for a short term, a superset
+        (items holding all its trigrams) for a longer one."""
+        if len(term) <= GRAM:
+            return self._mask(postings.get(term, _EMPTY))
+        lists = sorted((postings.get(term[i:i + GRAM], _EMPTY)
+                        for i in range(len(term) - GRAM + 1)), key=len)
+        m = self._mask(lists[0])
+        for ids in lists[1:]:
+            if not m.any():
+                break
+            m &= self._mask(ids)
+        return m
+
+    def _candidates(self, terms):
+        m = None
+        for t in sorted(set(terms), key=len, reverse=True):
+            hit = self._match(self._text, t)
+            m = hit if m is None else m & hit
+            if not m.any():
+                break
+        return m
+
+    def _holds(self, i, terms):
+        text = self.text[i]
+        return all(t in text for t in terms)
+
+    # -- queries ----------------------------------------------------------
+
+    def lookup(self, query, limit: int = LOOKUP_LIMIT) -> list:
+        """Typeahead: items holding every term in code or description, code
+        prefix hits first, then code hits, then description-only hits."""
+        terms = query_terms(query)
+        if not terms or not self.n:
+            return []
+        cand = self._candidates(terms)
+        if not cand.any():
+            return []
+        prefix = np.zeros(self.n, dtype=bool)
+        in_code = np.zeros(self.n, dtype=bool)
+        for t in set(terms):
+            if len(t) <= MAX_PREFIX:
+                prefix[self._prefix.get(t, _EMPTY)] = True
+            in_code |= self._match(self._code, t)
+        first = cand & prefix
+        second = cand & in_code & ~first
+
+        out, demoted = [], []
+        for i in np.flatnonzero(first):
+            if self._holds(i, terms):
+                out.append(i)
+                if len(out) >= limit:
+                    return [self.rows[i] for i in out]
+        for i in np.flatnonzero(second):
+            if not self._holds(i, terms):
+                continue
+            code = self.code[i]
+            if any(t in code for t in terms):
+                out.append(i)
+                if len(out) >= limit:
+                    return [self.rows[i] for i in out]
+            else:
+                demoted.append(i)
+        third = cand & ~in_code & ~prefix
+        if demoted:
+            third[demoted] = True
+        for i in np.flatnonzero(third):
+            if self._holds(i, terms):
+                out.append(i)
+                if len(out) >= limit:
+                    break
+        return [self.rows[i] for i in out]
+
+    def search(self, query="", category="") -> list:
+        """Stock page search: every term in code or description, or the whole
+        query in the category; optionally one category only. Sorted by
+        category then description."""
+        terms = query_terms(query)
+        if terms:
+            m = self._candidates(terms)
+            if any(len(t) > GRAM for t in terms):
+                for i in np.flatnonzero(m):
+                    if not self._holds(i, terms):
+                        m[i] = False
+            whole = str(query or "").strip().lower()
+            for cat, ids in self._cat.items():
+                if whole in cat:
+                    m[ids] = True
+        else:
+            m = np.ones(self.n, dtype=bool)
+        if category:
+            m &= self._mask(self._cat.get(str(category).lower(), _EMPTY))
+        ids = np.flatnonzero(m)
+        ids = ids[np.argsort(self._page_rank[ids], kind="stable")]
+        return [self.rows[i] for i in ids]
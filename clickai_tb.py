@@ -0,0 +1,388 @@
+"""
+ClickAI Trial Balance Module
+=============================
+One trial balance engine for the TB, Income Statement, Balance Sheet and
+the TB insights, for any number of comparative periods at once.
+
+trial_balance(db, biz, periods) reads the ledger once and returns, for
+every account and every period (date_from, date_to):
+
+    opening   - everything dated before date_from
+    movement  - everything dated in [date_from, date_to]
+    closing   - opening + movement
+
+each as gross {"debit", "credit"}. date_from None means "from the start"
+(opening is empty, movement is the whole history to date_to - an as-at
+TB); date_to None means no upper bound.
+
+The read is one aggregate, never journal lines: whole months come from
+gl_balances (once the business is rebuilt, see clickai_gl_balances) and
+only the months a period boundary cuts through are summed by day from
+journals; before the rebuild the journals are summed by (account, day) on
+the server. Imported opening balances (journal_entries with reference OB)
+sit before every period - undated, like the undated journals.
+
+Once months are closed (clickai_period_close), the dated journals up to the
+latest fresh GL snapshot that sits before every period come from that
+snapshot - one row per account - and only the journals dated after its
+month-end are read.
+
+Each account is classified once (classify()) - from its chart of accounts
+category when it has one, which is the only reliable key for Sage / Xero
+charts, else from the ClickAI code ranges (1xxx assets ... 6xxx+ expenses) -
+so the reports built on it agree with each other by construction.
+
+Import in clickai_reports.py:
+    from clickai_tb import trial_balance
+"""
+
+import calendar
+import logging
+from datetime import datetime, timedelta
+
+from clickai_gl_balances import is_ready, NO_DATE_PERIOD
+
+try:
+    from clickai_period_close import gl_snapshot
+    PERIOD_CLOSE_LOADED = True
+except ImportError:
+    PERIOD_CLOSE_LOADED = False
+
+logger = logging.getLogger(__name__)
+
+FAR_FUTURE = "9999-12-31"   # stands in for an open date_to when comparing
+
+# Sections: current_asset, fixed_asset, current_liability, long_term_liability,
+# equity, the income statement ones below, and unclassified (no category and
+# no ClickAI code) which the balance sheet shows on its own line
+PNL_SECTIONS = ("income", "other_income", "cos", "expense")
+
+# (category keywords, section) - most specific first ("non-current" before "current")
+_CATEGORY_SECTIONS = [
+    (("cost of sale", "cost of goods", "koste van verkope", "cogs"), "cos"),
+    (("other income", "ander inkomste"), "other_income"),
+    (("sales", "revenue", "turnover", "income", "inkomste", "omset"), "income"),
+    (("expense", "uitgawe", "operating"), "expense"),
+    (("non-current asset", "fixed asset", "vaste bate"), "fixed_asset"),
+    (("current asset", "bedryfsbate", "bank account"), "current_asset"),
+    (("non-current liabilit", "long term", "langtermyn"), "long_term_liability"),
+    (("liabilit", "bedryfslas"), "current_liability"),
+    (("equity", "ekwiteit", "owner", "eienaar"), "equity"),
+]
+
+# ClickAI default chart (CLICKAI_DEFAULTS): (first code, last code, section)
+_CODE_SECTIONS = [
+    (1000, 1499, "current_asset"), (1500, 1999, "fixed_asset"),
+    (2000, 2399, "current_liability"), (2400, 2999, "long_term_liability"),
+    (3000, 3999, "equity"), (4000, 4199, "income"), (4200, 4999, "other_income"),
+    (5000, 5999, "cos"), (6000, 9999, "expense"),
+]
+
+_CODE_ROLES = {"1000": "bank", "1050": "cash", "1100": "cash", "1200": "debtors", "1300": "stock",
+               "1400": "vat_input", "1700": "accum_depr", "2000": "creditors", "2100": "vat_output",
+               "2200": "paye", "2300": "uif", "3200": "drawings"}
+
+# (section, name keywords, role) - specific before generic, as in the TB analysis
+_NAME_ROLES = [
+    ("current_asset", ("vat input", "input vat", "input tax", "btw inset"), "vat_input"),
+    ("current_asset", ("petty", "cash", "kontant"), "cash"),
+    ("current_asset", ("bank", "fnb", "standard", "absa", "nedbank", "capitec", "investec"), "bank"),
+    ("current_asset", ("debtor", "receivable", "debiteur"), "debtors"),
+    ("current_asset", ("stock", "inventory", "voorraad"), "stock"),
+    ("fixed_asset", ("accumulated", "acc dep", "accum", "opgehoopte"), "accum_depr"),
+    ("current_liability", ("vat output", "output vat", "vat payable", "vat control", "vat / tax", "btw uitset"),
+     "vat_output"),
+    ("current_liability", ("paye", "pay as you earn"), "paye"),
+    ("current_liability", ("uif", "unemployment"), "uif"),
+    ("current_liability", ("creditor", "trade payable", "accounts payable", "krediteur"), "creditors"),
+    ("equity", ("drawing", "onttrekking"), "drawings"),
+]
+
+
+def classify(code: str, name: str = "", category: str = "") -> tuple:
+    """(section, role) for one account. role is "" unless the account is
+    one the ratios need (bank, debtors, stock, vat_output, ...)."""
+    cat = str(category or "").lower()
+    section = ""
+    for keywords, sec in _CATEGORY_SECTIONS:
+        if any(k in cat for k in keywords):
+            section = sec
+            break
+    code = str(code or "").strip()
+    role = ""
+    if not section:
+        head = code[:4]
+        if head.isdigit() and len(head) == 4:
+            n = int(head)
+            section = next((sec for lo, hi, sec in _CODE_SECTIONS if lo <= n <= hi), "unclassified")
+            role = _CODE_ROLES.get(head, "")
+        else:
+            section = "unclassified"
+    if not role:
+        lname = str(name or "").lower()
+        role = next((r for sec, keywords, r in _NAME_ROLES
+                     if sec == section and any(k in lname for k in keywords)), "")
+    return section, role
+
+
+def _month_end(period: str) -> str:
+    y, m = int(period[:4]), int(period[5:7])
+    return f"{period}-{calendar.monthrange(y, m)[1]:02d}"
+
+
+def _ob_code(entry, taken):
+    """An imported OB line's (code, name). Sage embeds the code in the name
+    ("8400/000 : Standard Bank"); anything else gets a 9xxx placeholder."""
+    name = entry.get("account") or "Unknown"
+    code = entry.get("account_code") or entry.get("code") or ""
+    if code:
+        return code, name
+    nm = name.strip()
+    prefix = ""
+    for sep in (" : ", ": ", " - "):
+        if sep in nm:
+            prefix = nm.split(sep, 1)[0].strip()
+            break
+    if prefix and prefix[0].isdigit():
+        return prefix, nm[len(prefix):].lstrip(" :-").strip() or nm
+    return f"9{taken:03d}", name
+
+
+class TrialBalance:
+    """Result of trial_balance(). accounts: {code: {"name", "category",
+    "section", "role", "opening", "movement"}} where opening / movement are
+    one [debit, credit] pair per period."""
+
+    def __init__(self, periods, accounts, ob_entries=0):
+        self.periods = periods
+        self.accounts = accounts
+        self.ob_entries = ob_entries   # imported OB lines read (the TB's "Clear OB (n)")
+
+    def amounts(self, code, i=0, kind="closing"):
+        """(debit, credit) of one account in period i."""
+        acc = self.accounts[code]
+        if kind == "closing":
+            o, m = acc["opening"][i], acc["movement"][i]
+            return o[0] + m[0], o[1] + m[1]
+        return tuple(acc[kind][i])
+
+    def balance(self, code, i=0, kind="closing"):
+        """Debit minus credit."""
+        dr, cr = self.amounts(code, i, kind)
+        return dr - cr
+
+    def codes(self, sections=None, i=None, kind="closing"):
+        """Account codes in code order, optionally only these sections and
+        only those with an amount in period i."""
+        out = []
+        for code in sorted(self.accounts):
+            if sections and self.accounts[code]["section"] not in sections:
+                continue
+            if i is not None and not any(abs(v) >= 0.005 for v in self.amounts(code, i, kind)):
+                continue
+            out.append(code)
+        return out
+
+    def total(self, sections, i=0, kind="closing", role=None):
+        """Debit minus credit over the accounts in these sections (and role)."""
+        return sum(self.balance(c, i, kind) for c in self.codes(sections)
+                   if role is None or self.accounts[c]["role"] == role)
+
+    def totals(self, i=0, kind="closing"):
+        """(total debit, total credit) of period i."""
+        dr = cr = 0.0
+        for code in self.accounts:
+            d, c = self.amounts(code, i, kind)
+            dr += d
+            cr += c
+        return dr, cr
+
+    def profit(self, i=0, kind="closing"):
+        """Income less expenses (a profit is positive)."""
+        return -self.total(PNL_SECTIONS, i, kind) + 0.0
+
+    def summary(self, i=0, kind="closing") -> dict:
+        """The headline figures and ratios of one period - the same keys
+        /api/reports/tb/analyze hands to the insights."""
+        t = lambda sections, role=None: self.total(sections, i, kind, role)
+        total_debit, total_credit = self.totals(i, kind)
+        bank_cash = t(("current_asset",), "bank") + t(("current_asset",), "cash")
+        debtors = t(("current_asset",), "debtors")
+        stock = t(("current_asset",), "stock")
+        current_assets = t(("current_asset",))
+        fixed_assets_net = t(("fixed_asset",))
+        current_liabilities = -t(("current_liability",))
+        long_term = -t(("long_term_liability",))
+        equity = -t(("equity",))
+        net_sales = -t(("income",))
+        other_income = -t(("other_income",))
+        cos = t(("cos",))
+        expenses = t(("expense",))
+        gross_profit = net_sales - cos
+        net_profit = net_sales + other_income - cos - expenses
+        total_income = net_sales + other_income
+        liabilities = current_liabilities + long_term
+        ratio = lambda a, b, nd=2: round(a / b, nd) if b > 0 else 0
+        return {
+            "total_debit": total_debit, "total_credit": total_credit,
+            "difference": abs(total_debit - total_credit),
+            "is_balanced": abs(total_debit - total_credit) < 0.01,
+            "current_assets": current_assets, "bank_cash": bank_cash, "debtors": debtors, "stock": stock,
+            "fixed_assets_net": fixed_assets_net, "total_assets": current_assets + fixed_assets_net,
+            "current_liabilities": current_liabilities, "long_term_liabilities": long_term,
+            "total_equity": equity,
+            "net_sales": net_sales, "cos": cos, "gross_profit": gross_profit,
+            "gp_margin": round(gross_profit / net_sales * 100, 1) if net_sales > 0 else 0,
+            "total_expenses": expenses, "net_profit": net_profit,
+            "np_margin": round(net_profit / total_income * 100, 1) if total_income > 0 else 0,
+            "current_ratio": ratio(current_assets, current_liabilities),
+            "quick_ratio": ratio(current_assets - stock, current_liabilities),
+            "debt_equity": ratio(liabilities, equity),
+            "debtor_days": round(debtors / net_sales * 365, 0) if net_sales > 0 else 0,
+            "creditor_days": round(-t(("current_liability",), "creditors") / cos * 365, 0) if cos > 0 else 0,
+            "stock_days": round(stock / cos * 365, 0) if cos > 0 else 0,
+            "vat_position": -t(("current_liability",), "vat_output") - t(("current_asset",), "vat_input"),
+            "paye": -t(("current_liability",), "paye"),
+            "uif": -t(("current_liability",), "uif"),
+        }
+
+
+def _ledger_rows(db, biz_id, periods, after: str = None):
+    """[(code, lo, hi, debit, credit)] - every journal amount that any of
+    the periods needs, each dated by the span it covers (a day, a whole
+    month, or "" for undated). after: a month-end a GL snapshot already
+    covers - only journals dated after it (and undated ones) are read."""
+    ends = [to for _, to in periods if to]
+    last = max(ends) if len(ends) == len(periods) else None
+    edges = set()
+    for date_from, date_to in periods:
+        if date_from and date_from[8:10] != "01":
+            edges.add(date_from[:7])
+        if date_to and date_to != _month_end(date_to[:7]):
+            edges.add(date_to[:7])
+    if after:
+        edges = {m for m in edges if m > after[:7]}
+    rows = []
+
+    def by_day(filters):
+        for r in db.aggregate("journals", sums=["debit", "credit"], group_by=["account_code", "date"],
+                              filters=filters):
+            if r.get("account_code"):
+                day = str(r.get("date") or "")[:10]
+                if after and day and day <= after:
+                    continue
+                rows.append((r["account_code"], day, day, r["debit"], r["credit"]))
+
+    if not is_ready(db, biz_id):
+        flt = {"business_id": biz_id}
+        dated = [c for c in (f"date.gt.{after}" if after else "", f"date.lte.{last}" if last else "") if c]
+        if dated:
+            flt["or"] = f"(date.is.null,{dated[0] if len(dated) == 1 else 'and(' + ','.join(dated) + ')'})"
+        by_day(flt)
+        return rows
+    flt = {"business_id": biz_id}
+    if last:
+        flt["period"] = ("lte", last[:7])
+    if after:
+        flt["or"] = f"(period.eq.{NO_DATE_PERIOD},period.gt.{after[:7]})"
+    for r in db.aggregate("gl_balances", sums=["debit", "credit"], group_by=["account_code", "period"],
+                          filters=flt):
+        period = r.get("period") or NO_DATE_PERIOD
+        if not r.get("account_code") or period in edges:
+            continue
+        if period == NO_DATE_PERIOD:
+            rows.append((r["account_code"], "", "", r["debit"], r["credit"]))
+        elif not after or period > after[:7]:
+            rows.append((r["account_code"], f"{period}-01", _month_end(period), r["debit"], r["credit"]))
+    if edges:
+        months = ",".join(f"and(date.gte.{m}-01,date.lte.{_month_end(m)})" for m in sorted(edges))
+        by_day({"business_id": biz_id, "or": f"({months})"})
+    return rows
+
+
+def dated_totals(db, biz_id, date_to: str, after: str = None) -> dict:
+    """{account_code: {"debit", "credit"}} of the dated journals in
+    (after, date_to] - what a period-close GL snapshot holds."""
+    totals = {}
+    for code, lo, hi, debit, credit in _ledger_rows(db, biz_id, [(None, date_to)], after):
+        if lo and hi <= date_to:
+            t = totals.setdefault(code, {"debit": 0.0, "credit": 0.0})
+            t["debit"] += debit
+            t["credit"] += credit
+    return totals
+
+
+def _snapshot_bound(periods) -> str:
+    """The last day a GL snapshot may end on and still sit before every
+    period: the day before the earliest date_from, or the earliest as-at."""
+    bounds = []
+    for date_from, date_to in periods:
+        if date_from:
+            day = datetime.strptime(date_from[:10], "%Y-%m-%d") - timedelta(days=1)
+            bounds.append(day.strftime("%Y-%m-%d"))
+        else:
+            bounds.append(date_to or FAR_FUTURE)
+    return min(bounds) if bounds else ""
+
+
+def trial_balance(db, biz_id, periods, names: dict = None, default_names: dict = None) -> TrialBalance:
+    """Opening / movement / closing per account for each (date_from, date_to)
+    in periods ('YYYY-MM-DD' or None). Names: an imported OB line's own name,
+    then names, then the chart of accounts, then default_names. Raises if a
+    read fails part-way - a TB with an account missing is worse than an
+    error page."""
+    periods = [(f or None, t or None) for f, t in periods]
+    n = len(periods)
+    accounts = {}
+
+    def account(code, name=""):
+        acc = accounts.get(code)
+        if acc is None:
+            acc = accounts[code] = {"name": name, "category": "", "opening": [[0.0, 0.0] for _ in range(n)],
+                                    "movement": [[0.0, 0.0] for _ in range(n)]}
+        return acc
+
+    def post(acc, lo, hi, debit, credit):
+        for i, (date_from, date_to) in enumerate(periods):
+            if date_from and hi < date_from:
+                slot = acc["opening"][i]
+            elif lo >= (date_from or "") and hi <= (date_to or FAR_FUTURE):
+                slot = acc["movement"][i]
+            else:
+                continue
+            slot[0] += debit
+            slot[1] += credit
+
+    if not biz_id:
+        return TrialBalance(periods, {})
+    ob = db.get("journal_entries", {"business_id": biz_id, "reference": "OB"}) or []
+    for entry in ob:
+        code, name = _ob_code(entry, len(accounts))
+        post(account(code, name), "", "", float(entry.get("debit", 0) or 0), float(entry.get("credit", 0) or 0))
+    base, snapshot = "", {}
+    if PERIOD_CLOSE_LOADED:
+        base, snapshot = gl_snapshot(db, biz_id, _snapshot_bound(periods))
+    # The snapshot is every dated journal to its month-end: posted as one
+    # span that ends there, it lands in opening or movement like the lines
+    for code, (debit, credit) in snapshot.items():
+        if debit or credit:
+            post(account(code), "", _month_end(base), debit, credit)
+    for code, lo, hi, debit, credit in _ledger_rows(db, biz_id, periods, _month_end(base) if base else None):
+        if debit or credit:
+            post(account(code), lo, hi, debit, credit)
+
+    coa = {}
+    for row in db.get("chart_of_accounts", {"business_id": biz_id}) or []:
+        code = str(row.get("account_code", "") or row.get("code", "")).strip()
+        if code:
+            coa[code] = row
+    names, default_names = names or {}, default_names or {}
+    for code, acc in accounts.items():
+        row = coa.get(code, {})
+        acc["name"] = (acc["name"] or names.get(code) or row.get("account_name") or row.get("name")
+                       or default_names.get(code) or f"Account {code}")
+        acc["category"] = row.get("category") or ""
+        acc["section"], acc["role"] = classify(code, acc["name"], acc["category"])
+    logger.info(f"[TB] {biz_id}: {len(accounts)} accounts over {n} period(s), {len(ob)} OB lines"
+                + (f", from the {base} snapshot" if base else ""))
+    return TrialBalance(periods, accounts, len(ob))
@@ -38,6 +38,7 @@ import requests
 from datetime import datetime, timedelta
 from functools import wraps
 from flask import request, jsonify, redirect, session
+from clickai_cache import BoundedCache
 
 logger = logging.getLogger("clickai.whatsapp")
 
@@ -262,8 +263,10 @@ class WhatsAppEngine:
     - Toggle on/off per business
     """
     
-    # In-memory rate limiter: {phone: [timestamp, ...]}
-    _rate_limits = {}
+    # In-memory rate limiter: {phone: [timestamp, ...]} — a phone silent for a
+    # whole window has nothing left to count, so the entry expires with it
+    _rate_limits = BoundedCache("whatsapp_rate_limits", ttl=3600, max_entries=10000,
+                                max_bytes=4 * 1024 * 1024)
     RATE_LIMIT_MAX = 20       # max messages per phone per hour
     RATE_LIMIT_WINDOW = 3600  # 1 hour in seconds
     
@@ -373,19 +376,18 @@ class WhatsAppEngine:
         """Return True if OK to send, False if rate limited"""
         now = time.time()
         
-        if phone not in self._rate_limits:
-            self._rate_limits[phone] = []
-        
         # Clean old entries
-        self._rate_limits[phone] = [
-            t for t in self._rate_limits[phone] 
+        sent = [
+            t for t in self._rate_limits.get(phone, [])
             if now - t < self.RATE_LIMIT_WINDOW
         ]
         
-        if len(self._rate_limits[phone]) >= self.RATE_LIMIT_MAX:
+        if len(sent) >= self.RATE_LIMIT_MAX:
+            self._rate_limits[phone] = sent
             return False
         
-        self._rate_limits[phone].append(now)
+        sent.append(now)
+        self._rate_limits[phone] = sent
         return True
     
     # ------------------------------------------------------------------
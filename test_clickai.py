@@ -8,6 +8,7 @@ What it does (and does NOT do):
   - Tier 1 (syntax)  : every clickai*.py file must parse. This is the #1 deploy-killer.
   - Tier 2 (imports) : every route module must import and expose its register_* function.
   - Tier 3 (logic)   : core money / identity / escaping functions must still behave.
+  - Tier 4 (DB layer): DB paging/filtering/caching against an in-memory PostgREST.
 
 How to run:
   python3 test_clickai.py
@@ -28,6 +29,11 @@ import glob
 HERE = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, HERE)
 
+# Keep the shared worker cache (clickai_cache.py) out of the real one on this box
+import tempfile
+os.environ.setdefault("CLICKAI_CACHE_PATH",
+                      os.path.join(tempfile.mkdtemp(prefix="clickai_test_"), "cache.sqlite3"))
+
 # ---------------------------------------------------------------------------
 # Tier 1 — SYNTAX GATE  (always runs, needs nothing)
 # ---------------------------------------------------------------------------
@@ -54,6 +60,9 @@ ROUTE_MODULES = {
     "clickai_allocation_log": "register_ledger_routes",
     "clickai_banking":        "register_banking_routes",
     "clickai_cashup":         "register_cashup_routes",
+    "clickai_gl_balances":    "register_gl_balance_routes",
+    "clickai_customer_ledger": "register_customer_ledger_routes",
+    "clickai_period_close":   "register_period_close_routes",
     "clickai_invoicing":      "register_invoicing_routes",
     "clickai_payroll":        "register_payroll_routes",
     "clickai_pos":            "register_pos_routes",
@@ -391,12 +400,1515 @@ def test_extract_time_hhmm():
     assert clickai.extract_time("2026-05-29T14:30:00") == "14:30"
 
 
+# ---------------------------------------------------------------------------
+# Tier 4 — DB LAYER  (DB against an in-memory PostgREST; still no network)
+#
+# FakeRest stands in for clickai._DB_SESSION. It understands just enough of
+# PostgREST (select, eq/gte/lt/in/is/..., or=(...), order, limit/offset and
+# Prefer: count=exact) to check the URLs DB builds and count what they move.
+# bench_clickai.py reuses it to measure bytes and round trips.
+# ---------------------------------------------------------------------------
+
+import json
+import time
+import threading
+from urllib.parse import urlsplit, parse_qsl
+
+
+class _FakeResponse:
+    def __init__(self, status_code, payload=None, headers=None):
+        self.status_code = status_code
+        self.text = json.dumps(payload) if payload is not None else ""
+        self.content = self.text.encode("utf-8")
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(self.text) if self.text else None
+
+
+def _split_top(s):
+    """Split 'a,b(c,d),e' on top-level commas only."""
+    out, depth, quoted, cur = [], 0, False, ""
+    for ch in s:
+        if ch == "," and depth == 0 and not quoted:
+            out.append(cur)
+            cur = ""
+            continue
+        quoted ^= ch == '"'
+        depth += ch == "(" and not quoted
+        depth -= ch == ")" and not quoted
+        cur += ch
+    if cur:
+        out.append(cur)
+    return out
+
+
+def _sort_key(v):
+    if v is None:
+        return (2, "")
+    try:
+        return (0, float(v))
+    except (TypeError, ValueError):
+        return (1, str(v))
+
+
+def _match(row, col, expr):
+    op, _, val = expr.partition(".")
+    if op == "not":
+        return not _match(row, col, val)
+    cur = row.get(col)
+    if op == "is":
+        return cur is None if val == "null" else str(cur).lower() == val
+    if cur is None:
+        return False
+    if op == "in":
+        items = [i.strip('"') for i in _split_top(val[1:-1])]
+        return str(cur) in items
+    if op in ("like", "ilike"):
+        pat = "^" + re.escape(val).replace(r"\*", ".*") + "$"
+        return re.match(pat, str(cur), re.I if op == "ilike" else 0) is not None
+    a, b = _sort_key(cur), _sort_key(val)
+    if a[0] != b[0]:
+        a, b = (1, str(cur)), (1, val)
+    return {"eq": a == b, "neq": a != b, "gt": a > b, "gte": a >= b,
+            "lt": a < b, "lte": a <= b}[op]
+
+
+def _match_tree(row, kind, body):
+    conds = []
+    for part in _split_top(body):
+        if part.startswith(("and(", "or(")):
+            k, _, rest = part.partition("(")
+            conds.append(_match_tree(row, k, rest[:-1]))
+        else:
+            col, _, expr = part.partition(".")
+            conds.append(_match(row, col, expr))
+    return all(conds) if kind == "and" else any(conds)
+
+
+class FakeRest:
+    """In-memory PostgREST. tables = {name: [row, ...]}."""
+
+    def __init__(self, tables, latency=0.0):
+        self.tables = tables
+        self.latency = latency    # seconds of simulated round trip per request
+        self.calls = []           # every URL requested, in order
+        self.bytes_out = 0        # response bytes "sent over the wire"
+        self.rows_walked = 0      # rows the server had to step through
+        self.fail_after = None    # answer 500 once this many requests were served
+        self.aggregates = True    # False = db-aggregates-enabled is off (PGRST123)
+        self.lost_responses = 0   # next N writes are applied but answered 502
+        self.reject_writes = None # answer every write with this 4xx status
+        self.missing_columns = set()  # filtering on / writing these answers 400 (column not migrated)
+        self.triggers = {}        # {table: fn(fake, row)} run on each inserted row; False drops it
+        self.rpcs = {}            # {function: fn(fake, params) -> (status, body)}, run under the lock
+        # Generated (STORED) columns the real schema computes on write
+        self.generated = {"receipts": {"customer_name_key":
+                                       lambda r: (r.get("customer_name") or "").upper().strip()}}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _aggregate(rows, select):
+        """select=account_code,debit:debit.sum(),count() → one row per group."""
+        plain, fns = [], []
+        for item in select.split(","):
+            if not item.endswith("()"):
+                plain.append(item)
+                continue
+            alias, _, call = item.rpartition(":")
+            col, _, fn = call[:-2].rpartition(".")
+            fns.append((alias or fn, col, fn or call[:-2]))
+        groups = {}
+        for r in rows:
+            groups.setdefault(tuple(r.get(c) for c in plain), []).append(r)
+        if not plain and not groups:
+            groups[()] = []
+        out = []
+        for key, members in groups.items():
+            g = dict(zip(plain, key))
+            for alias, col, fn in fns:
+                if fn == "count":
+                    g[alias] = len(members)
+                else:
+                    vals = [r[col] for r in members if r.get(col) is not None]
+                    g[alias] = sum(vals) if vals else None
+            out.append(g)
+        return out
+
+    def _query(self, url):
+        parts = urlsplit(url)
+        table = parts.path.rsplit("/", 1)[-1]
+        rows = list(self.tables.get(table, []))
+        for col, fn in self.generated.get(table, {}).items():
+            for r in rows:
+                r[col] = fn(r)
+        select, order, limit, offset = "*", "", None, 0
+        for k, v in parse_qsl(parts.query, keep_blank_values=True):
+            if k == "select":
+                select = v
+            elif k == "order":
+                order = v
+            elif k == "limit":
+                limit = int(v)
+            elif k == "offset":
+                offset = int(v)
+            elif k in ("or", "and"):
+                rows = [r for r in rows if _match_tree(r, k, v[1:-1])]
+            else:
+                rows = [r for r in rows if _match(r, k, v)]
+        aggregated = "()" in select
+        if aggregated:
+            with self.lock:
+                self.rows_walked += len(rows)
+            rows = self._aggregate(rows, select)
+        for clause in reversed([c for c in order.split(",") if c]):
+            col, *mods = clause.split(".")
+            desc = "desc" in mods
+            nulls_first = "nullsfirst" in mods or (desc and "nullslast" not in mods)
+            vals = [r for r in rows if r.get(col) is not None]
+            nulls = [r for r in rows if r.get(col) is None]
+            vals.sort(key=lambda r: _sort_key(r.get(col)), reverse=desc)
+            rows = nulls + vals if nulls_first else vals + nulls
+        total = len(rows)
+        rows = rows[offset:offset + limit if limit is not None else None]
+        if aggregated:
+            return rows, total
+        with self.lock:
+            # What the server walks: OFFSET re-reads every skipped row, a
+            # keyset seek starts at the first row it returns.
+            self.rows_walked += offset + len(rows)
+        if select != "*":
+            cols = select.split(",")
+            rows = [{c: r.get(c) for c in cols} for r in rows]
+        return rows, total
+
+    def get(self, url, headers=None, timeout=None):
+        time.sleep(self.latency)
+        if self.fail_after is not None and len(self.calls) >= self.fail_after:
+            return _FakeResponse(500, {"message": "connection reset"})
+        if not self.aggregates and "()" in url:
+            with self.lock:
+                self.calls.append(url)
+            return _FakeResponse(400, {"code": "PGRST123",
+                                       "message": "Use of aggregate functions is not allowed"})
+        missing = [c for c in self.missing_columns if f"&{c}=" in url or f"?{c}=" in url
+                   or re.search(rf"[=,]{c}(\.|,|&|$)", url)]   # filtered, ordered or selected
+        if missing:
+            with self.lock:
+                self.calls.append(url)
+            table = urlsplit(url).path.rsplit("/", 1)[-1]
+            return _FakeResponse(400, {"code": "42703", "message": f"column {table}.{missing[0]} does not exist"})
+        rows, total = self._query(url)
+        counted = "count=exact" in str((headers or {}).get("Prefer", ""))
+        resp = _FakeResponse(200, rows, {"content-range": f"0-{max(len(rows) - 1, 0)}/"
+                                                          f"{total if counted else '*'}"})
+        with self.lock:
+            self.calls.append(url)
+            self.bytes_out += len(resp.content)
+        return resp
+
+    def head(self, url, headers=None, timeout=None):
+        time.sleep(self.latency)
+        rows, total = self._query(url)
+        with self.lock:
+            self.calls.append(url)
+        return _FakeResponse(200, None, {"content-range": f"0-{max(len(rows) - 1, 0)}/{total}"})
+
+
+    def post(self, url, headers=None, json=None, timeout=None):
+        """Upsert on id (on_conflict=id + merge-duplicates); without on_conflict a
+        plain INSERT - one duplicate id refuses the whole array with 409."""
+        time.sleep(self.latency)
+        table = urlsplit(url).path.rsplit("/", 1)[-1]
+        if "/rpc/" in url:
+            with self.lock:
+                self.calls.append(("POST", url))
+                if table not in self.rpcs:
+                    return _FakeResponse(404, {"code": "PGRST202",
+                                               "message": f"Could not find the function public.{table}"})
+                status, body = self.rpcs[table](self, json)
+                if self.lost_responses and status < 300:
+                    self.lost_responses -= 1
+                    return _FakeResponse(502, {"message": "bad gateway"})
+            return _FakeResponse(status, body)
+        recs = json if isinstance(json, list) else [json]
+        prefer = str((headers or {}).get("Prefer", ""))
+        with self.lock:
+            self.calls.append(("POST", url))
+            if self.reject_writes:
+                return _FakeResponse(self.reject_writes, {"code": "PGRST204", "message": "rejected"})
+            missing = [c for rec in recs for c in rec if c in self.missing_columns]
+            if missing:
+                return _FakeResponse(400, {"code": "PGRST204", "message":
+                                           f"Could not find the '{missing[0]}' column of '{table}'"})
+            rows = self.tables.setdefault(table, [])
+            by_id = {r.get("id"): i for i, r in enumerate(rows)}
+            if "on_conflict=" not in url and any(rec.get("id") in by_id for rec in recs):
+                return _FakeResponse(409, {"code": "23505", "message": "duplicate key value"})
+            written = []
+            for rec in recs:
+                if rec.get("id") in by_id:
+                    rows[by_id[rec["id"]]].update(rec)
+                    written.append(rows[by_id[rec["id"]]])
+                else:
+                    row = dict(rec)
+                    if table in self.triggers and self.triggers[table](self, row) is False:
+                        continue            # a BEFORE INSERT trigger returned NULL
+                    by_id[rec.get("id")] = len(rows)
+                    rows.append(row)
+                    written.append(row)
+            if self.lost_responses:
+                self.lost_responses -= 1
+                return _FakeResponse(502, {"message": "bad gateway"})
+        if "return=representation" in prefer:
+            return _FakeResponse(201, [dict(r) for r in written])
+        return _FakeResponse(201, None)
+
+    def delete(self, url, headers=None, timeout=None):
+        """Delete every row the filters match."""
+        time.sleep(self.latency)
+        table = urlsplit(url).path.rsplit("/", 1)[-1]
+        matched, _ = self._query(url)
+        doomed = {id(r) for r in matched}
+        with self.lock:
+            self.calls.append(("DELETE", url))
+            self.tables[table] = [r for r in self.tables.get(table, []) if id(r) not in doomed]
+        return _FakeResponse(204, None)
+
+
+def _with_fake_rest(tables, latency=0.0):
+    """Swap clickai's HTTP session for a FakeRest; returns (fake, restore_fn)."""
+    import clickai
+    fake = FakeRest(tables, latency)
+    old = clickai._DB_SESSION
+    clickai._DB_SESSION = fake
+    def restore():
+        clickai._DB_SESSION = old
+    return fake, restore
+
+
+def test_db_filter_query_operators():
+    """INVARIANT: bare values stay eq.; operator tuples, lists, IN and IS render as PostgREST."""
+    import clickai
+    q = clickai.DB._filter_query
+    assert q({"business_id": "b1"}) == "&business_id=eq.b1"
+    assert q({"date": [("gte", "2026-01-01"), ("lt", "2026-03-01")]}) == \
+        "&date=gte.2026-01-01&date=lt.2026-03-01"
+    assert q({"status": ("in", ["paid", "a,b"])}) == '&status=in.(paid,"a%2Cb")'
+    assert q({"deleted_at": ("is", None)}) == "&deleted_at=is.null"
+    assert q({"created_at": ("gte", "2026-05-29T10:00:00+02:00")}).endswith("%2B02:00")
+    try:
+        q({"x": ("between", 1)})
+        assert False, "unknown operator must raise"
+    except ValueError:
+        pass
+
+
+def test_db_get_date_window_runs_on_server():
+    """A date window + explicit order must come back filtered AND sorted from the server."""
+    import clickai
+    rows = [{"id": f"{i:04d}", "business_id": "b1", "date": f"2026-0{1 + i % 6}-15", "total": i}
+            for i in range(60)]
+    fake, restore = _with_fake_rest({"sales": rows})
+    try:
+        got = clickai.db.get("sales", {"business_id": "b1", "date": [("gte", "2026-03-01"),
+                                                                       ("lt", "2026-05-01")]},
+                             order="total.desc")
+    finally:
+        restore()
+    assert len(got) == 20
+    assert all("2026-03-01" <= r["date"] < "2026-05-01" for r in got)
+    assert [r["total"] for r in got] == sorted((r["total"] for r in got), reverse=True)
+    assert "date=gte.2026-03-01" in fake.calls[0] and "order=total.desc" in fake.calls[0]
+
+
+def test_db_get_pages_by_keyset_not_offset():
+    """Multi-page reads use id=gt.<last> cursors: no OFFSET, no dupes. A read that fits in one
+    page keeps the server's order (no id sort); a caller's order gets id only as a tie-breaker."""
+    import clickai
+    rows = [{"id": f"{i:05d}", "business_id": "b1", "n": i} for i in range(2500)]
+    random_order = rows[::-1]
+    fake, restore = _with_fake_rest({"journals": random_order})
+    try:
+        got = clickai.db.get("journals", {"business_id": "b1"}, select="n")
+        paged = list(fake.calls)
+        fake.calls = []
+        first = clickai.db.get("journals", {"business_id": "b1"}, limit=1)
+        short = clickai.db.get("journals", {"business_id": "b1", "n": ("lt", 5)})
+        ordered = clickai.db.get("journals", {"business_id": "b1", "n": ("lt", 5)}, order="n.desc")
+    finally:
+        restore()
+    # page one comes back full, so the read restarts in id order: 1 + 3 round trips
+    assert len(paged) == 4, f"expected 4 round trips, got {len(paged)}"
+    assert "order=" not in paged[0] and not any("offset=" in u for u in paged)
+    assert "id=gt.00999" in paged[2] and "id=gt.01999" in paged[3]
+    assert sorted(r["n"] for r in got) == list(range(2500))
+    assert all(set(r) == {"n"} for r in got), "cursor column must not leak into a narrow select"
+    assert first[0]["n"] == 2499 and [r["n"] for r in short] == [4, 3, 2, 1, 0]
+    assert not any("order=" in u for u in fake.calls[:2]) and "order=n.desc,id.asc" in fake.calls[2]
+    assert [r["n"] for r in ordered] == [4, 3, 2, 1, 0]
+
+
+def test_db_get_offset_fallback_only_for_a_table_without_id():
+    """A 400 naming the id column switches that table to OFFSET paging for good; a
+    transient 5xx on the first page is an error and leaves keyset paging alone."""
+    import clickai
+    rates = [{"business_id": "b1", "n": i} for i in range(1500)]
+    fake, restore = _with_fake_rest({"wage_rates": rates, "payslips": [{"id": "p1", "business_id": "b1"}]})
+    fake.missing_columns = {"id"}
+    try:
+        assert len(clickai.db.get("wage_rates", {"business_id": "b1"})) == 1500
+        assert "wage_rates" in clickai.db._unkeyed_tables
+        assert sum("offset=" in u for u in fake.calls) == 2
+
+        fake.missing_columns, fake.fail_after, fake.calls = set(), 0, []
+        assert clickai.db.get("payslips", {"business_id": "b1"}) == []
+        assert "payslips" not in clickai.db._unkeyed_tables
+        fake.fail_after = None
+        assert len(clickai.db.get("payslips", {"business_id": "b1"})) == 1
+        assert not any("offset=" in u for u in fake.calls)
+    finally:
+        clickai.db._unkeyed_tables.discard("wage_rates")
+        restore()
+
+def test_db_get_keyset_with_explicit_order_and_nulls():
+    """Newest-first keyset on (date, id) must return every row once, NULL dates last."""
+    import clickai
+    rows = [{"id": f"{i:05d}", "business_id": "b1",
+             "date": None if i % 10 == 0 else f"2026-{1 + i % 12:02d}-{1 + i % 28:02d}"}
+            for i in range(2300)]
+    fake, restore = _with_fake_rest({"bank_transactions": rows})
+    try:
+        got = clickai.db.get("bank_transactions", {"business_id": "b1"},
+                             order="date.desc.nullslast")
+    finally:
+        restore()
+    assert sorted(r["id"] for r in got) == sorted(r["id"] for r in rows)
+    dates = [r["date"] for r in got]
+    dated = [d for d in dates if d is not None]
+    assert dated == sorted(dated, reverse=True)
+    assert dates[-1] is None and dates.index(None) == len(dated)
+    assert "and=(or(" in fake.calls[1]
+
+
+def test_db_get_parallel_prefetch_matches_sequential():
+    """parallel=True must return exactly the sequential rows, in order, within the page cap."""
+    import clickai
+    rows = [{"id": f"{i:05d}", "business_id": "b1", "debit": i} for i in range(4321)]
+    fake, restore = _with_fake_rest({"journals": rows})
+    try:
+        seq = clickai.db.get("journals", {"business_id": "b1"})
+        fake.calls = []
+        par = clickai.db.get("journals", {"business_id": "b1"}, parallel=True)
+    finally:
+        restore()
+    assert [r["id"] for r in par] == [r["id"] for r in seq]
+    assert len(fake.calls) == 6                        # unordered page one + 1 counted + 4 prefetched
+    assert sum("offset=" in u for u in fake.calls) == 4
+
+
+def test_db_single_flight_coalesces_concurrent_reads():
+    """8 threads asking for the same rows at once = 1 fetch, 8 private copies; a write splits flights."""
+    import clickai
+    from concurrent.futures import ThreadPoolExecutor
+    rows = [{"id": f"{i:04d}", "business_id": "b1", "qty": i} for i in range(50)]
+    fake, restore = _with_fake_rest({"stock_items": rows}, latency=0.05)
+    try:
+        before = dict(clickai.db.coalesce_stats())
+        barrier = threading.Barrier(8)
+        def read(_):
+            barrier.wait()
+            return clickai.db.get("stock_items", {"business_id": "b1"})
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(read, range(8)))
+        after = clickai.db.coalesce_stats()
+        results[0][0]["qty"] = -1                      # one caller scribbles on its copy
+        assert all(r[0]["qty"] == 0 for r in results[1:])
+        assert len(fake.calls) == 1, f"{len(fake.calls)} fetches for 8 identical reads"
+        assert after["coalesced"] - before["coalesced"] == 7
+        gen = clickai.db._table_gen.get("stock_items", 0)
+        clickai.db._touched("stock_items")             # what every write does
+        assert clickai.db._table_gen["stock_items"] == gen + 1
+    finally:
+        restore()
+
+
+def test_db_iter_rows_streams_pages_and_fails_loudly():
+    """iter_rows = get() one page at a time (plain and parallel); a page lost mid-ledger raises."""
+    import clickai
+    rows = [{"id": f"{i:05d}", "business_id": "b1", "debit": float(i)} for i in range(2500)]
+    fake, restore = _with_fake_rest({"journals": rows})
+    try:
+        it = clickai.db.iter_rows("journals", {"business_id": "b1"}, select="debit")
+        first = next(it)
+        # page one, then again in id order once it came back full - nothing further yet
+        assert len(fake.calls) == 2, "nothing past page one is fetched until it is needed"
+        streamed = [first] + list(it)
+        par = list(clickai.db.iter_rows("journals", {"business_id": "b1"}, parallel=True))
+        assert clickai.db.sum_column("journals", "debit", {"business_id": "b1"}) == sum(range(2500))
+        fake.calls, fake.fail_after = [], 2
+        try:
+            sum(r["debit"] for r in clickai.db.iter_rows("journals", {"business_id": "b1"}))
+            assert False, "a half-read ledger must not fold into a total"
+        except RuntimeError:
+            pass
+        fake.calls, fake.fail_after = [], 0
+        assert list(clickai.db.iter_rows("journals", {"business_id": "b1"})) == []
+    finally:
+        restore()
+    assert [r["debit"] for r in streamed] == [float(i) for i in range(2500)]
+    assert all(set(r) == {"debit"} for r in streamed)
+    assert [r["id"] for r in par] == [r["id"] for r in rows]
+
+
+def test_db_aggregate_on_server_and_python_fallback():
+    """GROUP BY totals: one small aggregate response; same rows when the server refuses aggregates."""
+    import clickai
+    rows = [{"id": f"{i:05d}", "business_id": "b1", "account_code": str(1000 + i % 30),
+             "debit": float(i % 7), "credit": None if i % 5 else 2.5} for i in range(3000)]
+    rows.append({"id": "99999", "business_id": "b2", "account_code": "1000", "debit": 1e6, "credit": 0})
+    want = {}
+    for r in rows[:-1]:
+        t = want.setdefault(r["account_code"], [0.0, 0.0, 0])
+        t[0] += r["debit"]; t[1] += r["credit"] or 0; t[2] += 1
+    fake, restore = _with_fake_rest({"journals": rows})
+    try:
+        args = dict(sums=["debit", "credit"], group_by=["account_code"], filters={"business_id": "b1"}, count=True)
+        server = clickai.db.aggregate("journals", **args)
+        server_calls, server_bytes = len(fake.calls), fake.bytes_out
+        assert clickai.db.count("journals", {"business_id": "b1"}) == 3000
+        assert clickai.db.sum_column("journals", "debit", {"business_id": "nobody"}) == 0
+        fake.aggregates, fake.calls, fake.bytes_out = False, [], 0
+        folded = clickai.db.aggregate("journals", **args)
+        assert clickai.DB._aggregates_off, "a PGRST123 answer must be remembered"
+        assert clickai.db.sum_column("journals", "debit", {"business_id": "b1"}) == sum(t[0] for t in want.values())
+    finally:
+        clickai.DB._aggregates_off = False
+        restore()
+    assert server == folded
+    assert [r["account_code"] for r in server] == sorted(want)
+    assert {r["account_code"]: [r["debit"], r["credit"], r["count"]] for r in server} == want
+    assert server_calls == 1 and server_bytes < fake.bytes_out / 20
+
+
+def test_db_get_columnar_vectors_match_row_sums():
+    """get_columnar: float vectors + masks give the same totals as the per-dict loops; never partial."""
+    import clickai
+    rows = [{"id": f"{i:05d}", "business_id": "b1", "total": round(i * 1.37, 2),
+             "vat": None if i % 9 == 0 else "1.5", "payment_method": ["cash", "card", "account"][i % 3]}
+            for i in range(2300)]
+    rows[7]["vat"] = "n/a"
+    fake, restore = _with_fake_rest({"sales": rows})
+    try:
+        cols = clickai.db.get_columnar("sales", ["total", "vat", "payment_method"],
+                                       {"business_id": "b1"}, numeric=["total", "vat"])
+        fake.fail_after = len(fake.calls) + 1
+        broken = clickai.db.get_columnar("sales", ["total"], {"business_id": "b1"}, numeric=["total"])
+    finally:
+        restore()
+    assert cols.n == 2300 and len(cols["total"]) == 2300 and set(cols) == {"total", "vat", "payment_method"}
+    assert abs(cols.total("total") - sum(r["total"] for r in rows)) < 1e-6
+    assert cols.total("vat") == 1.5 * sum(1 for r in rows if r["vat"] == "1.5")
+    cash_card = sum(r["total"] for r in rows if r["payment_method"] in ("cash", "card"))
+    assert abs(cols.total("total", cols.isin("payment_method", ("cash", "card"))) - cash_card) < 1e-6
+    assert cols["payment_method"][:3] == ["cash", "card", "account"]
+    assert broken.n == 0 and broken.total("total") == 0, "a failed read must not return a partial batch"
+
+
+def test_create_journal_entry_one_request_idempotent_retry():
+    """All lines in one POST; a lost response is retried with the same ids (no double-post);
+    cent imbalance is auto-balanced; a refused batch falls back to per-line save()."""
+    import clickai
+    entries = [{"account_code": "1000", "debit": 115.0, "credit": 0},
+               {"account_code": "4000", "debit": 0, "credit": 100.0},
+               {"account_code": "2100", "debit": 0, "credit": 14.98}]
+    fake, restore = _with_fake_rest({"journals": []})
+    saved = []
+    try:
+        clickai.create_journal_entry("b1", "2026-05-01", "POS Sale", "POS-1", entries)
+        posts = lambda: [c for c in fake.calls if isinstance(c, tuple)]
+        assert len(posts()) == 1, "one request per journal, not per line"
+        lines = fake.tables["journals"]
+        assert len(lines) == 4 and round(sum(l["debit"] - l["credit"] for l in lines), 2) == 0
+        assert len({l["id"] for l in lines}) == 4
+
+        fake.calls, fake.lost_responses = [], 1
+        clickai.create_journal_entry("b1", "2026-05-01", "POS Sale", "POS-2", entries[:2] +
+                                     [{"account_code": "2100", "debit": 0, "credit": 15.0}])
+        assert len(posts()) == 2, "a lost response is retried"
+        assert sum(1 for l in fake.tables["journals"] if l["reference"] == "POS-2") == 3, \
+            "the retry must overwrite the same rows, not add new ones"
+
+        fake.reject_writes = 400
+        clickai.db.save = lambda table, row: (saved.append(row), (True, row))[1]
+        clickai.create_journal_entry("b1", "2026-05-01", "POS Sale", "POS-3", entries[:2] +
+                                     [{"account_code": "2100", "debit": 0, "credit": 15.0}])
+        assert [r["account_code"] for r in saved] == ["1000", "4000", "2100"]
+        try:
+            clickai.create_journal_entry("b1", "2026-05-01", "x", "BAD", entries[:2])
+            assert False, "a real imbalance must still be blocked"
+        except ValueError:
+            pass
+    finally:
+        clickai.db.__dict__.pop("save", None)
+        restore()
+
+
+def test_gl_balances_match_journal_fold_and_verify_drift():
+    """account_totals: whole months from gl_balances + edge days from journals == a full journal
+    fold, before and after rebuild; verify() reports a drifted row."""
+    import clickai
+    import clickai_gl_balances as glb
+    journals = [{"id": f"{i:05d}", "business_id": biz, "account_code": str(1000 + i % 7),
+                 "date": f"2026-{1 + i % 3:02d}-{1 + i % 28:02d}", "debit": float(i % 11), "credit": float(i % 5)}
+                for i in range(1200) for biz in ("g1", "g2")]
+    balances = {}
+    for j in journals:          # what the trigger keeps
+        b = balances.setdefault((j["business_id"], j["account_code"], j["date"][:7]),
+                                {"business_id": j["business_id"], "account_code": j["account_code"],
+                                 "period": j["date"][:7], "debit": 0.0, "credit": 0.0})
+        b["debit"] += j["debit"]
+        b["credit"] += j["credit"]
+
+    def fold(biz, lo="", hi="9999"):
+        out = {}
+        for j in journals:
+            if j["business_id"] == biz and lo <= j["date"] <= hi:
+                t = out.setdefault(j["account_code"], {"debit": 0.0, "credit": 0.0})
+                t["debit"] += j["debit"]
+                t["credit"] += j["credit"]
+        return out
+
+    def close(a, b):
+        return a.keys() == b.keys() and all(abs(a[k][s] - b[k][s]) < 1e-6 for k in a for s in ("debit", "credit"))
+
+    fake, restore = _with_fake_rest({"journals": journals, "gl_balances": list(balances.values()),
+                                     "gl_balance_state": [{"business_id": "g2"}]})
+    try:
+        assert close(glb.account_totals(clickai.db, "g1", "2026-01-15", "2026-03-31"),
+                     fold("g1", "2026-01-15", "2026-03-31"))          # not rebuilt: journals only
+        fake.calls = []
+        assert close(glb.account_totals(clickai.db, "g2", "2026-01-15", "2026-03-31"),
+                     fold("g2", "2026-01-15", "2026-03-31"))
+        assert any("gl_balances" in u and "period=gte.2026-02" in u for u in fake.calls)
+        assert any("journals" in u and "date=lte.2026-01-31" in u for u in fake.calls)
+        assert close(glb.account_totals(clickai.db, "g2"), fold("g2"))
+        assert close(glb.account_totals(clickai.db, "g2", "2026-02-03", "2026-02-20"),
+                     fold("g2", "2026-02-03", "2026-02-20"))         # no whole month inside
+        assert glb.verify(clickai.db, "g2")["ok"]
+        fake.tables["gl_balances"][0]["debit"] += 5
+        report = glb.verify(clickai.db, fake.tables["gl_balances"][0]["business_id"])
+    finally:
+        restore()
+    assert not report["ok"] and report["mismatch_count"] == 1
+    assert report["mismatches"][0]["period"] == fake.tables["gl_balances"][0]["period"]
+
+
+def _period_stale_trigger(fake, row):
+    """What PERIOD_CLOSE_SQL's trigger does: a dated posting marks its closed month and every later one stale."""
+    for snap in fake.tables.get("period_snapshots", []):
+        if snap["business_id"] == row.get("business_id") and row.get("date") and \
+                snap["period"] >= str(row["date"])[:7]:
+            snap["stale"] = True
+
+
+def test_period_close_snapshots_stale_and_reopen():
+    """Closing a month freezes GL + sub-ledger balances; the as-at trial balance is snapshot + delta
+    and matches a full fold; a back-dated posting is kept and marks the closed months stale until
+    closed again, which replaces the month's rows."""
+    import clickai
+    import clickai_period_close as pc
+    from clickai_tb import trial_balance
+    journals = [{"id": f"j{i:04d}", "business_id": "p1", "account_code": str(1000 + i % 5),
+                 "date": f"2025-{1 + i % 3:02d}-{1 + i % 28:02d}", "debit": float(i % 7), "credit": float(i % 3)}
+                for i in range(300)]
+    invoices = [{"id": "i1", "business_id": "p1", "customer_id": "c1", "total": 100, "date": "2025-01-10"},
+                {"id": "i2", "business_id": "p1", "customer_id": "c1", "total": 50, "date": "2025-02-05"}]
+    s_invoices = [{"id": "s1", "business_id": "p1", "supplier_id": "v1", "total": 70, "date": "2025-01-03"},
+                  {"id": "s2", "business_id": "p1", "supplier_id": "v1", "total": 30, "date": "2025-02-03"}]
+
+    def fold(hi):
+        out = {}
+        for j in journals:
+            if j["date"] <= hi:
+                t = out.setdefault(j["account_code"], {"debit": 0.0, "credit": 0.0})
+                t["debit"] += j["debit"]
+                t["credit"] += j["credit"]
+        return out
+
+    def asat(day):
+        tb = trial_balance(clickai.db, "p1", [(None, day)])
+        return {code: dict(zip(("debit", "credit"), tb.amounts(code, 0))) for code in tb.accounts}
+
+    def same(a, b):
+        return a.keys() == b.keys() and all(abs(a[k][s] - b[k][s]) < 1e-6 for k in a for s in ("debit", "credit"))
+
+    pc._CLOSED.clear()
+    fake, restore = _with_fake_rest({"journals": journals, "invoices": invoices,
+                                     "supplier_invoices": s_invoices,
+                                     "customers": [{"id": "c1", "business_id": "p1", "name": "C"}],
+                                     "suppliers": [{"id": "v1", "business_id": "p1", "name": "V"}]})
+    for table in ("journals", "invoices", "supplier_invoices"):
+        fake.triggers[table] = _period_stale_trigger
+    try:
+        result = pc.close_period(clickai.db, "p1", "2025-01", "tester")
+        assert result["gl_accounts"] == 5 and pc.closed_through(clickai.db, "p1") == "2025-01"
+        assert clickai.calc_all_customer_balances("p1", asat="2025-01-31") == {"c1": 100.0}   # from the snapshot
+        assert clickai.calc_all_supplier_balances("p1", asat="2025-01-31") == {"v1": 70.0}
+        assert clickai.calc_all_supplier_balances("p1", asat="2025-02-28") == {"v1": 100.0}
+        fake.calls = []
+        assert same(asat("2025-02-15"), fold("2025-02-15"))
+        assert any("period_balances" in str(u) for u in fake.calls)
+        assert not any("journals" in str(u) and "2025-01-01" in str(u) for u in fake.calls)
+        pc.close_period(clickai.db, "p1", "2025-02")
+        assert same(asat("2025-03-10"), fold("2025-03-10"))
+        assert same(asat("2025-02-28"), fold("2025-02-28"))
+        try:
+            pc.close_period(clickai.db, "p1", "2025-01")
+            assert False, "closing a month whose snapshot still holds must raise"
+        except ValueError:
+            pass
+
+        # A back-dated invoice and its journal land in January: kept, and both snapshots go stale
+        clickai.db.save_batch("invoices", [{"id": "i3", "business_id": "p1", "customer_id": "c1",
+                                            "total": 9, "date": "2025-01-20"}])
+        clickai.create_journal_entry("p1", "2025-01-20", "late", "LATE-1",
+                                     [{"account_code": "1000", "debit": 5, "credit": 0},
+                                      {"account_code": "1001", "debit": 0, "credit": 5}])
+        journals = fake.tables["journals"]
+        assert len(journals) == 302
+        assert pc.stale_periods(clickai.db, "p1") == ["2025-01", "2025-02"]
+        assert pc.usable_periods(clickai.db, "p1") == []
+        assert clickai.calc_all_customer_balances("p1", asat="2025-01-31") == {"c1": 109.0}
+        assert same(asat("2025-02-28"), fold("2025-02-28"))
+
+        # Closing again rebuilds, oldest first - and a party that has gone keeps no stale row
+        s_invoices.remove(s_invoices[0])
+        pc.close_period(clickai.db, "p1", "2025-01")
+        assert not [r for r in fake.tables["period_balances"] if r["period"] == "2025-01" and r["kind"] == "supplier"]
+        assert clickai.calc_all_supplier_balances("p1", asat="2025-01-31") == {}
+        assert pc.stale_periods(clickai.db, "p1") == ["2025-02"]
+        fake.calls = []
+        assert same(asat("2025-02-28"), fold("2025-02-28"))
+        assert any("period=eq.2025-01" in str(u) for u in fake.calls)
+        pc.close_period(clickai.db, "p1", "2025-02")
+        assert pc.stale_periods(clickai.db, "p1") == []
+        assert clickai.calc_all_customer_balances("p1", asat="2025-01-31") == {"c1": 109.0}
+        assert same(asat("2025-03-10"), fold("2025-03-10"))
+
+        reopened = pc.reopen_period(clickai.db, "p1", "2025-01")
+        assert reopened["reopened"] == ["2025-01", "2025-02"] and reopened["closed_through"] == ""
+        assert not fake.tables["period_balances"] and not fake.tables["period_snapshots"]
+        assert clickai.calc_all_customer_balances("p1", asat="2025-01-31") == {"c1": 109.0}
+    finally:
+        restore()
+        pc._CLOSED.clear()
+
+
+def test_customer_ledger_matches_recompute_and_syncs_dirty_customers():
+    """The maintained customer ledger gives the same balances and aging as the full recompute,
+    rebuilds only the customers a write marked dirty, and reconcile() catches and repairs drift."""
+    import clickai
+    import clickai_customer_ledger as cl
+    customers = [{"id": f"c{i}", "business_id": "L", "name": n}
+                 for i, n in enumerate(["Alice", "Bob", "Carol", "Dan"])]
+    invoices = [{"id": f"i{i:03d}", "business_id": "L", "customer_id": f"c{i % 4}", "status": "posted",
+                 "total": 100 + i, "invoice_number": f"INV{i:03d}", "date": f"2026-0{1 + i % 5}-1{i % 9}"}
+                for i in range(40)]
+    invoices[5]["status"] = "reversed"
+    sales = [{"id": f"s{i:03d}", "business_id": "L", "customer_id": f"c{i % 3}",
+              "payment_method": "account" if i % 2 else "cash", "total": 20 + i, "date": f"2026-03-0{1 + i % 9}"}
+             for i in range(20)]
+    receipts = [{"id": f"r{i:03d}", "business_id": "L", "customer_id": f"c{i % 4}", "customer_name": "",
+                 "amount": 50 + i, "reference": f"BNK-{i}", "discount_total": 1 if i % 5 == 0 else 0,
+                 "date": f"2026-04-0{1 + i % 9}"} for i in range(16)]
+    receipts.append({"id": "r-unlinked", "business_id": "L", "customer_id": None, "customer_name": " alice ",
+                     "amount": 33, "reference": "BNK-U", "date": "2026-04-20"})
+    credit_notes = [{"id": "cn1", "business_id": "L", "customer_id": "c1", "total": 40,
+                     "invoice_number": "INV001", "date": "2026-05-02"},
+                    {"id": "cn2", "business_id": "L", "customer_id": "c3", "total": 10,
+                     "invoice_number": "INV002", "date": "2026-05-03"}]     # names another customer's invoice
+    alloc = [{"id": "a1", "business_id": "L", "source_table": "invoices", "source_id": "i010",
+              "extra": '{"action": "invoice_reverse"}', "reference": "", "status": "active"},
+             {"id": "a2", "business_id": "L", "source_table": "sales", "source_id": "s003",
+              "extra": {"action": "pos_refund"}, "reference": "", "status": "active"},
+             {"id": "a3", "business_id": "L", "source_table": "receipts", "source_id": "r002",
+              "extra": "{}", "reference": "BNK-2", "status": "reversed"}]
+    fake, restore = _with_fake_rest({"customers": customers, "invoices": invoices, "sales": sales,
+                                     "receipts": receipts, "credit_notes": credit_notes, "allocation_log": alloc,
+                                     "customer_ledgers": [], "customer_ledger_state": [],
+                                     "customer_ledger_dirty": []})
+    cl._READY.clear()
+    try:
+        full = clickai._customer_ledger_items("L")
+        for cid in full:
+            assert clickai._customer_ledger_items("L", customer_ids=[cid], strict=True)[cid] == full[cid]
+        want = clickai.calc_all_customer_balances("L")
+        want_asat = clickai.calc_all_customer_balances("L", asat="2026-03-31")
+        want_aging = clickai.calc_all_customer_aging("L", asat="2026-04-30")
+        want_one = clickai.calc_all_customer_balances("L")["c1"]
+        assert cl.rebuild(clickai.db, "L") == len(full)
+        fake.calls = []
+        assert clickai.calc_all_customer_balances("L") == want
+        assert not any("invoices" in str(u) or "receipts" in str(u) for u in fake.calls)
+        assert clickai.calc_all_customer_balances("L", asat="2026-03-31") == want_asat
+        assert clickai.calc_all_customer_aging("L", asat="2026-04-30") == want_aging
+        assert clickai.calc_customer_balance("L", "c1") == want_one
+        # A new invoice for c2 and an unlinked receipt for Alice, as the triggers would mark them
+        invoices.append({"id": "i-new", "business_id": "L", "customer_id": "c2", "status": "posted",
+                         "total": 500, "invoice_number": "INV-NEW", "date": "2026-06-01"})
+        receipts.append({"id": "r-new", "business_id": "L", "customer_id": "", "customer_name": "ALICE",
+                         "amount": 7, "reference": "BNK-N", "date": "2026-06-02"})
+        fake.tables["customer_ledger_dirty"] += [{"business_id": "L", "customer_key": "c2", "seq": 1},
+                                                 {"business_id": "L", "customer_key": "name:ALICE", "seq": 2}]
+        fake.calls = []
+        got = clickai.calc_all_customer_balances("L")
+        assert got["c2"] == round(want["c2"] + 500, 2) and got["c0"] == round(want["c0"] - 7, 2)
+        assert got["c1"] == want["c1"] and not fake.tables["customer_ledger_dirty"]
+        inv_reads = [u for u in fake.calls if "/invoices?" in str(u) and "customer_id=in." in str(u)]
+        assert inv_reads and all("c1" not in u and "c3" not in u for u in inv_reads)
+        assert cl.reconcile(clickai.db, "L")["ok"]
+        fake.tables["customer_ledgers"][0]["balance"] += 5
+        drift = cl.reconcile(clickai.db, "L", repair=True)
+        assert drift["mismatch_count"] == 1 and drift["repaired"] == 1
+        assert cl.reconcile(clickai.db, "L")["ok"]
+    finally:
+        restore()
+        cl._READY.clear()
+
+
+def test_single_customer_balance_reads_only_that_customer():
+    """calc_customer_balance and the statements: unlinked receipts found by indexed name key, reversals
+    looked up for this customer's documents only - same answer as the whole-table scan it replaces."""
+    import clickai
+    alice = {"id": "c1", "business_id": "B", "name": "Alice Traders"}
+    invoices = [{"id": f"i{i:04d}", "business_id": "B", "customer_id": f"c{i % 50}", "status": "posted",
+                 "total": 100.0, "invoice_number": f"INV{i}"} for i in range(1000)]
+    receipts = [{"id": f"r{i:04d}", "business_id": "B", "customer_id": f"c{i % 50}", "customer_name": "",
+                 "amount": 10.0, "reference": f"BNK-{i}"} for i in range(3000)]
+    receipts += [{"id": "r-u1", "business_id": "B", "customer_id": None, "customer_name": " alice traders",
+                  "amount": 25.0, "reference": "BNK-U1"},
+                 {"id": "r-u2", "business_id": "B", "customer_id": "", "customer_name": "Bob",
+                  "amount": 99.0, "reference": "BNK-U2"}]
+    alloc = [{"id": f"a{i:04d}", "business_id": "B", "source_table": "invoices", "source_id": f"i{i:04d}",
+              "extra": "{}", "reference": f"BNK-{i}", "status": "active"} for i in range(2000, 4000)]
+    alloc += [{"id": "a-rev", "business_id": "B", "source_table": "invoices", "source_id": "i0051",
+               "extra": '{"action": "invoice_reverse"}', "reference": "", "status": "active"},
+              {"id": "a-pay", "business_id": "B", "source_table": "receipts", "source_id": "r0001",
+               "extra": "{}", "reference": "BNK-1", "status": "reversed"}]
+    fake, restore = _with_fake_rest({"customers": [alice], "invoices": invoices, "sales": [], "receipts": receipts,
+                                     "credit_notes": [], "allocation_log": alloc})
+    clickai._receipt_name_key_off = False
+    try:
+        fast = clickai.calc_customer_balance("B", "c1", alice)
+        fast_walked = fake.rows_walked
+        fake.rows_walked = 0
+        statement_balance = clickai._build_statement_body_for_print(alice, {"id": "B", "name": "Biz"}, "B",
+                                                                    "2026-12-31")[1]
+        statement_walked = fake.rows_walked
+        fake.missing_columns = {"customer_name_key"}
+        fake.rows_walked = 0
+        slow = clickai.calc_customer_balance("B", "c1", alice)
+        slow_walked = fake.rows_walked
+    finally:
+        restore()
+        clickai._receipt_name_key_off = False
+    # 20 invoices (one reversed) - 60 receipts (one reversed) - the unlinked 25
+    assert fast == slow == round(19 * 100 - 59 * 10 - 25, 2)
+    assert fast_walked < 200 < 3000 < slow_walked
+    assert statement_walked < 200 and statement_balance == fast
+    assert not any(u for u in fake.calls if "customers" in str(u))
+
+
+def test_reversal_index_reads_only_reversal_entries():
+    """reversed_sources / reversed_references: one filtered read once allocation_log.action is
+    backfilled; the whole-log JSON scan before the migration or while rows are pending - same sets."""
+    import clickai
+    import clickai_allocation_log as al
+    log = [{"id": f"a{i:05d}", "business_id": "B", "source_table": "sales", "source_id": f"s{i}",
+            "extra": "{}", "action": "", "reference": f"POS-{i}", "status": "active"} for i in range(5000)]
+    log += [{"id": "a-rev", "business_id": "B", "source_table": "invoices", "source_id": "i7",
+             "extra": '{"action": "invoice_reverse", "reason": "dup"}', "action": "invoice_reverse",
+             "reference": "INV7", "status": "active"},
+            {"id": "a-ref", "business_id": "B", "source_table": "sales", "source_id": "s9",
+             "extra": {"action": "pos_refund"}, "action": "pos_refund", "reference": "POS-9", "status": "active"},
+            {"id": "a-odd", "business_id": "B", "source_table": "sales", "source_id": "i8",
+             "extra": '{"action": "invoice_reverse"}', "action": "invoice_reverse", "reference": "", "status": "active"},
+            {"id": "a-pay1", "business_id": "B", "source_table": "receipts", "source_id": "r1",
+             "extra": "{}", "action": "", "reference": "BNK-1", "status": "reversed"},
+            {"id": "a-pay2", "business_id": "B", "source_table": "receipts", "source_id": "r2",
+             "extra": "{}", "action": "", "reference": "BNK-2", "status": "reversed"},
+            {"id": "a-pay2b", "business_id": "B", "source_table": "receipts", "source_id": "r2b",
+             "extra": "{}", "action": "", "reference": "BNK-2", "status": None}]
+    fake, restore = _with_fake_rest({"allocation_log": log})
+    runs = {}
+    try:
+        for mode in ("unmigrated", "pending", "indexed"):
+            al._INDEX_READY.clear()
+            fake.missing_columns = {"action"} if mode == "unmigrated" else set()
+            log[0]["action"] = None if mode == "pending" else ""
+            fake.rows_walked = 0
+            runs[mode] = (clickai._reversed_sources("B"), clickai._reversed_customer_payment_refs("B"),
+                          fake.rows_walked)
+        fake.rows_walked = 0
+        only = clickai._reversed_sources("B", ["i7", "s1"])
+        only_walked = fake.rows_walked
+    finally:
+        restore()
+        al._INDEX_READY.clear()
+    for sources, refs, _ in runs.values():
+        assert sources == ({"i7"}, {"s9"}) and refs == {"BNK-1"}
+    assert runs["indexed"][2] < 20 < 5000 < runs["pending"][2]
+    assert only == ({"i7"}, set()) and only_walked < 20
+
+
+def test_customer_aging_engine_matches_statement_aging():
+    """GOLDEN: the columnar aging engine gives every customer exactly the buckets
+    _statement_aging_from_ledger gives them (allocations, FIFO, credit-note dating,
+    roll-forward, cent absorption); creditors buckets by calendar month."""
+    import random
+    import clickai
+    from clickai_aging import customer_aging, supplier_invoice_aging
+    rnd = random.Random(17)
+    items, alloc = {}, {}
+    for c in range(400):
+        rows = []
+        for k in range(rnd.randint(0, 25)):
+            d = f"2026-{rnd.randint(1, 9):02d}-{rnd.randint(1, 28):02d}" if rnd.random() > 0.05 \
+                else rnd.choice(["", None, "not-a-date"])
+            kind = rnd.random()
+            if kind < 0.5:
+                amt = round(rnd.uniform(1, 5000), 2)
+                rows.append({"date": d, "debit": amt, "credit": 0.0, "invoice_id": f"i{c}-{k}"})
+                if rnd.random() < 0.3:
+                    alloc[f"i{c}-{k}"] = round(amt * rnd.choice([1, 0.5, 0.2, 2]), 2)
+            elif kind < 0.85:
+                rows.append({"date": d, "debit": 0.0, "credit": round(rnd.uniform(1, 6000), 2), "kind": "payment"})
+            else:
+                rows.append({"date": d, "debit": 0.0, "credit": round(rnd.uniform(1, 800), 2),
+                             "age_date": rnd.choice([None, "2026-02-11", "x", d])})
+        items[f"c{c}"] = rows
+    got = customer_aging(items, "2026-08-31", alloc)
+    for cid, rows in items.items():
+        bal = round(sum(r["debit"] - r["credit"] for r in rows), 2)
+        want = clickai._statement_aging_from_ledger(rows, "2026-08-31", bal, alloc)
+        want["total"] = round(sum(want.values()), 2)
+        assert got[cid] == want, (cid, got[cid], want)
+    assert customer_aging({}, "2026-08-31") == {}
+
+    sinv = [{"supplier_id": "s1", "date": "2026-08-03", "total": 100, "paid_amount": 40, "status": "unpaid"},
+            {"supplier_id": "s1", "date": "2026-07-31", "total": 50, "status": "unpaid"},
+            {"supplier_id": "s1", "date": "2026-01-02", "total": 10, "status": "unpaid"},
+            {"supplier_id": "s1", "date": "2026-06-02", "total": 99, "status": "paid"},
+            {"supplier_name": "Cash Vendor", "date": None, "total": 5, "status": "unpaid"},
+            {"supplier_name": "Unknown", "date": "2026-05-01", "total": 7, "status": "unpaid"}]
+    assert supplier_invoice_aging(sinv, "2026-08-31") == {
+        "s1": {"current": 60.0, "30": 50.0, "60": 0.0, "90": 0.0, "120": 10.0, "total": 120.0},
+        "Cash Vendor": {"current": 5.0, "30": 0.0, "60": 0.0, "90": 0.0, "120": 0.0, "total": 5.0}}
+
+
+def test_gl_role_map_cached_until_coa_changes():
+    """gl(): the compiled role map is built once per business and reused; only a write to
+    chart_of_accounts (any DB write path) rebuilds it. Category rules still apply."""
+    import clickai
+    coa = [{"id": "a1", "business_id": "B", "account_code": "6700/000", "account_name": "Bank Charges",
+            "category": "Expenses"},
+           {"id": "a2", "business_id": "B", "account_code": "8400/000", "account_name": "Standard Bank Cheque",
+            "category": "Current Assets"},
+           {"id": "a3", "business_id": "B", "account_code": "9000/000", "account_name": "Sundry", "category": ""},
+           {"id": "a4", "business_id": "B", "account_code": "2100/005", "account_name": "Trading Stock",
+            "category": "Current Assets"}]
+    fake, restore = _with_fake_rest({"chart_of_accounts": coa})
+    clickai._gl_map_cache.clear()
+    try:
+        assert clickai.gl("B", "bank") == "8400/000"
+        assert clickai.gl("B", "bank_charges") == "6700/000"
+        assert clickai.gl("B", "stock") == "2100/005"
+        assert clickai.gl("B", "cogs") == clickai.CLICKAI_DEFAULTS["cogs"]
+        assert clickai.ensure_gl_account("B", "stock", "Stock") == "2100/005"
+        assert len(fake.calls) == 1, fake.calls
+        clickai.db.save_batch("chart_of_accounts", [{"id": "a5", "business_id": "B", "account_code": "5000/000",
+                                                     "account_name": "Cost of Sales", "category": "Cost of Sales"}])
+        assert clickai.gl("B", "cogs") == "5000/000"
+        assert len([u for u in fake.calls if not isinstance(u, tuple)]) == 2
+        clickai.db.delete_where("chart_of_accounts", {"business_id": "B", "id": "a4"})
+        assert clickai.gl("B", "stock") == clickai.CLICKAI_DEFAULTS["stock"]
+    finally:
+        restore()
+        clickai._gl_map_cache.clear()
+    # A write that does not name its business drops every business's map
+    assert clickai._written_business_ids(("a4", {"account_name": "x"}), {}) is None
+    assert clickai._written_business_ids(("a4", {}), {"business_id": "B"}) == {"B"}
+
+
+def _report_client():
+    """A Flask test client with clickai_reports registered against clickai.db,
+    logged in as business B."""
+    import clickai
+    from flask import Flask
+    from clickai_reports import register_report_routes
+    app = Flask("report_test")
+
+    class _Auth:
+        get_current_user = staticmethod(lambda: {"id": "u"})
+        get_current_business = staticmethod(lambda: {"id": "B", "name": "Test Biz"})
+
+    page = lambda title, content, user, active: f"<html><main>{content}</main></html>"
+    register_report_routes(app, clickai.db, lambda f: f, _Auth, page, clickai.generate_id, clickai.money,
+                           clickai.safe_string, clickai.now, clickai.today, None, None, None, None, None,
+                           None, "", {}, None)
+    return app.test_client()
+
+
+def test_gl_report_streams_totals_and_pages_lines():
+    """/reports/gl streams the account list with totals summed by the server (no journal lines
+    read); /api/reports/gl/lines pages one account newest first by (date, id) cursor."""
+    import clickai
+    coa = [{"id": "c1", "business_id": "B", "account_code": "1000", "account_name": "Bank",
+            "category": "Current Assets", "is_active": True},
+           {"id": "c2", "business_id": "B", "account_code": "4000", "account_name": "Sales",
+            "category": "Income", "is_active": True}]
+    journals = [{"id": f"j{i:05d}", "business_id": "B", "account_code": ("1000", "4000", "9100")[i % 3],
+                 "date": None if i % 97 == 0 else f"2026-0{1 + i % 6}-{1 + i % 9:02d}",
+                 "description": f"line {i}", "reference": f"R{i}",
+                 "debit": float(i % 7) if i % 2 else 0.0, "credit": 0.0 if i % 2 else float(i % 5)}
+                for i in range(1500)]
+    fake, restore = _with_fake_rest({"chart_of_accounts": coa, "journals": journals, "journal_entries": []})
+    client = _report_client()
+    try:
+        resp = client.get("/reports/gl")
+        assert resp.is_streamed
+        html = resp.get_data(as_text=True)
+        page_calls = list(fake.calls)
+        code = "1000"
+        seen, cursor = [], None
+        while True:
+            q = f"/api/reports/gl/lines?code={code}"
+            if cursor:
+                q += f"&before_date={cursor[0]}&before_id={cursor[1]}"
+            data = client.get(q).get_json()
+            seen += re.findall(r"<td>[^<]*</td><td>line (\d+)</td>", data["html"])
+            cursor = data["next"]
+            if not cursor:
+                break
+        fake.tables["chart_of_accounts"], fake.tables["journals"] = [], []
+        empty_html = client.get("/reports/gl").get_data(as_text=True)
+    finally:
+        restore()
+    assert html.startswith("<html><main>") and html.endswith("</main></html>")
+    assert "No accounts found" not in html and "No accounts found" in empty_html
+    assert not any("journals" in u and "()" not in u for u in page_calls), page_calls
+    want = [j for j in journals if j["account_code"] == code and (j["debit"] or j["credit"])]
+    want.sort(key=lambda j: (j["date"] is not None, j["date"] or "", j["id"]), reverse=True)
+    assert [int(i) for i in seen] == [int(j["id"][1:]) for j in want]
+    assert len(want) > 200
+    total_dr = sum(j["debit"] for j in journals)
+    total_cr = sum(j["credit"] for j in journals)
+    assert clickai.money(total_dr) in html and clickai.money(total_cr) in html
+    assert html.count("<details") == 3 and 'data-code="9100"' in html
+
+
+def test_trial_balance_engine_periods_match_journal_fold():
+    """trial_balance(): opening / movement / closing for several periods in one aggregate read
+    equal a line-by-line fold, before and after the gl_balances rebuild; the TB page and the
+    balance sheet built on it agree."""
+    import random
+    import clickai
+    import clickai_gl_balances as glb
+    from clickai_tb import trial_balance, classify
+    rnd = random.Random(20)
+    codes = ["1000", "1200", "1400", "2000", "2100", "3100", "4000", "5000", "6100", "ZZ1"]
+    journals = []
+    for i in range(2500):
+        amt = round(rnd.uniform(1, 500), 2)
+        day = None if i % 211 == 0 else f"2025-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}"
+        dr, cr = rnd.sample(codes, 2)
+        journals += [{"id": f"j{i}a", "business_id": "B", "account_code": dr, "date": day, "debit": amt, "credit": 0.0},
+                     {"id": f"j{i}b", "business_id": "B", "account_code": cr, "date": day, "debit": 0.0, "credit": amt}]
+    ob = [{"id": "ob1", "business_id": "B", "reference": "OB", "account": "8400/000 : Standard Bank",
+           "debit": 900.0, "credit": 0.0},
+          {"id": "ob2", "business_id": "B", "reference": "OB", "account_code": "3000", "account": "Capital",
+           "debit": 0.0, "credit": 900.0},
+          {"id": "je", "business_id": "B", "reference": "JNL", "account_code": "1000", "debit": 5.0, "credit": 0.0}]
+    balances = {}
+    for j in journals:
+        b = balances.setdefault((j["account_code"], glb.period_of(j["date"])),
+                                {"business_id": "B", "account_code": j["account_code"],
+                                 "period": glb.period_of(j["date"]), "debit": 0.0, "credit": 0.0})
+        b["debit"] += j["debit"]
+        b["credit"] += j["credit"]
+    periods = [("2025-03-15", "2025-08-10"), ("2025-01-01", "2025-06-30"), (None, "2025-09-30"), (None, None)]
+
+    def fold(code, keep):
+        dr = cr = 0.0
+        for j in journals:
+            if j["account_code"] == code and keep(j["date"] or ""):
+                dr, cr = dr + j["debit"], cr + j["credit"]
+        return dr, cr
+
+    close = lambda a, b: all(abs(x - y) < 1e-6 for x, y in zip(a, b))
+    fake, restore = _with_fake_rest({"journals": journals, "gl_balances": list(balances.values()),
+                                     "journal_entries": ob, "chart_of_accounts": [], "gl_balance_state": []})
+    results = []
+    try:
+        for ready in (False, True):
+            glb._READY.clear()
+            fake.tables["gl_balance_state"] = [{"business_id": "B"}] if ready else []
+            fake.calls = []
+            results.append(trial_balance(clickai.db, "B", periods))
+            assert not any("journals?" in u and "()" not in u for u in fake.calls), fake.calls
+            assert len({u.split("&limit=")[0] for u in fake.calls if "()" in u}) <= 2   # pages of one query
+        client = _report_client()
+        tb_html = client.get("/reports/tb?compare=1").get_data(as_text=True)
+        bad_asat = client.get("/reports/tb?asat=2025-13-99&compare=1")
+        bs_html = client.get("/reports/balance-sheet").get_data(as_text=True)
+    finally:
+        restore()
+        glb._READY.clear()
+    for tb in results:
+        for code in codes:
+            for i, (lo, hi) in enumerate(periods):
+                opening = fold(code, lambda d: lo is not None and d < lo)
+                moved = fold(code, lambda d: (lo is None or d >= lo) and (hi is None or d <= hi))
+                assert close(tb.amounts(code, i, "opening"), opening), (code, i)
+                assert close(tb.amounts(code, i, "movement"), moved), (code, i)
+        assert tb.amounts("8400/000", 0, "opening") == (900.0, 0.0)
+        assert tb.accounts["8400/000"]["name"] == "Standard Bank" and tb.ob_entries == 2
+        dr, cr = tb.totals(3)
+        assert abs(dr - cr) < 1e-6 and tb.summary(3)["is_balanced"]
+    assert classify("6100") == ("expense", "") and classify("1200") == ("current_asset", "debtors")
+    assert classify("1000/000", "Sales", "Sales")[0] == "income"
+    assert "Standard Bank" in tb_html and "<th style=\"text-align:right;width:150px;\">20" in tb_html
+    assert "Assets = Liabilities + Equity" in bs_html and "Difference" not in bs_html
+    assert bad_asat.status_code == 200 and f"As at {clickai.today()}" in bad_asat.get_data(as_text=True)
+
+
+def test_stock_index_lookup_matches_scan():
+    """GOLDEN: the prebuilt stock index returns exactly what the old per-keystroke
+    scan matched (multi-term, "10 x 12" fuzzy), code hits ahead of description
+    hits with code-prefix hits first; the Stock page search sorts by category."""
+    import random
+    import re
+    from clickai_stock_search import StockIndex
+    rnd = random.Random(21)
+    words = "bolt nut washer hex cap screw m6 m8 m10 galv zinc 304 316 plate angle pipe".split()
+    items = []
+    for i in range(3000):
+        code = f"{rnd.choice(['BLT', 'NUT', 'PL', 'M', ''])}{rnd.randint(1, 999)}"
+        desc = " ".join(rnd.sample(words, 3)) + f" {rnd.randint(5, 60)} {rnd.choice(['x', 'X', ' x '])} {rnd.randint(5, 60)}"
+        items.append({"id": str(i), "code": code, "description": desc,
+                      "category": rnd.choice(["Bolts", "Steel", None])})
+    index = StockIndex(items)
+
+    def scan(q):
+        terms = re.sub(r"\s*[xX]\s*", "x", q.lower()).split()
+        code_hits, desc_hits = [], []
+        for s in items:
+            c = re.sub(r"\s*[xX]\s*", "x", s["code"].lower())
+            d = re.sub(r"\s*[xX]\s*", "x", s["description"].lower())
+            if all(t in c + " " + d for t in terms):
+                (code_hits if any(t in c for t in terms) else desc_hits).append(s["id"])
+        return code_hits, desc_hits
+
+    for q in ["b", "m1", "bolt", "Bolt M10", "10 x 12", "blt12", "galv 316 plate", "pl1", "zzz", "x"]:
+        code_hits, desc_hits = scan(q)
+        got = [s["id"] for s in index.lookup(q, limit=10 ** 6)]
+        assert sorted(got) == sorted(code_hits + desc_hits), q
+        assert set(got[:len(code_hits)]) == set(code_hits), q
+        first = q.lower().split()[0]
+        prefixed = [s["id"] for s in items if s["id"] in code_hits and s["code"].lower().startswith(first)]
+        if prefixed and len(q.split()) == 1:
+            assert set(got[:len(prefixed)]) == set(prefixed), q
+        assert [s["id"] for s in index.lookup(q)] == got[:100], q
+
+    page = index.search("hex", "Bolts")
+    assert page and all(s["category"] == "Bolts" and "hex" in s["description"] for s in page)
+    assert [s["description"] for s in page] == sorted(s["description"] for s in page)
+    assert len(index.search("steel")) == sum(1 for s in items if s["category"] == "Steel"
+                                             or "steel" in (s["code"] + " " + s["description"]).lower())
+
+
+def test_db_get_many_chunks_and_spans_stock_tables():
+    """get_many: one id=in.() per URL-sized chunk; get_many_stock: legacy table only for the misses."""
+    import clickai
+    import uuid
+    ids = [str(uuid.UUID(int=i)) for i in range(400)]
+    users = [{"id": i, "email": f"u{n}@x.co"} for n, i in enumerate(ids)]
+    new_stock = [{"id": f"n{i}", "code": f"N{i}", "qty": i} for i in range(5)]
+    old_stock = [{"id": f"o{i}", "code": f"O{i}", "qty": i} for i in range(3)]
+    fake, restore = _with_fake_rest({"users": users, "stock_items": new_stock, "stock": old_stock})
+    try:
+        got = clickai.db.get_many("users", ids + [ids[0], None, "missing"], select="email")
+        user_calls = list(fake.calls)
+        fake.calls = []
+        stock = clickai.db.get_many_stock(["n1", "o2", "n4", "zz"])
+    finally:
+        restore()
+    assert len(got) == 400 and got[ids[7]]["email"] == "u7@x.co"
+    assert 2 <= len(user_calls) <= 4 and all(len(u) < 8000 for u in user_calls)
+    assert all("id=in.(" in u for u in user_calls)
+    assert set(stock) == {"n1", "o2", "n4"} and len(fake.calls) == 2
+    assert "o2" in fake.calls[1] and "n1" not in fake.calls[1]
+
+
+def test_stock_catalog_merges_once_types_fields_and_invalidates():
+    """One catalog per business: both tables merged once (legacy duplicates by code
+    dropped), typed fields whatever the column names, id/code lookups, the same
+    object until invalidate_stock(), then rebuilt from the tables."""
+    import clickai
+    new_stock = [{"id": "n1", "business_id": "bc", "code": "BLT10", "description": "Bolt M10",
+                  "quantity": "12", "cost_price": 1.5, "selling_price": "3", "category": "Bolts"},
+                 {"id": "n2", "business_id": "bc", "code": "", "description": "No code", "qty": 1}]
+    old_stock = [{"id": "o1", "business_id": "bc", "code": "blt10", "description": "Old bolt", "qty": 99},
+                 {"id": "o2", "business_id": "bc", "code": "NUT6", "name": "Nut M6", "qty": -2,
+                  "cost": "0.4", "price": None}]
+    fake, restore = _with_fake_rest({"stock_items": new_stock, "stock": old_stock})
+    clickai.db.invalidate_stock("bc")
+    try:
+        catalog = clickai.db.stock_catalog("bc")
+        loads = len(fake.calls)
+        assert clickai.db.stock_catalog("bc") is catalog
+        assert clickai.db.get_all_stock("bc") is catalog.rows and len(fake.calls) == loads == 2
+        assert [s.id for s in catalog] == ["n1", "n2", "o2"]
+        bolt = catalog.by_code(" blt10 ")
+        assert (bolt.id, bolt.qty, bolt.cost, bolt.price, bolt.table) == ("n1", 12.0, 1.5, 3.0, "stock_items")
+        nut = catalog.get("o2")
+        assert (nut.description, nut.qty, nut.cost, nut.price, nut.table) == ("Nut M6", -2.0, 0.4, 0.0, "stock")
+        assert "qty" not in catalog.get("n1").row        # raw rows are never rewritten
+        assert catalog.categories() == ["Bolts"] and catalog.categories("General") == ["Bolts", "General"]
+
+        new_stock[0]["quantity"] = 11
+        clickai.db.invalidate_stock("bc")
+        fresh = clickai.db.stock_catalog("bc")
+        assert fresh is not catalog and fresh.get("n1").qty == 11.0 and len(fake.calls) == loads + 2
+    finally:
+        clickai._stock_sync_off = False              # these rows have no updated_at
+        clickai.db.invalidate_stock("bc")
+        restore()
+
+
+def test_stock_catalog_delta_sync_patches_instead_of_reloading():
+    """After a load, stock reads fetch only rows whose updated_at moved: a sale's
+    update_stock row patches the catalog in place (search index kept), a value-only
+    delta is absorbed, a new item rebuilds, a delete (row count moved) or a table
+    without updated_at falls back to the full two-table load."""
+    import clickai
+    t0 = "2026-10-01T08:00:00+00:00"
+    new_stock = [{"id": f"n{i}", "business_id": "bd", "code": f"BLT{i}", "description": f"Bolt {i}",
+                  "quantity": 10, "updated_at": t0} for i in range(4)]
+    old_stock = [{"id": "o1", "business_id": "bd", "code": "NUT1", "description": "Nut", "qty": 3,
+                  "updated_at": t0},
+                 {"id": "o2", "business_id": "bd", "code": "blt0", "description": "Old bolt", "qty": 1,
+                  "updated_at": t0}]
+    fake, restore = _with_fake_rest({"stock_items": new_stock, "stock": old_stock})
+    clickai.db.invalidate_stock("bd")
+
+    def full_loads():
+        return sum(1 for u in fake.calls if isinstance(u, str) and "updated_at" not in u
+                   and "limit=1&" not in u and "/stock" in u)
+
+    try:
+        catalog = clickai.db.stock_catalog("bd")
+        index = clickai.db.stock_index("bd")
+        assert len(catalog) == 5 and full_loads() == 2
+
+        # A till sells 3 of BLT1: update_stock hands over the row PostgREST returned
+        new_stock[1].update(quantity=7, updated_at="2026-10-01T09:00:00+00:00")
+        clickai.db._stock_row_written("bd", dict(new_stock[1]))
+        assert clickai.db.stock_catalog("bd") is catalog and catalog.get("n1").qty == 7
+        assert clickai.db.stock_index("bd") is index and index.lookup("blt1")[0]["quantity"] == 7
+
+        # Another till's sale, seen by the delta sync: absorbed in place
+        new_stock[2].update(quantity=4, updated_at="2026-10-01T09:05:00+00:00")
+        clickai.db.stock_changed("bd")
+        fake.calls = []
+        assert clickai.db.stock_catalog("bd") is catalog and catalog.get("n2").qty == 4
+        assert full_loads() == 0 and sum("updated_at=gte." in u for u in fake.calls) == 2
+        assert clickai.db.stock_index("bd") is index
+
+        # A new item that shadows the legacy NUT1: new catalog, merge rule kept
+        new_stock.append({"id": "n9", "business_id": "bd", "code": "nut1", "description": "Nut M6",
+                          "quantity": 50, "updated_at": "2026-10-01T09:10:00+00:00"})
+        clickai.db.stock_changed("bd")
+        fresh = clickai.db.stock_catalog("bd")
+        assert fresh is not catalog and full_loads() == 0
+        assert fresh.by_code("NUT1").id == "n9" and fresh.get("o1") is None
+        assert [s.id for s in fresh] == ["n0", "n1", "n2", "n3", "n9"]
+
+        # A delete never shows up in a delta: the row counts send it to a full load
+        del new_stock[3]
+        clickai.db.stock_changed("bd")
+        assert clickai.db.stock_catalog("bd").get("n3") is None and full_loads() == 2
+
+        # No updated_at column (STOCK_SYNC_SQL not run): full reloads, as before
+        fake.missing_columns = {"updated_at"}
+        clickai.db.stock_changed("bd")
+        fake.calls = []
+        assert len(clickai.db.stock_catalog("bd")) == 4 and clickai._stock_sync_off
+        assert full_loads() == 2
+    finally:
+        clickai._stock_sync_off = False
+        clickai.db.invalidate_stock("bd")
+        restore()
+
+
+def test_stock_catalog_kept_when_too_big_for_local_copy():
+    """A stock list over the shared cache's local byte cap: the worker's catalog
+    is kept on the entry's stamp, so warm reads neither re-read nor decode it,
+    and another worker's write rebuilds it."""
+    import clickai
+    from clickai_cache import SharedCache, MemoryBackend
+    items = [{"id": f"{i:05d}", "business_id": "bk", "code": f"C{i}", "quantity": i}
+             for i in range(2500)]
+    fake, restore = _with_fake_rest({"stock_items": items, "stock": []})
+    saved = clickai._stock_cache
+    clickai._stock_cache = cache = SharedCache("stock", 3600, MemoryBackend(),
+                                               max_bytes=1024, register=False)
+    clickai._stock_catalogs.pop("bk", None)
+    try:
+        catalog = clickai.db.stock_catalog("bk")
+        assert len(catalog) == 2500
+        fake.calls = []
+        for _ in range(5):
+            assert clickai.db.stock_catalog("bk") is catalog
+        assert cache.decodes == 0 and fake.calls == []
+        other = SharedCache("stock", 3600, cache.backend, register=False)
+        other.set("bk", [time.time(), items[:10], 10, {"loaded_at": time.time(), "cursor": None}])
+        fresh = clickai.db.stock_catalog("bk")
+        assert fresh is not catalog and len(fresh) == 10 and cache.decodes == 1
+    finally:
+        clickai._stock_cache = saved
+        clickai._stock_sync_off = False              # these rows have no updated_at
+        clickai._stock_catalogs.pop("bk", None)
+        restore()
+
+
+def _stock_ledger_trigger(fake, row):
+    """What STOCK_LEDGER_SQL's BEFORE INSERT trigger does: a row without
+    qty_delta gets it from type/quantity and moves nothing; a ledger row adds
+    its delta to the item and takes the new on-hand as balance_after; one for
+    an item that does not exist is not stored."""
+    from clickai_stock_ledger import movement_delta
+    if row.get("qty_delta") is None:
+        row["qty_delta"] = movement_delta(row)
+        return
+    if row.get("kind") in (None, "opening"):
+        return
+    for table, cols in (("stock_items", ("quantity",)), ("stock", ("qty", "quantity"))):
+        for item in fake.tables.get(table, []):
+            if item.get("id") == row["stock_id"] and item.get("business_id") == row["business_id"]:
+                bal = float(item.get(cols[0]) or 0) + row["qty_delta"]
+                for c in cols:
+                    item[c] = bal
+                row["balance_after"] = bal
+                return
+    return False
+
+
+def test_stock_ledger_moves_concurrently_and_replays():
+    """Two tills selling the same item: every sale is one INSERT (no read, no
+    PATCH) and every one counts. A re-sent movement is refused, not moved twice;
+    replaying the ledger gives every quantity; without the ledger columns the
+    flows fall back and stop trying."""
+    import clickai
+    from clickai_stock_ledger import replay, signed_qty
+    stock = [{"id": "s1", "business_id": "bl", "code": "BLT10", "description": "Bolt", "quantity": 0},
+             {"id": "s2", "business_id": "bl", "code": "NUT6", "description": "Nut", "quantity": 0}]
+    legacy = [{"id": "o1", "business_id": "bl", "code": "WSH", "description": "Washer", "qty": 5}]
+    history = [{"id": "h1", "business_id": "bl", "stock_id": "o1", "type": "in", "quantity": 8},
+               {"id": "h2", "business_id": "bl", "stock_id": "o1", "type": "adjustment_out", "quantity": -3}]
+    fake, restore = _with_fake_rest({"stock_items": stock, "stock": legacy, "stock_movements": history})
+    fake.triggers["stock_movements"] = _stock_ledger_trigger
+    clickai.db.invalidate_stock("bl")
+    try:
+        assert clickai.db.move_stock("bl", "s1", "grv", 100, reference="GRV-1") == 100.0
+        assert clickai.db.move_stock("bl", "s2", "adjustment", 7) == 7.0
+        fake.calls = []
+        results = []
+
+        def till():
+            for _ in range(50):
+                results.append(clickai.db.move_stock("bl", "s1", "sale", 1, reference="POS"))
+
+        tills = [threading.Thread(target=till) for _ in range(2)]
+        for t in tills:
+            t.start()
+        for t in tills:
+            t.join()
+        assert stock[0]["quantity"] == 0.0 and sorted(results) == [float(q) for q in range(100)]
+        assert len(fake.calls) == 100 and all(c[0] == "POST" for c in fake.calls)
+        assert clickai.db.move_stock("bl", "o1", "sale", 2) == 3.0 and legacy[0]["qty"] == 3.0
+        assert clickai.db.move_stock("bl", "nope", "sale", 1) is None
+
+        # A retried insert (same movement id) is refused whole: nothing moves twice
+        mv = clickai.RecordFactory.stock_movement("bl", "s2", "out", 2, kind="sale",
+                                                  qty_delta=signed_qty("sale", 2))
+        assert clickai.db.record_stock_movements("bl", [mv])[0]["balance_after"] == 5.0
+        assert clickai.db.record_stock_movements("bl", [mv]) is not None
+        assert stock[1]["quantity"] == 5.0
+
+        check = clickai.db.stock_ledger_check("bl")
+        assert check["ok"] and check["mismatch_count"] == 0 and check["items"] == 3
+        assert replay(fake.tables["stock_movements"]) == {"s1": 0.0, "s2": 5.0, "o1": 3.0}
+        stock[1]["quantity"] = 9                         # changed outside the ledger
+        assert clickai.db.stock_catalog("bl").get("s2").qty == 5.0    # cached
+        assert clickai.db.stock_on_hand("bl", ["s2", "o1", "nope"]) == {"s2": 9.0, "o1": 3.0}
+        check = clickai.db.stock_ledger_check("bl")
+        assert not check["ok"] and check["mismatches"][0]["id"] == "s2"
+        assert check["mismatches"][0]["ledger_qty"] == 5.0
+
+        # No qty_delta column yet (STOCK_LEDGER_SQL not run)
+        fake.missing_columns = {"qty_delta"}
+        assert clickai.db.record_stock_movements("bl", [dict(mv, id="m-new")]) is None
+        assert clickai._stock_ledger_off
+    finally:
+        clickai._stock_ledger_off = False
+        clickai.db.invalidate_stock("bl")
+        restore()
+
+
+def _pos_commit_sale_rpc(fake, params):
+    """pos_commit_sale (POS_SALE_SQL) in one transaction: the sale id refuses a retry, a clashing
+    sale_number refuses the whole sale."""
+    if any(r["id"] == params["p_sale"]["id"] or r["sale_number"] == params["p_sale"]["sale_number"]
+           for r in fake.tables["sales"]):
+        return 409, {"code": "23505", "message": "duplicate key value violates unique constraint"}
+    fake.tables["sales"].append(dict(params["p_sale"]))
+    fake.tables["journals"] += [dict(r) for r in params["p_journals"]]
+    moved = []
+    for m in params["p_movements"]:
+        row = dict(m)
+        if _stock_ledger_trigger(fake, row) is not False:
+            fake.tables["stock_movements"].append(row)
+            moved.append({"stock_id": row["stock_id"], "balance_after": row.get("balance_after")})
+    for c in fake.tables["customers"]:
+        if params["p_customer_id"] and c["id"] == params["p_customer_id"]:
+            c["balance"] = float(c.get("balance") or 0) + params["p_balance"]
+    return 200, {"movements": moved}
+
+
+def test_pos_commit_sale_one_call_atomic_retry_and_bulk_fallback():
+    """A POS sale (sale row, sale + COS journals, three stock lines, account balance) is one
+    RPC; a lost response is retried and refused by the sale id, not posted twice; any other
+    409 is a failed sale; an unbalanced journal stops it before anything is written; without
+    POS_SALE_SQL it is one bulk request per table."""
+    import clickai
+    stock = [{"id": "s1", "business_id": "bp", "code": "BLT", "quantity": 10, "cost_price": 2},
+             {"id": "s2", "business_id": "bp", "code": "NUT", "quantity": 4, "cost_price": 1}]
+    tables = {"stock_items": stock, "stock": [], "sales": [], "journals": [], "stock_movements": [],
+              "customers": [{"id": "c1", "business_id": "bp", "name": "Acme", "balance": 100.0}]}
+    fake, restore = _with_fake_rest(tables)
+    fake.triggers["stock_movements"] = _stock_ledger_trigger
+    fake.rpcs["pos_commit_sale"] = _pos_commit_sale_rpc
+    sale_lines = [{"account_code": "1200", "debit": 115.0, "credit": 0},
+                  {"account_code": "4000", "debit": 0, "credit": 100.0},
+                  {"account_code": "2100", "debit": 0, "credit": 15.0}]
+    cos_lines = [{"account_code": "5000", "debit": 7.0, "credit": 0},
+                 {"account_code": "1300", "debit": 0, "credit": 7.0}]
+
+    def sale(n):
+        return {"id": f"sale-{n}", "business_id": "bp", "sale_number": f"POS{n}", "date": "2026-10-18",
+                "total": 115.0}
+
+    lines = [{"stock_id": "s1", "quantity": 2, "on_hand": 10}, {"stock_id": "s2", "quantity": 3, "on_hand": 4},
+             {"stock_id": "s1", "quantity": 1, "on_hand": 10}]
+    journals = [("POS Sale POS1", "POS1", sale_lines), ("COS - POS Sale POS1", "COS-POS1", cos_lines)]
+    posts = lambda: [c for c in fake.calls if isinstance(c, tuple)]
+    clickai.db.invalidate_stock("bp")
+    try:
+        ok, err, on_hand = clickai.commit_pos_sale("bp", sale(1), journals, lines,
+                                                   customer_id="c1", balance_delta=115.0)
+        assert ok and on_hand == {"s1": 7.0, "s2": 1.0}, (err, on_hand)
+        assert len(posts()) == 1 and posts()[0][1].endswith("/rpc/pos_commit_sale")
+        assert len(tables["sales"]) == 1 and len(tables["journals"]) == 5
+        assert [m["qty_delta"] for m in tables["stock_movements"]] == [-2.0, -3.0, -1.0]
+        assert tables["customers"][0]["balance"] == 215.0
+
+        fake.calls, fake.lost_responses = [], 1    # committed, but the answer never came back
+        ok, _, _ = clickai.commit_pos_sale("bp", sale(2), journals, lines[:1])
+        assert ok and len(posts()) == 2 and len(tables["sales"]) == 2 and stock[0]["quantity"] == 5.0
+
+        # Another till's sale_number in the same second: refused, and not reported as committed
+        ok, err, _ = clickai.commit_pos_sale("bp", dict(sale(6), sale_number="POS2"), journals, lines[:1])
+        assert not ok and "409" in err and len(tables["sales"]) == 2 and stock[0]["quantity"] == 5.0
+
+        fake.calls = []
+        try:
+            clickai.commit_pos_sale("bp", sale(3), [("bad", "POS3", sale_lines[:2])], lines)
+            assert False, "an unbalanced journal must block the sale"
+        except ValueError:
+            pass
+        assert not fake.calls and len(tables["sales"]) == 2
+
+        # POS_SALE_SQL not run: the RPC is missing once, then bulk writes per table
+        del fake.rpcs["pos_commit_sale"]
+        ok, _, on_hand = clickai.commit_pos_sale("bp", sale(4), journals, lines)
+        assert ok and clickai._pos_sale_rpc_off and on_hand == {"s1": 2.0, "s2": -2.0}
+        fake.calls = []
+        ok, _, _ = clickai.commit_pos_sale("bp", sale(5), journals, lines[1:2])
+        assert ok and [c[1].rsplit("/", 1)[-1].split("?")[0] for c in posts()] == \
+            ["sales", "journals", "stock_movements"]
+        assert len(tables["sales"]) == 4 and len(tables["journals"]) == 20 and stock[1]["quantity"] == -5.0
+    finally:
+        clickai._pos_sale_rpc_off = False
+        clickai.db.invalidate_stock("bp")
+        restore()
+
+
+def test_shared_cache_crosses_workers():
+    """Two workers on one cache file: a write in one is read by the other, a pop in
+    one clears both, and a load that raced an invalidation is refused."""
+    from clickai_cache import SharedCache, SQLiteBackend
+    path = os.path.join(tempfile.mkdtemp(prefix="clickai_cache_"), "shared.sqlite3")
+    w1 = SharedCache("stock", ttl=30, backend=SQLiteBackend(path), register=False)
+    w2 = SharedCache("stock", ttl=30, backend=SQLiteBackend(path), register=False)
+    items = [{"id": "s1", "code": "BOLT-M10", "qty": 4}]
+    w1["b1"] = (1.0, items)
+    assert w2.get("b1") == [1.0, items]
+    assert w2.get("b1") is w2.get("b1"), "unchanged entry must not be decoded again"
+    v = w2.version("b1")                             # worker 2 starts a reload...
+    w1.pop("b1", None)                               # ...worker 1 writes stock
+    assert w1.get("b1") is None and w2.get("b1") is None
+    assert not w2.set("b1", (2.0, items), version=v), "stale reload must not land"
+    assert w2.set("b1", (3.0, items), version=w2.version("b1"))
+    assert w1.get("b1")[0] == 3.0
+    assert SharedCache("stock", ttl=0, backend=SQLiteBackend(path), register=False).get("nope") is None
+
+
+def test_bounded_cache_lru_ttl_and_limits():
+    """LRU + TTL + entry/byte caps, with stats; every app cache is registered."""
+    from clickai_cache import BoundedCache, cache_stats
+    c = BoundedCache("test_lru", ttl=60, max_entries=3, max_bytes=10 ** 6)
+    for k in "abc":
+        c[k] = k * 10
+    assert c.get("a") == "a" * 10                   # a is now most recent
+    c["d"] = "d"                                     # evicts b, the least recent
+    assert "b" not in c and "a" in c and len(c) == 3
+    c.set("e", "x", ttl=-1)                          # already stale
+    assert c.get("e") is None
+    c["huge"] = "x" * (2 * 10 ** 6)                  # bigger than the whole cache
+    assert "huge" not in c and len(c) >= 2
+    st = c.stats()
+    assert st["evictions"] >= 2 and st["expirations"] == 1 and st["hits"] >= 2
+    assert 0 < st["bytes"] <= st["max_bytes"]
+    import clickai                                   # noqa: F401 — registers the app caches
+    import clickai_whatsapp                          # noqa: F401
+    names = {x["name"] for x in cache_stats()["caches"]}
+    assert {"stock", "auth", "gl_map", "unposted_sales", "audit_badge",
+            "smart_import", "whatsapp_rate_limits"} <= names, names
+
+
 # ---------------------------------------------------------------------------
 # Runner — auto-discovers test_* functions. SKIPS (not fails) Tier-3 tests
 # whose module can't be imported in a stripped-down environment.
 # ---------------------------------------------------------------------------
 
 _REQUIRES = {  # test name -> module it imports; SKIP (not fail) if that module won't import
+    "test_reversal_index_reads_only_reversal_entries": "clickai_allocation_log",
+    "test_customer_aging_engine_matches_statement_aging": "clickai_aging",
+    "test_gl_report_streams_totals_and_pages_lines": "clickai_reports",
+    "test_trial_balance_engine_periods_match_journal_fold": "clickai_reports",
+    "test_stock_index_lookup_matches_scan":        "clickai_stock_search",
     "test_paye_matches_sage":                      "clickai_payroll",
     "test_paye_zero_and_brackets":                 "clickai_payroll",
     "test_paye_rebates_and_deductions_reduce_tax": "clickai_payroll",
@@ -420,6 +1932,27 @@ _REQUIRES = {  # test name -> module it imports; SKIP (not fail) if that module
     "test_record_factory_stock_movement_shape":    "clickai",
     "test_record_factory_invoice_and_expense_shape": "clickai",
     "test_extract_time_hhmm":                      "clickai",
+    "test_db_filter_query_operators":              "clickai",
+    "test_db_get_date_window_runs_on_server":      "clickai",
+    "test_db_get_pages_by_keyset_not_offset":      "clickai",
+    "test_db_get_offset_fallback_only_for_a_table_without_id": "clickai",
+    "test_db_get_keyset_with_explicit_order_and_nulls": "clickai",
+    "test_db_get_parallel_prefetch_matches_sequential": "clickai",
+    "test_db_single_flight_coalesces_concurrent_reads": "clickai",
+    "test_db_iter_rows_streams_pages_and_fails_loudly": "clickai",
+    "test_db_aggregate_on_server_and_python_fallback": "clickai",
+    "test_db_get_columnar_vectors_match_row_sums":  "clickai",
+    "test_create_journal_entry_one_request_idempotent_retry": "clickai",
+    "test_gl_balances_match_journal_fold_and_verify_drift": "clickai_gl_balances",
+    "test_period_close_snapshots_stale_and_reopen":          "clickai_period_close",
+    "test_customer_ledger_matches_recompute_and_syncs_dirty_customers": "clickai_customer_ledger",
+    "test_stock_catalog_merges_once_types_fields_and_invalidates": "clickai",
+    "test_stock_catalog_delta_sync_patches_instead_of_reloading": "clickai",
+    "test_db_get_many_chunks_and_spans_stock_tables": "clickai",
+    "test_stock_ledger_moves_concurrently_and_replays": "clickai_stock_ledger",
+    "test_pos_commit_sale_one_call_atomic_retry_and_bulk_fallback": "clickai",
+    "test_shared_cache_crosses_workers":           "clickai_cache",
+    "test_bounded_cache_lru_ttl_and_limits":       "clickai",
 }
 
 def _importable(mod_name):